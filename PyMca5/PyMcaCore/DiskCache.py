@@ -0,0 +1,286 @@
+#/*##########################################################################
+#
+# The PyMca X-Ray Fluorescence Toolkit
+#
+# Copyright (c) 2004-2016 European Synchrotron Radiation Facility
+#
+# This file is part of the PyMca X-ray Fluorescence Toolkit developed at
+# the ESRF by the Software group.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+#############################################################################*/
+__author__ = "V.A. Sole - ESRF Data Analysis"
+__contact__ = "sole@esrf.fr"
+__license__ = "MIT"
+__copyright__ = "European Synchrotron Radiation Facility, Grenoble, France"
+__doc__ = """
+Content addressed cache of python objects on disk.
+
+Each object is stored in a JSON file named after the hash of the
+canonical representation of the inputs it was calculated from. Only
+dictionaries, lists, tuples, strings, numbers and numpy arrays of numbers
+can be stored and reading a file never executes code. A directory not
+owned by the user is not used. The cache is shared among processes:
+files are written to a temporary name and then renamed, and a corrupted
+or unreadable file is just considered a miss. When the total size of the
+cache exceeds the given maximum, the least recently used files are
+removed.
+"""
+import os
+import sys
+import base64
+import hashlib
+import json
+import tempfile
+import numpy
+
+DEBUG = 0
+
+# default maximum size of the cache in bytes
+MAX_SIZE = 100 * 1024 * 1024
+
+EXTENSION = ".json"
+
+
+def _canonical(obj):
+    # a representation not depending on dictionary ordering nor on the
+    # container types
+    if isinstance(obj, dict):
+        keys = sorted(obj.keys(), key=repr)
+        return "{" + ",".join(["%s:%s" % (_canonical(key),
+                                          _canonical(obj[key]))
+                               for key in keys]) + "}"
+    if isinstance(obj, (list, tuple)):
+        return "[" + ",".join([_canonical(item) for item in obj]) + "]"
+    if isinstance(obj, numpy.ndarray):
+        return "array(%s,%s,%s)" % (obj.dtype.str,
+                                    repr(obj.shape),
+                                    _canonical(obj.tolist()))
+    if isinstance(obj, numpy.generic):
+        obj = obj.item()
+    if isinstance(obj, bool):
+        obj = int(obj)
+    if isinstance(obj, float):
+        # repr gives back the same float
+        return repr(obj)
+    if isinstance(obj, bytes) and not isinstance(obj, str):
+        # python 3 bytes read from configuration files
+        obj = obj.decode("utf-8", "replace")
+    return repr(obj)
+
+
+def getKey(*objects):
+    """
+    Return the hexadecimal hash of the canonical representation of the
+    given objects. Dictionaries, lists, tuples, numpy arrays, strings and
+    numbers are supported.
+    """
+    text = _canonical(list(objects))
+    if sys.version_info >= (3,):
+        text = text.encode("utf-8")
+    return hashlib.sha1(text).hexdigest()
+
+
+def _encode(obj):
+    # JSON representation keeping the types of the supported objects
+    if isinstance(obj, (numpy.ndarray, numpy.generic)):
+        obj = numpy.asarray(obj)
+        if obj.dtype.kind not in "biufc":
+            raise TypeError("Cannot store arrays of type %s" % obj.dtype)
+        data = base64.b64encode(numpy.ascontiguousarray(obj).tobytes())
+        return {"ndarray": data.decode("ascii"),
+                "dtype": obj.dtype.str,
+                "shape": list(obj.shape)}
+    if isinstance(obj, dict):
+        return {"dict": [[_encode(key), _encode(value)] \
+                         for key, value in obj.items()]}
+    if isinstance(obj, tuple):
+        return {"tuple": [_encode(item) for item in obj]}
+    if isinstance(obj, list):
+        return [_encode(item) for item in obj]
+    if isinstance(obj, bytes) and not isinstance(obj, str):
+        return {"bytes": base64.b64encode(obj).decode("ascii")}
+    if (obj is None) or isinstance(obj, (bool, int, float)):
+        return obj
+    if sys.version_info < (3,):
+        if isinstance(obj, (long, str, unicode)):
+            return obj
+    elif isinstance(obj, str):
+        return obj
+    raise TypeError("Cannot store objects of type %s" % type(obj))
+
+
+def _decode(obj):
+    if isinstance(obj, list):
+        return [_decode(item) for item in obj]
+    if not isinstance(obj, dict):
+        return obj
+    if "ndarray" in obj:
+        data = base64.b64decode(obj["ndarray"].encode("ascii"))
+        array = numpy.frombuffer(data, dtype=numpy.dtype(str(obj["dtype"])))
+        array = array.reshape(obj["shape"]).copy()
+        if not len(obj["shape"]):
+            # numpy scalar
+            return array[()]
+        return array
+    if "dict" in obj:
+        return dict([(_decode(key), _decode(value)) \
+                     for key, value in obj["dict"]])
+    if "tuple" in obj:
+        return tuple([_decode(item) for item in obj["tuple"]])
+    if "bytes" in obj:
+        return base64.b64decode(obj["bytes"].encode("ascii"))
+    raise ValueError("Unknown object in cache file")
+
+
+def _isOwnDirectory(directory):
+    # the cached objects are trusted, a directory of another user is not
+    if not hasattr(os, "getuid"):
+        # windows
+        return True
+    try:
+        return os.stat(directory).st_uid == os.getuid()
+    except OSError:
+        return False
+
+
+class DiskCache(object):
+    def __init__(self, directory=None, maxsize=None):
+        """
+        :param directory: Directory where to store the files. If None, the
+                          PyMca default cache directory is used.
+        :param maxsize: Maximum size of the cache in bytes.
+                        Default is MAX_SIZE.
+        """
+        if directory is None:
+            import PyMca5
+            directory = PyMca5.getDefaultCacheDirectory()
+        self.directory = directory
+        if maxsize is None:
+            maxsize = MAX_SIZE
+        self.maxsize = maxsize
+
+    def isEnabled(self):
+        return (self.directory is not None) and \
+               os.path.isdir(self.directory) and \
+               _isOwnDirectory(self.directory)
+
+    def _getFileName(self, key):
+        return os.path.join(self.directory, key + EXTENSION)
+
+    def load(self, key):
+        """
+        Return the object stored under key or None if not present.
+        """
+        if not self.isEnabled():
+            return None
+        fileName = self._getFileName(key)
+        if not os.path.exists(fileName):
+            return None
+        try:
+            with open(fileName, "rb") as f:
+                obj = _decode(json.loads(f.read().decode("utf-8")))
+        except:
+            if DEBUG:
+                print("Discarding cache file %s: %s" % (fileName,
+                                                       sys.exc_info()[1]))
+            self._remove(fileName)
+            return None
+        try:
+            # mark it as recently used
+            os.utime(fileName, None)
+        except OSError:
+            pass
+        return obj
+
+    def save(self, key, obj):
+        """
+        Store the object under key. Errors are ignored.
+        """
+        if not self.isEnabled():
+            return False
+        fileName = self._getFileName(key)
+        try:
+            text = json.dumps(_encode(obj))
+            fd, tmpName = tempfile.mkstemp(suffix=".tmp",
+                                           dir=self.directory)
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(text.encode("utf-8"))
+                if hasattr(os, "replace"):
+                    os.replace(tmpName, fileName)
+                else:
+                    # python 2, it fails under windows if already there
+                    os.rename(tmpName, fileName)
+            except:
+                self._remove(tmpName)
+                raise
+        except:
+            if DEBUG:
+                print("Cannot write cache file %s: %s" % (fileName,
+                                                         sys.exc_info()[1]))
+            return False
+        self.evict()
+        return True
+
+    def evict(self, maxsize=None):
+        """
+        Remove the least recently used files until the size of the cache
+        is below maxsize.
+        """
+        if not self.isEnabled():
+            return
+        if maxsize is None:
+            maxsize = self.maxsize
+        fileList = []
+        total = 0
+        for name in os.listdir(self.directory):
+            if not name.endswith(EXTENSION):
+                continue
+            fileName = os.path.join(self.directory, name)
+            try:
+                info = os.stat(fileName)
+            except OSError:
+                # removed by another process
+                continue
+            fileList.append((info.st_mtime, info.st_size, fileName))
+            total += info.st_size
+        if total <= maxsize:
+            return
+        fileList.sort()
+        for mtime, size, fileName in fileList:
+            if total <= maxsize:
+                break
+            if DEBUG:
+                print("Evicting cache file %s" % fileName)
+            self._remove(fileName)
+            total -= size
+
+    def clear(self):
+        """
+        Remove all the files of the cache.
+        """
+        self.evict(maxsize=-1)
+
+    def _remove(self, fileName):
+        try:
+            os.remove(fileName)
+        except OSError:
+            pass
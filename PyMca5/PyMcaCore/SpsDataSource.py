@@ -31,11 +31,16 @@
 __license__ = "MIT"
 __copyright__ = "European Synchrotron Radiation Facility, Grenoble, France"
 import copy
+import numpy
 from . import DataObject
 from PyMca5.PyMcaIO import spswrap as sps
 
 DEBUG = 0
 SOURCE_TYPE = 'SPS'
+# read the shared memory through read-only views instead of copying it
+ZERO_COPY = True
+# maximum number of copies of data updated while being copied
+COPY_TRIALS = 3
 
 
 class SpsDataSource(object):
@@ -45,9 +50,11 @@ def __init__(self, name):
         self.name = name
         self.sourceName = name
         self.sourceType = SOURCE_TYPE
+        self.zeroCopy = ZERO_COPY
+        self.__views = {}
 
     def refresh(self):
-        pass
+        self.__views = {}
 
     def getSourceInfo(self):
         """
@@ -65,7 +72,14 @@ def getKeyInfo(self, key):
         else:
             return {}
 
-    def getDataObject(self, key_list, selection=None):
+    def getDataObject(self, key_list, selection=None, copyData=True):
+        """
+        In zero copy mode the shared memory arrays are accessed through
+        read-only views. The selected curves are always copied, the whole
+        array only if copyData is True. With copyData set to False the
+        data of the returned object follow the shared memory and cannot
+        be modified.
+        """
         if type(key_list) not in [type([])]:
             nolist = True
             key_list = [key_list]
@@ -83,7 +97,13 @@ def getDataObject(self, key_list, selection=None):
                 data = DataObject.DataObject()
                 data.info = self.__getArrayInfo(key)
                 data.info['selection'] = selection
-                data.data = sps.getdata(self.name, key)
+                view = None
+                if self.zeroCopy:
+                    view = self.__getDataView(key)
+                if view is None:
+                    data.data = sps.getdata(self.name, key)
+                else:
+                    data.data = view
                 if nolist:
                     if selection is not None:
                         scantest = (data.info['flag'] &
@@ -154,7 +174,7 @@ def getDataObject(self, key_list, selection=None):
                                 data.info['selection']['cntlist'] = data.info['LabelNames']
                                 selection = newSelection
                             data.data = None
-                            return data
+                            return self.__copyDataObject(data, view)
                         if (key in ["XIA_DATA"]) and 'XIA' in selection:
                             if selection["XIA"]:
                                 if 'Detectors' in data.info:
@@ -162,19 +182,65 @@ def getDataObject(self, key_list, selection=None):
                                         selection['rows']['y'][i] = \
                                             data.info['Detectors'].index(selection['rows']['y'][i]) + 1
                                     del selection['XIA']
-                        return data.select(selection)
+                        return self.__copyDataObject(data.select(selection),
+                                                     view, copyData)
                     else:
                         if data.data is not None:
                             data.info['selectiontype'] = "%dD" % len(data.data.shape)
                             if data.info['selectiontype'] == "2D":
                                 data.info["imageselection"] = True
-                        return data
+                        return self.__copyDataObject(data, view, copyData)
                 else:
-                    output.append(data.select(selection))
+                    output.append(self.__copyDataObject(data.select(selection),
+                                                        view, copyData))
             return output
         else:
             return None
 
+    def __getDataView(self, key):
+        view = self.__views.get(key, None)
+        if view is not None:
+            # the array may have been recreated
+            if sps.viewshmid(view) == sps.getshmid(self.name, key):
+                return view
+        view = sps.getdataview(self.name, key)
+        if view is None:
+            if key in self.__views:
+                del self.__views[key]
+        else:
+            self.__views[key] = view
+        return view
+
+    def __copyDataObject(self, dataObject, view, copyData=True):
+        """
+        Replace the views of the shared memory held by the data object
+        by copies. The copies are repeated if the array is updated while
+        being copied.
+        """
+        if view is None:
+            return dataObject
+        views = {}
+        for attr in ["x", "y", "m"]:
+            curves = getattr(dataObject, attr, None)
+            if curves:
+                views[attr] = curves
+        if copyData and (dataObject.data is not None):
+            views["data"] = dataObject.data
+        for i in range(COPY_TRIALS):
+            counter = sps.viewcounter(view)
+            for attr in views:
+                if attr == "data":
+                    dataObject.data = numpy.array(views[attr])
+                else:
+                    setattr(dataObject, attr,
+                            [numpy.array(curve) for curve in views[attr]])
+            if sps.viewcounter(view) == counter:
+                break
+            if DEBUG:
+                print("Array %s updated while being copied" % \
+                      dataObject.info['Key'])
+        return dataObject
+
     def __getSourceInfo(self):
         arraylist = []
         sourcename = self.name
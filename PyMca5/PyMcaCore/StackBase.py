@@ -35,6 +35,7 @@
 
 """
 from . import DataObject
+from . import StackROIIndex
 import numpy
 import time
 import os
@@ -103,6 +104,13 @@ def __init__(self):
         # the sums.
         self._dynamicLimit = 5.0E6
         self._tryNumpy = True
+        # index of cumulated sums to calculate ROI images independently
+        # of the ROI width. By default (None) it is used beyond the given
+        # number of elements, where each ROI calculation iterates over the
+        # whole stack.
+        self._useROIIndex = None
+        self._ROIIndexLimit = 5.0E6
+        self._ROIIndex = None
 
     def setPluginDirectoryList(self, dirlist):
         for directory in dirlist:
@@ -244,10 +252,68 @@ def setStack(self, stack, mcaindex=2, fileindex=None):
         self._stack.info['OtherIndex'] = otherIndex
         self.stackUpdated()
 
+    def setROIIndexEnabled(self, flag=True):
+        """
+        If flag is True, the ROI images are calculated from an index of the
+        stack built at first use. The time needed to calculate them does not
+        depend anymore on the width of the ROI at the cost of keeping in
+        memory (or in a temporary file for big or dynamically loaded stacks)
+        the cumulated sum of the spectra.
+        If flag is None (default), the index is used for stacks of more
+        elements than the limit set by setROIIndexLimit.
+        """
+        self._useROIIndex = flag
+        if not self.isROIIndexEnabled():
+            self._resetROIIndex()
+
+    def setROIIndexLimit(self, limit):
+        """
+        Number of elements of the stack beyond which the ROI index is used
+        unless it has been explicitly enabled or disabled.
+        """
+        self._ROIIndexLimit = limit
+        if not self.isROIIndexEnabled():
+            self._resetROIIndex()
+
+    def isROIIndexEnabled(self):
+        """
+        Returns True if the ROI images are calculated from the ROI index.
+        """
+        if self._useROIIndex is not None:
+            return bool(self._useROIIndex)
+        data = getattr(self._stack, "data", None)
+        if not hasattr(data, "shape"):
+            return False
+        return numpy.prod(data.shape, dtype=numpy.float64) > \
+               self._ROIIndexLimit
+
+    def _resetROIIndex(self):
+        if self._ROIIndex is not None:
+            self._ROIIndex.close()
+            self._ROIIndex = None
+
+    def getROIIndex(self):
+        """
+        Returns the index used to calculate the ROI images building it if
+        needed.
+        """
+        if self._ROIIndex is None:
+            if DEBUG:
+                t0 = time.time()
+            memmap = (not self._tryNumpy) or \
+                     (not isinstance(self._stack.data, numpy.ndarray))
+            self._ROIIndex = StackROIIndex.StackROIIndex(self._stack.data,
+                                                         self.mcaIndex,
+                                                         memmap=memmap)
+            if DEBUG:
+                print("ROI index built in %f seconds" % (time.time() - t0))
+        return self._ROIIndex
+
     def stackUpdated(self):
         """
         Recalculates the different images associated to the stack
         """
+        self._resetROIIndex()
         self._tryNumpy = True
         if hasattr(self._stack.data, "size"):
             if self._stack.data.size > self._dynamicLimit:
@@ -748,6 +814,9 @@ def calculateROIImages(self, index1, index2, imiddle=None, energy=None):
                       'Background': dummy}
             return imageDict
 
+        if (self.mcaIndex in [0, 2]) and self.isROIIndexEnabled():
+            return self._calculateROIImagesFromIndex(i1, i2, imiddle, energy)
+
         isUsingSuppliedEnergyAxis = False
         if self.fileIndex == 0:
             if self.mcaIndex == 1:
@@ -984,6 +1053,27 @@ def calculateROIImages(self, index1, index2, imiddle=None, energy=None):
             print("ROI images calculated")
         return imageDict
 
+    def _calculateROIImagesFromIndex(self, i1, i2, imiddle, energy):
+        if DEBUG:
+            t0 = time.time()
+        roiIndex = self.getROIIndex()
+        leftImage = roiIndex.getChannelImage(i1)
+        middleImage = roiIndex.getChannelImage(imiddle)
+        rightImage = roiIndex.getChannelImage(i2 - 1)
+        background = 0.5 * (i2 - i1) * (leftImage + rightImage)
+        imageDict = {'ROI': roiIndex.getROISum(i1, i2),
+                     'Maximum': energy[roiIndex.getROIArgMax(i1, i2)],
+                     'Minimum': energy[roiIndex.getROIArgMin(i1, i2)],
+                     'Left': leftImage,
+                     'Middle': middleImage,
+                     'Right': rightImage,
+                     'Background': background}
+        self.__ROIImageCalculationIsUsingSuppliedEnergyAxis = True
+        if DEBUG:
+            print("Indexed ROI image calculation elapsed = %f" %\
+                  (time.time() - t0))
+        return imageDict
+
     def setSelectionMask(self, mask):
         if DEBUG:
             print("setSelectionMask called")
@@ -0,0 +1,233 @@
+#/*##########################################################################
+#
+# The PyMca X-Ray Fluorescence Toolkit
+#
+# Copyright (c) 2004-2016 European Synchrotron Radiation Facility
+#
+# This file is part of the PyMca X-ray Fluorescence Toolkit developed at
+# the ESRF by the Software group.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+#############################################################################*/
+__author__ = "V.A. Sole - ESRF Data Analysis"
+__contact__ = "sole@esrf.fr"
+__license__ = "MIT"
+__copyright__ = "European Synchrotron Radiation Facility, Grenoble, France"
+__doc__ = """
+Index of a stack allowing to calculate ROI images in a time independent of
+the width of the ROI.
+
+The index contains the cumulated sum of the spectra along the MCA axis, so
+that the sum over any channel range is the difference of two images, and the
+maximum and minimum values (and their positions) of each spectrum in blocks
+of channels. A maximum or minimum image then only needs the data of the
+partially covered blocks at both ends of the ROI.
+
+The index is built once reading the stack sequentially and it can be kept
+in a (temporary) memory mapped file for stacks not fitting into memory.
+"""
+import tempfile
+import numpy
+
+DEBUG = 0
+
+
+class StackROIIndex(object):
+    def __init__(self, data, mcaIndex, blockSize=None, memmap=False):
+        """
+        :param data: 3D array like object indexable as a numpy array
+        :param mcaIndex: 0 or 2, index of the MCA axis
+        :param blockSize: number of channels per minimum/maximum block.
+                          Default is the square root of the number of channels
+        :param memmap: If True the index is stored in a temporary file
+        """
+        if mcaIndex < 0:
+            mcaIndex += len(data.shape)
+        if mcaIndex not in [0, 2]:
+            raise ValueError("Unsupported MCA index %d" % mcaIndex)
+        self._data = data
+        self._axis = mcaIndex
+        nChannels = data.shape[mcaIndex]
+        if blockSize is None:
+            blockSize = max(1, int(numpy.sqrt(nChannels)))
+        self._blockSize = blockSize
+        self._nChannels = nChannels
+        self._nBlocks = (nChannels + blockSize - 1) // blockSize
+        if mcaIndex == 0:
+            self.imageShape = (data.shape[1], data.shape[2])
+        else:
+            self.imageShape = (data.shape[0], data.shape[1])
+        self._files = []
+        self._cumSum = self._allocate(nChannels + 1, numpy.float64, memmap)
+        self._blockMax = self._allocate(self._nBlocks, numpy.float64, memmap)
+        self._blockMin = self._allocate(self._nBlocks, numpy.float64, memmap)
+        self._blockArgMax = self._allocate(self._nBlocks, numpy.int32, memmap)
+        self._blockArgMin = self._allocate(self._nBlocks, numpy.int32, memmap)
+        self._build()
+
+    def _allocate(self, n, dtype, memmap):
+        if self._axis == 0:
+            shape = (n,) + self.imageShape
+        else:
+            shape = self.imageShape + (n,)
+        if memmap:
+            fileObject = tempfile.TemporaryFile()
+            self._files.append(fileObject)
+            array = numpy.memmap(fileObject, dtype=dtype, mode="w+",
+                                 shape=shape)
+        else:
+            array = numpy.zeros(shape, dtype)
+        return array
+
+    def _build(self):
+        data = self._data
+        b = self._blockSize
+        if self._axis == 0:
+            # one image at a time
+            for i in range(self._nChannels):
+                image = numpy.asarray(data[i], dtype=numpy.float64)
+                image = image.reshape(self.imageShape)
+                numpy.add(self._cumSum[i], image, self._cumSum[i + 1])
+                k = i // b
+                if (i % b) == 0:
+                    self._blockMax[k] = image
+                    self._blockMin[k] = image
+                    self._blockArgMax[k] = i
+                    self._blockArgMin[k] = i
+                else:
+                    idx = image > self._blockMax[k]
+                    self._blockMax[k][idx] = image[idx]
+                    self._blockArgMax[k][idx] = i
+                    idx = image < self._blockMin[k]
+                    self._blockMin[k][idx] = image[idx]
+                    self._blockArgMin[k][idx] = i
+        else:
+            # one row of spectra at a time
+            for i in range(self.imageShape[0]):
+                spectra = numpy.asarray(data[i], dtype=numpy.float64)
+                spectra = spectra.reshape(self.imageShape[1],
+                                          self._nChannels)
+                numpy.cumsum(spectra, axis=-1, out=self._cumSum[i, :, 1:])
+                for k in range(self._nBlocks):
+                    block = spectra[:, k * b:(k + 1) * b]
+                    argMax = numpy.argmax(block, axis=-1)
+                    argMin = numpy.argmin(block, axis=-1)
+                    columns = numpy.arange(block.shape[0])
+                    self._blockMax[i, :, k] = block[columns, argMax]
+                    self._blockMin[i, :, k] = block[columns, argMin]
+                    self._blockArgMax[i, :, k] = argMax + k * b
+                    self._blockArgMin[i, :, k] = argMin + k * b
+        if DEBUG:
+            print("Stack ROI index built")
+
+    def _take(self, array, i1, i2):
+        if self._axis == 0:
+            return array[i1:i2]
+        else:
+            return array[:, :, i1:i2]
+
+    def _readChannels(self, i1, i2):
+        data = numpy.asarray(self._take(self._data, i1, i2),
+                             dtype=numpy.float64)
+        if self._axis == 0:
+            return data.reshape((i2 - i1,) + self.imageShape)
+        else:
+            return data.reshape(self.imageShape + (i2 - i1,))
+
+    def getChannelImage(self, i):
+        """
+        Return the image of channel i.
+        """
+        return self._readChannels(i, i + 1).reshape(self.imageShape)
+
+    def getROISum(self, i1, i2):
+        """
+        Return the image of the sum of the channels i1 to i2 - 1.
+        """
+        if self._axis == 0:
+            return self._cumSum[i2] - self._cumSum[i1]
+        else:
+            return self._cumSum[:, :, i2] - self._cumSum[:, :, i1]
+
+    def _reduce(self, i1, i2, blockValues, blockPositions, function, better):
+        b = self._blockSize
+        firstBlock = (i1 + b - 1) // b
+        lastBlock = i2 // b
+        if firstBlock >= lastBlock:
+            # no complete block covered: use the data
+            data = self._readChannels(i1, i2)
+            return function(data, axis=self._axis) + i1
+        # pieces of the range in channel order: head, blocks, tail
+        pieces = []
+        if i1 < firstBlock * b:
+            data = self._readChannels(i1, firstBlock * b)
+            position = function(data, axis=self._axis)
+            value = self._pick(data, position)
+            pieces.append((value, position + i1))
+        blocks = self._take(blockValues, firstBlock, lastBlock)
+        position = function(blocks, axis=self._axis)
+        value = self._pick(blocks, position)
+        positions = self._take(blockPositions, firstBlock, lastBlock)
+        pieces.append((value, self._pick(positions, position)))
+        if lastBlock * b < i2:
+            data = self._readChannels(lastBlock * b, i2)
+            position = function(data, axis=self._axis)
+            value = self._pick(data, position)
+            pieces.append((value, position + lastBlock * b))
+        bestValue, bestPosition = pieces[0]
+        bestPosition = numpy.array(bestPosition, dtype=numpy.int64)
+        for value, position in pieces[1:]:
+            # strict comparison keeps the first occurrence as numpy does
+            idx = better(value, bestValue)
+            bestValue = numpy.where(idx, value, bestValue)
+            bestPosition[idx] = position[idx]
+        return bestPosition
+
+    def _pick(self, array, position):
+        # values of array at the given positions along the MCA axis
+        rows, columns = numpy.indices(position.shape)
+        if self._axis == 0:
+            return array[position, rows, columns]
+        else:
+            return array[rows, columns, position]
+
+    def getROIArgMax(self, i1, i2):
+        """
+        Return the image of the channels of maximum value in i1 to i2 - 1.
+        """
+        return self._reduce(i1, i2, self._blockMax, self._blockArgMax,
+                            numpy.argmax, numpy.greater)
+
+    def getROIArgMin(self, i1, i2):
+        """
+        Return the image of the channels of minimum value in i1 to i2 - 1.
+        """
+        return self._reduce(i1, i2, self._blockMin, self._blockArgMin,
+                            numpy.argmin, numpy.less)
+
+    def close(self):
+        self._cumSum = None
+        self._blockMax = None
+        self._blockMin = None
+        self._blockArgMax = None
+        self._blockArgMin = None
+        for fileObject in self._files:
+            fileObject.close()
+        self._files = []
@@ -81,9 +81,11 @@ def _update(self, ddict):
     def _getDataObject(self, key=None, selection=None):
         if key is None:
             key = self.info['Key']
+        # the image is only displayed, there is no need to copy it
         dataObject = self.data.getDataObject(key,
                                              selection=None,
-                                             poll=False)
+                                             poll=False,
+                                             copyData=False)
         if dataObject is not None:
             dataObject.info['legend'] = self.info['Key']
             dataObject.info['imageselection'] = False
@@ -70,6 +70,9 @@ def __init__(self, parent=None, options=[1, 2, 3, 4, 5, 10],
         if 0:
             self.methods.append("Covariance Numpy")
             self.functions.append(PCAModule.numpyPCA)
+        if index != 0:
+            self.methods.append("Randomized")
+            self.functions.append(PCAModule.randomizedPCA)
         if MDP and (index != 0):
             #self.methods.append("MDP (PCA + ICA)")
             self.methods.append("MDP (SVD float32)")
@@ -32,6 +32,7 @@
 import os
 import time
 import subprocess
+import multiprocessing
 
 from PyMca5.PyMcaGui import PyMcaQt as qt
 
@@ -54,7 +55,6 @@
 from PyMca5.PyMcaGui.pymca import EdfFileSimpleViewer
 from PyMca5.PyMcaCore import HtmlIndex
 from PyMca5.PyMcaCore import PyMcaDirs
-from PyMca5.PyMcaCore import PyMcaBatchBuildOutput
 
 ROIWIDTH = 100.
 DEBUG = 0
@@ -69,8 +69,6 @@ def __init__(self,parent=None,name="PyMca batch fitting",fl=None,
         self._layout.setContentsMargins(0, 0, 0, 0)
         self._layout.setSpacing(0)
         self._edfSimpleViewer = None
-        self._timer = None
-        self._processList = []
         self._selection = None
         self.__build(actions)
         if filelist is None: filelist = []
@@ -780,21 +778,6 @@ def start(self):
                     qt.QMessageBox.critical(self, "ERROR",text)
                     self.raise_()
                     return
-            if len(self.fileList) == 1:
-                if int(qt.safe_str(self.__splitSpin.text())) > 1:
-                    allowSingleFileSplitProcesses = False
-                    if HDF5SUPPORT:
-                        if h5py.is_hdf5(self.fileList[0]):
-                            if DEBUG:
-                                print("Disallow single HDF5 process split")
-                                print("due to problems with concurrent access")
-                            #allowSingleFileSplitProcesses = True
-                            allowSingleFileSplitProcesses = False
-                    if not allowSingleFileSplitProcesses:
-                        text = "Multiple processes can only be used with multiple input files."
-                        qt.QMessageBox.critical(self, "ERROR",text)
-                        self.raise_()
-                        return
 
         if (self.configFile is None) or (not self.__goodConfigFile(self.configFile)):
             qt.QMessageBox.critical(self, "ERROR",'Invalid fit configuration file')
@@ -843,10 +826,10 @@ def start(self):
             overwrite= 1
             filestep = 1
             mcastep = 1
-            if len(self.fileList) == 1:
-                if self.__splitBox.isChecked():
-                    nbatches = int(qt.safe_str(self.__splitSpin.text()))
-                    mcastep = nbatches
+        # the spectra are fitted by a pool of processes of a single batch
+        processes = 1
+        if self.__splitBox.isChecked():
+            processes = int(qt.safe_str(self.__splitSpin.text()))
 
         fitfiles = self.__fitBox.isChecked()
         selection = self._selection
@@ -1003,64 +986,24 @@ def pause():
                                                                     html,htmlindex,
                                                                     listfile,concentrations,
                                                                     table, fitfiles, selectionFlag)
+            if processes > 1:
+                cmd += " --processes=%d" % processes
             self.hide()
             qApp = qt.QApplication.instance()
             qApp.processEvents()
             if DEBUG:
                 print("cmd = %s" % cmd)
-            if self.__splitBox.isChecked():
-                nbatches = int(qt.safe_str(self.__splitSpin.text()))
-                if len(self.fileList) > 1:
-                    filechunk = int(len(self.fileList)/nbatches)
-                    processList = []
-                    for i in range(nbatches):
-                        beginoffset = filechunk * i
-                        endoffset   = len(self.fileList) - filechunk * (i+1)
-                        if (i+1) == nbatches:endoffset = 0
-                        cmd1        = cmd + " --filebeginoffset=%d --fileendoffset=%d --chunk=%d" % \
-                                              (beginoffset, endoffset, i)
-                        try:
-                            processList.append(subprocess.Popen(cmd1,
-                                                            cwd=os.getcwd()))
-                        except UnicodeEncodeError:
-                            processList.append(\
-                                subprocess.Popen(cmd1.encode(sys.getfilesystemencoding()),
-                                                 cwd=os.getcwd()))
-
-                        if DEBUG:
-                            print("cmd = %s" % cmd1)
-                else:
-                    #f = open("CMD", 'wb')
-                    processList = []
-                    for i in range(nbatches):
-                        #the mcastep has been dealt with above
-                        cmd1        = cmd + " --mcaoffset=%d --chunk=%d" % (i, i)
-                        processList.append(subprocess.Popen(cmd1, cwd=os.getcwd()))
-                        if DEBUG:
-                            print("CMD = %s" % cmd1)
-                        #f.write(cmd1+"\n")
-                    #f.close()
-                self._processList = processList
-                if self._timer is None:
-                    self._timer = qt.QTimer(self)
-                    self._timer.timeout[()].connect(self._pollProcessList)
-                if not self._timer.isActive():
-                    self._timer.start(1000)
-                else:
-                    print("timer was already active")
-                return
-            else:
+            try:
+                subprocess.call(cmd)
+            except UnicodeEncodeError:
                 try:
-                    subprocess.call(cmd)
-                except UnicodeEncodeError:
+                    subprocess.call(cmd.encode(sys.getfilesystemencoding()))
+                except:
+                    # be ready for any weird error like missing that encoding
                     try:
-                        subprocess.call(cmd.encode(sys.getfilesystemencoding()))
-                    except:
-                        # be ready for any weird error like missing that encoding
-                        try:
-                            subprocess.call(cmd.encode('utf-8'))
-                        except UnicodeEncodeError:
-                            subprocess.call(cmd.encode('latin-1'))
+                        subprocess.call(cmd.encode('utf-8'))
+                    except UnicodeEncodeError:
+                        subprocess.call(cmd.encode('latin-1'))
             self.show()
         else:
             listfile = os.path.join(self.outputDir, "tmpfile")
@@ -1122,61 +1065,30 @@ def pause():
             if type(self.configFile) == type([]):
                 cfglistfile = os.path.join(self.outputDir, "tmpfile.cfg")
                 self.genListFile(cfglistfile, config=True)
-                cmd = "%s --cfglistfile=%s --outdir=%s --overwrite=%d --filestep=%d --mcastep=%d --html=%d --htmlindex=%s --listfile=%s  --concentrations=%d --table=%d --fitfiles=%d --selection=%d &" % \
+                cmd = "%s --cfglistfile=%s --outdir=%s --overwrite=%d --filestep=%d --mcastep=%d --html=%d --htmlindex=%s --listfile=%s  --concentrations=%d --table=%d --fitfiles=%d --selection=%d" % \
                                                     (myself,
                                                     cfglistfile,
                                                     self.outputDir, overwrite,
                                                     filestep, mcastep, html, htmlindex, listfile,
                                                     concentrations, table, fitfiles, selectionFlag)
             else:
-                cmd = "%s --cfg=%s --outdir=%s --overwrite=%d --filestep=%d --mcastep=%d --html=%d --htmlindex=%s --listfile=%s  --concentrations=%d --table=%d --fitfiles=%d  --selection=%d &" % \
+                cmd = "%s --cfg=%s --outdir=%s --overwrite=%d --filestep=%d --mcastep=%d --html=%d --htmlindex=%s --listfile=%s  --concentrations=%d --table=%d --fitfiles=%d  --selection=%d" % \
                                                    (myself, self.configFile,
                                                     self.outputDir, overwrite,
                                                     filestep, mcastep, html, htmlindex,
                                                     listfile, concentrations, table, fitfiles, selectionFlag)
+            if processes > 1:
+                cmd += " --processes=%d" % processes
+            cmd += " &"
             if DEBUG:
                 print("cmd = %s" % cmd)
-            if self.__splitBox.isChecked():
-                qApp = qt.QApplication.instance()
-                qApp.processEvents()
-                nbatches = int(qt.safe_str(self.__splitSpin.text()))
-                filechunk = int(len(self.fileList)/nbatches)
-                processList = []
-                for i in range(nbatches):
-                    beginoffset = filechunk * i
-                    endoffset   = len(self.fileList) - filechunk * (i+1)
-                    if (i+1) == nbatches:endoffset = 0
-                    cmd1 = cmd.replace("&", "") + \
-                           " --filebeginoffset=%d --fileendoffset=%d --chunk=%d" % \
-                            (beginoffset, endoffset, i)
-                    # unfortunately I have to set shell = True
-                    # otherways I get a file not found error in the
-                    # child process
-                    processList.append(\
-                        subprocess.Popen(cmd1,
-                                         cwd=os.getcwd(),
-                                         shell=True,
-                                         close_fds=True))
-                self._processList = processList
-                self.hide()
-                self._pollProcessList()
-                if self._timer is None:
-                    self._timer = qt.QTimer(self)
-                    self._timer.timeout[()].connect( \
-                                       self._pollProcessList)
-                if not self._timer.isActive():
-                    self._timer.start(1000)
-                else:
-                    print("timer was already active")
-                return
-            else:
-                os.system(cmd)
-                print(" COMMAND = ", cmd)
-                msg = qt.QMessageBox(self)
-                msg.setIcon(qt.QMessageBox.Information)
-                text = "Your batch has been started as an independent process."
-                msg.setText(text)
-                msg.exec_()
+            os.system(cmd)
+            print(" COMMAND = ", cmd)
+            msg = qt.QMessageBox(self)
+            msg.setIcon(qt.QMessageBox.Information)
+            text = "Your batch has been started as an independent process."
+            msg.setText(text)
+            msg.exec_()
 
     def genListFile(self, listfile, config=None):
         if os.path.exists(listfile):
@@ -1206,56 +1118,13 @@ def genListFile(self, listfile, config=None):
             fd.write(('%s\n' % filename).encode(sys.getfilesystemencoding()))
         fd.close()
 
-    def _pollProcessList(self):
-        processList = self._processList
-        rgb         = self._rgb
-        if QTVERSION < '4.0.0':rgb = None
-        n = 0
-        for process in processList:
-            if process.poll() is None:
-                n += 1
-        if n > 0: return
-        self._timer.stop()
-        self.show()
-        if QTVERSION < '4.0.0':
-            self.raiseW()
-        else:
-            self.raise_()
-
-        work = PyMcaBatchBuildOutput.PyMcaBatchBuildOutput(os.path.join(self.outputDir, "IMAGES"))
-        if DEBUG:
-            a, b, c = work.buildOutput(delete=False)
-        else:
-            a, b, c = work.buildOutput(delete=True)
-        if len(a):
-            if self._edfSimpleViewer is None:
-                self._edfSimpleViewer = EdfFileSimpleViewer.EdfFileSimpleViewer()
-            self._edfSimpleViewer.setFileList(a)
-            self._edfSimpleViewer.show()
-        if rgb is not None:
-            if len(b):
-                if sys.platform == "win32":
-                    try:
-                        subprocess.Popen('%s "%s"' % (rgb, b[0]),
-                                         cwd = os.getcwd())
-                    except UnicodeEncodeError:
-                        subprocess.Popen(('%s "%s"' % (rgb, b[0])).encode(sys.getfilesystemencoding()),
-                                         cwd = os.getcwd())
-                else:
-                    os.system("%s %s &" % (rgb, b[0]))
-        work = PyMcaBatchBuildOutput.PyMcaBatchBuildOutput(self.outputDir)
-        if DEBUG:
-            work.buildOutput(delete=False)
-        else:
-            work.buildOutput(delete=True)
-
 class McaBatch(McaAdvancedFitBatch.McaAdvancedFitBatch, qt.QThread):
     def __init__(self, parent, configfile, filelist=None, outputdir = None,
                      roifit = None, roiwidth=None, overwrite=1,
                      filestep=1, mcastep=1, concentrations=0,
                      fitfiles=0, filebeginoffset=0, fileendoffset=0,
                      mcaoffset=0, chunk=None,
-                     selection=None, lock=None):
+                     selection=None, lock=None, processes=None):
         McaAdvancedFitBatch.McaAdvancedFitBatch.__init__(self, configfile,
                                                          filelist=filelist, outputdir=outputdir,
                                                          roifit=roifit, roiwidth=roiwidth,
@@ -1268,7 +1137,8 @@ def __init__(self, parent, configfile, filelist=None, outputdir = None,
                                                          mcaoffset  = mcaoffset,
                                                          chunk=chunk,
                                                          selection=selection,
-                                                         lock=lock)
+                                                         lock=lock,
+                                                         processes=processes)
         qt.QThread.__init__(self)
         self.parent = parent
         self.pleasePause = 0
@@ -1729,7 +1599,8 @@ def main():
                    'overwrite=', 'filestep=', 'mcastep=', 'html=','htmlindex=',
                    'listfile=','cfglistfile=', 'concentrations=', 'table=', 'fitfiles=',
                    'filebeginoffset=','fileendoffset=','mcaoffset=', 'chunk=',
-                   'nativefiledialogs=','selection=', 'exitonend=']
+                   'nativefiledialogs=','selection=', 'exitonend=',
+                   'processes=']
     filelist = None
     outdir   = None
     cfg      = None
@@ -1751,6 +1622,7 @@ def main():
     mcaoffset = 0
     chunk = None
     exitonend = False
+    processes = None
     opts, args = getopt.getopt(
                     sys.argv[1:],
                     options,
@@ -1805,6 +1677,8 @@ def main():
                 PyMcaDirs.nativeFileDialogs = False
         elif opt in ('--exitonend'):
             exitonend = int(arg)
+        elif opt in ('--processes'):
+            processes = int(arg)
 
     if listfile is None:
         filelist=[]
@@ -1855,7 +1729,8 @@ def main():
                      overwrite = overwrite, filestep=filestep, mcastep=mcastep,
                       concentrations=concentrations, fitfiles=fitfiles,
                       filebeginoffset=filebeginoffset,fileendoffset=fileendoffset,
-                      mcaoffset=mcaoffset, chunk=chunk, selection=selection)
+                      mcaoffset=mcaoffset, chunk=chunk, selection=selection,
+                      processes=processes)
         except:
             if exitonend:
                 print("Error: " % sys.exc_info()[1])
@@ -1892,6 +1767,7 @@ def pause():
         app.exec_()
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support()
     main()
 
 
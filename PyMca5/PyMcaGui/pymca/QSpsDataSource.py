@@ -65,13 +65,15 @@ def __getattr__(self,attr):
                     pass
         raise AttributeError
 
-    def getDataObject(self,key_list,selection=None, poll=True):
+    def getDataObject(self,key_list,selection=None, poll=True, copyData=True):
         if poll:
-            data = self.__dataSource.getDataObject(key_list,selection)
+            data = self.__dataSource.getDataObject(key_list,selection,
+                                                   copyData=copyData)
             self.addToPoller(data)
             return data
         else:
-            return self.__dataSource.getDataObject(key_list,selection)
+            return self.__dataSource.getDataObject(key_list,selection,
+                                                   copyData=copyData)
 
     def customEvent(self, event):
         ddict = event.dict
@@ -31,6 +31,7 @@
 import os
 import traceback
 import time
+import multiprocessing
 from PyMca5.PyMcaGui import PyMcaQt as qt
 from PyMca5 import PyMcaDirs
 from PyMca5.PyMcaGui import SimpleFitGui
@@ -70,12 +71,41 @@ def __init__(self, parent=None):
         self.mainLayout.addWidget(self.outputFileLine,   1, 1)
         self.outputDirButton.clicked.connect(self.browseDirectory)
 
+        self.processesLabel = qt.QLabel(self)
+        self.processesLabel.setText("Number of processes")
+        self.processesSpin = qt.QSpinBox(self)
+        self.processesSpin.setMinimum(1)
+        self.processesSpin.setMaximum(max(1, multiprocessing.cpu_count()))
+        self.processesSpin.setValue(1)
+        self.processesSpin.setToolTip(\
+            "Fit functions have to be imported from a file to be used\n" +\
+            "by several processes")
+        self.warmStartBox = qt.QCheckBox(self)
+        self.warmStartBox.setText("Start each fit from the previous pixel")
+        self.hdf5Box = qt.QCheckBox(self)
+        self.hdf5Box.setText("Write the images into an HDF5 file")
+        if not StackSimpleFit.HDF5:
+            self.hdf5Box.setEnabled(False)
+        self.mainLayout.addWidget(self.processesLabel, 2, 0)
+        self.mainLayout.addWidget(self.processesSpin,  2, 1)
+        self.mainLayout.addWidget(self.warmStartBox,   3, 0, 1, 2)
+        self.mainLayout.addWidget(self.hdf5Box,        4, 0, 1, 2)
+
     def getOutputDirectory(self):
         return safe_str(self.outputDirLine.text())
 
     def getOutputFileBaseName(self):
         return safe_str(self.outputFileLine.text())
 
+    def getProcesses(self):
+        return self.processesSpin.value()
+
+    def getWarmStart(self):
+        return self.warmStartBox.isChecked()
+
+    def getHDF5Output(self):
+        return self.hdf5Box.isChecked()
+
     def setOutputDirectory(self, txt):
         if os.path.exists(txt):
             self.outputDirLine.setText(txt)
@@ -161,6 +191,10 @@ def startStackFit(self):
         self.stackFitInstance.setData(self.stack_x, self.stack_y,
                                      sigma=None, xmin=xmin, xmax=xmax)
         self.stackFitInstance.setDataIndex(self.data_index)
+        self.stackFitInstance.setProcesses(self.outputParameters.getProcesses())
+        self.stackFitInstance.setWarmStart(self.outputParameters.getWarmStart())
+        self.stackFitInstance.setHDF5Output(\
+                                    self.outputParameters.getHDF5Output())
         #check filenames
         fileNames = self.stackFitInstance.getOutputFileNames()
         deleteFiles = None
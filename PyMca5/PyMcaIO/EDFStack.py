@@ -37,6 +37,8 @@
 import numpy
 import sys
 import os
+import collections
+from multiprocessing.pool import ThreadPool
 
 # Offer automatic conversion to HDF5 in case of lacking
 # memory to hold the Stack.
@@ -55,8 +57,118 @@
 Y_AXIS=1
 Z_AXIS=2
 
+# Number of threads reading files and maximum number of files being read
+# in advance by EDFStack.loadFileList
+WORKERS = 4
+READAHEAD = 32
+
+def iterateFileList(filelist, function, workers=None, readahead=None):
+    """
+    Generator returning function(index, filename) for each file of the list
+    in the order of the list.
+
+    The function is called by a pool of worker threads with at most readahead
+    files being processed in advance of the file returned. Files on high
+    latency file systems are then read concurrently while the order seen by
+    the caller is kept.
+    """
+    if workers is None:
+        workers = WORKERS
+    if readahead is None:
+        readahead = READAHEAD
+    nFiles = len(filelist)
+    if (workers < 2) or (nFiles < 2):
+        for index in range(nFiles):
+            yield function(index, filelist[index])
+        return
+    readahead = max(readahead, workers)
+    pool = ThreadPool(min(workers, nFiles))
+    pending = collections.deque()
+    try:
+        index = 0
+        while (index < nFiles) or len(pending):
+            while (index < nFiles) and (len(pending) < readahead):
+                pending.append(pool.apply_async(function,
+                                                (index, filelist[index])))
+                index += 1
+            yield pending.popleft().get()
+    finally:
+        pool.terminate()
+        pool.join()
+
+class VirtualImageStack(object):
+    """
+    Array like object of shape (nFiles, nRows, nColumns) giving access to a
+    list of EDF files containing one image each without reading them in
+    advance. The requested pixels are read through memory mapped views of the
+    files when needed.
+    """
+    def __init__(self, filelist, shape, dtype):
+        self._fileList = filelist
+        self._edfList = [None] * len(filelist)
+        self.shape = (len(filelist),) + tuple(shape)
+        self.dtype = numpy.dtype(dtype)
+        self.size = len(filelist) * shape[0] * shape[1]
+        self.ndim = 3
+
+    def __len__(self):
+        return self.shape[0]
+
+    def getImage(self, index):
+        """
+        Return a read-only view of the image of the given file index
+        """
+        if self._edfList[index] is None:
+            self._edfList[index] = EdfFile.EdfFile(self._fileList[index],
+                                                   'rb')
+        return self._edfList[index].GetData(0, memmap=True)
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        fileKey = key[0]
+        imageKey = key[1:]
+        if isinstance(fileKey, (int, numpy.integer)):
+            if fileKey < 0:
+                fileKey += self.shape[0]
+            return self._readImage(fileKey, imageKey)
+        indices = numpy.arange(self.shape[0])[fileKey]
+        output = None
+        for i, index in enumerate(indices):
+            image = self._readImage(index, imageKey)
+            if output is None:
+                output = numpy.zeros((len(indices),) + image.shape,
+                                     self.dtype)
+            output[i] = image
+        if output is None:
+            output = numpy.zeros((0,) + \
+                        numpy.zeros(self.shape[1:], numpy.uint8)[imageKey].shape,
+                        self.dtype)
+        return output
+
+    def _readImage(self, index, imageKey):
+        image = self.getImage(index)
+        if image.shape != self.shape[1:]:
+            # assume missing data were at the end
+            print(" ERROR on file %s" % self._fileList[index])
+            tmpImage = numpy.zeros(self.shape[1:], image.dtype)
+            tmpImage[:image.shape[0], :image.shape[1]] = \
+                                image[:self.shape[1], :self.shape[2]]
+            image = tmpImage
+        return numpy.array(image[imageKey], dtype=self.dtype)
+
 class EDFStack(DataObject.DataObject):
-    def __init__(self, filelist = None, imagestack=None, dtype=None):
+    def __init__(self, filelist = None, imagestack=None, dtype=None,
+                 virtual=False, workers=None, readahead=None):
+        """
+        If virtual is True and the files contain one uncompressed image each,
+        the data are not read in advance but accessed through memory mapping
+        when needed.
+
+        workers and readahead are the number of threads used to read the
+        files and the maximum number of files read in advance. The module
+        WORKERS and READAHEAD values are used by default.
+        """
         DataObject.DataObject.__init__(self)
         self.incrProgressBar=0
         self.__keyList = []
@@ -65,6 +177,9 @@ def __init__(self, filelist = None, imagestack=None, dtype=None):
         else:
             self.__imageStack = imagestack
         self.__dtype = dtype
+        self.__virtual = virtual
+        self.__workers = workers
+        self.__readahead = readahead
         if filelist is not None:
             if type(filelist) != type([]):
                 filelist = [filelist]
@@ -108,8 +223,14 @@ def loadFileList(self, filelist, fileindex=0):
         if self.__dtype is None:
             self.__dtype = arrRet.dtype
 
-        self.onBegin(self.nbFiles)
         singleImageShape = arrRet.shape
+        if self.__virtual and (nImages == 1) and \
+           (len(singleImageShape) == 2) and (fileindex != 1) and \
+           (not self.__isID24(filelist)):
+            self.__loadVirtualStack(filelist, singleImageShape, fileindex)
+            return
+
+        self.onBegin(self.nbFiles)
         actualImageStack = False
         if (fileindex == 2) or (self.__imageStack):
             self.__imageStack = True
@@ -173,26 +294,18 @@ def loadFileList(self, filelist, fileindex=0):
                                                      arrRet.shape[0],
                                                      arrRet.shape[1]),
                                                      self.__dtype)
-                            self.incrProgressBar=0
-                            for tempEdfFileName in filelist:
-                                tempEdf=EdfFile.EdfFile(tempEdfFileName, 'rb')
-                                pieceOfStack=tempEdf.GetData(0)
-                                self.data[self.incrProgressBar] = pieceOfStack
-                                self.incrProgressBar += 1
-                                self.onProgress(self.incrProgressBar)
+                            def store(index, pieceOfStack):
+                                self.data[index] = pieceOfStack
+                            self.__readFileList(filelist, store)
                             actualImageStack = True
                         else:
                             self.data = numpy.zeros((arrRet.shape[0],
                                                      arrRet.shape[1],
                                                      self.nbFiles),
                                                      self.__dtype)
-                            self.incrProgressBar=0
-                            for tempEdfFileName in filelist:
-                                tempEdf=EdfFile.EdfFile(tempEdfFileName, 'rb')
-                                pieceOfStack=tempEdf.GetData(0)
-                                self.data[:,:, self.incrProgressBar] = pieceOfStack
-                                self.incrProgressBar += 1
-                                self.onProgress(self.incrProgressBar)
+                            def store(index, pieceOfStack):
+                                self.data[:, :, index] = pieceOfStack
+                            self.__readFileList(filelist, store)
                     except (MemoryError, ValueError):
                         hdf5done = False
                         if HDF5 and (('PyMcaQt' in sys.modules) or\
@@ -243,14 +356,10 @@ def loadFileList(self, filelist, fileindex=0):
                                     samplingStep = i
                                 except:
                                     i += 1
-                            self.incrProgressBar=0
-                            for tempEdfFileName in filelist:
-                                tempEdf=EdfFile.EdfFile(tempEdfFileName, 'rb')
-                                pieceOfStack=tempEdf.GetData(0)
-                                self.data[:,:, self.incrProgressBar] = pieceOfStack[
-                                                            ::samplingStep,::samplingStep]
-                                self.incrProgressBar += 1
-                                self.onProgress(self.incrProgressBar)
+                            def store(index, pieceOfStack):
+                                self.data[:, :, index] = pieceOfStack[
+                                                ::samplingStep, ::samplingStep]
+                            self.__readFileList(filelist, store)
                 self.onEnd()
         else:
             self.__imageStack = False
@@ -405,12 +514,9 @@ def loadFileList(self, filelist, fileindex=0):
                                     raise MemoryError("Memory Error")
                     self.incrProgressBar=0
                     if fileindex == 1:
-                        for tempEdfFileName in filelist:
-                            tempEdf=EdfFile.EdfFile(tempEdfFileName, 'rb')
-                            pieceOfStack=tempEdf.GetData(0)
-                            self.data[:,self.incrProgressBar,:] = pieceOfStack[:,:]
-                            self.incrProgressBar += 1
-                            self.onProgress(self.incrProgressBar)
+                        def store(index, pieceOfStack):
+                            self.data[:, index, :] = pieceOfStack[:, :]
+                        self.__readFileList(filelist, store)
                     else:
                         # test for ID24 map
                         ID24 = False
@@ -423,7 +529,6 @@ def loadFileList(self, filelist, fileindex=0):
                             i0StartFile = filelist[0].replace("_sample_", "_I0start_")
                             if os.path.exists(i0StartFile):
                                 ID24 = True
-                                id24idx = 0
                                 i0Start = EdfFile.EdfFile(i0StartFile, 'rb').GetData(0).astype(numpy.float)
                                 i0Start -= bckData
                                 i0EndFile = filelist[0].replace("_sample_", "_I0end_")
@@ -431,28 +536,23 @@ def loadFileList(self, filelist, fileindex=0):
                                 if os.path.exists(i0EndFile):
                                     i0End = EdfFile.EdfFile(i0EndFile, 'rb').GetData(0) - bckData
                                     i0Slope = (i0End-i0Start)/len(filelist)
-                        for tempEdfFileName in filelist:
-                            tempEdf=EdfFile.EdfFile(tempEdfFileName, 'rb')
+                        def store(index, pieceOfStack):
                             if ID24:
-                                pieceOfStack=-numpy.log((tempEdf.GetData(0) - bckData)/(i0Start[0,:] + id24idx * i0Slope))
+                                pieceOfStack=-numpy.log((pieceOfStack - bckData)/(i0Start[0,:] + index * i0Slope))
                                 pieceOfStack[numpy.isfinite(pieceOfStack) == False] = 1
-                                id24idx += 1
-                            else:
-                                pieceOfStack=tempEdf.GetData(0)
                             try:
-                                self.data[self.incrProgressBar, :,:] = pieceOfStack[:,:]
+                                self.data[index, :,:] = pieceOfStack[:,:]
                             except:
                                 if pieceOfStack.shape[1] != arrRet.shape[1]:
-                                    print(" ERROR on file %s" % tempEdfFileName)
+                                    print(" ERROR on file %s" % filelist[index])
                                     print(" DIM 1 error Assuming missing data were at the end!!!")
                                 if pieceOfStack.shape[0] != arrRet.shape[0]:
-                                    print(" ERROR on file %s" % tempEdfFileName)
+                                    print(" ERROR on file %s" % filelist[index])
                                     print(" DIM 0 error Assuming missing data were at the end!!!")
-                                self.data[self.incrProgressBar,\
+                                self.data[index,\
                                          :pieceOfStack.shape[0],\
                                          :pieceOfStack.shape[1]] = pieceOfStack[:,:]
-                            self.incrProgressBar += 1
-                            self.onProgress(self.incrProgressBar)
+                        self.__readFileList(filelist, store)
                     self.onEnd()
         self.__nFiles         = self.incrProgressBar
         self.__nImagesPerFile = nImages
@@ -487,6 +587,43 @@ def loadFileList(self, filelist, fileindex=0):
             self.info["Size"] = self.__nFiles * self.__nImagesPerFile
 
 
+    def __readFileList(self, filelist, store):
+        # store(index, image) puts the first image of each file in its slot
+        def read(index, filename):
+            store(index, EdfFile.EdfFile(filename, 'rb').GetData(0))
+        self.incrProgressBar = 0
+        for result in iterateFileList(filelist, read,
+                                      workers=self.__workers,
+                                      readahead=self.__readahead):
+            self.incrProgressBar += 1
+            self.onProgress(self.incrProgressBar)
+
+    def __isID24(self, filelist):
+        if "_sample_" in filelist[0]:
+            i0StartFile = filelist[0].replace("_sample_", "_I0start_")
+            return os.path.exists(i0StartFile)
+        return False
+
+    def __loadVirtualStack(self, filelist, imageShape, fileindex):
+        self.data = VirtualImageStack(filelist, imageShape, self.__dtype)
+        self.__nFiles = len(filelist)
+        self.__nImagesPerFile = 1
+        self.incrProgressBar = self.__nFiles
+        shape = self.data.shape
+        for i in range(len(shape)):
+            key = 'Dim_%d' % (i+1,)
+            self.info[key] = shape[i]
+        self.info["SourceType"] = SOURCE_TYPE
+        self.info["SourceName"] = self.sourceName
+        self.info["NumberOfFiles"] = self.__nFiles
+        self.info["Size"] = self.__nFiles
+        if (fileindex == 2) or self.__imageStack:
+            self.__imageStack = True
+            self.info["McaIndex"] = 0
+            self.info["FileIndex"] = 1
+        else:
+            self.info["FileIndex"] = fileindex
+
     def onBegin(self, n):
         pass
 
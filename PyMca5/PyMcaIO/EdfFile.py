@@ -39,7 +39,7 @@
     class EdfFile:
         __init__(self,FileName)
         GetNumImages(self)
-        def GetData(self,Index, DataType="",Pos=None,Size=None):
+        def GetData(self,Index, DataType="",Pos=None,Size=None,memmap=False):
         GetPixel(self,Index,Position)
         GetHeader(self,Index)
         GetStaticHeader(self,Index)
@@ -584,7 +584,7 @@ def GetData(self, *var, **kw):
         finally:
             self.__makeSureFileIsClosed()
 
-    def _GetData(self, Index, DataType="", Pos=None, Size=None):
+    def _GetData(self, Index, DataType="", Pos=None, Size=None, memmap=False):
         """ Returns numpy array with image data
             Index:          The zero-based index of the image in the file
             DataType:       The edf type of the array to be returnd
@@ -613,10 +613,18 @@ def _GetData(self, Index, DataType="", Pos=None, Size=None):
                             (x,y,z) if ommited, is the distance from Pos to the end.
 
             If Pos and Size not mentioned, returns the whole data.
+
+            memmap:         If True and the file is an uncompressed EDF file,
+                            a read-only numpy.memmap of the data (or of the
+                            Pos/Size region) is returned without reading
+                            the file.
         """
         fastedf = self.fastedf
         if Index < 0 or Index >= self.NumImages:
             raise ValueError("EdfFile: Index out of limit")
+        if memmap and (DataType in ["", self.Images[Index].DataType]) and\
+           self.__canMemoryMap():
+            return self._GetMemoryMappedData(Index, Pos=Pos, Size=Size)
         if fastedf is None:fastedf = 0
         if Pos is None and Size is None:
             if self.ADSC or self.MARCCD or self.PILATUS_CBF or self.SPE:
@@ -757,6 +765,50 @@ def _GetData(self, Index, DataType="", Pos=None, Size=None):
 
 
 
+    def _GetMemoryMappedData(self, Index, Pos=None, Size=None):
+        """ Returns a read-only numpy.memmap view of the image data
+            Index, Pos and Size have the same meaning as in GetData
+        """
+        image = self.Images[Index]
+        dtype = numpy.dtype(self.__GetDefaultNumpyType__(image.DataType,
+                                                          index=Index))
+        if self.SysByteOrder.upper() != image.ByteOrder.upper():
+            # let numpy handle the byte order instead of swapping
+            dtype = dtype.newbyteorder()
+        if image.NumDim == 3:
+            shape = (image.Dim3, image.Dim2, image.Dim1)
+        elif image.NumDim == 2:
+            shape = (image.Dim2, image.Dim1)
+        else:
+            shape = (image.Dim1,)
+        Data = numpy.memmap(self.FileName, dtype=dtype, mode="r",
+                            offset=image.DataPosition, shape=shape)
+        if (Pos is None) and (Size is None):
+            return Data
+        if Pos is None:
+            Pos = (0,) * image.NumDim
+        if Size is None:
+            Size = (0,) * image.NumDim
+        # Pos and Size are given as (x, y, z) and a size of 0 means up to
+        # the end of the corresponding dimension
+        region = []
+        for i in range(image.NumDim - 1, -1, -1):
+            start = Pos[i]
+            if Size[i] == 0:
+                region.append(slice(start, shape[image.NumDim - 1 - i]))
+            else:
+                region.append(slice(start, start + Size[i]))
+        return Data[tuple(region)]
+
+    def __canMemoryMap(self):
+        if not self.__ownedOpen:
+            # compressed files or file descriptors supplied by the caller
+            return False
+        if self.ADSC or self.MARCCD or self.PILATUS_CBF or self.SPE or \
+           self.TIFF:
+            return False
+        return os.path.isfile(self.FileName)
+
     def GetPixel(self, Index, Position):
         """ Returns double value of the pixel, regardless the format of the array
             Index:      The zero-based index of the image in the file
@@ -0,0 +1,204 @@
+#/*##########################################################################
+#
+# The PyMca X-Ray Fluorescence Toolkit
+#
+# Copyright (c) 2004-2016 European Synchrotron Radiation Facility
+#
+# This file is part of the PyMca X-ray Fluorescence Toolkit developed at
+# the ESRF by the Software group.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+#############################################################################*/
+__author__ = "V.A. Sole - ESRF Data Analysis"
+__contact__ = "sole@esrf.fr"
+__license__ = "MIT"
+__copyright__ = "European Synchrotron Radiation Facility, Grenoble, France"
+__doc__ = """
+Block-wise reading of three dimensional stacks of spectra of the form
+[nRows, nColumns, nChannels].
+
+When the stack is an HDF5 dataset, the blocks are aligned to the chunk layout
+of the dataset and the next block is read by a background thread while the
+current one is processed. The memory used is therefore limited to a few
+blocks whatever the size of the dataset.
+"""
+import sys
+import threading
+import numpy
+try:
+    import queue
+except ImportError:
+    # python 2
+    import Queue as queue
+
+DEBUG = 0
+
+
+def isHDF5Dataset(data):
+    """
+    Return True if data behaves as an h5py dataset.
+    """
+    return hasattr(data, "chunks") and hasattr(data, "id") and \
+           hasattr(data, "file")
+
+
+def getBlockShape(data, rows=1, columns=None):
+    """
+    Return the (rows, columns) shape of the blocks to be read.
+
+    The shape is the smallest multiple of the HDF5 chunk shape covering the
+    requested number of rows and columns. For in-memory arrays and contiguous
+    datasets complete rows are used.
+    """
+    nRows, nColumns = data.shape[0], data.shape[1]
+    chunks = getattr(data, "chunks", None)
+    if chunks is None:
+        return min(rows, nRows), nColumns
+    if columns is None:
+        columns = nColumns
+    blockRows = chunks[0] * int(numpy.ceil(rows / float(chunks[0])))
+    blockColumns = chunks[1] * int(numpy.ceil(columns / float(chunks[1])))
+    return min(blockRows, nRows), min(blockColumns, nColumns)
+
+
+def _getBlockList(data, rowStart, rowEnd, blockShape, mask=None):
+    blockRows, blockColumns = blockShape
+    nColumns = data.shape[1]
+    blockList = []
+    # block boundaries at multiples of the block shape
+    r0 = rowStart
+    while r0 < rowEnd:
+        r1 = min(rowEnd, blockRows * (r0 // blockRows + 1))
+        for c0 in range(0, nColumns, blockColumns):
+            c1 = min(c0 + blockColumns, nColumns)
+            if mask is not None:
+                if not mask[r0:r1, c0:c1].any():
+                    continue
+            blockList.append((r0, r1, c0, c1))
+        r0 = r1
+    return blockList
+
+
+def _put(blockQueue, item, stopEvent):
+    while not stopEvent.is_set():
+        try:
+            blockQueue.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def _prefetch(data, blockList, channels, blockQueue, stopEvent):
+    try:
+        for r0, r1, c0, c1 in blockList:
+            block = data[r0:r1, c0:c1, channels[0]:channels[1]]
+            if not _put(blockQueue, ((r0, r1, c0, c1), block), stopEvent):
+                return
+        _put(blockQueue, None, stopEvent)
+    except BaseException:
+        # also KeyboardInterrupt or SystemExit, never taken as a block
+        _put(blockQueue, sys.exc_info()[1], stopEvent)
+
+
+def iterateBlocks(data, rowStart=0, rowEnd=None, columns=None,
+                  channels=None, mask=None, prefetch=1):
+    """
+    Generator returning tuples ((r0, r1, c0, c1), block) where block is
+    data[r0:r1, c0:c1, channels[0]:channels[1]].
+
+    :param data: 3D array or HDF5 dataset [nRows, nColumns, nChannels]
+    :param rowStart: first row to be read
+    :param rowEnd: last row to be read plus one
+    :param columns: minimum number of columns of each block
+    :param channels: (first, last + 1) channels to be read
+    :param mask: if given, 2D boolean array. Blocks without any True pixel
+                 are not read.
+    :param prefetch: number of HDF5 blocks read in advance
+    """
+    if rowEnd is None:
+        rowEnd = data.shape[0]
+    if channels is None:
+        channels = (0, data.shape[2])
+    if not isHDF5Dataset(data):
+        # in memory data: just views of complete rows
+        for i in range(rowStart, rowEnd):
+            if mask is not None:
+                if not mask[i].any():
+                    continue
+            yield ((i, i + 1, 0, data.shape[1]),
+                   data[i:i + 1, :, channels[0]:channels[1]])
+        return
+    blockShape = getBlockShape(data, rows=1, columns=columns)
+    blockList = _getBlockList(data, rowStart, rowEnd, blockShape, mask=mask)
+    if DEBUG:
+        print("Reading %d blocks of shape %s" % (len(blockList),
+                                                 blockShape))
+    if not len(blockList):
+        return
+    blockQueue = queue.Queue(maxsize=max(1, prefetch))
+    stopEvent = threading.Event()
+    thread = threading.Thread(target=_prefetch,
+                              args=(data, blockList, channels,
+                                    blockQueue, stopEvent))
+    thread.daemon = True
+    thread.start()
+    try:
+        while True:
+            item = blockQueue.get()
+            if item is None:
+                break
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        stopEvent.set()
+        thread.join()
+
+
+def getMaskedSpectra(data, mask, channels=None, dtype=None):
+    """
+    Return the spectra of the pixels selected by mask as a 2D array of shape
+    (mask.sum(), nChannels) in the same order as data[mask] would give.
+
+    Datasets not supporting two dimensional indexing, as h5py ones, are read
+    block by block, skipping the blocks without any selected pixel.
+    """
+    if channels is None:
+        channels = (0, data.shape[2])
+    if dtype is None:
+        dtype = data.dtype
+    nChannels = channels[1] - channels[0]
+    mask = numpy.asarray(mask, dtype=numpy.bool_)
+    flatIndices = numpy.nonzero(mask.ravel())[0]
+    spectra = numpy.zeros((flatIndices.size, nChannels), dtype)
+    if isinstance(data, numpy.ndarray):
+        spectra[:] = data[mask, channels[0]:channels[1]]
+        return spectra
+    nColumns = data.shape[1]
+    for (r0, r1, c0, c1), block in iterateBlocks(data,
+                                                 channels=channels,
+                                                 mask=mask):
+        subMask = mask[r0:r1, c0:c1]
+        rows, cols = numpy.nonzero(subMask)
+        destination = numpy.searchsorted(flatIndices,
+                                         (rows + r0) * nColumns + cols + c0)
+        spectra[destination] = block[subMask]
+    return spectra
@@ -45,19 +45,107 @@
 except ImportError:
     print("HDF5Stack1D importing NexusDataSource from local directory!")
     import NexusDataSource
+try:
+    from PyMca5.PyMcaIO import LazyHDF5Stack
+except ImportError:
+    print("HDF5Stack1D importing LazyHDF5Stack from local directory!")
+    import LazyHDF5Stack
 
 DEBUG = 0
 SOURCE_TYPE = "HDF5Stack1D"
 
+# approximate size in bytes of the hyperslabs read at once
+BLOCK_SIZE = 64 * 1024 * 1024
+
+
+def _getBlockLength(dataset, itemSize):
+    """
+    Return the number of elements along the first dimension of the dataset
+    to be read at once. It is a multiple of the chunk size of the dataset.
+    """
+    size = itemSize
+    for dim in dataset.shape[1:]:
+        size *= dim
+    blockLength = max(1, BLOCK_SIZE // max(1, size))
+    chunks = getattr(dataset, "chunks", None)
+    if chunks:
+        blockLength = chunks[0] * max(1, blockLength // chunks[0])
+    return max(1, min(blockLength, dataset.shape[0]))
+
+
+def _divide(data, monitor):
+    if data.dtype.kind in "fc":
+        numpy.divide(data, monitor, out=data)
+    else:
+        data[...] = data / monitor
+
+
+def _readArray(dataset, destination, monitor=None):
+    """
+    Copy the dataset into the array destination of the same shape dividing
+    it by the monitor, an array of the same number of dimensions
+    broadcastable to that shape.
+
+    The dataset is read in hyperslabs of complete chunks along its first
+    dimension. HDF5 datasets are read directly into destination.
+    """
+    direct = hasattr(dataset, "read_direct") and \
+             destination.flags['C_CONTIGUOUS']
+    blockLength = _getBlockLength(dataset, destination.dtype.itemsize)
+    for i0 in range(0, dataset.shape[0], blockLength):
+        i1 = min(i0 + blockLength, dataset.shape[0])
+        if direct:
+            dataset.read_direct(destination,
+                                source_sel=numpy.s_[i0:i1],
+                                dest_sel=numpy.s_[i0:i1])
+        else:
+            destination[i0:i1] = dataset[i0:i1]
+        if monitor is not None:
+            if monitor.shape[0] > 1:
+                _divide(destination[i0:i1], monitor[i0:i1])
+            else:
+                _divide(destination[i0:i1], monitor)
+
+
+def _readImagesAsSpectra(dataset, destination, monitor=None):
+    """
+    Copy the dataset, a stack of images of the form [nChannels, ...], into
+    the array destination of the form [nPixels, nChannels] dividing it by
+    the monitor, a 2D array broadcastable to that shape.
+
+    The dataset is read in hyperslabs of complete chunks along its first
+    dimension.
+    """
+    nChannels = dataset.shape[0]
+    blockLength = _getBlockLength(dataset, destination.dtype.itemsize)
+    for i0 in range(0, nChannels, blockLength):
+        i1 = min(i0 + blockLength, nChannels)
+        block = dataset[i0:i1]
+        destination[:, i0:i1] = block.reshape(i1 - i0, -1).T
+        if monitor is not None:
+            if monitor.shape[1] > 1:
+                _divide(destination[:, i0:i1], monitor[:, i0:i1])
+            else:
+                _divide(destination[:, i0:i1], monitor)
+
+
 class HDF5Stack1D(DataObject.DataObject):
     def __init__(self, filelist, selection,
                        scanlist=None,
-                       dtype=None):
+                       dtype=None,
+                       lazy=False):
+        """
+        If lazy is True, the spectra are not copied into memory but read
+        from the files when the data are sliced. Stacks of images (index 0)
+        are always copied. Lazy loading is also used when the stack does
+        not fit into memory.
+        """
         DataObject.DataObject.__init__(self)
 
         #the data type of the generated stack
         self.__dtype0 = dtype
         self.__dtype  = dtype
+        self.__lazy = lazy
 
         if filelist is not None:
             if selection is not None:
@@ -246,9 +334,13 @@ def loadFileList(self, filelist, selection, scanlist=None):
         if DEBUG:
             print("mcaIndex = %d" % mcaIndex)
         considerAsImages = False
+        # the lazy stack handles spectra as last dimension only
+        spectraLast = (mcaIndex != 0) or (len(shape) == 1)
         dim0, dim1, mcaDim = self.getDimensions(nFiles, nScans, shape,
                                                 index=mcaIndex)
         try:
+            if self.__lazy and spectraLast:
+                raise MemoryError("Force lazy loading")
             if self.__dtype in [numpy.float32, numpy.int32]:
                 bytefactor = 4
             elif self.__dtype in [numpy.int16, numpy.uint16]:
@@ -285,20 +377,40 @@ def loadFileList(self, filelist, selection, scanlist=None):
             DONE = False
         except (MemoryError, ValueError):
             #some versions report ValueError instead of MemoryError
-            if (nFiles == 1) and (len(shape) == 3):
+            if (nFiles == 1) and (len(shape) == 3) and (not self.__lazy):
                 print("Attempting dynamic loading")
                 self.data = yDataset
                 if mSelection is not None:
-                    mDataset = tmpHdf[mpath].value
+                    mDataset = tmpHdf[mpath][()]
                     self.monitor = [mDataset]
                 if xSelection is not None:
-                    xDataset = tmpHdf[xpath].value
+                    xDataset = tmpHdf[xpath][()]
                     self.x = [xDataset]
                 if h5py.version.version < '2.0':
                     #prevent automatic closing keeping a reference
                     #to the open file
                     self._fileReference = hdfStack
                 DONE = True
+            elif spectraLast:
+                print("Attempting lazy loading")
+                sourceList = []
+                for hdf in hdfStack._sourceObjectList:
+                    for entryName in self._getEntryList(hdf, scanlist,
+                                                        JUST_KEYS):
+                        mpath = None
+                        if mSelection is not None:
+                            mpath = entryName + mSelection
+                        sourceList.append((hdf.filename,
+                                           entryName + ySelection,
+                                           mpath))
+                self.data = LazyHDF5Stack.LazyHDF5Stack(sourceList,
+                                                        shape=(dim0, dim1),
+                                                        dtype=self.__dtype)
+                if xSelection is not None:
+                    xDataset = tmpHdf[xpath][()]
+                # spectra as last dimension whatever the datasets
+                mcaIndex = 2
+                DONE = True
             else:
                 #what to do if the number of dimensions is only 2?
                 raise
@@ -313,177 +425,55 @@ def loadFileList(self, filelist, selection, scanlist=None):
                 self.onBegin(dim0)
             self.incrProgressBar=0
             for hdf in hdfStack._sourceObjectList:
-                entryNames = list(hdf["/"].keys())
-                goodEntryNames = []
-                for entry in entryNames:
-                    tmpPath = "/" + entry
-                    if hasattr(hdf[tmpPath], "keys"):
-                        goodEntryNames.append(entry)
-                for scan in scanlist:
-                    if JUST_KEYS:
-                        entryName = goodEntryNames[int(scan.split(".")[-1])-1]
-                        path = entryName + ySelection
-                        if mSelection is not None:
-                            mpath = entryName + mSelection
-                            mDataset = hdf[mpath].value
-                        if xSelection is not None:
-                            xpath = entryName + xSelection
-                            xDataset = hdf[xpath].value
-                    else:
-                        path = scan + ySelection
-                        if mSelection is not None:
-                            mpath = scan + mSelection
-                            mDataset = hdf[mpath].value
-                        if xSelection is not None:
-                            xpath = scan + xSelection
-                            xDataset = hdf[xpath].value
-                    try:
-                        yDataset = hdf[path]
-                        tmpShape = yDataset.shape
-                        totalBytes = numpy.ones((1,), yDataset.dtype).itemsize
-                        for nItems in tmpShape:
-                            totalBytes *= nItems
-                        if (totalBytes/(1024.*1024.)) > 500:
-                            #read from disk
-                            IN_MEMORY = False
-                        else:
-                            #read the data into memory
-                            yDataset = hdf[path].value
-                            IN_MEMORY = True
-                    except (MemoryError, ValueError):
-                        yDataset = hdf[path]
-                        IN_MEMORY = False
+                for entryName in self._getEntryList(hdf, scanlist, JUST_KEYS):
+                    path = entryName + ySelection
+                    if mSelection is not None:
+                        mpath = entryName + mSelection
+                        mDataset = hdf[mpath][()]
+                    if xSelection is not None:
+                        xpath = entryName + xSelection
+                        xDataset = hdf[xpath][()]
+                    yDataset = hdf[path]
                     nMcaInYDataset = 1
                     for dim in yDataset.shape:
                         nMcaInYDataset *= dim
                     nMcaInYDataset = int(nMcaInYDataset/mcaDim)
+                    # the spectra of the dataset follow the ones already read
+                    destination = self.data.reshape(-1, mcaDim)
+                    destination = destination[n:(n + nMcaInYDataset)]
+                    monitor = None
                     if mcaIndex != 0:
-                        if IN_MEMORY:
-                            yDataset.shape = -1, mcaDim
                         if mSelection is not None:
-                            case = -1
-                            nMonitorData = 1
-                            for  v in mDataset.shape:
-                                nMonitorData *= v
+                            nMonitorData = mDataset.size
                             if nMonitorData == nMcaInYDataset:
-                                mDataset.shape = nMcaInYDataset
-                                case = 0
+                                # one value per spectrum
+                                monitor = mDataset.reshape(\
+                                            yDataset.shape[:-1] + (1,))
                             elif nMonitorData == (nMcaInYDataset * mcaDim):
-                                case = 1
-                                mDataset.shape = nMcaInYDataset, mcaDim
-                            if case == -1:
+                                # one value per channel of each spectrum
+                                monitor = mDataset.reshape(yDataset.shape)
+                            else:
                                 raise ValueError(\
                                     "I do not know how to handle this monitor data")
-                        if (len(yDataset.shape) == 3) and\
-                           (dim1 == yDataset.shape[1]):
-                            mca = 0
-                            deltaI = int(yDataset.shape[1]/dim1)
-                            for ii in range(yDataset.shape[0]):
-                                i = int(n/dim1)
-                                yData = yDataset[ii:(ii+1)]
-                                yData.shape = -1, mcaDim
-                                if mSelection is not None:
-                                    if case == 0:
-                                        mData = numpy.outer(mDataset[mca:(mca+dim1)],
-                                                            numpy.ones((mcaDim)))
-                                        self.data[i, :, :] = yData/mData
-                                    elif case == 1:
-                                        mData = mDataset[mca:(mca+dim1), :]
-                                        mData.shape = -1, mcaDim
-                                        self.data[i, :, :]  = yData/mData
-                                else:
-                                    self.data[i:(i+deltaI), :] = yData
-                                n += yDataset.shape[1]
-                                mca += dim1
-                        else:
-                            for mca in range(nMcaInYDataset):
-                                i = int(n/dim1)
-                                j = n % dim1
-                                if len(yDataset.shape) == 3:
-                                    ii = int(mca/yDataset.shape[1])
-                                    jj = mca % yDataset.shape[1]
-                                    yData = yDataset[ii, jj]
-                                elif len(yDataset.shape) == 2:
-                                    yData = yDataset[mca,:]
-                                elif len(yDataset.shape) == 1:
-                                    yData = yDataset
-                                if mSelection is not None:
-                                    if case == 0:
-                                        self.data[i, j, :] = yData/mDataset[mca]
-                                    elif case == 1:
-                                        self.data[i, j, :]  = yData/mDataset[mca, :]
-                                else:
-                                    self.data[i, j, :] = yData
-                                n += 1
+                        _readArray(yDataset,
+                                   destination.reshape(yDataset.shape),
+                                   monitor)
                     else:
                         if mSelection is not None:
-                            case = -1
-                            nMonitorData = 1
-                            for  v in mDataset.shape:
-                                nMonitorData *= v
+                            nMonitorData = mDataset.size
                             if nMonitorData == yDataset.shape[0]:
-                                case = 3
-                                mDataset.shape = yDataset.shape[0]
+                                # one value per channel
+                                monitor = mDataset.reshape(1, -1)
                             elif nMonitorData == nMcaInYDataset:
-                                mDataset.shape = nMcaInYDataset
-                                case = 0
-                            #elif nMonitorData == (yDataset.shape[1] * yDataset.shape[2]):
-                            #    case = 1
-                            #    mDataset.shape = yDataset.shape[1], yDataset.shape[2]
-                            if case == -1:
+                                # one value per spectrum
+                                monitor = mDataset.reshape(-1, 1)
+                            else:
                                 raise ValueError(\
                                     "I do not know how to handle this monitor data")
-                        if IN_MEMORY:
-                            yDataset.shape = mcaDim, -1
-                        if len(yDataset.shape) != 3:
-                            for mca in range(nMcaInYDataset):
-                                i = int(n/dim1)
-                                j = n % dim1
-                                if len(yDataset.shape) == 3:
-                                    ii = int(mca/yDataset.shape[2])
-                                    jj = mca % yDataset.shape[2]
-                                    yData = yDataset[:, ii, jj]
-                                elif len(yDataset.shape) == 2:
-                                    yData = yDataset[:, mca]
-                                elif len(yDataset.shape) == 1:
-                                    yData = yDataset[:]
-                                if mSelection is not None:
-                                    if case == 0:
-                                        self.data[i, j, :] = yData/mDataset[mca]
-                                    elif case == 1:
-                                        self.data[i, j, :]  = yData/mDataset[:, mca]
-                                    elif case == 3:
-                                        self.data[i, j, :]  = yData/mDataset
-                                else:
-                                    self.data[i, j, :] = yData
-                                n += 1
-                        else:
-                            #stack of images to be read as MCA
-                            for nImage in range(yDataset.shape[0]):
-                                tmp = yDataset[nImage:(nImage+1)]
-                                if len(tmp.shape) == 3:
-                                    i = int(n/dim1)
-                                    j = n % dim1
-                                    if 0:
-                                        #this loop is extremely SLOW!!!(and useless)
-                                        for ii in range(tmp.shape[1]):
-                                            for jj in range(tmp.shape[2]):
-                                                self.data[i+ii, j+jj, nImage] = tmp[0, ii, jj]
-                                    else:
-                                        self.data[i:i+tmp.shape[1],
-                                                  j:j+tmp.shape[2], nImage] = tmp[0]
-                            if mSelection is not None:
-                                for mca in range(yDataset.shape[0]):
-                                    i = int(n/dim1)
-                                    j = n % dim1
-                                    yData = self.data[i, j, :]
-                                    if case == 0:
-                                        self.data[i, j, :] = yData/mDataset[mca]
-                                    elif case == 1:
-                                        self.data[i, j, :]  = yData/mDataset[:, mca]
-                                    n += 1
-                            else:
-                                n += tmp.shape[1] * tmp.shape[2]
+                        _readImagesAsSpectra(yDataset, destination, monitor)
+                    n += nMcaInYDataset
+                    i = int((n - 1) / dim1)
+                    j = (n - 1) % dim1
                     if dim0 == 1:
                         self.onProgress(j)
                 if dim0 != 1:
@@ -500,42 +490,36 @@ def loadFileList(self, filelist, selection, scanlist=None):
                         path = entryName + ySelection
                         if mSelection is not None:
                             mpath = entryName + mSelection
-                            mDataset.shape
+                            mDataset = hdf[mpath][()]
                         if xSelection is not None:
                             xpath = entryName + xSelection
-                            xDataset = hdf[xpath].value
+                            xDataset = hdf[xpath][()]
                     else:
                         path = scan + ySelection
                         if mSelection is not None:
                             mpath = scan + mSelection
-                            mDataset = hdf[mpath].value
+                            mDataset = hdf[mpath][()]
                         if xSelection is not None:
                             xpath = scan + xSelection
-                            xDataset = hdf[xpath].value
+                            xDataset = hdf[xpath][()]
+                    monitor = None
                     if mSelection is not None:
                         nMonitorData = mDataset.size
-                        case = -1
                         yDatasetShape = yDataset.shape
+                        nPixels = 1
+                        for dim in yDatasetShape[1:]:
+                            nPixels *= dim
                         if nMonitorData == yDatasetShape[0]:
                             #as many monitor data as images
-                            mDataset.shape = yDatasetShape[0]
-                            case = 0
-                        elif nMonitorData == (yDatasetShape[1] * yDatasetShape[2]):
+                            monitor = mDataset.reshape((-1,) + \
+                                            (1,) * (len(yDatasetShape) - 1))
+                        elif nMonitorData == nPixels:
                             #as many monitorData as pixels
-                            case = 1
-                            mDataset.shape = yDatasetShape[1], yDatasetShape[2]
-                        if case == -1:
+                            monitor = mDataset.reshape((1,) + yDatasetShape[1:])
+                        else:
                             raise ValueError(\
                                 "I do not know how to handle this monitor data")
-                        if case == 0:
-                            for i in range(yDatasetShape[0]):
-                                self.data[i] = yDataset[i].value / mDataset[i]
-                        elif case == 1:
-                            for i in range(yDataset.shape[0]):
-                                self.data[i] = yDataset[i] / mDataset
-                    else:
-                        for i in range(yDataset.shape[0]):
-                            self.data[i:i+1] = yDataset[i:i+1]
+                    _readArray(yDataset, self.data, monitor)
         else:
             self.info["McaIndex"] = mcaIndex
 
@@ -560,6 +544,21 @@ def loadFileList(self, filelist, selection, scanlist=None):
                 print("Ignoring xSelection")
 
 
+    def _getEntryList(self, hdf, scanlist, justKeys):
+        """
+        Returns the paths of the entries of the file corresponding to the
+        items of the scanlist
+        """
+        if not justKeys:
+            return scanlist
+        goodEntryNames = []
+        for entry in hdf["/"].keys():
+            tmpPath = "/" + entry
+            if hasattr(hdf[tmpPath], "keys"):
+                goodEntryNames.append(entry)
+        return [goodEntryNames[int(scan.split(".")[-1])-1] \
+                for scan in scanlist]
+
     def getDimensions(self, nFiles, nScans, shape, index=None):
         #some body may want to overwrite this
         """
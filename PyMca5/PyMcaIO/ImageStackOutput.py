@@ -0,0 +1,166 @@
+#/*##########################################################################
+#
+# The PyMca X-Ray Fluorescence Toolkit
+#
+# Copyright (c) 2004-2016 European Synchrotron Radiation Facility
+#
+# This file is part of the PyMca X-ray Fluorescence Toolkit developed at
+# the ESRF by the Software group.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+#############################################################################*/
+__author__ = "V.A. Sole - ESRF Data Analysis"
+__contact__ = "sole@esrf.fr"
+__license__ = "MIT"
+__copyright__ = "European Synchrotron Radiation Facility, Grenoble, France"
+__doc__ = """
+Destinations of stacks of images of the form [nImages, nRows, nColumns]
+filled row by row, as the results of fitting a map of spectra.
+
+ArrayOutput keeps the stacks in memory as numpy arrays. HDF5Output creates
+them as chunked, optionally compressed, HDF5 datasets. Each chunk covers
+complete rows of a single image, therefore the rows can be written as soon
+as they are available and the images can be read and updated one by one
+without ever holding the complete stacks in memory.
+
+Both return objects supporting the numpy slicing used by the writers:
+
+    stack[:, row0:row1] = values
+    image = stack[i]
+    stack[i] = image
+"""
+import posixpath
+import numpy
+try:
+    import h5py
+    HDF5 = True
+except ImportError:
+    HDF5 = False
+
+DEBUG = 0
+
+# approximate size in bytes of the HDF5 chunks
+CHUNK_SIZE = 1024 * 1024
+
+
+def setMaskedValues(stack, index, mask, values):
+    """
+    Set the values of the pixels of the image index of the stack selected
+    by the mask. The image is read and written back in order to support
+    HDF5 datasets.
+    """
+    image = stack[index]
+    image[mask] = values
+    stack[index] = image
+
+
+class ArrayOutput(object):
+    """
+    Stacks kept in memory as numpy arrays.
+    """
+    def createStack(self, name, shape, dtype=numpy.float32, labels=None):
+        """
+        Return a new stack of the given shape filled with zeros.
+        """
+        return numpy.zeros(shape, dtype)
+
+    def getBlockRows(self, stack):
+        """
+        Return the number of rows to be written at once into the stack.
+        """
+        return stack.shape[1]
+
+    def setLabels(self, stack, labels):
+        pass
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class HDF5Output(object):
+    def __init__(self, fileName, entry="images", compression=None,
+                 mode="w"):
+        """
+        :param fileName: Name of the HDF5 file
+        :param entry: Group where to create the stacks
+        :param compression: None or a compression filter supported by h5py
+                            as "gzip" or "lzf"
+        :param mode: h5py opening mode of the file. Default is "w".
+        """
+        if not HDF5:
+            raise ImportError("h5py is needed to write HDF5 files")
+        self.fileName = fileName
+        self.entry = entry
+        self.compression = compression
+        self._h5 = h5py.File(fileName, mode)
+
+    def createStack(self, name, shape, dtype=numpy.float32, labels=None):
+        """
+        Return a new dataset of the given shape chunked by complete rows.
+        The optional labels of the images are stored as the attribute
+        "labels" of the dataset.
+        """
+        nImages, nRows, nColumns = shape
+        itemSize = numpy.dtype(dtype).itemsize
+        chunkRows = max(1, CHUNK_SIZE // max(1, nColumns * itemSize))
+        if nImages * nRows * nColumns:
+            chunks = (1, min(chunkRows, nRows), nColumns)
+        else:
+            # empty stack
+            chunks = None
+        path = posixpath.join(self.entry, name)
+        if path in self._h5:
+            del self._h5[path]
+        if DEBUG:
+            print("Creating dataset %s with chunks %s" % (path, chunks))
+        dataset = self._h5.create_dataset(path,
+                                          shape=shape,
+                                          dtype=dtype,
+                                          chunks=chunks,
+                                          compression=self.compression,
+                                          fillvalue=0)
+        if labels is not None:
+            self.setLabels(dataset, labels)
+        return dataset
+
+    def setLabels(self, stack, labels):
+        stack.attrs["labels"] = numpy.array([label.encode("utf-8") \
+                                             for label in labels])
+
+    def getBlockRows(self, stack):
+        """
+        Return the number of rows of the chunks of the stack in order to
+        write complete chunks at once.
+        """
+        if stack.chunks is None:
+            return max(1, stack.shape[1])
+        return stack.chunks[1]
+
+    def flush(self):
+        if self._h5 is not None:
+            self._h5.flush()
+
+    def close(self):
+        if self._h5 is not None:
+            self._h5.close()
+            self._h5 = None
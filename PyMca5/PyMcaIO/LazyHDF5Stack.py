@@ -0,0 +1,368 @@
+#/*##########################################################################
+#
+# The PyMca X-Ray Fluorescence Toolkit
+#
+# Copyright (c) 2004-2016 European Synchrotron Radiation Facility
+#
+# This file is part of the PyMca X-ray Fluorescence Toolkit developed at
+# the ESRF by the Software group.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+#############################################################################*/
+__author__ = "V.A. Sole - ESRF Data Analysis"
+__contact__ = "sole@esrf.fr"
+__license__ = "MIT"
+__copyright__ = "European Synchrotron Radiation Facility, Grenoble, France"
+__doc__ = """
+Read only stack of spectra of the form [dim0, dim1, nChannels] made of the
+spectra of a list of HDF5 datasets, possibly in different files, taken one
+after the other.
+
+Nothing is read until the stack is sliced. Integers, slices and a
+sequence of integers on one of the axes are supported as indices, what
+covers the access made by StackBase, the fast XRF fit and the block
+readers. The monitor, if any, is applied to the spectra as they are read.
+
+The files are opened on first use by each process, therefore the stack can
+be shared with forked worker processes.
+"""
+import os
+import bisect
+import numbers
+import numpy
+import h5py
+
+DEBUG = 0
+
+
+def _openFile(fileName):
+    if '%' in fileName:
+        return h5py.File(fileName, 'r', driver='family')
+    return h5py.File(fileName, 'r')
+
+
+def _divide(data, monitor):
+    if data.dtype.kind in "fc":
+        numpy.divide(data, monitor, out=data)
+    else:
+        data[...] = data / monitor
+
+
+class LazyHDF5Stack(object):
+    def __init__(self, sources, shape=None, dtype=None):
+        """
+        :param sources: List of (fileName, path, monitor) tuples. The channels
+                        are the last dimension of the datasets at path, that
+                        have up to three dimensions. The monitor is None, the
+                        path of a dataset of the same file or an array. It
+                        can give one value per spectrum or one value per
+                        channel of each spectrum.
+        :param shape: (dim0, dim1) of the stack. Default is one row with all
+                      the spectra.
+        :param dtype: Data type of the stack. Default is the one of the first
+                      dataset or float64 if there is a monitor.
+        """
+        self._files = {}
+        self._pid = os.getpid()
+        self._sources = []
+        self._offsets = []
+        nSpectra = 0
+        nChannels = None
+        for fileName, path, monitor in sources:
+            dataset = self._getDataset(fileName, path)
+            if len(dataset.shape) > 3:
+                raise ValueError("Dataset %s has more than three dimensions" %\
+                                 path)
+            if nChannels is None:
+                nChannels = dataset.shape[-1]
+                if dtype is None:
+                    dtype = dataset.dtype
+                    if monitor is not None:
+                        dtype = numpy.float64
+            elif dataset.shape[-1] != nChannels:
+                raise ValueError("Dataset %s has %d channels instead of %d" %\
+                                 (path, dataset.shape[-1], nChannels))
+            n = int(numpy.prod(dataset.shape[:-1]))
+            source = {'file': fileName,
+                      'path': path,
+                      'shape': dataset.shape,
+                      'spectra': n,
+                      'monitor': None,
+                      'monitorPath': None}
+            if monitor is not None:
+                if not isinstance(monitor, numpy.ndarray):
+                    monitorDataset = self._getDataset(fileName, monitor)
+                    if monitorDataset.size == n:
+                        monitor = monitorDataset[()]
+                    elif monitorDataset.size == n * nChannels:
+                        # as big as the data, read with them
+                        if monitorDataset.shape != dataset.shape:
+                            raise ValueError(\
+                                "Monitor %s and data have different shapes" %\
+                                monitor)
+                        source['monitorPath'] = monitor
+                        monitor = None
+                    else:
+                        raise ValueError(\
+                            "I do not know how to handle this monitor data")
+                if monitor is not None:
+                    if monitor.size != n:
+                        raise ValueError(\
+                            "I do not know how to handle this monitor data")
+                    source['monitor'] = numpy.array(monitor,
+                                        numpy.float64).reshape(-1, 1)
+            self._sources.append(source)
+            self._offsets.append(nSpectra)
+            nSpectra += n
+        if nChannels is None:
+            raise ValueError("Empty list of datasets")
+        if shape is None:
+            shape = (1, nSpectra)
+        if (shape[0] * shape[1]) != nSpectra:
+            raise ValueError("Shape %s does not match %d spectra" %\
+                             (shape, nSpectra))
+        self.shape = (shape[0], shape[1], nChannels)
+        self.dtype = numpy.dtype(dtype)
+        self.ndim = 3
+        self.size = self.shape[0] * self.shape[1] * self.shape[2]
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getstate__(self):
+        # the file handles are not inherited
+        state = self.__dict__.copy()
+        state['_files'] = {}
+        return state
+
+    def __array__(self, dtype=None):
+        data = self[:, :, :]
+        if dtype is not None:
+            data = data.astype(dtype)
+        return data
+
+    def _getDataset(self, fileName, path):
+        if self._pid != os.getpid():
+            # forked process, the handles of the parent cannot be used
+            self._files = {}
+            self._pid = os.getpid()
+        if fileName not in self._files:
+            self._files[fileName] = _openFile(fileName)
+        return self._files[fileName][path]
+
+    def close(self):
+        if self._pid == os.getpid():
+            for h5 in self._files.values():
+                h5.close()
+        self._files = {}
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        if any([item is Ellipsis for item in key]):
+            i = [item is Ellipsis for item in key].index(True)
+            key = key[:i] + (slice(None),) * (4 - len(key)) + key[i + 1:]
+        if len(key) > 3:
+            raise IndexError("Too many indices")
+        key = key + (slice(None),) * (3 - len(key))
+        indices = []
+        squeeze = []
+        sequenceAxis = None
+        for axis, item in enumerate(key):
+            n = self.shape[axis]
+            if isinstance(item, (numbers.Integral, numpy.integer)):
+                item = int(item)
+                if item < 0:
+                    item += n
+                if (item < 0) or (item >= n):
+                    raise IndexError("Index %d out of range" % key[axis])
+                indices.append(range(item, item + 1))
+                squeeze.append(axis)
+            elif isinstance(item, slice):
+                indices.append(range(*item.indices(n)))
+            elif isinstance(item, (list, tuple, numpy.ndarray)) and \
+                 (sequenceAxis is None):
+                index = numpy.array(item)
+                if index.size == 0:
+                    index = index.astype(numpy.int64)
+                if (index.ndim != 1) or (index.dtype.kind not in "iu"):
+                    raise TypeError("Only sequences of integers are supported")
+                index = numpy.where(index < 0, index + n, index)
+                if index.size and ((index.min() < 0) or (index.max() >= n)):
+                    raise IndexError("Index out of range")
+                indices.append(index.tolist())
+                sequenceAxis = axis
+            else:
+                raise TypeError("Only integers, slices and one sequence "
+                                "of integers are supported")
+        if min([len(index) for index in indices]):
+            # read the smallest block containing the selection
+            limits = [(min(index), max(index) + 1) for index in indices]
+            data = self._readBlock(limits)
+            for axis, index in enumerate(indices):
+                if (len(index) != (limits[axis][1] - limits[axis][0])) or \
+                   (index[0] != limits[axis][0]) or \
+                   ((axis == sequenceAxis) and \
+                    (index != list(range(*limits[axis])))):
+                    # steps other than one or unordered indices
+                    data = numpy.take(data,
+                                      [i - limits[axis][0] for i in index],
+                                      axis=axis)
+        else:
+            data = numpy.zeros([len(index) for index in indices], self.dtype)
+        if len(squeeze):
+            data.shape = [len(index) for axis, index in enumerate(indices) \
+                          if axis not in squeeze]
+            if sequenceAxis is not None:
+                advanced = sorted(squeeze + [sequenceAxis])
+                if (advanced[-1] - advanced[0]) >= len(advanced):
+                    # as numpy, the indexed axis goes first when it is not
+                    # next to the integer indices
+                    position = sequenceAxis - len([axis for axis in squeeze \
+                                                   if axis < sequenceAxis])
+                    data = numpy.moveaxis(data, position, 0)
+        return data
+
+    def _readBlock(self, limits):
+        (r0, r1), (c0, c1), (h0, h1) = limits
+        dim1 = self.shape[1]
+        data = numpy.empty((r1 - r0, c1 - c0, h1 - h0), self.dtype)
+        if (c0 == 0) and (c1 == dim1):
+            self._readSpectra(r0 * dim1, r1 * dim1, h0, h1,
+                              data.reshape(-1, h1 - h0))
+        else:
+            for r in range(r0, r1):
+                self._readSpectra(r * dim1 + c0, r * dim1 + c1, h0, h1,
+                                  data[r - r0])
+        return data
+
+    def _readSpectra(self, p0, p1, h0, h1, out):
+        """
+        Read the channels h0 to h1 - 1 of the spectra p0 to p1 - 1 of the
+        stack into the 2D array out.
+        """
+        start = p0
+        k = bisect.bisect_right(self._offsets, p0) - 1
+        while p0 < p1:
+            source = self._sources[k]
+            s0 = p0 - self._offsets[k]
+            s1 = min(p1 - self._offsets[k], source['spectra'])
+            if s1 > s0:
+                target = out[(p0 - start):(p0 - start + s1 - s0)]
+                self._readSource(source, s0, s1, h0, h1, target)
+                p0 += s1 - s0
+            k += 1
+
+    def _readSource(self, source, s0, s1, h0, h1, target):
+        dataset = self._getDataset(source['file'], source['path'])
+        _readPieces(dataset, s0, s1, h0, h1, target)
+        if source['monitorPath'] is not None:
+            monitor = numpy.empty(target.shape, numpy.float64)
+            _readPieces(self._getDataset(source['file'],
+                                         source['monitorPath']),
+                        s0, s1, h0, h1, monitor)
+            _divide(target, monitor)
+        elif source['monitor'] is not None:
+            _divide(target, source['monitor'][s0:s1])
+
+    def createVirtualDataset(self, group, name):
+        """
+        Create in the HDF5 group an h5py virtual dataset of the shape of the
+        stack mapping the original datasets, without applying the monitor.
+        Each dataset has to cover complete rows of the stack or be part of
+        a single row. It needs h5py 2.9 or later.
+
+        The files of the stack are closed. HDF5 cannot read the virtual
+        dataset while they are kept open by h5py and it silently returns
+        the fill value instead.
+        """
+        if not hasattr(h5py, "VirtualLayout"):
+            raise ImportError("Virtual datasets need h5py 2.9 or later")
+        dim1 = self.shape[1]
+        first = self._getDataset(self._sources[0]['file'],
+                                 self._sources[0]['path'])
+        layout = h5py.VirtualLayout(shape=self.shape, dtype=first.dtype)
+        for k, source in enumerate(self._sources):
+            shape = source['shape']
+            n = source['spectra']
+            row, column = divmod(self._offsets[k], dim1)
+            vsource = h5py.VirtualSource(source['file'], source['path'],
+                                         shape=shape)
+            if (len(shape) == 3) and (shape[1] == dim1) and (column == 0):
+                layout[row:(row + shape[0])] = vsource
+            elif (len(shape) == 3) and \
+                 ((dim1 % shape[1]) == 0) and ((column % shape[1]) == 0):
+                # each dataset row goes into part of a stack row
+                for i in range(shape[0]):
+                    row, column = divmod(self._offsets[k] + i * shape[1],
+                                         dim1)
+                    layout[row, column:(column + shape[1])] = vsource[i]
+            elif (len(shape) == 2) and ((column + n) <= dim1):
+                layout[row, column:(column + n)] = vsource
+            elif len(shape) == 1:
+                layout[row, column] = vsource
+            else:
+                raise ValueError(\
+                    "Dataset %s cannot be mapped into the stack rows" %\
+                    source['path'])
+        dataset = group.create_virtual_dataset(name, layout, fillvalue=0)
+        # they are opened again if the stack is used
+        self.close()
+        return dataset
+
+
+def _read(dataset, selection, target):
+    if target.flags['C_CONTIGUOUS']:
+        # no intermediate copy
+        dataset.read_direct(target, source_sel=selection)
+    else:
+        target[...] = dataset[selection]
+
+
+def _readPieces(dataset, s0, s1, h0, h1, target):
+    """
+    Read the channels h0 to h1 - 1 of the spectra s0 to s1 - 1 of a dataset
+    of up to three dimensions into the 2D array target.
+    """
+    shape = dataset.shape
+    if len(shape) == 1:
+        _read(dataset, numpy.s_[h0:h1], target[0])
+    elif len(shape) == 2:
+        _read(dataset, numpy.s_[s0:s1, h0:h1], target)
+    else:
+        nColumns = shape[1]
+        i = s0
+        while i < s1:
+            row, column = divmod(i, nColumns)
+            if (column == 0) and ((s1 - i) >= nColumns):
+                # complete rows at once
+                nRows = (s1 - i) // nColumns
+                n = nRows * nColumns
+                _read(dataset,
+                      numpy.s_[row:(row + nRows), :, h0:h1],
+                      target[(i - s0):(i - s0 + n)].reshape(nRows,
+                                                            nColumns,
+                                                            h1 - h0))
+            else:
+                n = min(nColumns - column, s1 - i)
+                _read(dataset,
+                      numpy.s_[row, column:(column + n), h0:h1],
+                      target[(i - s0):(i - s0 + n)])
+            i += n
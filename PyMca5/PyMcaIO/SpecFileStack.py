@@ -148,14 +148,13 @@ def loadFileList(self, filelist, fileindex=0, shape=None):
                 #prevent problems if the scan number is different
                 #scan = tempInstance.select(keylist[-1])
                 scan = tempInstance[-1]
-                iterationList = range(scan.nbmca())
-                for i in iterationList:
-                    #mcadata = scan_obj.mca(i)
-                    self.data[0,
-                              i,
-                              :] = scan.mca(i+1)[:]
-                    self.incrProgressBar += 1
-                    self.onProgress(self.incrProgressBar)
+                if self.data.dtype == numpy.float64:
+                    # all the mca parsed in one pass into the stack
+                    scan.allmca(self.data[0])
+                else:
+                    self.data[0] = scan.allmca()[:numberofmca]
+                self.incrProgressBar += scan.nbmca()
+                self.onProgress(self.incrProgressBar)
                 filecounter = 1
         elif shape is None:
             #it can only be here if there is one scan per file
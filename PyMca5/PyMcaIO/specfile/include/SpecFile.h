@@ -108,6 +108,8 @@ typedef struct _SfCursor {
     long  int data;        /* data flag */
     long  int file_header; /* address of file header for this scan */
     long  int fileh_size;  /* size of it */
+    long  int linestart;   /* last character read starts a line */
+    long  int lastchar;    /* last character read */
 } SfCursor;
 
 
@@ -133,6 +135,8 @@ typedef struct _SpecFile{
   long           *data_info;
   SfCursor        cursor;
   short           updating;
+  long            idx_scans;
+  long            idx_size;
 } SpecFile;
 
 typedef struct _SpecFileOut{
@@ -249,6 +253,10 @@ DllExport extern int  SfGetMca  ( SpecFile *sf, long index, long mcano,
                                           double **retdata, int *error );
 DllExport extern long SfMcaCalib ( SpecFile *sf, long index, double **calib,
                                           int *error );
+DllExport extern long SfMcaChannels ( SpecFile *sf, long index, int *error );
+DllExport extern long SfGetMcaArray ( SpecFile *sf, long index, double *data,
+                                          long nmca, long nchannels,
+                                          int *error );
 
   /*
    * Write and write related functions
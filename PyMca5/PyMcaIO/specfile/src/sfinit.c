@@ -96,6 +96,7 @@
  *********************************************************************/
 #include <sys/types.h>
 #include <sys/stat.h>
+#include <stddef.h>
 #include <errno.h>
 #include <fcntl.h>
 #include <ctype.h>
@@ -103,6 +104,7 @@
 #ifdef WIN32
 #include <stdio.h>
 #include <stdlib.h>
+#include <process.h>
 #else
 #include <unistd.h>
 #endif
@@ -114,16 +116,60 @@
  * Defines
  */
 
-#define ANY          0
-#define NEWLINE      1
-#define COMMENT      2
-
 #define SF_ISFX      ".sfI"
 
 #define SF_INIT      0
 #define SF_READY     1
 #define SF_MODIFIED  2
 
+/*
+ * Index file.
+ *
+ * The scan list of files larger than SF_INDEX_MIN_SIZE bytes is kept in
+ * a file with the SF_ISFX extension next to the data file. It contains a
+ * SfIndexHeader followed by one record of SF_INDEX_NSCAN longs per
+ * complete scan. The header describes the data file indexed (size,
+ * modification time and checksums of its first and last bytes) and the
+ * state of the parser at the end of it, therefore a file that has grown
+ * is read from the last indexed offset only. Scan records are only
+ * appended and the header is written after them. The index file is not
+ * portable, it is just ignored if not written by the same platform.
+ *
+ * The size threshold can be changed at run time setting the environment
+ * variable SPECFILE_INDEX_MIN_SIZE. A negative value disables the index.
+ */
+#ifndef SF_INDEX_MIN_SIZE
+#define SF_INDEX_MIN_SIZE   (16 * 1024 * 1024)
+#endif
+
+#define SF_INDEX_MAGIC      "SpecFile Index"
+#define SF_INDEX_VERSION    1
+#define SF_INDEX_BYTEORDER  0x01020304L
+#define SF_INDEX_SAMPLE     4096
+#define SF_INDEX_NCURSOR    13
+#define SF_INDEX_NSCAN      10
+
+#ifdef O_BINARY
+#define SF_INDEX_FLAG       O_BINARY
+#else
+#define SF_INDEX_FLAG       0
+#endif
+
+typedef struct _SfIndexHeader {
+    char  magic[16];
+    long  version;
+    long  headersize;
+    long  recordsize;
+    long  byteorder;
+    long  filesize;             /* bytes of the data file indexed */
+    long  mtime;                /* modification time of the data file */
+    long  headsum;              /* checksum of its first bytes */
+    long  tailsum;              /* checksum of its last bytes */
+    long  nscans;               /* number of scan records */
+    long  cursor[SF_INDEX_NCURSOR];
+    long  checksum;             /* checksum of the preceding fields */
+} SfIndexHeader;
+
 /*
  * Function declaration
  */
@@ -134,30 +180,30 @@ DllExport int        SfClose  ( SpecFile *sf);
 DllExport short      SfUpdate ( SpecFile *sf, int *error);
 DllExport char     * SfError  ( int error);
 
-
-#ifdef linux
-char SF_SIGNATURE[] =  "Linux 2ruru Sf2.0";
-#else
-char SF_SIGNATURE[] =  "2ruru Sf2.0";
-#endif
-
 /*
  * Internal functions
  */
-static short statusEnd     ( char c2, char c1);
-static void  sfStartBuffer ( SpecFile *sf, SfCursor *cursor, short status,char c0, char c1,int *error);
+static void  sfInitCursor  ( SfCursor *cursor);
+static long  sfCompleteScans ( SfCursor *cursor);
+static void  sfFreeScans   ( SpecFile *sf);
 static void  sfNewLine     ( SpecFile *sf, SfCursor *cursor, char c0,char c1,int *error);
 static void  sfHeaderLine  ( SpecFile *sf, SfCursor *cursor, char c,int *error);
 static void  sfNewBlock    ( SpecFile *sf, SfCursor *cursor, short how,int *error);
 static void  sfSaveScan    ( SpecFile *sf, SfCursor *cursor, int *error);
-static void  sfAssignScanNumbers (SpecFile *sf);
+static void  sfAssignScanNumbers (SpecFile *sf, long first);
 static void  sfReadFile    ( SpecFile *sf, SfCursor *cursor, int *error);
-static void  sfResumeRead  ( SpecFile *sf, SfCursor *cursor, int *error);
-#ifdef SPECFILE_USE_INDEX_FILE
-static short sfOpenIndex   ( SpecFile *sf, SfCursor *cursor, int *error);
-static short sfReadIndex   ( int sfi, SpecFile *sf, SfCursor *cursor, int *error);
-static void  sfWriteIndex  ( SpecFile *sf, SfCursor *cursor, int *error);
-#endif
+static long  sfIndexMinSize ( void );
+static void  sfCursorToIndex ( SfCursor *cursor, long *values);
+static void  sfIndexToCursor ( long *values, SfCursor *cursor);
+static void  sfScanToIndex ( SpecScan *scan, long *values);
+static void  sfIndexToScan ( long *values, SpecScan *scan);
+static char *sfIndexName   ( SpecFile *sf);
+static unsigned long sfChecksum ( unsigned char *buffer, long size);
+static int   sfFileChecksums ( SpecFile *sf, long filesize, long *headsum, long *tailsum);
+static int   sfReadIndexHeader ( int fdi, SfIndexHeader *header);
+static int   sfWriteIndexData ( int fdi, SpecFile *sf, SfIndexHeader *header, long first);
+static short sfOpenIndex   ( SpecFile *sf, SfCursor *cursor, long filesize, int *error);
+static void  sfWriteIndex  ( SpecFile *sf, int *error);
 
 /*
  * errors
@@ -249,6 +295,7 @@ DllExport SpecFile *
 SfOpen2(int fd, char *name,int *error) {
    SpecFile   *sf;
    short       idxret;
+   long        first;
    SfCursor      cursor;
    struct stat mystat;
 
@@ -291,42 +338,32 @@ SfOpen2(int fd, char *name,int *error) {
    sf->data            = (double **)NULL;
    sf->data_info       = (long *)NULL;
    sf->updating        = 0;
+   sf->idx_scans       = -1;
+   sf->idx_size        = -1;
 
   /*
    * Init cursor
    */
-   cursor.bytecnt      = 0;
-   cursor.cursor       = 0;
-   cursor.scanno       = 0;
-   cursor.hdafoffset   = -1;
-   cursor.dataoffset   = -1;
-   cursor.mcaspectra   = 0;
-   cursor.what         = 0;
-   cursor.data         = 0;
-   cursor.file_header  = 0;
-
-
-#ifdef SPECFILE_USE_INDEX_FILE
+   sfInitCursor(&cursor);
+
   /*
    * Check if index file
    *   open it and continue from there
    */
-   idxret = sfOpenIndex(sf,&cursor,error);
-#else
-   idxret = SF_INIT;
-#endif
+   idxret = sfOpenIndex(sf,&cursor,(long) mystat.st_size,error);
 
    switch(idxret) {
       case SF_MODIFIED:
-          sfResumeRead(sf,&cursor,error);
-          sfReadFile(sf,&cursor,error);
-          break;
-
       case SF_INIT:
           sfReadFile(sf,&cursor,error);
           break;
 
       case SF_READY:
+         /*
+          * Nothing to read, just save last
+          */
+          sf->no_scans = cursor.scanno;
+          sfSaveScan(sf,&cursor,error);
           break;
 
       default:
@@ -337,12 +374,12 @@ SfOpen2(int fd, char *name,int *error) {
 
   /*
    * Once is all done assign scan numbers and orders
+   * to the scans not found in the index file
    */
-   sfAssignScanNumbers(sf);
+   first = (sf->idx_scans > 0) ? sf->idx_scans : 0;
+   sfAssignScanNumbers(sf,first);
 
-#ifdef SPECFILE_USE_INDEX_FILE
-   if (idxret != SF_READY) sfWriteIndex(sf,&cursor,error);
-#endif
+   if (idxret != SF_READY) sfWriteIndex(sf,error);
    return(sf);
 }
 
@@ -366,16 +403,9 @@ SfOpen2(int fd, char *name,int *error) {
 DllExport int
 SfClose( SpecFile *sf )
 {
-     register ObjectList  *ptr;
-     register ObjectList  *prevptr;
-
      freeAllData(sf);
 
-     for( ptr=sf->list.last ; ptr ; ptr=prevptr ) {
-          free( (SpecScan *)ptr->contents );
-          prevptr = ptr->prev;
-	  free( (ObjectList *)ptr );
-     }
+     sfFreeScans(sf);
 
      free ((char *)sf->sfname);
      if (sf->scanbuffer != NULL)
@@ -400,7 +430,10 @@ SfClose( SpecFile *sf )
  *   Function:          short SfUpdate( sf, error )
  *
  *   Description:       Updates connection to Spec data file .
- *                      Appends to index list in memory.
+ *                      Appends to index list in memory reading
+ *                      from the last byte read only.
+ *                      If the file is shorter than the bytes
+ *                      read, it is read again.
  *
  *   Parameters:
  *              Input :
@@ -421,25 +454,44 @@ SfUpdate ( SpecFile *sf, int *error )
 {
     struct stat mystat;
     long   mtime;
-   /*printf("In SfUpdate\n");
-   __asm("int3");*/
+    long   first;
+
     stat(sf->sfname,&mystat);
 
     mtime = mystat.st_mtime;
 
-    if (sf->m_time != mtime)  {
-       sfResumeRead (sf,&(sf->cursor),error);
-       sfReadFile   (sf,&(sf->cursor),error);
-
-       sf->m_time = mtime;
-       sfAssignScanNumbers(sf);
-#ifdef SPECFILE_USE_INDEX_FILE
-       sfWriteIndex (sf,&(sf->cursor),error);
-#endif
-       return(1);
-    }else{
+    if (sf->m_time == mtime && (long) mystat.st_size == sf->cursor.bytecnt) {
        return(0);
     }
+
+    if ((long) mystat.st_size < sf->cursor.bytecnt) {
+       /*
+        * File rewritten
+        */
+        freeAllData(sf);
+        sf->current = (ObjectList *)NULL;
+        sfFreeScans(sf);
+        sfInitCursor(&(sf->cursor));
+        sf->idx_scans = -1;
+        sf->idx_size  = -1;
+        first = 0;
+    } else {
+       /*
+        * The last scan is saved again
+        */
+        if (sf->current != (ObjectList *)NULL && sf->current == sf->list.last) {
+            freeAllData(sf);
+            sf->current = (ObjectList *)NULL;
+        }
+        first = sfCompleteScans(&(sf->cursor));
+        sf->updating = (sf->list.last != (ObjectList *)NULL);
+    }
+    sfReadFile   (sf,&(sf->cursor),error);
+
+    sf->m_time = mtime;
+    sfAssignScanNumbers(sf,first);
+    sfWriteIndex (sf,error);
+    return(1);
 }
 
 
@@ -462,18 +514,68 @@ SfError(int code ) {
      }
      return( errors[i].message );
 }
-
 
 static void
+sfInitCursor(SfCursor *cursor) {
+   cursor->bytecnt      = 0;
+   cursor->cursor       = 0;
+   cursor->scanno       = 0;
+   cursor->hdafoffset   = -1;
+   cursor->datalines    = 0;
+   cursor->dataoffset   = -1;
+   cursor->mcaspectra   = 0;
+   cursor->what         = 0;
+   cursor->data         = 0;
+   cursor->file_header  = 0;
+   cursor->fileh_size   = 0;
+   cursor->linestart    = 0;
+   cursor->lastchar     = '\n';
+}
+
+
+/*
+ * Number of scans followed by another block in the file
+ */
+static long
+sfCompleteScans(SfCursor *cursor) {
+   return(cursor->scanno - (cursor->what == SCAN ? 1 : 0));
+}
+
+
+static void
+sfFreeScans(SpecFile *sf) {
+     register ObjectList  *ptr;
+     register ObjectList  *prevptr;
+
+     for( ptr=sf->list.last ; ptr ; ptr=prevptr ) {
+          free( (SpecScan *)ptr->contents );
+          prevptr = ptr->prev;
+	  free( (ObjectList *)ptr );
+     }
+     sf->list.first = (ObjectList *)NULL;
+     sf->list.last  = (ObjectList *)NULL;
+     sf->no_scans   = 0;
+}
+
+
+/*****************************************************************************
+ *
+ *    Function:   static void sfReadFile()
+ *
+ *    Description:  reads the file from the cursor byte count up to its end.
+ *                  A line start is analyzed once its second character is
+ *                  available, the cursor keeps the last character read
+ *                  in order to continue with the next buffer or update.
+ *
+ *****************************************************************************/
+static void
 sfReadFile(SpecFile *sf,SfCursor *cursor,int *error) {
 
    int         fd;
 
-   char  *buffer,*ptr;
-
-   long  size,bytesread;
+   char  *buffer,*ptr,*end;
 
-   short  status;
+   long  size,bytesread,offset;
 
    fd   = sf->fd;
 
@@ -490,27 +592,40 @@ sfReadFile(SpecFile *sf,SfCursor *cursor,int *error) {
                * Uhmmm
                */
               *error = SF_ERR_MEMORY_ALLOC;
-              free(sf->sfname);
-              free(sf);
-              sf = (SpecFile *)NULL;
               return;
          }
    }
 
-   status              = NEWLINE;
+   lseek(fd,cursor->bytecnt,SEEK_SET);
    while ((bytesread = read(fd,buffer,size)) > 0 ) {
+      offset = cursor->bytecnt;
+      end    = buffer + bytesread;
 
-      sfStartBuffer(sf,cursor,status,buffer[0],buffer[1],error);
+      if (cursor->linestart) {
+          cursor->bytecnt = offset - 1;
+          sfNewLine(sf,cursor,(char) cursor->lastchar,buffer[0],error);
+      }
+      cursor->linestart = 0;
 
-      cursor->bytecnt++;
-      for (ptr=buffer+1;ptr < buffer + bytesread -1; ptr++,cursor->bytecnt++) {
-          if (*(ptr-1) == '\n' ) {
-             sfNewLine(sf,cursor,*ptr,*(ptr+1),error);
+      if (cursor->lastchar == '\n') {
+          ptr = buffer;
+      } else if ((ptr = (char *) memchr(buffer,'\n',bytesread)) != NULL) {
+          ptr++;
+      }
+      while (ptr != NULL && ptr < end) {
+          if (ptr + 1 == end) {
+              cursor->linestart = 1;
+              break;
+          }
+          cursor->bytecnt = offset + (ptr - buffer);
+          sfNewLine(sf,cursor,ptr[0],ptr[1],error);
+          if ((ptr = (char *) memchr(ptr,'\n',end - ptr)) != NULL) {
+              ptr++;
           }
       }
 
-      cursor->bytecnt++;
-      status = statusEnd(buffer[bytesread-2],buffer[bytesread-1]);
+      cursor->lastchar = end[-1];
+      cursor->bytecnt  = offset + bytesread;
   }
 
   free(buffer);
@@ -525,167 +640,359 @@ sfReadFile(SpecFile *sf,SfCursor *cursor,int *error) {
 
 }
 
-
-static void
-sfResumeRead  ( SpecFile *sf, SfCursor *cursor, int *error) {
-    cursor->bytecnt      = cursor->cursor;
-    cursor->what         = 0;
-    cursor->hdafoffset   = -1;
-    cursor->dataoffset   = -1;
-    cursor->mcaspectra   = 0;
-    cursor->data         = 0;
-    cursor->scanno--;
-    sf->updating = 1;
-    lseek(sf->fd,cursor->bytecnt,SEEK_SET);
-    return;
+
+static long
+sfIndexMinSize(void) {
+    char *value;
+
+    value = getenv("SPECFILE_INDEX_MIN_SIZE");
+    if (value == NULL || *value == '\0') {
+        return(SF_INDEX_MIN_SIZE);
+    }
+    return(atol(value));
 }
 
-
-#ifdef SPECFILE_USE_INDEX_FILE
-static short
-sfOpenIndex ( SpecFile *sf, SfCursor *cursor, int *error) {
+
+static char *
+sfIndexName(SpecFile *sf) {
     char *idxname;
-    short namelength;
-    int   sfi;
 
-    namelength = strlen(sf->sfname) + strlen(SF_ISFX) + 1;
+    idxname = (char *)malloc(strlen(sf->sfname) + strlen(SF_ISFX) + 1);
+    if (idxname != NULL) {
+        sprintf(idxname,"%s%s",sf->sfname,SF_ISFX);
+    }
+    return(idxname);
+}
 
-    idxname = (char *)malloc(sizeof(char) * namelength);
 
-    sprintf(idxname,"%s%s",sf->sfname,SF_ISFX);
+/*
+ * 32 bit FNV-1a hash
+ */
+static unsigned long
+sfChecksum(unsigned char *buffer, long size) {
+    unsigned long hash = 2166136261UL;
+    long          i;
 
-    if ((sfi = open(idxname,SF_OPENFLAG)) == -1) {
-        free(idxname);
-        return(SF_INIT);
-    } else {
-        free(idxname);
-        return(sfReadIndex(sfi,sf,cursor,error));
+    for (i=0; i < size; i++) {
+        hash = ((hash ^ buffer[i]) * 16777619UL) & 0xffffffffUL;
     }
+    return(hash);
 }
 
-
-static short
-sfReadIndex   ( int sfi, SpecFile *sf, SfCursor *cursor, int *error) {
-    SfCursor   filecurs;
-    char       buffer[200];
-    long       bytesread,i=0;
-    SpecScan   scan;
-    short      modif = 0;
-    long       mtime;
 
-   /*
-    * read signature
-    */
-    bytesread = read(sfi,buffer,sizeof(SF_SIGNATURE));
-    if (strcmp(buffer,SF_SIGNATURE) || bytesread == 0 ) {
-        return(SF_INIT);
-    }
+/*
+ * Checksums of the first and of the last bytes of the first
+ * filesize bytes of the file
+ */
+static int
+sfFileChecksums(SpecFile *sf, long filesize, long *headsum, long *tailsum) {
+    unsigned char buffer[SF_INDEX_SAMPLE];
+    long          size;
 
-   /*
-    * read cursor and specfile structure
-    */
-    if ( read(sfi,&mtime,   sizeof(long)) == 0)   return(SF_INIT);
-    if ( read(sfi,&filecurs, sizeof(SfCursor)) == 0) return(SF_INIT);
+    size = (filesize < SF_INDEX_SAMPLE) ? filesize : SF_INDEX_SAMPLE;
 
-    if (sf->m_time != mtime)  modif = 1;
+    lseek(sf->fd,0,SEEK_SET);
+    if ((long) read(sf->fd,buffer,size) != size) return(-1);
+    *headsum = (long) sfChecksum(buffer,size);
 
-    while(read(sfi,&scan, sizeof(SpecScan))) {
-        addToList(&(sf->list), (void *)&scan, (long)sizeof(SpecScan));
-        i++;
-    }
-    sf->no_scans = i;
+    lseek(sf->fd,filesize - size,SEEK_SET);
+    if ((long) read(sf->fd,buffer,size) != size) return(-1);
+    *tailsum = (long) sfChecksum(buffer,size);
 
-    memcpy(cursor,&filecurs,sizeof(SfCursor));
+    return(0);
+}
 
-    if (modif) return(SF_MODIFIED);
 
-    return(SF_READY);
+static void
+sfCursorToIndex(SfCursor *cursor, long *values) {
+    values[0]  = cursor->scanno;
+    values[1]  = cursor->cursor;
+    values[2]  = cursor->hdafoffset;
+    values[3]  = cursor->datalines;
+    values[4]  = cursor->dataoffset;
+    values[5]  = cursor->mcaspectra;
+    values[6]  = cursor->bytecnt;
+    values[7]  = cursor->what;
+    values[8]  = cursor->data;
+    values[9]  = cursor->file_header;
+    values[10] = cursor->fileh_size;
+    values[11] = cursor->linestart;
+    values[12] = cursor->lastchar;
 }
 
-
+
 static void
-sfWriteIndex  ( SpecFile *sf, SfCursor *cursor, int *error) {
+sfIndexToCursor(long *values, SfCursor *cursor) {
+    cursor->scanno      = values[0];
+    cursor->cursor      = values[1];
+    cursor->hdafoffset  = values[2];
+    cursor->datalines   = values[3];
+    cursor->dataoffset  = values[4];
+    cursor->mcaspectra  = values[5];
+    cursor->bytecnt     = values[6];
+    cursor->what        = values[7];
+    cursor->data        = values[8];
+    cursor->file_header = values[9];
+    cursor->fileh_size  = values[10];
+    cursor->linestart   = values[11];
+    cursor->lastchar    = values[12];
+}
 
-    int         fdi;
-    char       *idxname;
-    short       namelength;
-    ObjectList *obj;
-    long        mtime;
 
-    namelength = strlen(sf->sfname) + strlen(SF_ISFX) + 1;
+static void
+sfScanToIndex(SpecScan *scan, long *values) {
+    values[0] = scan->index;
+    values[1] = scan->scan_no;
+    values[2] = scan->order;
+    values[3] = scan->offset;
+    values[4] = scan->size;
+    values[5] = scan->last;
+    values[6] = scan->file_header;
+    values[7] = scan->data_offset;
+    values[8] = scan->hdafter_offset;
+    values[9] = scan->mcaspectra;
+}
 
-    idxname = (char *)malloc(sizeof(char) * namelength);
 
-    sprintf(idxname,"%s%s",sf->sfname,SF_ISFX);
+static void
+sfIndexToScan(long *values, SpecScan *scan) {
+    scan->index          = values[0];
+    scan->scan_no        = values[1];
+    scan->order          = values[2];
+    scan->offset         = values[3];
+    scan->size           = values[4];
+    scan->last           = values[5];
+    scan->file_header    = values[6];
+    scan->data_offset    = values[7];
+    scan->hdafter_offset = values[8];
+    scan->mcaspectra     = values[9];
+}
 
-    /* if ((fdi = open(idxname,SF_WRITEFLAG,SF_UMASK)) == -1) { */
-    if ((fdi = open(idxname,O_CREAT | O_WRONLY,SF_UMASK)) == -1) {
-        printf("    - cannot open. Error: (%d)\n",errno);
-        free(idxname);
-        return;
-    } else {
-        mtime = sf->m_time;
-        write(fdi,SF_SIGNATURE,sizeof(SF_SIGNATURE));
- /*
-  * Swap bytes for linux
-  */
-        write(fdi, (void *) &mtime, sizeof(long));
-        write(fdi, (void *) cursor, sizeof(SfCursor));
-        for( obj = sf->list.first; obj ; obj = obj->next)
-           write(fdi,(void *) obj->contents, sizeof(SpecScan));
-        close(fdi);
-        free(idxname);
-        return;
+
+static int
+sfReadIndexHeader(int fdi, SfIndexHeader *header) {
+    lseek(fdi,0,SEEK_SET);
+    if ((long) read(fdi,header,sizeof(SfIndexHeader)) != (long) sizeof(SfIndexHeader)) {
+        return(-1);
+    }
+    if (strncmp(header->magic,SF_INDEX_MAGIC,sizeof(header->magic)) ||
+        header->version    != SF_INDEX_VERSION ||
+        header->headersize != (long) sizeof(SfIndexHeader) ||
+        header->recordsize != (long) (SF_INDEX_NSCAN * sizeof(long)) ||
+        header->byteorder  != SF_INDEX_BYTEORDER ||
+        header->checksum   != (long) sfChecksum((unsigned char *) header,
+                                   (long) offsetof(SfIndexHeader,checksum)) ||
+        header->nscans < 0 || header->filesize < 0) {
+        return(-1);
     }
+    return(0);
 }
-#endif
 
-
+
+/*
+ * Write the scan records from first on and then the header
+ */
+static int
+sfWriteIndexData(int fdi, SpecFile *sf, SfIndexHeader *header, long first) {
+    ObjectList *obj;
+    long       *records;
+    long        i, n, size;
+
+    n = header->nscans - first;
+    if (n > 0) {
+        size    = n * header->recordsize;
+        records = (long *) malloc(size);
+        if (records == (long *)NULL) return(-1);
+
+        for (obj=sf->list.first, i=0; obj && i < first; obj=obj->next, i++);
+        for (i=0; obj && i < n; obj=obj->next, i++) {
+            sfScanToIndex((SpecScan *) obj->contents,records + i * SF_INDEX_NSCAN);
+        }
+        if (i < n ||
+            lseek(fdi,header->headersize + first * header->recordsize,SEEK_SET) == -1 ||
+            (long) write(fdi,records,size) != size) {
+            free(records);
+            return(-1);
+        }
+        free(records);
+    }
+    lseek(fdi,0,SEEK_SET);
+    if ((long) write(fdi,header,sizeof(SfIndexHeader)) != (long) sizeof(SfIndexHeader)) {
+        return(-1);
+    }
+    return(0);
+}
+
+
 /*****************************************************************************
  *
- *    Function:   static void sfStartBuffer()
+ *    Function:   static short sfOpenIndex()
+ *
+ *    Description:  reads the scan list and the cursor from the index file
+ *                  if it matches the data file.
  *
- *    Description:  start analyzing file buffer and takes into account the last
- *                  bytes of previous reading as defined in variable status
+ *    Returns:      SF_INIT if the file has to be read from the beginning
+ *                  SF_READY if the file is completely indexed
+ *                  SF_MODIFIED if the file has to be read from the cursor
  *
  *****************************************************************************/
-static void
-sfStartBuffer(SpecFile *sf,SfCursor *cursor,short status,char c0,char c1,int *error) {
+static short
+sfOpenIndex ( SpecFile *sf, SfCursor *cursor, long filesize, int *error) {
+    SfIndexHeader  header;
+    SfCursor       filecurs;
+    SpecScan       scan;
+    char          *idxname;
+    long          *records;
+    long           minsize,headsum,tailsum,size,i;
+    int            sfi;
+    short          ret;
+
+    minsize = sfIndexMinSize();
+    if (minsize < 0 || filesize < minsize) {
+        return(SF_INIT);
+    }
 
-    if ( status == ANY ) {
-        return;
-    } else if ( status == NEWLINE ) {
-        sfNewLine(sf,cursor,c0,c1,error);
-    } else if ( status == COMMENT ) {
-        cursor->bytecnt--;
-        sfHeaderLine(sf,cursor,c0,error);
-        cursor->bytecnt++;
+    if ((idxname = sfIndexName(sf)) == NULL) {
+        return(SF_INIT);
+    }
+    sfi = open(idxname,SF_OPENFLAG | SF_INDEX_FLAG);
+    free(idxname);
+    if (sfi == -1) {
+        return(SF_INIT);
     }
 
+    ret     = SF_INIT;
+    records = (long *)NULL;
+    if (sfReadIndexHeader(sfi,&header) == 0) {
+        sfIndexToCursor(header.cursor,&filecurs);
+        if (filecurs.bytecnt == header.filesize &&
+            header.filesize <= filesize &&
+            (header.filesize < filesize || header.mtime == sf->m_time) &&
+            sfFileChecksums(sf,header.filesize,&headsum,&tailsum) == 0 &&
+            headsum == header.headsum && tailsum == header.tailsum) {
+            size    = header.nscans * header.recordsize;
+            records = (long *) malloc(size + 1);
+        }
+        if (records != (long *)NULL && (long) read(sfi,records,size) == size) {
+            for (i=0; i < header.nscans; i++) {
+                sfIndexToScan(records + i * SF_INDEX_NSCAN,&scan);
+                if (addToList(&(sf->list),(void *)&scan,(long)sizeof(SpecScan))) {
+                    break;
+                }
+            }
+            if (i == header.nscans) {
+                ret = (header.filesize == filesize) ? SF_READY : SF_MODIFIED;
+            } else {
+                sfFreeScans(sf);
+            }
+        }
+    }
+    if (records != (long *)NULL) free(records);
+    close(sfi);
+
+    if (ret != SF_INIT) {
+        memcpy(cursor,&filecurs,sizeof(SfCursor));
+        sf->idx_scans = header.nscans;
+        sf->idx_size  = header.filesize;
+    }
+    return(ret);
 }
 
-
-/*******************************************************************************
+
+/*****************************************************************************
  *
- *    Function:   static void statusEnd()
+ *    Function:   static void sfWriteIndex()
  *
- *    Description:  ends analysis of file buffer and returns a variable
- *                  indicating staus ( last character is COMMENT,NEWLINE of ANY )
+ *    Description:  appends the new complete scans to the index file if it
+ *                  is the one read or written before, otherwise writes a
+ *                  new one. Errors are ignored, the index file is optional.
  *
- *******************************************************************************/
-static short
-statusEnd(char c2,char c1) {
-
-      if (c2=='\n' && c1=='#') {
-            return(COMMENT);
-      } else if (c1=='\n') {
-            return(NEWLINE);
-      } else {
-            return(ANY);
-      }
+ *****************************************************************************/
+static void
+sfWriteIndex  ( SpecFile *sf, int *error) {
+    SfIndexHeader  header;
+    SfIndexHeader  old;
+    struct stat    mystat;
+    char          *idxname;
+    char          *tmpname;
+    long           minsize;
+    int            fdi;
+    int            done;
+
+    minsize = sfIndexMinSize();
+    if (minsize < 0 || sf->cursor.bytecnt < minsize) {
+        return;
+    }
+
+    memset(&header,0,sizeof(SfIndexHeader));
+    strcpy(header.magic,SF_INDEX_MAGIC);
+    header.version    = SF_INDEX_VERSION;
+    header.headersize = sizeof(SfIndexHeader);
+    header.recordsize = SF_INDEX_NSCAN * sizeof(long);
+    header.byteorder  = SF_INDEX_BYTEORDER;
+    header.filesize   = sf->cursor.bytecnt;
+   /*
+    * The modification time is only valid if nothing was appended
+    * after reading
+    */
+    if (fstat(sf->fd,&mystat) == 0 && (long) mystat.st_size == header.filesize) {
+        header.mtime  = mystat.st_mtime;
+    } else {
+        header.mtime  = -1;
+    }
+    if (sfFileChecksums(sf,header.filesize,&header.headsum,&header.tailsum)) {
+        return;
+    }
+    header.nscans     = sfCompleteScans(&(sf->cursor));
+    sfCursorToIndex(&(sf->cursor),header.cursor);
+    header.checksum   = (long) sfChecksum((unsigned char *) &header,
+                                          (long) offsetof(SfIndexHeader,checksum));
+
+    if ((idxname = sfIndexName(sf)) == NULL) {
+        return;
+    }
+
+    done = 0;
+    if (sf->idx_scans >= 0 && sf->idx_scans <= header.nscans) {
+        fdi = open(idxname,O_RDWR | SF_INDEX_FLAG);
+        if (fdi != -1) {
+            if (sfReadIndexHeader(fdi,&old) == 0 &&
+                old.nscans == sf->idx_scans && old.filesize == sf->idx_size) {
+                done = (sfWriteIndexData(fdi,sf,&header,sf->idx_scans) == 0);
+            }
+            close(fdi);
+        }
+    }
+
+    if (!done) {
+       /*
+        * Write a complete index file and replace the previous one
+        */
+        tmpname = (char *)malloc(strlen(idxname) + 32);
+        if (tmpname != (char *)NULL) {
+            sprintf(tmpname,"%s.%ld",idxname,(long) getpid());
+            fdi = open(tmpname,O_CREAT | O_WRONLY | O_TRUNC | SF_INDEX_FLAG,SF_UMASK);
+            if (fdi != -1) {
+                done = (sfWriteIndexData(fdi,sf,&header,0) == 0);
+                if (close(fdi)) done = 0;
+#ifdef WIN32
+                if (done) remove(idxname);
+#endif
+                if (done && rename(tmpname,idxname)) done = 0;
+                if (!done) remove(tmpname);
+            }
+            free(tmpname);
+        }
+    }
+    free(idxname);
+
+    if (done) {
+        sf->idx_scans = header.nscans;
+        sf->idx_size  = header.filesize;
+    }
 }
 
-
+
 static void
 sfNewLine(SpecFile *sf,SfCursor *cursor,char c0,char c1,int *error) {
      if (c0 == '#') {
@@ -783,9 +1090,10 @@ sfSaveScan(SpecFile *sf, SfCursor *cursor,int *error) {
 
 
 static void
-sfAssignScanNumbers(SpecFile *sf) {
+sfAssignScanNumbers(SpecFile *sf, long first) {
 
   int                    size,i;
+  long                   n,nbytes;
   char                  *buffer,*ptr;
 
   char   buffer2[50];
@@ -798,14 +1106,20 @@ sfAssignScanNumbers(SpecFile *sf) {
   size = 50;
   buffer = (char *) malloc(size);
 
-  for ( object = (sf->list).first; object; object=object->next) {
+  for ( object = (sf->list).first,n=0; object && n < first; object=object->next,n++);
+
+  for ( ; object; object=object->next) {
         scan = (SpecScan *) object->contents;
 
         lseek(sf->fd,scan->offset,SEEK_SET);
-        read(sf->fd,buffer,size);
-        buffer[49] = '\0';
+       /*
+        * The last line of the file may be incomplete
+        */
+        nbytes = read(sf->fd,buffer,size-1);
+        if (nbytes < 0) nbytes = 0;
+        buffer[nbytes] = '\0';
 
-        for ( ptr = buffer+3,i=0; *ptr != ' ';ptr++,i++) buffer2[i] = *ptr;
+        for ( ptr = buffer+3,i=0; ptr < buffer+nbytes && *ptr != ' ' && *ptr != '\n';ptr++,i++) buffer2[i] = *ptr;
 
         buffer2[i] = '\0';
 
@@ -816,6 +1130,7 @@ sfAssignScanNumbers(SpecFile *sf) {
             if (scan2->scan_no == scan->scan_no) scan->order++;
         }
   }
+  free(buffer);
 }
 
 void
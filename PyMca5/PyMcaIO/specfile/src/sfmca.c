@@ -79,6 +79,14 @@ DllExport int  SfGetMca   ( SpecFile *sf, long index, long mcano,
                                           double **retdata, int *error );
 DllExport long SfMcaCalib ( SpecFile *sf, long index, double **calib,
                                           int *error );
+DllExport long SfMcaChannels ( SpecFile *sf, long index, int *error );
+DllExport long SfGetMcaArray ( SpecFile *sf, long index, double *data,
+                                          long nmca, long nchannels,
+                                          int *error );
+
+static double sfAtof       ( const char *strval );
+static char  *sfReadMca    ( char *ptr, char *to, double *data,
+                                          long maxvals, long *vals );
 
 
 /*********************************************************************
@@ -334,3 +342,230 @@ SfMcaCalib ( SpecFile *sf, long index, double **calib, int *error )
      *calib = retdata;
      return(0);
 }
+
+
+/*********************************************************************
+ *   Function:        double sfAtof( strval )
+ *
+ *   Description:    Converts a string to a double without depending on
+ *                   the locale. Integers and decimals with up to 19
+ *                   digits and a decimal exponent within 22 are exactly
+ *                   converted without any library call. Other strings
+ *                   are handed to PyMcaAtof.
+ *
+ *********************************************************************/
+static double
+sfAtof( const char *strval )
+{
+     static const double powers[] = {1e0,  1e1,  1e2,  1e3,  1e4,  1e5,
+                                     1e6,  1e7,  1e8,  1e9,  1e10, 1e11,
+                                     1e12, 1e13, 1e14, 1e15, 1e16, 1e17,
+                                     1e18, 1e19, 1e20, 1e21, 1e22};
+     const char         *ptr = strval;
+     unsigned long long  mantissa = 0;
+     int                 negative = 0,
+                         digits = 0,
+                         exponent = 0,
+                         expvalue = 0,
+                         expnegative = 0;
+     double              val;
+
+     if (*ptr == '-' || *ptr == '+') {
+         negative = (*ptr == '-');
+         ptr++;
+     }
+     for ( ; isdigit(*ptr); ptr++) {
+         if (digits >= 19)
+             return(PyMcaAtof(strval));
+         mantissa = 10 * mantissa + (*ptr - '0');
+         if (mantissa)
+             digits++;
+     }
+     if (*ptr == '.') {
+         for (ptr++; isdigit(*ptr); ptr++) {
+             if (digits >= 19)
+                 return(PyMcaAtof(strval));
+             mantissa = 10 * mantissa + (*ptr - '0');
+             if (mantissa)
+                 digits++;
+             exponent--;
+         }
+     }
+     if (*ptr == 'e' || *ptr == 'E') {
+         ptr++;
+         if (*ptr == '-' || *ptr == '+') {
+             expnegative = (*ptr == '-');
+             ptr++;
+         }
+         for ( ; isdigit(*ptr); ptr++) {
+             if (expvalue > 1000)
+                 return(PyMcaAtof(strval));
+             expvalue = 10 * expvalue + (*ptr - '0');
+         }
+         exponent += expnegative ? -expvalue : expvalue;
+     }
+     if (*ptr != '\0' || mantissa > (1ULL << 53) ||
+                          exponent < -22 || exponent > 22)
+         return(PyMcaAtof(strval));
+     val = (double) mantissa;
+     if (exponent < 0)
+         val /= powers[-exponent];
+     else
+         val *= powers[exponent];
+     return(negative ? -val : val);
+}
+
+
+/*********************************************************************
+ *   Function:        char *sfReadMca( ptr, to, data, maxvals, vals )
+ *
+ *   Description:    Parses the values of the spectrum starting at ptr,
+ *                   just after its '@' character, as SfGetMca does.
+ *
+ *   Parameters:
+ *        Input :    (1) Beginning of the spectrum
+ *                   (2) End of the scan buffer
+ *                   (3) Data array or NULL to just count the values
+ *                   (4) Maximum number of values stored into data
+ *        Output:
+ *                   (5) Number of values of the spectrum
+ *   Returns:
+ *            Position of the end of the spectrum
+ *
+ *********************************************************************/
+static char *
+sfReadMca( char *ptr, char *to, double *data, long maxvals, long *vals )
+{
+     char    strval[100];
+     int     i = 0;
+
+     *vals = 0;
+     /* skip the character following '@' as SfGetMca */
+     ptr++;
+     for ( ;(*(ptr+1) != '\n' || (*ptr == MCA_CONT)) && ptr < to - 1 ; ptr++)
+     {
+         if (*ptr == ' ' || *ptr == '\t' || *ptr == '\\' || *ptr == '\n') {
+             if ( i ) {
+                strval[i] = '\0';
+                i = 0;
+                if ((data != (double *) NULL) && (*vals < maxvals))
+                    data[*vals] = sfAtof(strval);
+                (*vals)++;
+             }
+         } else if (isnumber(*ptr) && (i < 98)) {
+             strval[i] = *ptr;
+             i++;
+         }
+     }
+     if (ptr < to && isnumber(*ptr)) {
+         strval[i]    = *ptr;
+         strval[i+1]  = '\0';
+         if ((data != (double *) NULL) && (*vals < maxvals))
+             data[*vals] = sfAtof(strval);
+         (*vals)++;
+     }
+     return(ptr);
+}
+
+
+/*********************************************************************
+ *   Function:        long SfMcaChannels( sf, index, error )
+ *
+ *   Description:    Gets the number of values of the first mca
+ *                   spectrum of a scan
+ *
+ *   Parameters:
+ *        Input :    (1) File pointer
+ *                   (2) Index
+ *        Output:
+ *                   (3) error number
+ *   Returns:
+ *            Number of values,
+ *            ( -1 ) => errors.
+ *   Possible errors:
+ *            SF_ERR_SCAN_NOT_FOUND
+ *            SF_ERR_MCA_NOT_FOUND
+ *
+ *********************************************************************/
+DllExport long
+SfMcaChannels( SpecFile *sf, long index, int *error )
+{
+     SpecScan *scan;
+     char     *from,
+              *to;
+     long      vals;
+
+     if (sfSetCurrent(sf,index,error) == -1 )
+         return(-1);
+
+     scan = (SpecScan *)sf->current->contents;
+     from = sf->scanbuffer + scan->data_offset - scan->offset;
+     to   = sf->scanbuffer + scan->size;
+
+     for ( ; from < to && *from != '@'; from++);
+     if (from >= to) {
+         *error = SF_ERR_MCA_NOT_FOUND;
+         return(-1);
+     }
+     sfReadMca(from + 1, to, (double *) NULL, 0, &vals);
+     return(vals);
+}
+
+
+/*********************************************************************
+ *   Function:        long SfGetMcaArray( sf, index, data, nmca,
+ *                                        nchannels, error )
+ *
+ *   Description:    Reads all the mca spectra of a scan in one pass.
+ *                   All the state is local, therefore different files
+ *                   can be read at the same time from different threads.
+ *
+ *   Parameters:
+ *        Input :    (1) File pointer
+ *                   (2) Index
+ *                   (3) Data array of nmca x nchannels values. Spectra
+ *                       shorter than nchannels are not padded.
+ *                   (4) Number of spectra to read
+ *                   (5) Number of values of each spectrum
+ *        Output:
+ *                   (6) error number
+ *   Returns:
+ *            Number of spectra read,
+ *            ( -1 ) => errors.
+ *   Possible errors:
+ *            SF_ERR_SCAN_NOT_FOUND
+ *            SF_ERR_MCA_NOT_FOUND
+ *
+ *********************************************************************/
+DllExport long
+SfGetMcaArray( SpecFile *sf, long index, double *data, long nmca,
+                                         long nchannels, int *error )
+{
+     SpecScan *scan;
+     char     *ptr,
+              *to;
+     long      spect_no = 0,
+               vals;
+
+     if (sfSetCurrent(sf,index,error) == -1 )
+         return(-1);
+
+     scan = (SpecScan *)sf->current->contents;
+     ptr  = sf->scanbuffer + scan->data_offset - scan->offset;
+     to   = sf->scanbuffer + scan->size;
+
+     while ( spect_no < nmca && ptr < to ) {
+         if (*ptr == '@') {
+             ptr = sfReadMca(ptr + 1, to, data + spect_no * nchannels,
+                             nchannels, &vals);
+             if (vals > nchannels) {
+                 /* spectra of different lengths */
+                 *error = SF_ERR_MCA_NOT_FOUND;
+                 return(-1);
+             }
+             spect_no++;
+         }
+         ptr++;
+     }
+     return(spect_no);
+}
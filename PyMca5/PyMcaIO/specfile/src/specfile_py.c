@@ -134,6 +134,14 @@ static PyObject *ErrorObject;
 #define onError(message)  \
      {PyErr_SetString (ErrorObject,message); return NULL; }
 
+/*
+ * The file buffers may be reallocated by any access to the file, hence no
+ * method can use a file object while allmca reads it without the GIL.
+ */
+#define checkBusy(fileobject)  \
+     if (((fileobject) != NULL) && (fileobject)->busy) \
+          onError("specfile in use by another thread")
+
 /*
  * Data types
  */
@@ -141,7 +149,8 @@ typedef struct {
    PyObject_HEAD
    SpecFile *sf;
    char     *name;
-   short     length;
+   long      length;
+   int       busy;
 } specfileobject;
 
 typedef struct {
@@ -230,6 +239,7 @@ static PyObject   * scandata_header       (PyObject *self,PyObject *args);
 static PyObject   * scandata_fileheader   (PyObject *self,PyObject *args);
 static PyObject   * scandata_nbmca        (PyObject *self,PyObject *args);
 static PyObject   * scandata_mca          (PyObject *self,PyObject *args);
+static PyObject   * scandata_allmca       (PyObject *self,PyObject *args);
 static PyObject   * scandata_show         (PyObject *self,PyObject *args);
 
 static struct PyMethodDef  scandata_methods[] = {
@@ -251,6 +261,7 @@ static struct PyMethodDef  scandata_methods[] = {
    {"fileheader",  scandata_fileheader,  1},
    {"nbmca",       scandata_nbmca,       1},
    {"mca",         scandata_mca,         1},
+   {"allmca",      scandata_allmca,      1},
    {"show",        scandata_show,        1},
    { NULL, NULL}
 };
@@ -297,6 +308,8 @@ specfile_list(PyObject *self,PyObject *args)
 
     specfileobject *v = (specfileobject *) self;
 
+    checkBusy(v);
+
     if (!PyArg_ParseTuple(args, ""))
         return NULL;
 
@@ -325,6 +338,8 @@ specfile_allmotors(PyObject *self,PyObject *args)
 
     specfileobject *v = (specfileobject *) self;
 
+    checkBusy(v);
+
     if (!PyArg_ParseTuple(args, ""))
         return NULL;
 
@@ -351,6 +366,8 @@ specfile_title(PyObject *self,PyObject *args)
 
     specfileobject *v = (specfileobject *) self;
 
+    checkBusy(v);
+
     if (!PyArg_ParseTuple(args, ""))
         return NULL;
 
@@ -372,6 +389,8 @@ specfile_user(PyObject *self,PyObject *args)
 
     specfileobject *v = (specfileobject *) self;
 
+    checkBusy(v);
+
     if (!PyArg_ParseTuple(args, ""))
         return NULL;
 
@@ -394,6 +413,8 @@ specfile_date(PyObject *self,PyObject *args)
 
     specfileobject *v = (specfileobject *) self;
 
+    checkBusy(v);
+
     if (!PyArg_ParseTuple(args, ""))
         return NULL;
 
@@ -415,6 +436,8 @@ specfile_epoch(PyObject *self,PyObject *args)
 
     specfileobject *v = (specfileobject *) self;
 
+    checkBusy(v);
+
     if (!PyArg_ParseTuple(args, ""))
         return NULL;
 
@@ -435,6 +458,8 @@ specfile_update(PyObject *self,PyObject *args)
 
     specfileobject *v = (specfileobject *) self;
 
+    checkBusy(v);
+
     if (!PyArg_ParseTuple(args, ""))
         return NULL;
 
@@ -451,6 +476,7 @@ specfile_scanno(PyObject *self,PyObject *args)
     long scanno;
     specfileobject *v = (specfileobject *) self;
 
+    checkBusy(v);
 
     if (!PyArg_ParseTuple(args, ""))
         return NULL;
@@ -471,6 +497,8 @@ specfile_select(PyObject *self,PyObject *args)
     scandataobject *v;
     specfileobject *f = (specfileobject *)self;
 
+    checkBusy(f);
+
    if (!PyArg_ParseTuple(args,"s",&scanstr)) {
        return NULL;
    } else {
@@ -504,6 +532,8 @@ specfile_show(PyObject *self,PyObject *args)
 
     specfileobject *f = (specfileobject *)self;
 
+    checkBusy(f);
+
     SfShow(f->sf);
 
     return (Py_BuildValue("l",0));
@@ -528,6 +558,7 @@ specfile_open(char *filename) {      /* on x = specfile.Specfile(name) */
         onError("cannot open file");
 
     self->sf = sf;
+    self->busy = 0;
     self->length = SfScanNo(sf);
     self->name = (char *)strdup(filename);
     strcpy(self->name,filename);
@@ -571,6 +602,8 @@ specfile_scan(PyObject *self, Py_ssize_t index) {
     scandataobject *v;
     specfileobject *f = (specfileobject *)self;
 
+    checkBusy(f);
+
     if ( index < 0 || index >= f->length) {
          PyErr_SetString(PyExc_IndexError,"scan out of bounds");
          return NULL;
@@ -669,6 +702,8 @@ scandata_data(PyObject *self,PyObject *args) {
 
     scandataobject *s = (scandataobject *) self;
 
+    checkBusy(s->file);
+
     sf  = (s->file)->sf;
     idx = s->index;
 
@@ -721,6 +756,8 @@ scandata_dataline(PyObject *self,PyObject *args) {
 
     scandataobject *s = (scandataobject *) self;
 
+    checkBusy(s->file);
+
     sf  = (s->file)->sf;
     idx = s->index;
 
@@ -753,6 +790,8 @@ scandata_datacol(PyObject *self,PyObject *args) {
     int     idx;
     scandataobject *s = (scandataobject *) self;
 
+    checkBusy(s->file);
+
     sf  = (s->file)->sf;
     idx = s->index;
 
@@ -800,6 +839,8 @@ scandata_alllabels  (PyObject *self,PyObject *args)
 
     scandataobject *v = (scandataobject *) self;
 
+    checkBusy(v->file);
+
     if (!PyArg_ParseTuple(args, ""))
         return NULL;
 
@@ -824,6 +865,8 @@ scandata_allmotors  (PyObject *self,PyObject *args)
 
     scandataobject *v = (scandataobject *) self;
 
+    checkBusy(v->file);
+
     if (!PyArg_ParseTuple(args, ""))
         return NULL;
 
@@ -848,6 +891,8 @@ scandata_allmotorpos  (PyObject *self,PyObject *args)
 
     scandataobject *v = (scandataobject *) self;
 
+    checkBusy(v->file);
+
     if (!PyArg_ParseTuple(args, ""))
         return NULL;
 
@@ -872,6 +917,8 @@ scandata_motorpos  (PyObject *self,PyObject *args)
 
     scandataobject *v = (scandataobject *) self;
 
+    checkBusy(v->file);
+
     if (!PyArg_ParseTuple(args,"s",&motorname)) {
        return NULL;
     }
@@ -897,6 +944,8 @@ scandata_hkl          (PyObject *self,PyObject *args)
 
     scandataobject *s = (scandataobject *) self;
 
+    checkBusy(s->file);
+
     idx = s->index;
     if (idx == -1 ) {
         onError("empty scan data");
@@ -922,6 +971,8 @@ scandata_number       (PyObject *self,PyObject *args)
 
     scandataobject *s = (scandataobject *) self;
 
+    checkBusy(s->file);
+
     sf  = (s->file)->sf;
     idx = s->index;
 
@@ -939,6 +990,8 @@ scandata_order        (PyObject *self,PyObject *args)
 
     scandataobject *s = (scandataobject *) self;
 
+    checkBusy(s->file);
+
     sf  = (s->file)->sf;
     idx = s->index;
 
@@ -959,6 +1012,8 @@ scandata_command      (PyObject *self,PyObject *args)
 
     scandataobject *s = (scandataobject *) self;
 
+    checkBusy(s->file);
+
     idx = s->index;
     if (idx == -1 ) {
         onError("empty scan data");
@@ -987,6 +1042,8 @@ scandata_date      (PyObject *self,PyObject *args)
 
     scandataobject *s = (scandataobject *) self;
 
+    checkBusy(s->file);
+
     idx = s->index;
     if (idx == -1 ) {
         onError("empty scan data");
@@ -1011,6 +1068,8 @@ scandata_cols      (PyObject *self,PyObject *args)
 
     scandataobject *s = (scandataobject *) self;
 
+    checkBusy(s->file);
+
     idx = s->index;
     if (idx == -1 )
         onError("empty scan data");
@@ -1032,6 +1091,8 @@ scandata_lines      (PyObject *self,PyObject *args)
 
     scandataobject *s = (scandataobject *) self;
 
+    checkBusy(s->file);
+
     idx = s->index;
     if (idx == -1 )
         onError("empty scan data");
@@ -1061,6 +1122,8 @@ scandata_fileheader     (PyObject *self,PyObject *args)
 
     scandataobject *s = (scandataobject *) self;
 
+    checkBusy(s->file);
+
     if (!PyArg_ParseTuple(args,"s",&searchstr))
       return NULL;
 
@@ -1098,6 +1161,8 @@ scandata_header     (PyObject *self,PyObject *args)
 
     scandataobject *s = (scandataobject *) self;
 
+    checkBusy(s->file);
+
     if (!PyArg_ParseTuple(args,"s",&searchstr))
       return NULL;
 
@@ -1133,6 +1198,8 @@ scandata_nbmca      (PyObject *self,PyObject *args)
 
     scandataobject *s = (scandataobject *) self;
 
+    checkBusy(s->file);
+
     idx = s->index;
     if (idx == -1 ) {
         onError("empty scan data");
@@ -1162,6 +1229,8 @@ scandata_mca      (PyObject *self,PyObject *args)
 
     scandataobject *s = (scandataobject *) self;
 
+    checkBusy(s->file);
+
     if (!PyArg_ParseTuple(args,"l",&mcano))
             onError("cannot decode arguments for line data");
 
@@ -1198,6 +1267,84 @@ scandata_mca      (PyObject *self,PyObject *args)
      */
 }
 
+static PyObject   *
+scandata_allmca   (PyObject *self,PyObject *args)
+{
+    int       error = 0;
+    long      idx, nmca, nchannels, ret;
+    npy_intp  dimensions[2];
+
+    PyObject       *out = NULL;
+    PyArrayObject  *r_array;
+
+    SpecFile *sf;
+
+    scandataobject *s = (scandataobject *) self;
+
+    checkBusy(s->file);
+
+    if (!PyArg_ParseTuple(args,"|O",&out))
+            onError("cannot decode arguments for mca data");
+
+    idx = s->index;
+
+    if (idx == -1 ) {
+        onError("empty scan data");
+    }
+
+    sf  = (s->file)->sf;
+
+    nmca = SfNoMca(sf,idx,&error);
+    if (nmca == -1)
+        onError("cannot get number of mca for scan");
+
+    if ((out == NULL) || (out == Py_None)) {
+        nchannels = 0;
+        if (nmca > 0) {
+            nchannels = SfMcaChannels(sf,idx,&error);
+            if (nchannels == -1)
+                onError("cannot get mca for scan");
+        }
+        dimensions[0] = nmca;
+        dimensions[1] = nchannels;
+        r_array = (PyArrayObject *)PyArray_ZEROS(2,dimensions,NPY_DOUBLE,0);
+        if (r_array == NULL)
+            return NULL;
+    } else {
+        if (!PyArray_Check(out))
+            onError("output must be an array");
+        r_array = (PyArrayObject *) out;
+        if ((PyArray_NDIM(r_array) != 2) ||
+            (PyArray_TYPE(r_array) != NPY_DOUBLE) ||
+            (!PyArray_ISCARRAY(r_array)))
+            onError("output must be a writeable 2D C contiguous array of doubles");
+        if (PyArray_DIM(r_array, 0) < nmca)
+            nmca = (long) PyArray_DIM(r_array, 0);
+        nchannels = (long) PyArray_DIM(r_array, 1);
+        Py_INCREF(out);
+    }
+
+    /*
+     * All the parsing state is local, the lock is released in order to
+     * read different files at once from different threads. The file
+     * object is marked as busy meanwhile, because any other access to it
+     * could reallocate the scan buffer being parsed.
+     */
+    (s->file)->busy = 1;
+    Py_BEGIN_ALLOW_THREADS
+    ret = SfGetMcaArray(sf,idx,(double *) PyArray_DATA(r_array),
+                        nmca,nchannels,&error);
+    Py_END_ALLOW_THREADS
+    (s->file)->busy = 0;
+
+    if (ret == -1) {
+        Py_DECREF(r_array);
+        onError("cannot get mca for scan");
+    }
+
+    return PyArray_Return(r_array);
+}
+
 static PyObject   *
 scandata_show      (PyObject *self,PyObject *args)
 {
@@ -1207,6 +1354,8 @@ scandata_show      (PyObject *self,PyObject *args)
 
     scandataobject *s = (scandataobject *) self;
 
+    checkBusy(s->file);
+
     idx = s->index;
 
     if (idx == -1 )
@@ -1270,6 +1419,7 @@ scandata_col(PyObject *self, Py_ssize_t index) {
 
     scandataobject *s = (scandataobject *) self;
 
+    checkBusy(s->file);
 
     if ( index < 0 || index > (s->cols - 1) ) {
          PyErr_SetString(PyExc_IndexError,"column out of bounds");
@@ -1326,6 +1476,8 @@ scandata_print(PyObject *self,FILE *fp,int flags) {
     idx = s->index;
     if (idx == -1 ) {
         fprintf(fp,"scandata('empty')");
+    } else if ((s->file)->busy) {
+        fprintf(fp,"scandata('source: %s')", (s->file)->name);
     } else {
         sf  = (s->file)->sf;
         fprintf(fp,"scandata('source: %s,scan: %d.%d')",
@@ -27,7 +27,8 @@ typedef struct {
     /* Type-specific fields go here. */
     SpecFile *sf;
     char     *name;
-    short     length;
+    long      length;
+    int       busy;
 } specfileobject;
 
 typedef struct {
@@ -41,6 +42,14 @@ static PyObject *SpecfileError;
 #define onError(message)  \
      {PyErr_SetString (SpecfileError, message); return NULL; }
 
+/*
+ * The file buffers may be reallocated by any access to the file, hence no
+ * method can use a file object while allmca reads it without the GIL.
+ */
+#define checkBusy(fileobject)  \
+     if (((fileobject) != NULL) && (fileobject)->busy) \
+          onError("specfile in use by another thread")
+
 /*---------------------------*/
 
    /*
@@ -81,6 +90,8 @@ specfile_list(PyObject *self,PyObject *args)
 
     specfileobject *v = (specfileobject *) self;
 
+    checkBusy(v);
+
     if (!PyArg_ParseTuple(args, ""))
         return NULL;
 
@@ -108,6 +119,8 @@ specfile_allmotors(PyObject *self,PyObject *args)
 
     specfileobject *v = (specfileobject *) self;
 
+    checkBusy(v);
+
     if (!PyArg_ParseTuple(args, ""))
         return NULL;
 
@@ -134,6 +147,8 @@ specfile_title(PyObject *self,PyObject *args)
 
     specfileobject *v = (specfileobject *) self;
 
+    checkBusy(v);
+
     if (!PyArg_ParseTuple(args, ""))
         return NULL;
 
@@ -155,6 +170,8 @@ specfile_user(PyObject *self,PyObject *args)
 
     specfileobject *v = (specfileobject *) self;
 
+    checkBusy(v);
+
     if (!PyArg_ParseTuple(args, ""))
         return NULL;
 
@@ -177,6 +194,8 @@ specfile_date(PyObject *self,PyObject *args)
 
     specfileobject *v = (specfileobject *) self;
 
+    checkBusy(v);
+
     if (!PyArg_ParseTuple(args, ""))
         return NULL;
 
@@ -198,6 +217,8 @@ specfile_epoch(PyObject *self,PyObject *args)
 
     specfileobject *v = (specfileobject *) self;
 
+    checkBusy(v);
+
     if (!PyArg_ParseTuple(args, ""))
         return NULL;
 
@@ -218,6 +239,8 @@ specfile_update(PyObject *self,PyObject *args)
 
     specfileobject *v = (specfileobject *) self;
 
+    checkBusy(v);
+
     if (!PyArg_ParseTuple(args, ""))
         return NULL;
 
@@ -234,6 +257,7 @@ specfile_scanno(PyObject *self,PyObject *args)
     long scanno;
     specfileobject *v = (specfileobject *) self;
 
+    checkBusy(v);
 
     if (!PyArg_ParseTuple(args, ""))
         return NULL;
@@ -249,6 +273,8 @@ specfile_show(PyObject *self,PyObject *args)
 
     specfileobject *f = (specfileobject *)self;
 
+    checkBusy(f);
+
     SfShow(f->sf);
 
     return (Py_BuildValue("l",0));
@@ -366,6 +392,7 @@ specfile_open(PyObject *self, PyObject *args) /* on x = specfile.Specfile(name)
     if (object == NULL)
         return NULL;
     object->sf = NULL;
+    object->busy = 0;
     object->name = (char *)strdup(filename);
     strcpy(object->name, filename);
 #ifdef WIN32
@@ -377,7 +404,7 @@ specfile_open(PyObject *self, PyObject *args) /* on x = specfile.Specfile(name)
         onError("cannot open file");
     }
     object->sf = sf;
-    object->length = (short) SfScanNo(sf);
+    object->length = SfScanNo(sf);
     return (PyObject *) object;
 }
 
@@ -455,6 +482,7 @@ static PyObject   * scandata_header       (PyObject *self,PyObject *args);
 static PyObject   * scandata_fileheader   (PyObject *self,PyObject *args);
 static PyObject   * scandata_nbmca        (PyObject *self,PyObject *args);
 static PyObject   * scandata_mca          (PyObject *self,PyObject *args);
+static PyObject   * scandata_allmca       (PyObject *self,PyObject *args);
 static PyObject   * scandata_show         (PyObject *self,PyObject *args);
 
 static struct PyMethodDef  scandata_methods[] = {
@@ -476,6 +504,7 @@ static struct PyMethodDef  scandata_methods[] = {
    {"fileheader",  scandata_fileheader,  1},
    {"nbmca",       scandata_nbmca,       1},
    {"mca",         scandata_mca,         1},
+   {"allmca",      scandata_allmca,      1},
    {"show",        scandata_show,        1},
    { NULL, NULL}
 };
@@ -512,6 +541,7 @@ scandata_col(PyObject *self, Py_ssize_t index) {
 
     scandataobject *s = (scandataobject *) self;
 
+    checkBusy(s->file);
 
     if ( index < 0 || index > (s->cols - 1) ) {
          PyErr_SetString(PyExc_IndexError,"column out of bounds");
@@ -573,6 +603,8 @@ scandata_data(PyObject *self,PyObject *args) {
 
     scandataobject *s = (scandataobject *) self;
 
+    checkBusy(s->file);
+
     sf  = (s->file)->sf;
     idx = s->index;
 
@@ -625,6 +657,8 @@ scandata_dataline(PyObject *self,PyObject *args) {
 
     scandataobject *s = (scandataobject *) self;
 
+    checkBusy(s->file);
+
     sf  = (s->file)->sf;
     idx = s->index;
 
@@ -657,6 +691,8 @@ scandata_datacol(PyObject *self,PyObject *args) {
     int     idx;
     scandataobject *s = (scandataobject *) self;
 
+    checkBusy(s->file);
+
     sf  = (s->file)->sf;
     idx = s->index;
 
@@ -704,6 +740,8 @@ scandata_alllabels  (PyObject *self,PyObject *args)
 
     scandataobject *v = (scandataobject *) self;
 
+    checkBusy(v->file);
+
     if (!PyArg_ParseTuple(args, ""))
         return NULL;
 
@@ -728,6 +766,8 @@ scandata_allmotors  (PyObject *self,PyObject *args)
 
     scandataobject *v = (scandataobject *) self;
 
+    checkBusy(v->file);
+
     if (!PyArg_ParseTuple(args, ""))
         return NULL;
 
@@ -752,6 +792,8 @@ scandata_allmotorpos  (PyObject *self,PyObject *args)
 
     scandataobject *v = (scandataobject *) self;
 
+    checkBusy(v->file);
+
     if (!PyArg_ParseTuple(args, ""))
         return NULL;
 
@@ -776,6 +818,8 @@ scandata_motorpos  (PyObject *self,PyObject *args)
 
     scandataobject *v = (scandataobject *) self;
 
+    checkBusy(v->file);
+
     if (!PyArg_ParseTuple(args,"s",&motorname)) {
        return NULL;
     }
@@ -801,6 +845,8 @@ scandata_hkl          (PyObject *self,PyObject *args)
 
     scandataobject *s = (scandataobject *) self;
 
+    checkBusy(s->file);
+
     idx = s->index;
     if (idx == -1 ) {
         onError("empty scan data");
@@ -826,6 +872,8 @@ scandata_number       (PyObject *self,PyObject *args)
 
     scandataobject *s = (scandataobject *) self;
 
+    checkBusy(s->file);
+
     sf  = (s->file)->sf;
     idx = s->index;
 
@@ -843,6 +891,8 @@ scandata_order        (PyObject *self,PyObject *args)
 
     scandataobject *s = (scandataobject *) self;
 
+    checkBusy(s->file);
+
     sf  = (s->file)->sf;
     idx = s->index;
 
@@ -863,6 +913,8 @@ scandata_command      (PyObject *self,PyObject *args)
 
     scandataobject *s = (scandataobject *) self;
 
+    checkBusy(s->file);
+
     idx = s->index;
     if (idx == -1 ) {
         onError("empty scan data");
@@ -891,6 +943,8 @@ scandata_date      (PyObject *self,PyObject *args)
 
     scandataobject *s = (scandataobject *) self;
 
+    checkBusy(s->file);
+
     idx = s->index;
     if (idx == -1 ) {
         onError("empty scan data");
@@ -915,6 +969,8 @@ scandata_cols      (PyObject *self,PyObject *args)
 
     scandataobject *s = (scandataobject *) self;
 
+    checkBusy(s->file);
+
     idx = s->index;
     if (idx == -1 )
         onError("empty scan data");
@@ -936,6 +992,8 @@ scandata_lines      (PyObject *self,PyObject *args)
 
     scandataobject *s = (scandataobject *) self;
 
+    checkBusy(s->file);
+
     idx = s->index;
     if (idx == -1 )
         onError("empty scan data");
@@ -965,6 +1023,8 @@ scandata_fileheader     (PyObject *self,PyObject *args)
 
     scandataobject *s = (scandataobject *) self;
 
+    checkBusy(s->file);
+
     if (!PyArg_ParseTuple(args,"s",&searchstr))
       return NULL;
 
@@ -1002,6 +1062,8 @@ scandata_header     (PyObject *self,PyObject *args)
 
     scandataobject *s = (scandataobject *) self;
 
+    checkBusy(s->file);
+
     if (!PyArg_ParseTuple(args,"s",&searchstr))
       return NULL;
 
@@ -1037,6 +1099,8 @@ scandata_nbmca      (PyObject *self,PyObject *args)
 
     scandataobject *s = (scandataobject *) self;
 
+    checkBusy(s->file);
+
     idx = s->index;
     if (idx == -1 ) {
         onError("empty scan data");
@@ -1066,6 +1130,8 @@ scandata_mca      (PyObject *self,PyObject *args)
 
     scandataobject *s = (scandataobject *) self;
 
+    checkBusy(s->file);
+
     if (!PyArg_ParseTuple(args,"l",&mcano))
             onError("cannot decode arguments for line data");
 
@@ -1102,6 +1168,84 @@ scandata_mca      (PyObject *self,PyObject *args)
      */
 }
 
+static PyObject   *
+scandata_allmca   (PyObject *self,PyObject *args)
+{
+    int       error = 0;
+    long      idx, nmca, nchannels, ret;
+    npy_intp  dimensions[2];
+
+    PyObject       *out = NULL;
+    PyArrayObject  *r_array;
+
+    SpecFile *sf;
+
+    scandataobject *s = (scandataobject *) self;
+
+    checkBusy(s->file);
+
+    if (!PyArg_ParseTuple(args,"|O",&out))
+            onError("cannot decode arguments for mca data");
+
+    idx = s->index;
+
+    if (idx == -1 ) {
+        onError("empty scan data");
+    }
+
+    sf  = (s->file)->sf;
+
+    nmca = SfNoMca(sf,idx,&error);
+    if (nmca == -1)
+        onError("cannot get number of mca for scan");
+
+    if ((out == NULL) || (out == Py_None)) {
+        nchannels = 0;
+        if (nmca > 0) {
+            nchannels = SfMcaChannels(sf,idx,&error);
+            if (nchannels == -1)
+                onError("cannot get mca for scan");
+        }
+        dimensions[0] = nmca;
+        dimensions[1] = nchannels;
+        r_array = (PyArrayObject *)PyArray_ZEROS(2,dimensions,NPY_DOUBLE,0);
+        if (r_array == NULL)
+            return NULL;
+    } else {
+        if (!PyArray_Check(out))
+            onError("output must be an array");
+        r_array = (PyArrayObject *) out;
+        if ((PyArray_NDIM(r_array) != 2) ||
+            (PyArray_TYPE(r_array) != NPY_DOUBLE) ||
+            (!PyArray_ISCARRAY(r_array)))
+            onError("output must be a writeable 2D C contiguous array of doubles");
+        if (PyArray_DIM(r_array, 0) < nmca)
+            nmca = (long) PyArray_DIM(r_array, 0);
+        nchannels = (long) PyArray_DIM(r_array, 1);
+        Py_INCREF(out);
+    }
+
+    /*
+     * All the parsing state is local, the lock is released in order to
+     * read different files at once from different threads. The file
+     * object is marked as busy meanwhile, because any other access to it
+     * could reallocate the scan buffer being parsed.
+     */
+    (s->file)->busy = 1;
+    Py_BEGIN_ALLOW_THREADS
+    ret = SfGetMcaArray(sf,idx,(double *) PyArray_DATA(r_array),
+                        nmca,nchannels,&error);
+    Py_END_ALLOW_THREADS
+    (s->file)->busy = 0;
+
+    if (ret == -1) {
+        Py_DECREF(r_array);
+        onError("cannot get mca for scan");
+    }
+
+    return PyArray_Return(r_array);
+}
+
 static PyObject   *
 scandata_show      (PyObject *self,PyObject *args)
 {
@@ -1111,6 +1255,8 @@ scandata_show      (PyObject *self,PyObject *args)
 
     scandataobject *s = (scandataobject *) self;
 
+    checkBusy(s->file);
+
     idx = s->index;
 
     if (idx == -1 )
@@ -1189,6 +1335,8 @@ specfile_select(PyObject *self, PyObject *args)
     scandataobject *v;
     specfileobject *f = (specfileobject *)self;
 
+    checkBusy(f);
+
    if (!PyArg_ParseTuple(args,"s",&scanstr)) {
        return NULL;
    } else {
@@ -1226,6 +1374,8 @@ specfile_scan(PyObject *self, Py_ssize_t index) {
     specfileobject *f;
     f = (specfileobject *) self;
 
+    checkBusy(f);
+
     if ( index < 0 || index >= f->length) {
          PyErr_SetString(PyExc_IndexError,"scan out of bounds");
          return NULL;
@@ -1269,6 +1419,8 @@ scandata_print(PyObject *self,FILE *fp,int flags) {
     idx = s->index;
     if (idx == -1 ) {
         fprintf(fp,"scandata('empty')");
+    } else if ((s->file)->busy) {
+        fprintf(fp,"scandata('source: %s')", (s->file)->name);
     } else {
         sf  = (s->file)->sf;
         fprintf(fp,"scandata('source: %s,scan: %d.%d')",
@@ -565,6 +565,19 @@ def mca(self,number):
             raise ValueError("Specfile mca numberig starts at 1")
         return self.__data[:,number-1]
 
+    def allmca(self, out=None):
+        """
+        Returns all the mca of the scan as a 2D array of shape
+        (nbmca, nchannels) as the specfile module does. If given, the
+        first out.shape[0] mca are written into the output array.
+        """
+        data = self.__data[:, :self.nbmca()].T
+        if out is None:
+            return numpy.array(data, numpy.float64)
+        n = min(out.shape[0], data.shape[0])
+        out[:n] = data[:n]
+        return out
+
 class BufferedFile(object):
     def __init__(self, filename):
         f = open(filename, 'rb')
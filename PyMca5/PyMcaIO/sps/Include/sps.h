@@ -168,6 +168,16 @@
    shared memory. The write_flag tells the function if you would like
    to update the shared memory contents or just read it.
 
+      SPS_GetDataView (spec version, array name, &rows, &cols, &type, &flag)
+
+   returns a read-only pointer to the data in the shared memory array that
+   stays valid until you give it back with SPS_ReturnDataView, even if the
+   memory is deleted and recreated in the mean time. No data are copied.
+   SPS_DataViewCounter gives the update counter of the array seen through
+   this pointer without any system call, and SPS_DataViewShmId its shared
+   memory identifier. Compare it with SPS_GetShmId to know if the array has
+   been recreated.
+
    If you want to make a copy of the data in the shared memory array to
    your own buffer or the copy your buffer to the shared memory you can use
    the functions:
@@ -350,6 +360,55 @@ void * SPS_GetDataPointer (char *fullname, char* array, int write_flag) ;
 
 int SPS_ReturnDataPointer (void *pointer);
 
+/*
+   Gives you a read-only pointer to the data area of the SPEC array. The
+   process is attached once more to the shared memory for this pointer,
+   therefore it stays valid until it is returned with SPS_ReturnDataView,
+   whatever the other SPS_ functions do. If the other party recreates the
+   shared memory the pointer keeps pointing to the old data.
+   Input: fullname : Spec version
+          array : Name of the array
+	  rows, cols, type, flag : Pointers to return the properties of the
+	                           array as SPS_GetArrayInfo (can be NULL)
+   Returns: NULL error
+            void * to the data area
+*/
+
+void * SPS_GetDataView (char *fullname, char *array, int *rows, int *cols,
+			int *type, int *flag);
+
+/*
+   Detaches the process from the shared memory of a pointer returned by
+   SPS_GetDataView. The pointer is not valid anymore.
+   Input: pointer : Pointer returned by SPS_GetDataView
+   Returns: 0 success
+            1 error
+*/
+
+int SPS_ReturnDataView (void *pointer);
+
+/*
+   Returns the update counter of the array of a pointer returned by
+   SPS_GetDataView reading the shared memory header only. Read it before
+   and after copying the data to know if they were updated in between.
+   Input: pointer : Pointer returned by SPS_GetDataView
+   Returns: update counter value
+           -1 Error
+*/
+
+int SPS_DataViewCounter (void *pointer);
+
+/*
+   Returns the shared memory identifier of the array of a pointer returned
+   by SPS_GetDataView. If it differs from the one given by SPS_GetShmId the
+   array has been recreated and a new pointer is needed.
+   Input: pointer : Pointer returned by SPS_GetDataView
+   Returns: shared memory identifier
+           -1 Error
+*/
+
+int SPS_DataViewShmId (void *pointer);
+
 /*
   Used to read a shared string array in where every line is in the
   format identifier=value
@@ -138,6 +138,7 @@ static  SHM     *attachArray(char *fullname, char *array, int read_only);
 static  SHM     *attachSpec(char *fullname);
 static  SHM     *create_master_shm(char *name);
 static  SHM     *create_shm(char *specversion, char *array, int rows, int cols, int type, int flags);
+static  SHM     *data_to_shm(void *data);
 static  SPS_ARRAY add_private_shm(SHM *shm, char *fullname, char *array, int write_flag);
 static  SPS_ARRAY convert_to_handle(char *spec_version, char *array_name);
 static  char    *GetNextAll(int flag);
@@ -184,6 +185,8 @@ char    *SPS_GetNextSpec(int flag);
 int     SPS_CopyFromShared(char *name, char *array, void *buffer, int my_type, int items_in_buffer);
 int     SPS_CopyToShared(char *name, char *array, void *buffer, int my_type, int items_in_buffer);
 int     SPS_CreateArray(char *spec_version, char *arrayname, int rows, int cols, int type, int flags);
+int     SPS_DataViewCounter(void *data);
+int     SPS_DataViewShmId(void *data);
 int     SPS_FreeDataCopy(char *fullname, char *array);
 int     SPS_GetArrayInfo(char *spec_version, char *array_name, int *rows, int *cols, int *type, int *flag);
 int     SPS_GetFrameSize(char *spec_version, char *array_name);
@@ -191,12 +194,14 @@ int     SPS_IsUpdated(char *fullname, char *array);
 int     SPS_LatestFrame(char *fullname, char *array);
 int     SPS_PutEnvStr(char *spec_version, char *array_name, char *identifier, char *set_value);
 int     SPS_ReturnDataPointer(void *pointer);
+int     SPS_ReturnDataView(void *data);
 int     SPS_Size(int type);
 int     SPS_UpdateDone(char *fullname, char *array);
 s32_t   SPS_GetSpecState(char *version);
 void    *SPS_GetDataCol(char *name, char *array, int my_type, int col, int row, int *act_rows);
 void    *SPS_GetDataCopy(char *fullname, char *array, int my_type, int *rows_ptr, int *cols_ptr);
 void    *SPS_GetDataPointer(char *fullname, char*array, int write_flag);
+void    *SPS_GetDataView(char *fullname, char *array, int *rows, int *cols, int *type, int *flag);
 void    *SPS_GetDataRow(char *name, char *array, int my_type, int row, int col, int *act_cols);
 void    SPS_CleanUpAll(void);
 
@@ -1407,17 +1412,10 @@ void *SPS_GetDataPointer(char *fullname, char *array, int write_flag) {
 int SPS_ReturnDataPointer(void *data) {
   SPS_ARRAY private_shm;
   struct shm_created *created;
-  struct shm_head *sh;
   SHM *shm;
 
-  /* Try old header size first, since it is smaller */
-  sh = (struct shm_head *) (((char *) data) - SHM_OHEAD_SIZE);
-  if (sh->magic != SHM_MAGIC)
-     sh = (struct shm_head *) (((char *) data) - SHM_HEAD_SIZE);
-  if (sh->magic != SHM_MAGIC)
-     return(1);
-
-  shm = (SHM *) sh;
+  if ((shm = data_to_shm(data)) == NULL)
+    return 1;
 
   if ((created = ll_find_pointer(shm)) == NULL)
     return 1;
@@ -1434,6 +1432,128 @@ int SPS_ReturnDataPointer(void *data) {
   return 0;
 }
 
+/*
+   Used internally. Finds the shared memory header of a pointer to the
+   data area of a SPEC array.
+   Input: data : pointer to the data area
+   Returns: NULL if no shared memory header found
+            pointer to SPEC shared memory shm_header
+*/
+
+static SHM *data_to_shm(void *data) {
+  struct shm_head *sh;
+
+  if (data == NULL)
+    return NULL;
+
+  /* Try old header size first, since it is smaller */
+  sh = (struct shm_head *) (((char *) data) - SHM_OHEAD_SIZE);
+  if (sh->magic != SHM_MAGIC)
+     sh = (struct shm_head *) (((char *) data) - SHM_HEAD_SIZE);
+  if (sh->magic != SHM_MAGIC)
+     return NULL;
+
+  return (SHM *) sh;
+}
+
+/*
+   Gives you a read-only pointer to the data area of the SPEC array. The
+   process is attached once more to the shared memory for this pointer,
+   therefore it stays valid until it is returned with SPS_ReturnDataView,
+   whatever the other SPS_ functions do.
+   Input: fullname : Spec version
+          array : Name of the array
+	  rows, cols, type, flag : Pointers to return the properties of the
+	                           array (can be NULL)
+   Returns: NULL error
+            void * to the data area
+*/
+
+void *SPS_GetDataView(char *fullname, char *array, int *rows, int *cols,
+		      int *type, int *flag) {
+  int was_attached;
+  SPS_ARRAY private_shm;
+  SHM *shm;
+
+  if ((private_shm = convert_to_handle(fullname, array)) == NULL)
+    return NULL;
+
+  was_attached = private_shm->attached;
+
+  if (ReconnectToArray(private_shm, 0))
+    return NULL;
+
+  /* not c_shmat: arrays created by this process need their own attachment
+     too, otherwise the view would be lost if they are recreated */
+  shm = (SHM *) shmat(private_shm->id, NULL, SHM_RDONLY);
+
+  if (was_attached == 0 && private_shm->stay_attached == 0)
+    DeconnectArray(private_shm);
+
+  if (shm == (SHM *) -1 || shm == NULL)
+    return NULL;
+
+  if (rows) *rows = shm->head.head.rows;
+  if (cols) *cols = shm->head.head.cols;
+  if (type) *type = shm->head.head.type;
+  if (flag) *flag = shm->head.head.flags;
+
+  if (shm->head.head.version < 4)
+    return &(((struct shm_oheader *)shm)->data);
+  return &(shm->data);
+}
+
+/*
+   Detaches from the shared memory of a pointer given by SPS_GetDataView.
+   Input: data : pointer returned by SPS_GetDataView
+   Returns: 0 success
+            1 error
+*/
+
+int SPS_ReturnDataView(void *data) {
+  SHM *shm;
+
+  if ((shm = data_to_shm(data)) == NULL)
+    return 1;
+
+  shmdt((void *) shm);
+  return 0;
+}
+
+/*
+   Returns the update counter of the array of a pointer given by
+   SPS_GetDataView. Only the shared memory header is read.
+   Input: data : pointer returned by SPS_GetDataView
+   Returns: update counter value
+           -1 Error
+*/
+
+int SPS_DataViewCounter(void *data) {
+  SHM *shm;
+
+  if ((shm = data_to_shm(data)) == NULL)
+    return -1;
+
+  return shm->head.head.utime;
+}
+
+/*
+   Returns the shared memory identifier of the array of a pointer given by
+   SPS_GetDataView.
+   Input: data : pointer returned by SPS_GetDataView
+   Returns: shared memory identifier
+           -1 Error
+*/
+
+int SPS_DataViewShmId(void *data) {
+  SHM *shm;
+
+  if ((shm = data_to_shm(data)) == NULL)
+    return -1;
+
+  return shm->head.head.shmid;
+}
+
 /*
    Copies the data from the shared memory SPEC array to the user's buffer.
    The type of the data in the shared array and the type the user wants
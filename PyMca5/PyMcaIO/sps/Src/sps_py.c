@@ -461,6 +461,126 @@ static PyObject *sps_getshmid(PyObject *self, PyObject *args)
   return Py_BuildValue("i", shmid);
 }
 
+/*
+  The arrays returned by getdataview keep their shared memory attached
+  through a capsule set as their base object.
+*/
+#define SPS_DATAVIEW "sps.dataview"
+
+static void sps_releasedataview(PyObject *capsule)
+{
+  void *data;
+
+  data = PyCapsule_GetPointer(capsule, SPS_DATAVIEW);
+  if (data != NULL)
+    SPS_ReturnDataView(data);
+}
+
+static void *sps_dataviewpointer(PyObject *obj)
+{
+  /* views of the returned arrays have it as base */
+  while ((obj != NULL) && PyArray_Check(obj))
+    obj = PyArray_BASE((PyArrayObject *) obj);
+
+  if ((obj == NULL) || !PyCapsule_IsValid(obj, SPS_DATAVIEW))
+    return NULL;
+
+  return PyCapsule_GetPointer(obj, SPS_DATAVIEW);
+}
+
+static PyObject *sps_getdataview(PyObject *self, PyObject *args)
+{
+  char *spec_version, *array_name;
+  int rows, cols, type, flag;
+  npy_intp dims[2];
+  int ptype, stype;
+  PyArrayObject *arrobj;
+  PyObject *capsule;
+  void *data;
+
+  if (!PyArg_ParseTuple(args, "ss", &spec_version, &array_name)) {
+    return NULL;
+  }
+
+  if ((data = SPS_GetDataView(spec_version, array_name,
+                              &rows, &cols, &type, &flag)) == NULL) {
+    struct module_state *st = GETSTATE(self);
+    PyErr_SetString(st->SPSError, "Error getting data view");
+    return NULL;
+  }
+
+  dims[0]=rows;
+  dims[1]=cols;
+  ptype = sps_type2py(type);
+  stype = sps_py2type(ptype);
+
+  if (type != stype) {
+    struct module_state *st = GETSTATE(self);
+    SPS_ReturnDataView(data);
+    PyErr_SetString(st->SPSError, "Type of data in shared memory not supported");
+    return NULL;
+  }
+
+  if ((capsule = PyCapsule_New(data, SPS_DATAVIEW, sps_releasedataview))
+      == NULL) {
+    SPS_ReturnDataView(data);
+    return NULL;
+  }
+
+  if ((arrobj = (PyArrayObject*) PyArray_SimpleNewFromData(2, dims, ptype, data))
+      == NULL) {
+    struct module_state *st = GETSTATE(self);
+    Py_DECREF(capsule);
+    PyErr_SetString(st->SPSError, "Could not create mathematical array");
+    return NULL;
+  }
+
+  PyArray_CLEARFLAGS(arrobj, NPY_ARRAY_WRITEABLE);
+  /* steals the reference to the capsule */
+  if (PyArray_SetBaseObject(arrobj, capsule) < 0) {
+    Py_DECREF(arrobj);
+    return NULL;
+  }
+
+  return (PyObject*) arrobj;
+}
+
+static PyObject *sps_viewcounter(PyObject *self, PyObject *args)
+{
+  PyObject *in_arr;
+  void *data;
+
+  if (!PyArg_ParseTuple(args, "O", &in_arr)) {
+    return NULL;
+  }
+
+  if ((data = sps_dataviewpointer(in_arr)) == NULL) {
+    struct module_state *st = GETSTATE(self);
+    PyErr_SetString(st->SPSError, "Input must be an array returned by getdataview");
+    return NULL;
+  }
+
+  return PyInt_FromLong(SPS_DataViewCounter(data));
+}
+
+static PyObject *sps_viewshmid(PyObject *self, PyObject *args)
+{
+  PyObject *in_arr;
+  void *data;
+
+  if (!PyArg_ParseTuple(args, "O", &in_arr)) {
+    return NULL;
+  }
+
+  if ((data = sps_dataviewpointer(in_arr)) == NULL) {
+    struct module_state *st = GETSTATE(self);
+    PyErr_SetString(st->SPSError, "Input must be an array returned by getdataview");
+    return NULL;
+  }
+
+  return PyInt_FromLong(SPS_DataViewShmId(data));
+}
+
 static PyObject *sps_getdata(PyObject *self, PyObject *args)
 {
   char *spec_version, *array_name;
@@ -742,6 +862,9 @@ static PyMethodDef SPSMethods[] = {
   { "getkeylist",    sps_getkeylist, METH_VARARGS},
   { "getshmid",      sps_getshmid,   METH_VARARGS},
   { "getdata",       sps_getdata,    METH_VARARGS},
+  { "getdataview",   sps_getdataview, METH_VARARGS},
+  { "viewcounter",   sps_viewcounter, METH_VARARGS},
+  { "viewshmid",     sps_viewshmid,  METH_VARARGS},
   { "getdatarow",    sps_getdatarow, METH_VARARGS},
   { "getdatacol",    sps_getdatacol, METH_VARARGS},
   { "getarrayinfo",  sps_getarrayinfo, METH_VARARGS},
@@ -188,6 +188,44 @@ def getdata(spec,shm):
     spslock.release()
     return result
 
+def getdataview(spec, shm):
+    # read-only array sharing the memory of the SPEC array
+    # or None if not supported
+    result = None
+
+    if hasattr(sps, "getdataview"):
+        spslock.acquire()
+        try:
+            result = sps.getdataview(spec, shm)
+        except:
+            pass
+        spslock.release()
+    return result
+
+def viewcounter(view):
+    # only the header of the shared memory is read
+    try:
+        return sps.viewcounter(view)
+    except:
+        return -1
+
+def viewshmid(view):
+    try:
+        return sps.viewshmid(view)
+    except:
+        return -1
+
+def getshmid(spec, shm):
+    result = -1
+
+    spslock.acquire()
+    try:
+        result = sps.getshmid(spec, shm)
+    except:
+        pass
+    spslock.release()
+    return result
+
 def getdatacol(spec,shm,idx):
 
     result = []
@@ -36,6 +36,9 @@
 snip1d = SpecfitFuns.snip1d
 snip2d = SpecfitFuns.snip2d
 
+# number of spectra handled at once by the stack functions
+SPECTRA_BLOCK_SIZE = 1000
+
 
 def getSpectrumBackground(spectrum, width, roi_min=None, roi_max=None, smoothing=1):
     if roi_min is None:
@@ -48,11 +51,40 @@ def getSpectrumBackground(spectrum, width, roi_min=None, roi_max=None, smoothing
 
 getSnip1DBackground = getSpectrumBackground
 
+def getMultipleSpectraBackground(spectra, width, anchors=None, smoothing=0,
+                                 sg_width=None):
+    """
+    Calculate in one go the SNIP background of a set of spectra.
+
+    :param spectra: 2D array of shape (nSpectra, nChannels)
+    :param width: SNIP width
+    :param anchors: list of channels the background has to pass through
+    :param smoothing: number of smoothing iterations prior to SNIP
+    :param sg_width: if given, width of a Savitzky-Golay filter applied to
+                     the spectra prior to the background calculation
+    :return: 2D array of shape (nSpectra, nChannels) with the backgrounds
+    """
+    if sg_width is not None:
+        background = SpecfitFuns.SavitskyGolay(spectra, sg_width)
+    else:
+        background = numpy.array(spectra, dtype=numpy.float64)
+    if len(background.shape) == 1:
+        background.shape = 1, -1
+    nChannels = background.shape[-1]
+    lastAnchor = 0
+    if anchors is not None:
+        for anchor in anchors:
+            if (anchor > lastAnchor) and (anchor < nChannels):
+                background[:, lastAnchor:anchor] = \
+                    snip1d(background[:, lastAnchor:anchor], width, smoothing)
+                lastAnchor = anchor
+    if lastAnchor < nChannels:
+        background[:, lastAnchor:] = \
+                    snip1d(background[:, lastAnchor:], width, smoothing)
+    background.shape = numpy.asarray(spectra).shape
+    return background
+
 def subtractSnip1DBackgroundFromStack(stack, width, roi_min=None, roi_max=None,  smoothing=1):
-    if roi_min is None:
-        roi_min = 0
-    if roi_max is None:
-        roi_max = len(spectrum)
     mcaIndex = -1
     if hasattr(stack, "info") and hasattr(stack, "data"):
         data = stack.data
@@ -61,6 +93,10 @@ def subtractSnip1DBackgroundFromStack(stack, width, roi_min=None, roi_max=None,
         data = stack
     if not isinstance(data, numpy.ndarray):
         raise TypeError("This Plugin only supports numpy arrays")
+    if roi_min is None:
+        roi_min = 0
+    if roi_max is None:
+        roi_max = data.shape[mcaIndex]
     oldShape = data.shape
     if mcaIndex in [-1, len(data.shape)-1]:
         data.shape = -1, oldShape[-1]
@@ -68,16 +104,18 @@ def subtractSnip1DBackgroundFromStack(stack, width, roi_min=None, roi_max=None,
             data[:, 0:roi_min] = 0
         if roi_max < oldShape[-1]:
             data[:, roi_max:] = 0
-        for i in range(data.shape[0]):
-            data[i,roi_min:roi_max] -= snip1d(data[i,roi_min:roi_max],
-                                              width, smoothing)
+        for i in range(0, data.shape[0], SPECTRA_BLOCK_SIZE):
+            block = data[i:i + SPECTRA_BLOCK_SIZE, roi_min:roi_max]
+            block -= getMultipleSpectraBackground(block, width,
+                                                  smoothing=smoothing)
         data.shape = oldShape
 
     elif mcaIndex == 0:
         data.shape = oldShape[0], -1
-        for i in range(data.shape[-1]):
-            data[roi_min:roi_max, i] -= snip1d(data[roi_min:roi_max, i],
-                                               width, smoothing)
+        for i in range(0, data.shape[-1], SPECTRA_BLOCK_SIZE):
+            block = data[roi_min:roi_max, i:i + SPECTRA_BLOCK_SIZE]
+            block -= getMultipleSpectraBackground(block.T, width,
+                                                  smoothing=smoothing).T
         data.shape = oldShape
     else:
         raise ValueError("Invalid 1D index %d" % mcaIndex)
@@ -47,7 +47,8 @@
 
 def LeastSquaresFit(model, parameters0, data=None, maxiter = 100,constrains=None,
                         weightflag = 0,model_deriv=None,deltachi=None,fulloutput=0,
-                        xdata=None,ydata=None,sigmadata=None,linear=None):
+                        xdata=None,ydata=None,sigmadata=None,linear=None,
+                        model_jacobian=None):
     """
     Typical use:
 
@@ -96,6 +97,13 @@ def LeastSquaresFit(model, parameters0, data=None, maxiter = 100,constrains=None
                       of the fitting parameters, index is the fitting parameter index of which the the derivative has
                       to be provided in the supplied array of x points.
 
+        model_jacobian - function providing the fitting function and its derivatives respect to several fitted
+                      parameters from a single evaluation. It will be called as model_jacobian(parameters, indices, x)
+                      where parameters are the current values of all the fitting parameters (ignored ones set to 0)
+                      and indices are the fitting parameter indices of which the derivatives have to be provided.
+                      It has to return the function values and an array of shape (len(indices), len(x)) with the
+                      derivatives. If given, model_deriv is not used.
+
         linear - Flag to indicate a linear fit instead of a non-linear. Default is non-linear fit (=false)
 
         maxiter - Maximum number of iterations (default is 100)
@@ -129,7 +137,8 @@ def LeastSquaresFit(model, parameters0, data=None, maxiter = 100,constrains=None
                                         fulloutput=fulloutput,
                                         xdata=xdata,
                                         ydata=ydata,
-                                        sigmadata=sigmadata)
+                                        sigmadata=sigmadata,
+                                        model_jacobian=model_jacobian)
     elif len(constrains) == 0:
         try:
             model(parameters,x)
@@ -146,7 +155,8 @@ def LeastSquaresFit(model, parameters0, data=None, maxiter = 100,constrains=None
                                     fulloutput=fulloutput,
                                     xdata=xdata,
                                     ydata=ydata,
-                                    sigmadata=sigmadata)
+                                    sigmadata=sigmadata,
+                                    model_jacobian=model_jacobian)
         except TypeError:
             print("You should reconsider how to write your function")
             raise TypeError("You should reconsider how to write your function")
@@ -158,13 +168,15 @@ def LeastSquaresFit(model, parameters0, data=None, maxiter = 100,constrains=None
                                 fulloutput=fulloutput,
                                 xdata=xdata,
                                 ydata=ydata,
-                                sigmadata=sigmadata)
+                                sigmadata=sigmadata,
+                                model_jacobian=model_jacobian)
 
 def LinearLeastSquaresFit(model0,parameters0,data0,maxiter,
                                 constrains0,weightflag,model_deriv=None,deltachi=0.01,fulloutput=0,
                                     xdata=None,
                                     ydata=None,
-                                    sigmadata=None):
+                                    sigmadata=None,
+                                    model_jacobian=None):
     #get the codes:
     # 0 = Free       1 = Positive     2 = Quoted
     # 3 = Fixed      4 = Factor       5 = Delta
@@ -255,7 +267,8 @@ def LinearLeastSquaresFit(model0,parameters0,data0,maxiter,
         n_free, free_index, noigno, fitparam, derivfactor  =ChisqAlphaBeta(
                                                  model,newpar,
                                                  x,y,weight,constrains,model_deriv=model_deriv,
-                                                 linear=1)
+                                                 linear=1,
+                                                 model_jacobian=model_jacobian)
         nr, nc = alpha0.shape
         fittedpar = numpy.dot(beta, inv(alpha0))
         #check respect of constraints (only positive is handled -force parameter to 0 and fix it-)
@@ -286,7 +299,8 @@ def RestreinedLeastSquaresFit(model0,parameters0,data0,maxiter,
                 constrains0,weightflag,model_deriv=None,deltachi=0.01,fulloutput=0,
                                     xdata=None,
                                     ydata=None,
-                                    sigmadata=None):
+                                    sigmadata=None,
+                                    model_jacobian=None):
     #get the codes:
     # 0 = Free       1 = Positive     2 = Quoted
     # 3 = Fixed      4 = Factor       5 = Delta
@@ -387,7 +401,8 @@ def RestreinedLeastSquaresFit(model0,parameters0,data0,maxiter,
         chisq0, alpha0, beta,\
         n_free, free_index, noigno, fitparam, derivfactor  =ChisqAlphaBeta(
                                                  model,fittedpar,
-                                                 x,y,weight,constrains,model_deriv=model_deriv)
+                                                 x,y,weight,constrains,model_deriv=model_deriv,
+                                                 model_jacobian=model_jacobian)
         nr, nc = alpha0.shape
         flag = 0
         lastdeltachi = chisq0
@@ -463,7 +478,8 @@ def RestreinedLeastSquaresFit(model0,parameters0,data0,maxiter,
     else:
         return fittedpar.tolist(), chisq/(len(yfit)-len(sigma0)), sigmapar.tolist(),niter,lastdeltachi
 
-def ChisqAlphaBeta(model0, parameters, x,y,weight, constrains,model_deriv=None,linear=None):
+def ChisqAlphaBeta(model0, parameters, x,y,weight, constrains,model_deriv=None,linear=None,
+                   model_jacobian=None):
     if linear is None:linear=0
     model = model0
     #nr0, nc = data.shape
@@ -525,7 +541,16 @@ def ChisqAlphaBeta(model0, parameters, x,y,weight, constrains,model_deriv=None,l
     newpar = numpy.take(newpar,noigno)
     if n_free == 0:
         raise ValueError("No free parameters to fit")
+    yfit = None
+    if model_jacobian is not None:
+        # function and derivatives from a single evaluation
+        newpar = numpy.array(getparameters(pwork.tolist(),constrains))
+        yfit, deriv = model_jacobian(newpar, free_index, x)
+        deriv = numpy.array(deriv, dtype=numpy.float).reshape(n_free, nr)
+        deriv *= numpy.array(derivfactor, dtype=numpy.float).reshape(-1, 1)
     for i in range(n_free):
+        if model_jacobian is not None:
+            break
         if model_deriv is None:
             #pwork = parameters.__copy__()
             pwork [free_index[i]] = fitparam [i] + delta [i]
@@ -554,29 +579,18 @@ def ChisqAlphaBeta(model0, parameters, x,y,weight, constrains,model_deriv=None,l
     if linear:
         pseudobetahelp = weight * y
     else:
-        newpar = getparameters(pwork.tolist(),constrains)
-        newpar = numpy.take(newpar,noigno)
-        yfit = model(newpar, x)
+        if yfit is None:
+            newpar = getparameters(pwork.tolist(),constrains)
+            newpar = numpy.take(newpar,noigno)
+            yfit = model(newpar, x)
         deltay = y - yfit
         help0 = weight * deltay
-    for i in range(n_free):
-        derivi = numpy.resize(deriv [i,:], (1,nr))
-        if linear:
-            if i==0:
-                beta = numpy.resize(numpy.sum((pseudobetahelp * derivi),1),(1,1))
-            else:
-                beta = numpy.concatenate((beta, numpy.resize(numpy.sum((pseudobetahelp * derivi),1),(1,1))), 1)
-        else:
-            help1 = numpy.resize(numpy.sum((help0 * derivi),1),(1,1))
-            if i == 0:
-                beta = help1
-            else:
-                beta = numpy.concatenate((beta, help1), 1)
-        help1 = numpy.inner(deriv,weight*derivi)
-        if i == 0:
-            alpha = help1
-        else:
-            alpha = numpy.concatenate((alpha, help1),1)
+    # the curvature matrix and the gradient as matrix products
+    alpha = numpy.dot(deriv * weight, deriv.T)
+    if linear:
+        beta = numpy.dot(deriv, pseudobetahelp).reshape(1, n_free)
+    else:
+        beta = numpy.dot(deriv, help0).reshape(1, n_free)
     if linear:
         #not used
         chisq = 0.0
@@ -234,8 +234,6 @@ def importFunctions(self, modname):
         except:
             widget=None
 
-        basename = os.path.basename(newfun.__file__)
-
         for i in range(len(theory)):
             ddict = {}
             functionName = theory[i]
@@ -246,7 +244,8 @@ def importFunctions(self, modname):
             ddict['derivative'] = None
             ddict['configure']  = None
             ddict['widget']     = None
-            ddict['file']       = newfun.__file__
+            # modules built at run time have no file
+            ddict['file']       = getattr(newfun, "__file__", None)
             ddict['configuration'] = {}
             if estimate is not None:
                 ddict['estimate'] = estimate[i]
@@ -32,14 +32,102 @@
 __copyright__ = "European Synchrotron Radiation Facility, Grenoble, France"
 import sys
 import os
+import multiprocessing
+import posixpath
 import numpy
 from PyMca5.PyMcaIO import ConfigDict
 from . import SimpleFitModule
 from PyMca5.PyMcaIO import ArraySave
 from PyMca5 import PyMcaDirs
+from PyMca5.PyMcaMisc import ProcessPool
+try:
+    import h5py
+    HDF5 = True
+except ImportError:
+    HDF5 = False
 
 DEBUG = 0
 
+# number of neighbouring pixels fitted by a worker process in one task
+PIXELS_PER_TASK = 200
+
+# number of fitted pixels kept in memory before writing them to the
+# HDF5 output
+HDF5_FLUSH_SIZE = 5000
+
+
+def _getWorkerConfiguration(configuration):
+    """
+    Return the configuration to be sent to the worker processes or None
+    if a fit function cannot be imported from its file by the workers.
+    """
+    functions = {}
+    for fName in configuration['functions']:
+        ffile = configuration['functions'][fName].get('file', None)
+        if ffile is None:
+            return None
+        functions[fName] = {}
+        functions[fName]['configuration'] = \
+                        configuration['functions'][fName]['configuration']
+        functions[fName]['file'] = ffile
+    ddict = {}
+    ddict.update(configuration)
+    ddict['functions'] = functions
+    return ddict
+
+
+def _getWorkerFit():
+    # The fit is configured by the first task of each worker. A failure to
+    # import the functions is then raised by the task result in the main
+    # process.
+    context = ProcessPool.WORKER_CONTEXT
+    fit = context.get('fit', None)
+    if fit is None:
+        fit = SimpleFitModule.SimpleFit()
+        fit.setConfiguration(context['configuration'], try_import=True)
+        context['fit'] = fit
+    return fit
+
+
+def _setStartingValues(fit, first, previous, alwaysEstimate, warmStart):
+    """
+    Estimate the fit parameters or start from the values fitted for the
+    previous pixel when warm starting.
+    """
+    if warmStart and (previous is not None):
+        for i, param in enumerate(fit.paramlist):
+            param['estimation'] = previous[i]
+    elif first or alwaysEstimate or warmStart:
+        fit.estimate()
+
+
+def _fitPixels(task):
+    """
+    Fit a list of neighbouring pixels in a worker process.
+
+    Return a list of (fit result, error message) tuples.
+    """
+    spectra, alwaysEstimate, warmStart = task
+    fit = _getWorkerFit()
+    output = []
+    first = True
+    previous = None
+    for x, y, sigma, xmin, xmax in spectra:
+        try:
+            fit.setData(x, y, sigma=sigma, xmin=xmin, xmax=xmax)
+            _setStartingValues(fit, first, previous,
+                               alwaysEstimate, warmStart)
+            first = False
+            previous = None
+            values, chisq, sigmas, niter, lastdeltachi = fit.startFit()
+            previous = values
+            output.append((fit.getResult(configuration=False)['result'],
+                           None))
+        except Exception:
+            output.append((None, "%s" % sys.exc_info()[1]))
+    return output
+
+
 class StackSimpleFit(object):
     def __init__(self, fit=None):
         if fit is None:
@@ -56,6 +144,10 @@ def __init__(self, fit=None):
         # optimization variables
         self.mask = None
         self.__ALWAYS_ESTIMATE = True
+        self.processes = None
+        self.warmStart = False
+        self.hdf5Output = False
+        self._h5 = None
 
     def setProgressCallback(self, method):
         """
@@ -87,6 +179,33 @@ def setData(self, stack_x, stack_y, sigma=None, xmin=None, xmax=None):
         self.xMin = xmin
         self.xMax = xmax
 
+    def setProcesses(self, processes=None):
+        """
+        If processes is greater than one, the pixels are fitted by a pool of
+        processes. The value 0 means the number of CPUs.
+        """
+        if processes == 0:
+            processes = multiprocessing.cpu_count()
+        self.processes = processes
+
+    def setWarmStart(self, flag=True):
+        """
+        If set, each fit starts from the parameters fitted for the previous
+        pixel instead of estimating them.
+        """
+        self.warmStart = flag
+
+    def setHDF5Output(self, flag=True):
+        """
+        If set, the fixed length output images are written to the
+        IMAGES/<output>.h5 file while fitting instead of being kept in
+        memory and saved as EDF and CSV files. An existing file is not
+        overwritten.
+        """
+        if flag and not HDF5:
+            raise ImportError("h5py is needed for the HDF5 output")
+        self.hdf5Output = flag
+
     def setDataIndex(self, data_index=None):
         self.data_index = data_index
 
@@ -164,28 +283,50 @@ def processStack(self, mask=None):
         if "Estimate always" not in [functionPolicy, backgroundPolicy]:
             self.__ALWAYS_ESTIMATE = False
 
+        if self.fixedLenghtOutput and self.hdf5Output:
+            fileName = self.getOutputFileNames()['h5']
+            if os.path.exists(fileName):
+                raise IOError("HDF5 output file %s already exists" % fileName)
+
         # initialize control variables
         self._parameters = None
+        self._previousValues = None
+        self._flushedRows = 0
         self._row = 0
         self._column = -1
         self._progress = 0
         self._status = "Fitting"
-        for i in range(nPixels):
-            self._progress = (i * 100.)/ nPixels
-            if (self._column+1) == self._nColumns:
-                self._column = 0
-                self._row   += 1
+        pool = None
+        if (self.processes is not None) and (self.processes > 1):
+            configuration = _getWorkerConfiguration(self.fit.getConfiguration())
+            if configuration is None:
+                print("WARNING: Fit functions not read from a file cannot be used by other processes")
             else:
-                self._column += 1
-            try:
-                if self.mask[self._row, self._column]:
-                    self.processStackData(i)
-            except:
-                print("Error %s processing index = %d, row = %d column = %d" %\
-                        (sys.exc_info()[1], i, self._row, self._column))
-                if DEBUG:
-                    raise
-        self.onProcessStackFinished()
+                pool = ProcessPool.getPool(self.processes,
+                                        {'configuration': configuration})
+        try:
+            if pool is not None:
+                self._processStackInPool(nPixels, pool)
+            else:
+                for i in range(nPixels):
+                    self._progress = (i * 100.)/ nPixels
+                    if (self._column+1) == self._nColumns:
+                        self._column = 0
+                        self._row   += 1
+                    else:
+                        self._column += 1
+                    try:
+                        if self.mask[self._row, self._column]:
+                            self.processStackData(i)
+                    except:
+                        self._previousValues = None
+                        print("Error %s processing index = %d, row = %d column = %d" %\
+                                (sys.exc_info()[1], i, self._row, self._column))
+                        if DEBUG:
+                            raise
+            self.onProcessStackFinished()
+        finally:
+            self._closeHDF5Output()
         self._status = "Ready"
         if self.progressCallback is not None:
             self.progressCallback(nPixels, nPixels)
@@ -194,18 +335,63 @@ def processStackData(self, i):
         self.aboutToGetStackData(i)
         x, y, sigma, xmin, xmax = self.getFitInputValues(i)
         self.fit.setData(x, y, sigma=sigma, xmin=xmin, xmax=xmax)
-        if self._parameters is None:
-            if DEBUG:
-                print("First estimation")
-            self.fit.estimate()
-        elif self.__ALWAYS_ESTIMATE:
-            if DEBUG:
-                print("Estimation due to settings")
-            self.fit.estimate()
+        previous = self._previousValues
+        self._previousValues = None
+        _setStartingValues(self.fit, self._parameters is None, previous,
+                           self.__ALWAYS_ESTIMATE, self.warmStart)
         self.estimateFinished()
         values, chisq, sigma, niter, lastdeltachi = self.fit.startFit()
+        self._previousValues = values
         self.fitFinished()
 
+    def _processStackInPool(self, nPixels, pool):
+        tasks = ProcessPool.OrderedTasks(pool, self._storeBlock)
+        try:
+            block = []
+            for i in range(nPixels):
+                self._row = i // self._nColumns
+                self._column = i % self._nColumns
+                if not self.mask[self._row, self._column]:
+                    continue
+                try:
+                    spectrum = self.getFitInputValues(i)
+                except:
+                    print("Error %s processing index = %d, row = %d column = %d" %\
+                            (sys.exc_info()[1], i, self._row, self._column))
+                    if DEBUG:
+                        raise
+                    continue
+                block.append(((i, self._row, self._column), spectrum))
+                if len(block) == PIXELS_PER_TASK:
+                    # limit the number of spectra in memory
+                    self._submitBlock(tasks, block, 4 * self.processes)
+                    block = []
+            if len(block):
+                self._submitBlock(tasks, block, 0)
+            tasks.handle(0)
+        finally:
+            tasks.terminate()
+
+    def _submitBlock(self, tasks, block, maxPending):
+        task = ([spectrum for position, spectrum in block],
+                self.__ALWAYS_ESTIMATE, self.warmStart)
+        tasks.submit(_fitPixels, task,
+                     info=[position for position, spectrum in block],
+                     maxPending=maxPending)
+
+    def _storeBlock(self, positions, output):
+        # store the results of a block of pixels in the order they were read
+        nPixels = self._nRows * self._nColumns
+        for position, (result, error) in zip(positions, output):
+            i, self._row, self._column = position
+            self._progress = (i * 100.)/ nPixels
+            self.aboutToGetStackData(i)
+            if error is not None:
+                print("Error %s processing index = %d, row = %d column = %d" %\
+                        (error, i, self._row, self._column))
+                continue
+            self._storeFitOutput({'result': result})
+
     def getFitInputValues(self, index):
         """
         Returns the fit parameters x, y, sigma, xmin, xmax
@@ -317,7 +503,9 @@ def fitFinished(self):
             print("fit finished")
 
         #get parameter results
-        fitOutput = self.fit.getResult(configuration=False)
+        self._storeFitOutput(self.fit.getResult(configuration=False))
+
+    def _storeFitOutput(self, fitOutput):
         result = fitOutput['result']
         row= self._row
         column = self._column
@@ -335,21 +523,32 @@ def fitFinished(self):
                 raise IOError(msg)
             self.imgDir = imgdir
             self._parameters  = []
-            self._images      = {}
-            self._sigmas      = {}
             for parameter in result['parameters']:
                 self._parameters.append(parameter)
-                self._images[parameter] = numpy.zeros((self._nRows,
+            # with the HDF5 output only a block of rows is kept in memory
+            self._bufferRows = self._nRows
+            if self.hdf5Output:
+                self._bufferRows = min(self._nRows,
+                            max(1, HDF5_FLUSH_SIZE // self._nColumns))
+            self._images      = {}
+            self._sigmas      = {}
+            for parameter in self._parameters:
+                self._images[parameter] = numpy.zeros((self._bufferRows,
                                                        self._nColumns),
                                                        numpy.float32)
-                self._sigmas[parameter] = numpy.zeros((self._nRows,
+                self._sigmas[parameter] = numpy.zeros((self._bufferRows,
                                                        self._nColumns),
                                                        numpy.float32)
-            self._images['chisq'] = numpy.zeros((self._nRows,
+            self._images['chisq'] = numpy.zeros((self._bufferRows,
                                                        self._nColumns),
                                                        numpy.float32)
+            if self.hdf5Output:
+                self._openHDF5Output()
 
         if self.fixedLenghtOutput:
+            if row >= (self._flushedRows + self._bufferRows):
+                self._flushHDF5Output(row)
+            row -= self._flushedRows
             i = 0
             for parameter in self._parameters:
                 self._images[parameter] [row, column] =\
@@ -388,6 +587,53 @@ def _appendOneResultToSpecfile(self, filename, result=None):
         sf.write(text)
         sf.close()
 
+    def _openHDF5Output(self):
+        # the fitted rows are written into preallocated datasets
+        self._closeHDF5Output()
+        fileName = self.getOutputFileNames()['h5']
+        # never overwrite previous results
+        h5 = h5py.File(fileName, "w-")
+        entry = "stack_fit"
+        shape = (self._nRows, self._nColumns)
+        self._datasets = {}
+        for parameter in self._parameters:
+            path = posixpath.join(entry, "parameters", parameter)
+            self._datasets[parameter] = (h5.require_dataset(path,
+                                                shape=shape,
+                                                dtype=numpy.float32),
+                                         self._images[parameter])
+            path = posixpath.join(entry, "uncertainties", parameter)
+            self._datasets['s(%s)' % parameter] = (h5.require_dataset(path,
+                                                shape=shape,
+                                                dtype=numpy.float32),
+                                         self._sigmas[parameter])
+        path = posixpath.join(entry, "chisq")
+        self._datasets['chisq'] = (h5.require_dataset(path,
+                                                      shape=shape,
+                                                      dtype=numpy.float32),
+                                   self._images['chisq'])
+        self._h5 = h5
+
+    def _flushHDF5Output(self, row):
+        # write the buffered rows and buffer the rows from row onwards
+        if self._h5 is None:
+            return
+        nRows = min(row - self._flushedRows, self._bufferRows)
+        if nRows > 0:
+            for dataset, image in self._datasets.values():
+                dataset[self._flushedRows:self._flushedRows + nRows] = \
+                                    image[:nRows]
+                image[:] = 0
+            self._h5.flush()
+        self._flushedRows = row
+
+    def _closeHDF5Output(self):
+        if self._h5 is not None:
+            h5 = self._h5
+            self._h5 = None
+            self._datasets = {}
+            h5.close()
+
     def getOutputFileNames(self):
         specfile = os.path.join(self.outputDir,
                                 self.outputFile+".spec")
@@ -395,18 +641,24 @@ def getOutputFileNames(self):
         filename = os.path.join(imgDir, self.outputFile)
         csv = filename + ".csv"
         edf = filename + ".edf"
+        h5 = filename + ".h5"
         ddict = {}
         ddict['specfile'] = specfile
         ddict['csv'] = csv
         ddict['edf'] = edf
+        ddict['h5'] = h5
         return ddict
 
     def onProcessStackFinished(self):
         if DEBUG:
             print("Stack proccessed")
         self._status = "Stack Fitting finished"
-        if self.fixedLenghtOutput:
+        if self.fixedLenghtOutput and (self._parameters is not None):
             self._status = "Writing output files"
+            if self._h5 is not None:
+                self._flushHDF5Output(self._nRows)
+                self._closeHDF5Output()
+                return
             nParameters = len(self._parameters)
             datalist = [None] * (2*len(self._sigmas.keys())+1)
             labels = []
@@ -3138,6 +3138,201 @@ printf("LT_Area=%f,LT_Slope=%f\n",phyper[i].lt_area_r,phyper[i].lt_slope_r);
 }
 
 
+static PyObject *
+SpecfitFuns_fastahypermetgroups(PyObject *self, PyObject *args)
+{
+    /* Evaluate the hypermet peaks of several groups in one call.
+       param is the usual (npeaks, 8) table of fastahypermet and offsets
+       the (ngroups + 1) indices of the first peak of each group followed by
+       the total number of peaks. It returns a (ngroups, len(x)) array with
+       the sum of the peaks of each group. */
+    double erfc(double);
+    double fastexp(double);
+    PyObject *input1, *input2, *input3;
+    int debug=0;
+    int tails=15;
+    int expected_pars = 8;
+    int g_term_flag, st_term_flag, lt_term_flag, step_term_flag;
+    PyArrayObject   *param, *x, *offsets;
+    PyArrayObject   *ret;
+    npy_intp dim_ret[2];
+    npy_intp npars, npeaks, nx, ngroups;
+    npy_intp i, j, group;
+    int *poffsets;
+    double  dhelp, log2, sqrt2PI, tosigma;
+    double x1, x2, x3, x4, x5, x6, x7, x8;
+    double z0, z1, z2, gnorm, st_help, lt_help;
+    double  *px, *pret, *prow;
+    typedef struct {
+        double  area;
+        double  position;
+        double  fwhm;
+        double  st_area_r;
+        double  st_slope_r;
+        double  lt_area_r;
+        double  lt_slope_r;
+        double  step_height_r;
+    } hypermet;
+    hypermet *phyper;
+
+    /** statements **/
+    if (!PyArg_ParseTuple(args, "OOO|ii", &input1, &input2, &input3,
+                          &tails, &debug))
+        return NULL;
+
+    param = (PyArrayObject *)
+             PyArray_ContiguousFromObject(input1, NPY_DOUBLE, 0, 0);
+    if (param == NULL)
+        return NULL;
+    x = (PyArrayObject *)
+             PyArray_ContiguousFromObject(input2, NPY_DOUBLE, 0, 0);
+    if (x == NULL){
+        Py_DECREF(param);
+        return NULL;
+    }
+    offsets = (PyArrayObject *)
+             PyArray_ContiguousFromObject(input3, NPY_INT, 1, 1);
+    if (offsets == NULL){
+        Py_DECREF(param);
+        Py_DECREF(x);
+        return NULL;
+    }
+
+    npars = PyArray_SIZE(param);
+    if ((npars % expected_pars) != 0) {
+        PyErr_SetString(PyExc_ValueError, "Incorrect number of parameters");
+        Py_DECREF(param);
+        Py_DECREF(x);
+        Py_DECREF(offsets);
+        return NULL;
+    }
+    npeaks = npars / expected_pars;
+    nx = PyArray_SIZE(x);
+    ngroups = PyArray_DIMS(offsets)[0] - 1;
+    if (ngroups < 0){
+        ngroups = 0;
+    }
+    poffsets = (int *) PyArray_DATA(offsets);
+    for (group = 0; group < ngroups; group++){
+        if ((poffsets[group] < 0) || (poffsets[group] > poffsets[group + 1]) ||
+            (poffsets[group + 1] > npeaks)){
+            PyErr_SetString(PyExc_ValueError, "Invalid group offsets");
+            Py_DECREF(param);
+            Py_DECREF(x);
+            Py_DECREF(offsets);
+            return NULL;
+        }
+    }
+    if (debug){
+        printf("npeaks = %d ngroups = %d nx = %d\n",
+               (int) npeaks, (int) ngroups, (int) nx);
+    }
+
+    /* Create the output array */
+    dim_ret[0] = ngroups;
+    dim_ret[1] = nx;
+    ret = (PyArrayObject *) PyArray_SimpleNew(2, dim_ret, NPY_DOUBLE);
+    if (ret == NULL){
+        Py_DECREF(param);
+        Py_DECREF(x);
+        Py_DECREF(offsets);
+        return NULL;
+    }
+    PyArray_FILLWBYTE(ret, 0);
+    if (tails <= 0){
+        /* I give back a matrix filled with zeros */
+        Py_DECREF(param);
+        Py_DECREF(x);
+        Py_DECREF(offsets);
+        return PyArray_Return(ret);
+    }
+    g_term_flag    = tails & 1;
+    st_term_flag   = (tails>>1) & 1;
+    lt_term_flag   = (tails>>2) & 1;
+    step_term_flag = (tails>>3) & 1;
+
+    log2 = 0.69314718055994529;
+    sqrt2PI= sqrt(2.0*M_PI);
+    tosigma=1.0/(2.0*sqrt(2.0*log2));
+
+    phyper = (hypermet *) PyArray_DATA(param);
+    for (group = 0; group < ngroups; group++){
+        prow = (double *) PyArray_DATA(ret) + group * nx;
+        for (i = poffsets[group]; i < poffsets[group + 1]; i++){
+            x1 = phyper[i].area;
+            x2 = phyper[i].position;
+            x3 = phyper[i].fwhm * tosigma;
+            x4 = phyper[i].st_area_r;
+            x5 = phyper[i].st_slope_r;
+            x6 = phyper[i].lt_area_r;
+            x7 = phyper[i].lt_slope_r;
+            x8 = phyper[i].step_height_r;
+            if (x3 == 0){
+                PyErr_SetString(PyExc_ValueError,
+                                "Linear Algebra Error: Division by zero");
+                Py_DECREF(param);
+                Py_DECREF(x);
+                Py_DECREF(offsets);
+                Py_DECREF(ret);
+                return NULL;
+            }
+            if (x1 == 0){
+                /* nothing to add */
+                continue;
+            }
+            /* the terms not depending on x */
+            z1 = x3 * 1.4142135623730950488;
+            gnorm = x1/(x3*sqrt2PI);
+            st_help = 0.0;
+            if (x5 != 0){
+                st_help = 0.5 * (x3/x5) * (x3/x5);
+            }
+            lt_help = 0.0;
+            if (x7 != 0){
+                lt_help = 0.5 * (x3/x7) * (x3/x7);
+            }
+            px = (double *) PyArray_DATA(x);
+            pret = prow;
+            for (j = 0; j < nx; j++){
+                z0 = *px - x2;
+                z2 = (0.5 * z0 * z0) / (x3 * x3);
+                if (g_term_flag && (z2 < 100)){
+                    *pret += fastexp (-z2) * gnorm;
+                }
+                if (st_term_flag && (x5 != 0) && (x4 != 0)){
+                    dhelp = (z0/z1) + 0.5 * z1/x5;
+                    if (dhelp < 10){
+                        dhelp = x4 * 0.5 * erfc(dhelp);
+                        if ((dhelp > 0) && (fabs(z0/x5) <= 612)){
+                            *pret += ((x1 * dhelp)/x5) * fastexp(st_help + (z0/x5));
+                        }
+                    }
+                }
+                if (lt_term_flag && (x7 != 0) && (x6 != 0)){
+                    dhelp = (z0/z1) + 0.5 * z1/x7;
+                    if (dhelp < 10){
+                        dhelp = x6 * 0.5 * erfc(dhelp);
+                        if ((dhelp > 0) && (fabs(z0/x7) <= 612)){
+                            *pret += ((x1 * dhelp)/x7) * fastexp(lt_help + (z0/x7));
+                        }
+                    }
+                }
+                if (step_term_flag && (x8 != 0)){
+                    *pret +=  x8 * gnorm * 0.5 * erfc(z0/z1);
+                }
+                pret++;
+                px++;
+            }
+        }
+    }
+
+    Py_DECREF(param);
+    Py_DECREF(x);
+    Py_DECREF(offsets);
+    return PyArray_Return(ret);
+}
+
+
 
 static PyObject *
 SpecfitFuns_seek(PyObject *self, PyObject *args)
@@ -4053,7 +4248,7 @@ SpecfitFuns_SavitskyGolay(PyObject *self, PyObject *args)
 {
     PyObject *input;
     PyArrayObject *ret;
-    int n, npoints;
+    int n, npoints, k, n_spectra;
     double dpoints = 5.;
     double coeff[MAX_SAVITSKY_GOLAY_WIDTH];
     int i, j, m;
@@ -4064,8 +4259,9 @@ SpecfitFuns_SavitskyGolay(PyObject *self, PyObject *args)
     if (!PyArg_ParseTuple(args, "O|d", &input, &dpoints))
         return NULL;
 
+    /* a 2D input is taken as a set of spectra, one per row */
     ret = (PyArrayObject *)
-             PyArray_FROMANY(input, NPY_DOUBLE, 1, 1, NPY_ARRAY_ENSURECOPY);
+             PyArray_FROMANY(input, NPY_DOUBLE, 1, 2, NPY_ARRAY_ENSURECOPY);
 
     if (ret == NULL){
         printf("Cannot create 1D array from input\n");
@@ -4074,7 +4270,16 @@ SpecfitFuns_SavitskyGolay(PyObject *self, PyObject *args)
     npoints = (int )  dpoints;
     if (!(npoints % 2)) npoints +=1;
 
-    n = (int) PyArray_DIMS(ret)[0];
+    if(PyArray_NDIM(ret) == 1)
+    {
+        n_spectra = 1;
+        n = (int) PyArray_DIMS(ret)[0];
+    }
+    else
+    {
+        n_spectra = (int) PyArray_DIMS(ret)[0];
+        n = (int) PyArray_DIMS(ret)[1];
+    }
 
     if((npoints < MIN_SAVITSKY_GOLAY_WIDTH) ||  (n < npoints))
     {
@@ -4090,33 +4295,41 @@ SpecfitFuns_SavitskyGolay(PyObject *self, PyObject *args)
         coeff[m-i] = coeff[m+i];
     }
 
-    /* do the job */
-    output = (double *) PyArray_DATA(ret);
-
-    /* simple smoothing at the beginning */
-    for (j=0; j<=(int)(npoints/3); j++)
-    {
-        smooth1d(output, m);
+    /*one does not need the whole spectrum buffer, but code is clearer */
+    data = (double *) malloc(n * sizeof(double));
+    if (data == NULL){
+        Py_DECREF(ret);
+        return PyErr_NoMemory();
     }
 
-    /* simple smoothing at the end */
-    for (j=0; j<=(int)(npoints/3); j++)
+    for (k=0; k < n_spectra; k++)
     {
-        smooth1d((output+n-m-1), m);
-    }
+        /* do the job */
+        output = ((double *) PyArray_DATA(ret)) + k * n;
 
-    /*one does not need the whole spectrum buffer, but code is clearer */
-    data = (double *) malloc(n * sizeof(double));
-    memcpy(data, output, n * sizeof(double));
+        /* simple smoothing at the beginning */
+        for (j=0; j<=(int)(npoints/3); j++)
+        {
+            smooth1d(output, m);
+        }
 
-    /* the actual SG smoothing in the middle */
-    for (i=m; i<(n-m); i++){
-        dhelp = 0;
-        for (j=-m;j<=m;j++) {
-            dhelp += coeff[m+j] * (*(data+i+j));
+        /* simple smoothing at the end */
+        for (j=0; j<=(int)(npoints/3); j++)
+        {
+            smooth1d((output+n-m-1), m);
         }
-        if(dhelp > 0.0){
-            *(output+i) = dhelp / den;
+
+        memcpy(data, output, n * sizeof(double));
+
+        /* the actual SG smoothing in the middle */
+        for (i=m; i<(n-m); i++){
+            dhelp = 0;
+            for (j=-m;j<=m;j++) {
+                dhelp += coeff[m+j] * (*(data+i+j));
+            }
+            if(dhelp > 0.0){
+                *(output+i) = dhelp / den;
+            }
         }
     }
     free(data);
@@ -4145,6 +4358,7 @@ static PyMethodDef SpecfitFuns_methods[] = {
     {"slit",        SpecfitFuns_slit,       METH_VARARGS},
     {"ahypermet",   SpecfitFuns_ahypermet,  METH_VARARGS},
     {"fastahypermet",   SpecfitFuns_fastahypermet,  METH_VARARGS},
+    {"fastahypermetgroups", SpecfitFuns_fastahypermetgroups, METH_VARARGS},
     {"erfc",        SpecfitFuns_erfc,       METH_VARARGS},
     {"erf",         SpecfitFuns_erf,        METH_VARARGS},
     {"seek",        SpecfitFuns_seek,       METH_VARARGS},
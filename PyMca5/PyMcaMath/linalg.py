@@ -30,6 +30,7 @@
 __contact__ = "sole@esrf.fr"
 __license__ = "MIT"
 __copyright__ = "European Synchrotron Radiation Facility, Grenoble, France"
+import sys
 import numpy
 __doc__ = """
 
@@ -46,6 +47,51 @@
 
 """
 
+def _solveWeightedNormalEquations(a, b, w, parameters, sigmapar,
+                                  covarianceMatrix=None):
+    """
+    Solve the weighted normal equations (A^T W A) x = A^T W b of each
+    column of b, with W the inverse of the squared uncertainties w, filling
+    parameters, sigmapar and, if given, covarianceMatrix.
+
+    The K matrices A^T W A are obtained from a single product of the
+    (M, N * N) matrix of the outer products of the rows of A by W and they
+    are inverted with a batched Cholesky decomposition.
+    """
+    m, n = a.shape
+    weights = 1.0 / (w * w)
+    if weights.shape[1] != b.shape[1]:
+        weights = numpy.outer(weights[:, 0], numpy.ones(b.shape[1]))
+    outer = (a[:, :, None] * a[:, None, :]).reshape(m, n * n)
+    alpha = numpy.dot(outer.T, weights).T.reshape(-1, n, n)
+    beta = numpy.dot(a.T, b * weights).T.reshape(-1, n, 1)
+    # scale the systems to unit diagonal to improve their conditioning
+    scale = numpy.sqrt(numpy.diagonal(alpha, axis1=1, axis2=2))
+    scale = 1.0 / (scale + numpy.equal(scale, 0))
+    try:
+        # scaled alpha = L L^T and covariance = inv(L)^T inv(L) scaled back
+        lInverse = numpy.linalg.inv(numpy.linalg.cholesky(\
+                        alpha * scale[:, :, None] * scale[:, None, :]))
+        lInverse *= scale[:, None, :]
+    except numpy.linalg.LinAlgError:
+        # at least one singular system, solve them one by one
+        for i in range(alpha.shape[0]):
+            try:
+                _covariance = numpy.linalg.inv(alpha[i])
+            except numpy.linalg.LinAlgError:
+                print("Exception", sys.exc_info()[1])
+                continue
+            parameters[:, i] = numpy.dot(_covariance, beta[i])[:, 0]
+            sigmapar[:, i] = numpy.sqrt(numpy.diag(_covariance))
+            if covarianceMatrix is not None:
+                covarianceMatrix[i] = _covariance
+        return
+    _covariance = numpy.matmul(lInverse.transpose(0, 2, 1), lInverse)
+    parameters[:, :] = numpy.matmul(_covariance, beta)[:, :, 0].T
+    sigmapar[:, :] = numpy.sqrt((lInverse * lInverse).sum(axis=1)).T
+    if covarianceMatrix is not None:
+        covarianceMatrix[:] = _covariance
+
 # fit to a straight line
 
 def linregress(x, y, sigmay=None, full_output=False):
@@ -172,8 +218,9 @@ def lstsq(a, b, rcond=None, sigma_b=None, weight=False,
                 Weighted fit using the supplied experimental uncertainties or the
                 square root of the b values.
 
-    svd: If not true, a simple matrix inversion will be used in case of weighting with unequal
-         data weights. Ignored in any other cases.
+    svd: If not true, the normal equations of all the columns of b are solved at once using
+         a Cholesky decomposition in case of weighting with unequal data weights. Ignored
+         in any other cases.
 
     last_svd: Tuple containing U, s, V of the weighted model matrix or None. This is to
                     prevent recalculation on repeated fits.
@@ -383,29 +430,12 @@ def lstsq(a, b, rcond=None, sigma_b=None, weight=False,
                     if covariances:
                         covarianceMatrix[i] = _covariance
         elif 1:
-            # Pure matrix inversion (faster than SVD)
-            # I do not seem to gain anything by re-using the storage
-            #alpha = numpy.empty((n, n), numpy.float)
-            #beta = numpy.empty((n, 1), numpy.float)
-            for i in range(b_shape[1]):
-                tmpWeight = w[:, i:i+1]
-                A = a / tmpWeight
-                tmpData =  b[:, i:i+1] / tmpWeight
-                #numpy.dot(A.T, A, alpha)
-                #numpy.dot(A.T, tmpData, beta)
-                alpha = numpy.dot(A.T, A)
-                beta = numpy.dot(A.T, tmpData)
-                try:
-                    _covariance = numpy.linalg.inv(alpha)
-                except:
-                    print("Exception")
-                    print("Exception", sys.exc_info()[1])
-                    continue
-                parameters[:, i:i+1] = numpy.dot(_covariance, beta)
-                if uncertainties:
-                    sigmapar[:, i] = numpy.sqrt(numpy.diag(_covariance))
-                if covariances:
-                    covarianceMatrix[i] = covariance
+            # Normal equations of all the spectra solved at once
+            if covariances:
+                _solveWeightedNormalEquations(a, b, w, parameters, sigmapar,
+                                              covarianceMatrix)
+            else:
+                _solveWeightedNormalEquations(a, b, w, parameters, sigmapar)
         else:
             # Matrix inversion with buffers does not improve
             bufferProduct = numpy.empty((n, n + 1), numpy.float)
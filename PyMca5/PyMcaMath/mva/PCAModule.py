@@ -482,6 +482,24 @@ def numpyPCA(stack, ncomponents=10, binning=None, legacy=True, **kw):
                              legacy=legacy,
                              **kw)
 
+def randomizedPCA(stack, ncomponents=10, binning=None, legacy=True, **kw):
+    """
+    This is a randomized method reading the data in blocks. It is fast and
+    it has a small memory footprint when the number of components is small
+    """
+    if DEBUG:
+        print("PCAModule.randomizedPCA called")
+    if hasattr(stack, "info"):
+        index = stack.info.get('McaIndex', -1)
+    else:
+        index = kw.pop("index", -1)
+    return PCATools.randomizedPCA(stack,
+                                  index=index,
+                                  ncomponents=ncomponents,
+                                  binning=binning,
+                                  legacy=legacy,
+                                  **kw)
+
 def mdpPCASVDFloat32(stack, ncomponents=10, binning=None,
                      mask=None, spectral_mask=None, legacy=True, **kw):
     return mdpPCA(stack, ncomponents, binning=binning, dtype='float32',
@@ -31,8 +31,15 @@
 __license__ = "MIT"
 __copyright__ = "European Synchrotron Radiation Facility, Grenoble, France"
 import sys
+import collections
+from multiprocessing.pool import ThreadPool
 import numpy
 import numpy.linalg
+try:
+    import queue
+except ImportError:
+    # python 2
+    import Queue as queue
 try:
     # make a explicit import to warn about missing optimized libraries
     import numpy.core._dotblas as dotblas
@@ -43,6 +50,96 @@
 
 DEBUG = 0
 
+# Number of threads accumulating the covariance matrix and approximate number
+# of values of the blocks of spectra they process
+WORKERS = 4
+BLOCK_SIZE = 4 * 1024 * 1024
+
+def _getSpectraBlocks(shape, nSpectra):
+    # keys of the blocks of about nSpectra spectra of a 2D or 3D stack
+    # sliced along the first dimension
+    if len(shape) == 2:
+        for k in range(0, shape[0], nSpectra):
+            yield (slice(k, min(k + nSpectra, shape[0])),)
+    elif shape[1] >= nSpectra:
+        for i in range(shape[0]):
+            for k in range(0, shape[1], nSpectra):
+                yield (slice(i, i + 1), slice(k, min(k + nSpectra, shape[1])))
+    else:
+        deltaRow = nSpectra // shape[1]
+        for i in range(0, shape[0], deltaRow):
+            yield (slice(i, min(i + deltaRow, shape[0])), slice(None))
+
+def _accumulateBlock(block, weights, badMask, accumulators):
+    a = numpy.array(block, dtype=numpy.float64)
+    a = a.reshape(-1, a.shape[-1]) * weights
+    if badMask is not None:
+        a[badMask.reshape(-1)] = 0
+    blockSum = a.sum(axis=0)
+    blockProduct = dotblas.dot(a.T, a)
+    a = None
+    # add the partial sums to the first free accumulator
+    accumulator = accumulators.get()
+    try:
+        accumulator[0] += blockSum
+        accumulator[1] += blockProduct
+    finally:
+        accumulators.put(accumulator)
+
+def _accumulateCovariance(data, nChannels, binning, weights, badMask,
+                          covMatrix, sumSpectrum, workers=None):
+    """
+    Add to covMatrix and sumSpectrum the X^T X product and the sum of the
+    spectra of a 2D or 3D stack with the spectra along the last dimension.
+
+    The stack is read in blocks of spectra by slicing its first dimensions
+    and the blocks are processed by a pool of threads, each one accumulating
+    partial sums reduced at the end.
+    """
+    if workers is None:
+        workers = WORKERS
+    workers = max(1, workers)
+    nSpectra = max(1, BLOCK_SIZE // nChannels)
+    channels = slice(0, nChannels * binning, binning)
+    accumulators = queue.Queue()
+    accumulators.put([sumSpectrum, covMatrix])
+    for i in range(workers - 1):
+        accumulators.put([numpy.zeros(sumSpectrum.shape, numpy.float64),
+                          numpy.zeros(covMatrix.shape, covMatrix.dtype)])
+    if workers > 1:
+        pool = ThreadPool(workers)
+    else:
+        pool = None
+    pending = collections.deque()
+    try:
+        for key in _getSpectraBlocks(data.shape, nSpectra):
+            block = data[key + (channels,)]
+            if badMask is None:
+                blockMask = None
+            else:
+                blockMask = badMask[key]
+            if pool is None:
+                _accumulateBlock(block, weights, blockMask, accumulators)
+                continue
+            # limit the number of blocks in memory
+            while len(pending) >= 2 * workers:
+                pending.popleft().get()
+            pending.append(pool.apply_async(_accumulateBlock,
+                                            (block, weights, blockMask,
+                                             accumulators)))
+        while len(pending):
+            pending.popleft().get()
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+    # reduce the partial sums
+    while not accumulators.empty():
+        partialSum, partialProduct = accumulators.get()
+        if partialProduct is not covMatrix:
+            sumSpectrum += partialSum
+            covMatrix += partialProduct
+
 def getCovarianceMatrix(stack,
                         index=None,
                         binning=None,
@@ -50,7 +147,8 @@ def getCovarianceMatrix(stack,
                         force=True,
                         center=True,
                         weights=None,
-                        spatial_mask=None):
+                        spatial_mask=None,
+                        workers=None):
     """
     Calculate the covariance matrix of input data (stack) array. The input array is to be
     understood as a set of observables (spectra) taken at different instances (for instance
@@ -80,6 +178,9 @@ def getCovarianceMatrix(stack,
     :spatial_mask: Array of size n where n is the number of measurement instances. In mapping
     experiments, n would be equal to the number of pixels.
     :type spatial_mask: Numpy array of unsigned bytes (numpy.uint8) or None (default).
+    :param workers: Number of threads accumulating the covariance matrix of blocks of spectra
+    when the observables are in the last dimension and the data are progressively read.
+    :type workers: Positive integer or None (default) to use the module WORKERS value.
     :returns: The covMatrix, the average spectrum and the number of used pixels.
     """
     #the 1D mask = weights should correspond to the values, before or after
@@ -399,131 +500,16 @@ def getCovarianceMatrix(stack,
         #the data are already arranged as (nPixels, nChannels) and we
         #basically have to return data.T * data to get back the covariance
         #matrix as (nChannels, nChannels)
-        #if someone had the bad idea to store the data in HDF5 with a chunk
-        #size based on the pixels and not on the spectra a loop based on
-        #reading spectrum per spectrum can be very slow
-        step = 0
-        divider = 10
-        while step < 1:
-            step = int(nPixels / divider)
-            divider -= 1
-            if divider <= 0:
-                step = nPixels
-                break
-        step = nPixels
-        if DEBUG:
-            print("Reading chunks of %d spectra" % step)
-
+        #the partial sums of blocks of spectra are accumulated by a pool
+        #of threads while the next blocks are read
         cleanWeights.shape = 1, -1
-        if len(data.shape) == 2:
-            if cleanMask is not None:
-                badMask.shape = -1
-            tmpData = numpy.zeros((step, nChannels), numpy.float64)
-            k = 0
-            while k < nPixels:
-                kToRead = min(step, nPixels - k)
-                tmpData[0:kToRead] = data[k: k + kToRead, ::binning]
-                if cleanMask is not None:
-                    tmpData[badMask[k: k + kToRead]] = 0
-                a = tmpData[0:kToRead] * cleanWeights
-                sumSpectrum += a.sum(axis=0)
-                covMatrix += dotblas.dot(a.T, a)
-                a = None
-                k += kToRead
-            tmpData = None
-        elif len(data.shape) == 3:
-            if oldShape[0] == 1:
-                #close to the previous case
-                tmpData = numpy.zeros((step, nChannels), numpy.float64)
-                if cleanMask is not None:
-                    badMask.shape = data.shape[0], data.shape[1]
-                for i in range(oldShape[0]):
-                    k = 0
-                    while k < oldShape[1]:
-                        kToRead = min(step, oldShape[1] - k)
-                        tmpData[0:kToRead] = data[i, k:k + kToRead, ::binning]\
-                                             * cleanWeights
-                        if cleanMask is not None:
-                            tmpData[0:kToRead][badMask[i, k: k + kToRead]] = 0
-                        a = tmpData[0:kToRead]
-                        sumSpectrum += a.sum(axis=0)
-                        covMatrix += dotblas.dot(a.T, a)
-                        a = None
-                        k += kToRead
-                tmpData = None
-            elif oldShape[1] == 1:
-                #almost identical to the previous case
-                tmpData = numpy.zeros((step, nChannels), numpy.float64)
-                if cleanMask is not None:
-                    badMask.shape = data.shape[0], data.shape[1]
-                for i in range(oldShape[1]):
-                    k = 0
-                    while k < oldShape[0]:
-                        kToRead = min(step, oldShape[0] - k)
-                        tmpData[0:kToRead] = data[k: k + kToRead, i, ::binning]\
-                                             * cleanWeights
-                        if cleanMask is not None:
-                            tmpData[0:kToRead][badMask[k: k + kToRead, i]] = 0
-                        a = tmpData[0:kToRead]
-                        sumSpectrum += a.sum(axis=0)
-                        covMatrix += dotblas.dot(a.T, a)
-                        a = None
-                        k += kToRead
-                tmpData = None
-            elif oldShape[0] < 21:
-                if step > oldShape[1]:
-                    step = oldShape[1]
-                tmpData = numpy.zeros((step, nChannels), numpy.float64)
-                if cleanMask is not None:
-                    badMask.shape = data.shape[0], data.shape[1]
-                for i in range(oldShape[0]):
-                    k = 0
-                    while k < oldShape[1]:
-                        kToRead = min(step, oldShape[1] - k)
-                        tmpData[0:kToRead] = data[i, k: k + kToRead, ::binning]\
-                                             * cleanWeights
-                        if cleanMask is not None:
-                            tmpData[0:kToRead][badMask[i, k: k + kToRead]] = 0
-                        a = tmpData[0:kToRead]
-                        sumSpectrum += a.sum(axis=0)
-                        covMatrix += dotblas.dot(a.T, a)
-                        a = None
-                        k += kToRead
-                tmpData = None
-            else:
-                #I should choose the sizes in terms of the size
-                #of the dataset
-                if oldShape[0] < 41:
-                    #divide by 10
-                    deltaRow = 4
-                elif oldShape[0] < 101:
-                    #divide by 10
-                    deltaRow = 10
-                else:
-                    #take pieces of one tenth
-                    deltaRow = int(oldShape[0] / 10)
-                deltaCol = oldShape[1]
-                tmpData = numpy.zeros((deltaRow, deltaCol, nChannels),
-                                      numpy.float64)
-                if cleanMask is not None:
-                    badMask.shape = data.shape[0], data.shape[1]
-                i = 0
-                while i < oldShape[0]:
-                    iToRead = min(deltaRow, oldShape[0] - i)
-                    kToRead = iToRead * oldShape[1]
-                    tmpData[:iToRead] = data[i:(i + iToRead), :, ::binning]
-                    if cleanMask is not None:
-                        tmpData[0:kToRead][badMask[i:(i + iToRead), :]] = 0
-                    a = tmpData[:iToRead]
-                    a.shape = kToRead, nChannels
-                    a *= cleanWeights
-                    if 0:
-                        #weight each spectrum
-                        a /= (a.sum(axis=1).reshape(-1, 1))
-                    sumSpectrum += a.sum(axis=0)
-                    covMatrix += dotblas.dot(a.T, a)
-                    a = None
-                    i += iToRead
+        if cleanMask is not None:
+            badMask = badMask.reshape(data.shape[:-1]) > 0
+        else:
+            badMask = None
+        _accumulateCovariance(data, nChannels, binning,
+                              cleanWeights[:, :nChannels], badMask, covMatrix, sumSpectrum,
+                              workers=workers)
         #should one divide by N or by N-1 ??
         covMatrix /= usedPixels - 1
         if center:
@@ -603,7 +589,8 @@ def numpyPCA(stack, index=-1, ncomponents=10, binning=None,
                                                              force=force,
                                                              center=center,
                                                              spatial_mask=mask,
-                                                             weights=spectral_mask)
+                                                             weights=spectral_mask,
+                                                             workers=kw.get("workers", None))
 
     #the total variance is the sum of the elements of the diagonal
     totalVariance = numpy.diag(cov)
@@ -720,6 +707,147 @@ def numpyPCA(stack, index=-1, ncomponents=10, binning=None,
                 "pixels": calculatedPixels,
                 "variance": calculatedTotalVariance}
 
+def _getStackData(stack):
+    if hasattr(stack, "info") and hasattr(stack, "data"):
+        #we are dealing with a PyMca data object
+        return stack.data
+    return stack
+
+def _scatterProduct(data, vectors, nChannels, binning, weights, badMask,
+                    projections=None):
+    # one pass over the spectra returning X^T X vectors, the sum of the
+    # spectra and the sum of their squares. If given, projections is filled
+    # with the products of the unweighted spectra by the vectors.
+    product = numpy.zeros(vectors.shape, numpy.float64)
+    sumSpectrum = numpy.zeros((nChannels,), numpy.float64)
+    sumSquares = numpy.zeros((nChannels,), numpy.float64)
+    nSpectra = max(1, BLOCK_SIZE // nChannels)
+    channels = slice(0, nChannels * binning, binning)
+    indices = numpy.arange(int(numpy.prod(data.shape[:-1])))
+    indices = indices.reshape(data.shape[:-1])
+    for key in _getSpectraBlocks(data.shape, nSpectra):
+        a = numpy.array(data[key + (channels,)], dtype=numpy.float64)
+        a = a.reshape(-1, nChannels)
+        if projections is not None:
+            projections[indices[key].reshape(-1)] = dotblas.dot(a, vectors)
+        a *= weights
+        if badMask is not None:
+            a[badMask[key].reshape(-1)] = 0
+        sumSpectrum += a.sum(axis=0)
+        sumSquares += (a * a).sum(axis=0)
+        product += dotblas.dot(a.T, dotblas.dot(a, vectors))
+        a = None
+    return product, sumSpectrum, sumSquares
+
+def randomizedPCA(stack, index=-1, ncomponents=10, binning=None,
+                  center=True, mask=None, spectral_mask=None, legacy=True,
+                  oversampling=10, iterations=0, seed=0, **kw):
+    """
+    Calculate the principal components of a stack with the spectra along the
+    last dimension using a randomized range finder.
+
+    The stack is only read in blocks of spectra. Without power iterations,
+    two passes over the data give the eigenvalues, the eigenvectors and the
+    projections of the spectra, without calculating the full covariance
+    matrix. Each power iteration needs an additional pass and improves the
+    accuracy of the smaller components.
+
+    :param stack: 2D or 3D array or PyMca data object
+    :param ncomponents: Number of components to calculate
+    :param binning: Spectral sampling as in getCovarianceMatrix
+    :param center: If True the average spectrum is subtracted
+    :param mask: Spatial mask of the pixels to be considered
+    :param spectral_mask: Weight of each channel
+    :param oversampling: Number of additional random vectors
+    :param iterations: Number of power iterations
+    :param seed: Seed of the random vectors
+    :returns: The same output as numpyPCA
+    """
+    if DEBUG:
+        print("PCATools.randomizedPCA")
+    data = _getStackData(stack)
+    oldShape = data.shape
+    if index not in [-1, len(oldShape) - 1]:
+        raise IndexError("Randomized PCA requires the spectra along the " +\
+                         "last dimension")
+    if binning is None:
+        binning = 1
+    nPixels = 1
+    for i in range(len(oldShape) - 1):
+        nPixels *= oldShape[i]
+    N = int(oldShape[-1] / binning)
+    if ncomponents > N:
+        msg = "Requested %d components for a maximum of %d" % (ncomponents, N)
+        raise ValueError(msg)
+
+    if spectral_mask is None:
+        weights = numpy.ones((1, N), numpy.float64)
+    elif spectral_mask.size == N:
+        weights = numpy.array(spectral_mask, numpy.float64).reshape(1, N)
+    else:
+        weights = numpy.array(spectral_mask[::binning][:N],
+                              numpy.float64).reshape(1, N)
+    if mask is not None:
+        badMask = numpy.asarray(mask[:]).reshape(oldShape[:-1]) < 1
+        usedPixels = nPixels - badMask.sum()
+    else:
+        badMask = None
+        usedPixels = nPixels
+
+    def centeredProduct(vectors, projections=None):
+        # scatter matrix of the (centered) data times the vectors
+        product, sumSpectrum, sumSquares = _scatterProduct(data, vectors,
+                                                N, binning, weights,
+                                                badMask,
+                                                projections=projections)
+        average = sumSpectrum / usedPixels
+        if center:
+            product -= usedPixels * numpy.outer(average,
+                                                dotblas.dot(average, vectors))
+            sumSquares -= usedPixels * average * average
+        return product, average, sumSquares.sum() / (usedPixels - 1)
+
+    k = min(N, ncomponents + oversampling)
+    randomState = numpy.random.RandomState(seed)
+    product = centeredProduct(randomState.normal(size=(N, k)))[0]
+    for i in range(iterations):
+        q = numpy.linalg.qr(product)[0]
+        product = centeredProduct(q)[0]
+    q = numpy.linalg.qr(product)[0]
+
+    # the final pass also projects the spectra on the found subspace
+    projections = numpy.zeros((nPixels, k), numpy.float32)
+    product, avgSpectrum, totalVariance = centeredProduct(q, projections)
+    smallMatrix = dotblas.dot(q.T, product) / (usedPixels - 1)
+    evalues, evectors = numpy.linalg.eigh(0.5 * (smallMatrix + smallMatrix.T))
+    idx = numpy.argsort(evalues)[::-1][:ncomponents]
+
+    dtype = numpy.float32
+    eigenvalues = evalues[idx].astype(dtype)
+    eigenvectors = dotblas.dot(q, evectors[:, idx]).T.astype(dtype)
+    images = dotblas.dot(projections,
+                         evectors[:, idx].astype(dtype)).T.astype(dtype)
+    projections = None
+    totalExplainedVariance = 0.0
+    for i in range(ncomponents):
+        partialExplainedVariance = 100. * eigenvalues[i] / totalVariance
+        print("PC%02d  Explained variance %.5f %% " %\
+                                    (i + 1, partialExplainedVariance))
+        totalExplainedVariance += partialExplainedVariance
+    print("Total explained variance = %.2f %% " % totalExplainedVariance)
+    images.shape = (ncomponents,) + oldShape[:-1]
+    if len(oldShape) == 2:
+        images.shape = ncomponents, nPixels
+    if legacy:
+        return images, eigenvalues, eigenvectors
+    else:
+        return {"scores": images,
+                "eigenvalues": eigenvalues,
+                "eigenvectors": eigenvectors,
+                "average": avgSpectrum,
+                "pixels": usedPixels,
+                "variance": totalVariance}
+
 
 def test():
     x = numpy.array([[0.0,  2.0,  3.0],
@@ -0,0 +1,137 @@
+#/*##########################################################################
+#
+# The PyMca X-Ray Fluorescence Toolkit
+#
+# Copyright (c) 2004-2016 European Synchrotron Radiation Facility
+#
+# This file is part of the PyMca X-ray Fluorescence Toolkit developed at
+# the ESRF by the Software group.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+#############################################################################*/
+__author__ = "V.A. Sole - ESRF Data Analysis"
+__contact__ = "sole@esrf.fr"
+__license__ = "MIT"
+__copyright__ = "European Synchrotron Radiation Facility, Grenoble, France"
+__doc__ = """
+Pools of worker processes used by the batch and stack fits.
+
+The workers are forked, therefore they inherit the context given when
+creating the pool (data, configured fit instances, ...) without pickling it
+and the program is not started again in each of them. Where fork is not
+available no pool is created and the callers work serially.
+"""
+import sys
+import collections
+import multiprocessing
+
+# Context of the worker processes, set by the pool initializer
+WORKER_CONTEXT = {}
+
+
+def getMultiprocessingContext():
+    """
+    Return the multiprocessing context used to create the pools or None if
+    the worker processes cannot inherit the context (no fork available).
+    """
+    if sys.platform.startswith("win"):
+        return None
+    if hasattr(multiprocessing, "get_context"):
+        try:
+            return multiprocessing.get_context("fork")
+        except ValueError:
+            return None
+    return multiprocessing
+
+
+def _initializeWorker(context):
+    WORKER_CONTEXT.clear()
+    WORKER_CONTEXT.update(context)
+
+
+def getPool(processes, context=None):
+    """
+    Return a pool of processes whose WORKER_CONTEXT is a copy of the given
+    dictionary or None if the work has to be done serially.
+    """
+    mpContext = getMultiprocessingContext()
+    if mpContext is None:
+        return None
+    if context is None:
+        context = {}
+    return mpContext.Pool(processes,
+                          initializer=_initializeWorker,
+                          initargs=(context,))
+
+
+class OrderedTasks(object):
+    def __init__(self, pool, callback):
+        """
+        Tasks submitted to a pool whose results are handled in the order
+        the tasks were submitted.
+
+        :param pool: Pool of processes.
+        :param callback: Called as callback(info, result) with the info given
+                         when submitting the task.
+        """
+        self._pool = pool
+        self._callback = callback
+        self._pending = collections.deque()
+
+    def __len__(self):
+        return len(self._pending)
+
+    def submit(self, function, task, info=None, maxPending=None):
+        """
+        Run function(task) in the pool. If function is None, there is nothing
+        to be calculated and the callback receives None as result.
+
+        If maxPending is given, the results of the oldest tasks are handled
+        until at most maxPending are left, what limits the memory used by
+        the tasks waiting to be run.
+        """
+        if function is None:
+            asyncResult = None
+        else:
+            asyncResult = self._pool.apply_async(function, (task,))
+        self._pending.append((asyncResult, info))
+        if maxPending is not None:
+            self.handle(maxPending)
+
+    def handle(self, maxPending=0):
+        """
+        Wait for the oldest tasks and handle their results until at most
+        maxPending tasks are left.
+        """
+        while len(self._pending) > maxPending:
+            asyncResult, info = self._pending.popleft()
+            if asyncResult is None:
+                result = None
+            else:
+                result = asyncResult.get()
+            self._callback(info, result)
+
+    def terminate(self):
+        """
+        Discard the pending tasks and stop the pool.
+        """
+        self._pending.clear()
+        self._pool.terminate()
+        self._pool.join()
@@ -48,6 +48,10 @@
     _XAS = False
 DEBUG = 0
 
+# the window and the interpolation grid of the last Fourier transforms
+FT_GRID_CACHE_SIZE = 16
+_FT_GRID_CACHE = {}
+
 def polynom(x, parameters):
     if hasattr(x, 'shape'):
         output = numpy.zeros(x.shape)
@@ -394,6 +398,47 @@ def polspl_test():
     return
 
 
+def getPostEdgeLimits(kmin, kmax, polDegree, knots=None):
+    """
+    Return the len(polDegree) + 1 limits of the intervals of the post-edge
+    spline. Without knots the [kmin, kmax] interval is divided into
+    equidistant intervals.
+    """
+    xrange1 = [kmin, kmax]
+    if knots not in [None, []]:
+        if len(knots) == len(polDegree):
+            if knots[0] > kmin:
+                knots = [kmin] + list(knots)
+            elif knots[-1] < kmax:
+                knots = list(knots) + [kmax]
+        elif len(knots) == (len(polDegree) - 1):
+            # probably just given the intermediate knots
+            if knots[0] > kmin:
+                knots = [kmin] + list(knots)
+            if knots[-1] < kmax:
+                knots = list(knots) + [kmax]
+        if ( (len(polDegree)+1) != len(knots) ):
+            print("Error: dimension of knots must be dimension of polDegree+1")
+            print("       Forced automatic (equidistant) knot definition.")
+            knots = None
+        else:
+            xrange1 = knots[0],knots[-1]
+    else:
+        knots = None
+
+    nr = len(polDegree)
+    limits = numpy.zeros((nr + 1,), numpy.float)
+    limits[0] = xrange1[0]
+    limits[nr] = xrange1[1]
+    if knots is None:
+        step = (limits[nr]-limits[0])/float(nr)
+        for i in range(1,nr):
+            limits[i] = limits[i-1] + step
+    else:
+        for i in range(1,nr):
+            limits[i] = knots[i]
+    return limits
+
 def postEdge(set2,kmin=None,kmax=None,polDegree=[3,3,3],knots=None, full=False):
     r"""
         postEdge(set2,kmin=None,kmax=None,polDegree=[3,3,3],knots=None)
@@ -440,45 +485,16 @@ def postEdge(set2,kmin=None,kmax=None,polDegree=[3,3,3],knots=None, full=False):
     if kmax != None:
         x2 = kmax
 
-    xrange1 = [x1,x2]
+    limits = getPostEdgeLimits(x1, x2, polDegree, knots=knots)
+    xrange1 = [limits[0], limits[-1]]
     if DEBUG:
         print("++++++++++++++++++",xrange1)
-    if knots not in [None, []]:
-        if len(knots) == len(polDegree):
-            if knots[0] > kmin:
-                knots = [kmin] + list(knots)
-            elif knots[-1] < kmax:
-                knots = list(knots) + [kmax]
-        elif len(knots) == (len(polDegree) - 1):
-            # probably just given the intermediate knots
-            if knots[0] > kmin:
-                knots = [kmin] + list(knots)
-            if knots[-1] < kmax:
-                knots = list(knots) + [kmax]
-        if ( (len(polDegree)+1) != len(knots) ):
-            print("Error: dimension of knots must be dimension of polDegree+1")
-            print("       Forced automatic (equidistant) knot definition.")
-            knots = None
-        else:
-            xrange1 = knots[0],knots[-1]
-
 
     nr = len(polDegree)
-    xl[1] = xrange1[0]
-    xh[nr] = xrange1[1]
-
     for i in range(1,nr+1):
         nc[i] = polDegree[i-1] + 1
-
-    if knots == None:
-        step = (xh[nr]-xl[1])/float(nr)
-        for i in range(1,nr):
-            xl[i+1] = xl[i] + step
-            xh[i]   = xl[i+1]
-    else:
-        for i in range(1,nr):
-            xl[i+1] = knots[i]
-            xh[i]   = xl[i+1]
+        xl[i] = limits[i-1]
+        xh[i] = limits[i]
 
     #
     # select only points in selected interval
@@ -540,6 +556,132 @@ def postEdge0(k, mu, kmin=None, kmax=None, degrees=(3, 3, 3), knots=None, full=F
     set0[:, 1] = mu
     return postEdge(set0, kmin, kmax, degrees, knots=knots, full=full)
 
+def solveMultiple(a, b):
+    """
+    Solve the stack of linear systems a[i] x[i] = b[i].
+
+    :param a: Array of shape (nSystems, n, n)
+    :param b: Array of shape (nSystems, n)
+    :return: Array of shape (nSystems, n)
+    """
+    try:
+        return numpy.linalg.solve(a, b[:, :, None])[:, :, 0]
+    except numpy.linalg.LinAlgError:
+        # at least one of the systems is singular, take the minimum norm
+        # least squares solution of each of them. The systems with non
+        # finite elements have no solution.
+        x = numpy.zeros(b.shape, dtype=numpy.float)
+        for i in range(b.shape[0]):
+            if numpy.isfinite(a[i]).all() and numpy.isfinite(b[i]).all():
+                x[i] = numpy.linalg.lstsq(a[i], b[i], rcond=-1)[0]
+            else:
+                x[i] = numpy.nan
+        return x
+
+def postEdgeMultiple(k, mu, kmin, kmax, polDegree=(3, 3, 3), knots=None):
+    """
+    Calculate the post edge fit of many spectra at once.
+
+    :param k: Array of shape (nSpectra, nPoints) increasing along each row
+    :param mu: Array of shape (nSpectra, nPoints)
+    :param kmin: Bottom limit for the fit
+    :param kmax: Upper limit for the fit. Scalar or one value per spectrum.
+    :param polDegree: Degree of the polynomial of each interval
+    :param knots: Knots to be used instead of equidistant intervals
+    :return: Array of shape (nSpectra, nPoints) with the fit
+
+    It is equivalent to postEdge applied to each spectrum. The polynomial
+    spline least squares problems, with the function and its first
+    derivative matched at the knots, are solved as a stack of systems.
+    """
+    k = numpy.asarray(k, dtype=numpy.float)
+    mu = numpy.asarray(mu, dtype=numpy.float)
+    nSpectra, nPoints = k.shape
+    kmax = numpy.zeros((nSpectra,), dtype=numpy.float) + kmax
+    polDegree = list(polDegree)
+    nr = len(polDegree)
+    if knots is not None:
+        # unset values are ignored
+        knots = [x for x in knots if x is not None]
+        if not len(knots):
+            knots = None
+
+    # the limits of the intervals of each spectrum
+    if knots is None:
+        limits = numpy.zeros((nSpectra, nr + 1), dtype=numpy.float)
+        limits[:, 0] = kmin
+        limits[:, nr] = kmax
+        step = (limits[:, nr] - limits[:, 0]) / float(nr)
+        for i in range(1, nr):
+            limits[:, i] = limits[:, i - 1] + step
+    else:
+        limits = numpy.array([getPostEdgeLimits(kmin, x, polDegree,
+                                                knots=knots) for x in kmax])
+
+    nc = [degree + 1 for degree in polDegree]
+    offsets = [sum(nc[:i]) for i in range(nr)]
+    nCoefficients = sum(nc)
+    n = nCoefficients + 2 * (nr - 1)
+    # The polynomial of each interval is expressed in terms of the k values
+    # scaled to [-1, 1] inside the interval. The raw powers of k give
+    # normal equations too badly conditioned to be solved in double
+    # precision.
+    center = 0.5 * (limits[:, 1:] + limits[:, :-1])
+    scale = 0.5 * (limits[:, 1:] - limits[:, :-1])
+    scale[~(scale > 0)] = 1.0
+
+    def getPowers(i, m):
+        powers = numpy.ones((nSpectra, nPoints, m), dtype=numpy.float)
+        t = (k - center[:, i:i + 1]) / scale[:, i:i + 1]
+        for j in range(1, m):
+            powers[:, :, j] = powers[:, :, j - 1] * t
+        return powers
+
+    # normal equations of each interval, the matrix elements only depend
+    # on the sums of the powers of the scaled k
+    a = numpy.zeros((nSpectra, n, n), dtype=numpy.float)
+    b = numpy.zeros((nSpectra, n), dtype=numpy.float)
+    for i in range(nr):
+        o = offsets[i]
+        m = nc[i]
+        powers = getPowers(i, 2 * m - 1)
+        inside = (k >= limits[:, i:i + 1]) & (k <= limits[:, i + 1:i + 2])
+        inside = inside.astype(numpy.float)
+        moments = numpy.matmul(inside[:, None, :], powers)[:, 0, :]
+        for j in range(m):
+            a[:, o + j, o:o + m] = moments[:, j:j + m]
+        b[:, o:o + m] = numpy.matmul((inside * mu)[:, None, :],
+                                     powers[:, :, :m])[:, 0, :]
+
+    # Lagrange multipliers to match the value and the first derivative
+    # at the knots, the end and the start of two consecutive intervals
+    row = nCoefficients
+    for i in range(nr - 1):
+        for sign, interval, t in [(-1.0, i, 1.0), (1.0, i + 1, -1.0)]:
+            o = offsets[interval]
+            for j in range(nc[interval]):
+                a[:, o + j, row] = sign * pow(t, j)
+                if j:
+                    a[:, o + j, row + 1] = sign * j * pow(t, j - 1) / \
+                                           scale[:, interval]
+        row += 2
+    a[:, nCoefficients:, :nCoefficients] = \
+                    a[:, :nCoefficients, nCoefficients:].transpose(0, 2, 1)
+    c = solveMultiple(a, b)
+
+    # the first and last polynomials are extrapolated
+    interval = numpy.zeros(k.shape, dtype=numpy.int32)
+    for i in range(1, nr):
+        interval += k > limits[:, i:i + 1]
+    fit = numpy.zeros(k.shape, dtype=numpy.float)
+    for i in range(nr):
+        o = offsets[i]
+        m = nc[i]
+        idx = interval == i
+        values = numpy.matmul(getPowers(i, m), c[:, o:o + m, None])[:, :, 0]
+        fit[idx] = values[idx]
+    return fit
+
 def getFTWindowWeights(tk, window="Gaussian", windpar=0.2, wrange=None):
 
     r"""
@@ -592,10 +734,13 @@ def getFTWindowWeights(tk, window="Gaussian", windpar=0.2, wrange=None):
     if DEBUG:
         print("Using window ", window)
 
-    if wrange == None:
+    tk = numpy.asarray(tk)
+    if wrange is None:
         xmax = tk.max()
         xmin = tk.min()
     else:
+        # the limits can also be arrays to be broadcasted against tk
+        # in order to handle many spectra at once
         xmin = wrange[0]
         xmax = wrange[1]
 
@@ -604,137 +749,223 @@ def getFTWindowWeights(tk, window="Gaussian", windpar=0.2, wrange=None):
     apo1 = xmin + windpar
     apo2 = xmax - windpar
 
-    npoint = len(tk)
-    wind = numpy.ones(npoint, dtype=numpy.float)
-
+    wind = numpy.ones(tk.shape, dtype=numpy.float)
+    # the high side is evaluated last to give it priority as the
+    # former point by point implementation
+    low = tk <= apo1
+    high = tk >= apo2
     if window in ["Gaussian", "Gauss"]:
         wind = numpy.power((tk - xp)/xm, 2)
         wind = numpy.exp(-wind * 9.2)
-
     elif window == "Hanning":
-        for i in range(npoint):
-            if tk[i] <= apo1:
-                wind[i] = 0.5*(1.0-numpy.cos(numpy.pi*(tk[i]-xmin)/windpar))
-            if tk[i] >= apo2:
-                wind[i] = 0.5*(1.0+numpy.cos(numpy.pi*(tk[i]-apo2)/windpar))
+        wind = numpy.where(low,
+                    0.5*(1.0-numpy.cos(numpy.pi*(tk-xmin)/windpar)), wind)
+        wind = numpy.where(high,
+                    0.5*(1.0+numpy.cos(numpy.pi*(tk-apo2)/windpar)), wind)
     elif window == "Box":
-        for i in range(npoint):
-            if tk[i] <= apo1:
-                wind[i] = 0.0
-            if tk[i] >= apo2:
-                wind[i] = 0.0
+        wind[low | high] = 0.0
     elif window in ["Parzen", "Triangle", "Triangular"]:
-        for i in range(npoint):
-            if tk[i] <= apo1:
-                wind[i] = (tk[i]-xmin)/windpar
-            if tk[i] >= apo2:
-                wind[i] = 1 - (tk[i]-apo2)/windpar
+        wind = numpy.where(low, (tk-xmin)/windpar, wind)
+        wind = numpy.where(high, 1 - (tk-apo2)/windpar, wind)
     elif window == "Welch":
-        for i in range(npoint):
-            if tk[i] <= apo1:
-                wind[i] = 1.0 - numpy.power( ( (tk[i]-apo1) / windpar), 2)
-            if tk[i] >= apo2:
-                wind[i] =  1.0 - numpy.power( (tk[i]-apo2) / windpar, 2 )
+        wind = numpy.where(low,
+                    1.0 - numpy.power(((tk-apo1) / windpar), 2), wind)
+        wind = numpy.where(high,
+                    1.0 - numpy.power((tk-apo2) / windpar, 2), wind)
     elif window == "Hamming":
-        for i in range(npoint):
-            if tk[i] <= apo1:
-                wind[i] = 1.08 - (.54+0.46*numpy.cos(numpy.pi*(tk[i]-xmin)/windpar))
-            if tk[i] >= apo2:
-                wind[i] =   1.08 - (.54-0.46*numpy.cos(numpy.pi*(tk[i]-apo2)/windpar))
+        wind = numpy.where(low,
+            1.08 - (.54+0.46*numpy.cos(numpy.pi*(tk-xmin)/windpar)), wind)
+        wind = numpy.where(high,
+            1.08 - (.54-0.46*numpy.cos(numpy.pi*(tk-apo2)/windpar)), wind)
     elif window == "Tukey":
-        for i in range(npoint):
-            if tk[i] <= apo1:
-                wind[i] = 1.0 - numpy.power(numpy.cos(0.5*numpy.pi*(tk[i]-xmin)/windpar),2)
-            if tk[i] >= apo2:
-                wind[i] = numpy.power(numpy.cos(-0.5*numpy.pi*(tk[i]-apo2)/windpar),2)
+        wind = numpy.where(low,
+            1.0 - numpy.power(numpy.cos(0.5*numpy.pi*(tk-xmin)/windpar),2),
+            wind)
+        wind = numpy.where(high,
+            numpy.power(numpy.cos(-0.5*numpy.pi*(tk-apo2)/windpar),2), wind)
     elif window == "Papul":
-        for i in range(npoint):
-            if tk[i] <= apo1:
-                a=(1./numpy.pi)*numpy.sin(numpy.pi*(tk[i]-xmin)/windpar) + \
-                  (1.-(tk[i]-xmin)/windpar)*numpy.cos(numpy.pi*(tk[i]-xmin)/windpar)
-                wind[i] = 1.0 - a
-            if tk[i] >= apo2:
-                a=(1./numpy.pi)*numpy.sin(numpy.pi*(tk[i]-apo2)/windpar) + \
-                  (1.-(tk[i]-apo2)/windpar)*numpy.cos(numpy.pi*(tk[i]-apo2)/windpar)
-                wind[i] = a
+        a = (1./numpy.pi)*numpy.sin(numpy.pi*(tk-xmin)/windpar) + \
+            (1.-(tk-xmin)/windpar)*numpy.cos(numpy.pi*(tk-xmin)/windpar)
+        wind = numpy.where(low, 1.0 - a, wind)
+        a = (1./numpy.pi)*numpy.sin(numpy.pi*(tk-apo2)/windpar) + \
+            (1.-(tk-apo2)/windpar)*numpy.cos(numpy.pi*(tk-apo2)/windpar)
+        wind = numpy.where(high, a, wind)
     elif _XAS and window in ["Kaiser", "Kasel"]:
-        wind= (_xas.j0(windpar * numpy.sqrt(1. - 4.0 * pow((tk-xp)/xm, 2))) - 1.0)/ (_xas.j0(windpar) - 1.0)
+        argument = windpar * numpy.sqrt(1. - 4.0 * pow((tk-xp)/xm, 2))
+        wind = (_xas.j0(argument.reshape(-1)) - 1.0)/ (_xas.j0(windpar) - 1.0)
+        wind.shape = argument.shape
     else:
         raise ValueError("Window <%s> not implemented" % window)
     return wind
 
+def _getFTInterpolation(k, kmin, kmax, npoints, kstep):
+    # Indices and weights of the linear interpolation of the spectra into
+    # the regular grid of the Fourier transform. The weights are zero
+    # outside the [kmin, kmax] range of each spectrum.
+    # Non finite k values, as those of a spectrum without a defined edge,
+    # are never selected and are counted beyond the end of the grid.
+    nSpectra, nPoints = k.shape
+    finite = numpy.isfinite(k)
+    selected = finite & (k >= kmin) & (k <= kmax)
+    interpolatedDataX = numpy.linspace(0.0, npoints-1, npoints) * kstep
+    # number of k values not greater than each grid point
+    index = numpy.ceil(numpy.where(finite, k, numpy.inf) / kstep)
+    index = numpy.clip(index, 0, npoints).astype(numpy.int64)
+    index += (numpy.arange(nSpectra) * (npoints + 1))[:, None]
+    counts = numpy.bincount(index.ravel(), minlength=nSpectra * (npoints + 1))
+    counts.shape = nSpectra, npoints + 1
+    j = numpy.clip(numpy.cumsum(counts, axis=1)[:, :npoints] - 1,
+                   0, nPoints - 2)
+    j += (numpy.arange(nSpectra) * nPoints)[:, None]
+    x0 = k.ravel()[j]
+    x1 = k.ravel()[j + 1]
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        w1 = (interpolatedDataX - x0) / (x1 - x0)
+    w0 = 1.0 - w1
+    kFirst = numpy.where(selected, k, numpy.inf).min(axis=1)
+    kLast = numpy.where(selected, k, -numpy.inf).max(axis=1)
+    outside = (interpolatedDataX < kFirst[:, None]) | \
+              (interpolatedDataX > kLast[:, None]) | \
+              ~numpy.isfinite(w1)
+    w0[outside] = 0.0
+    w1[outside] = 0.0
+    return interpolatedDataX, selected, j, w0, w1
+
+def _getFTGrid(k, kmin, kmax, npoints, kstep, window, apodization):
+    # the selected points, the window and the interpolation of a set of
+    # spectra. They are cached when all the spectra share the same k values
+    # because they do not depend on the signal.
+    key = None
+    if (k.shape[0] == 1) and (kmin.size == 1) and (kmax.size == 1):
+        key = (k.tobytes(), float(kmin[0, 0]), float(kmax[0, 0]),
+               npoints, kstep, window, apodization)
+        if key in _FT_GRID_CACHE:
+            return _FT_GRID_CACHE[key]
+    wweights = getFTWindowWeights(k,
+                                  window=window,
+                                  windpar=apodization,
+                                  wrange=(kmin, kmax))
+    grid = (wweights,) + _getFTInterpolation(k, kmin, kmax, npoints, kstep)
+    if key is not None:
+        for item in grid:
+            item.setflags(write=False)
+        if len(_FT_GRID_CACHE) >= FT_GRID_CACHE_SIZE:
+            _FT_GRID_CACHE.clear()
+        _FT_GRID_CACHE[key] = grid
+    return grid
+
 def getFT(k, exafs, npoints=2048, rrange=(0.0, 7.0),
            krange=None, kstep=0.02, kweight=0,
            window="gaussian", apodization=0.2, wweights=None):
     if krange is not None:
         idx = (k >= krange[0]) & (k <= krange[1])
-        k = k[idx]
-        exafs = exafs[idx]
-    if wweights is None:
-        wweights = getFTWindowWeights(k,
-                                      window=window,
-                                      windpar=apodization,
-                                      wrange=krange)
-    if 0:
-        set3 = numpy.zeros((k.size, 2), dtype=numpy.float)
-        set3[:, 0] = k
-        set3[:, 1] = exafs * wweights
-        setFT = exex.fastftr(set3,npoint=npoints,rrange=[0.,7.],kstep=0.02)
-    npoint2 = k.size
-    xmin = k[0]
-    xmax = k[-1]
-
+    else:
+        idx = slice(None)
+    if wweights is not None:
+        # supplied for the selected points
+        weights = numpy.zeros(k.shape, dtype=numpy.float)
+        weights[idx] = wweights
+        wweights = weights
+    ddict = getFTMultiple(k, exafs, krange=krange, npoints=npoints,
+                          rrange=rrange, kstep=kstep, kweight=kweight,
+                          window=window, apodization=apodization,
+                          wweights=wweights)
+    f10 = ddict["FTRadius"]
+    f11 = ddict["FTIntensity"][0]
+    f12 = ddict["FTReal"][0]
+    f13 = ddict["FTImaginary"][0]
 
     # ;
-    # ; creates the input interpolated values
+    # ; define the result array
     # ;
-    interpolatedDataX = numpy.linspace(0.0, npoints-1, npoints) * kstep
-    interpolatedDataY = numpy.interp( interpolatedDataX , k, wweights * exafs * pow(k, kweight),
-                                      left=0.0, right=0.0)
+    fourier = numpy.zeros((len(f10),4))
+    fourier[:,0] = f10
+    fourier[:,1] = f11
+    fourier[:,2] = f12
+    fourier[:,3] = f13
+    ddict["Set"] = fourier
+    ddict["InterpolatedSignal"] = ddict["InterpolatedSignal"][0]
+    ddict["K"] = k[idx]
+    ddict["WindowWeight"] = ddict["WindowWeight"][0][idx]
+    ddict["FTIntensity"] = f11
+    ddict["FTReal"] = f12
+    ddict["FTImaginary"] = f13
+    return ddict
 
-    # ; calculates the fft and generates the conjugated variable (rr)
+def getFTMultiple(k, exafs, krange=None, npoints=2048, rrange=(0.0, 7.0),
+                  kstep=0.02, kweight=0, window="gaussian", apodization=0.2,
+                  wweights=None):
+    """
+    Fourier transform of many EXAFS spectra at once.
+
+    :param k: Array of shape (nSpectra, nPoints) increasing along each row
+              or array of shape (nPoints, ) shared by all the spectra.
+    :param exafs: Array of shape (nSpectra, nPoints)
+    :param krange: (kmin, kmax) The limits can be scalars or arrays with one
+                   value per spectrum. Default is the range of each spectrum.
+    :param wweights: Window weights to use instead of calculating them
+
+    The rest of parameters and the returned dictionary are those of getFT
+    but the transforms have the number of spectra as first dimension and
+    there is no "Set" key. The window and the interpolation grid are cached
+    when the spectra share the same k values and range.
+    """
+    k = numpy.asarray(k, dtype=numpy.float)
+    exafs = numpy.asarray(exafs, dtype=numpy.float)
+    if len(k.shape) == 1:
+        k = k.reshape(1, -1)
+    exafs = exafs.reshape(-1, k.shape[1])
+    nSpectra = exafs.shape[0]
+    if krange is None:
+        krange = (k.min(axis=1), k.max(axis=1))
+    kmin = numpy.asarray(krange[0], dtype=numpy.float).reshape(-1, 1)
+    kmax = numpy.asarray(krange[1], dtype=numpy.float).reshape(-1, 1)
+    if (k.shape[0] == 1) and (max(kmin.size, kmax.size) > 1):
+        # different ranges on the same k values
+        k = numpy.zeros((nSpectra, 1), dtype=numpy.float) + k
+    weights, interpolatedDataX, selected, j, w0, w1 = \
+             _getFTGrid(k, kmin, kmax, npoints, kstep, window, apodization)
+    if wweights is not None:
+        weights = numpy.asarray(wweights,
+                                dtype=numpy.float).reshape(-1, k.shape[1])
+    # the signal to be interpolated
+    # the points not selected do not contribute even if they are not finite
+    signal = numpy.where(selected, exafs * weights * pow(k, kweight), 0.0)
+    if k.shape[0] == 1:
+        interpolatedDataY = numpy.take(signal, j[0], axis=1) * w0 + \
+                            numpy.take(signal, j[0] + 1, axis=1) * w1
+    else:
+        signal = signal.ravel()
+        interpolatedDataY = signal[j] * w0 + signal[j + 1] * w1
 
-    ff = numpy.fft.ifft(interpolatedDataY)
+    # ; calculates the fft and generates the conjugated variable (rr)
+    ff = numpy.fft.ifft(interpolatedDataY, axis=-1)
     rstep = numpy.pi / npoints / kstep
     rr = numpy.linspace(0.0, npoints-1, npoints) * rstep
 
-
     # ;
     # ; prepare the results
     # ;
-
     coef = npoints * kstep / numpy.sqrt(numpy.pi) * numpy.sqrt(2.)
-    f12 = coef*numpy.real(ff)             # real part of fft
-    f13 = coef*numpy.imag(ff)*(-1.)       # imaginary part of fft
 
     # ;
     # ; cut the results to the selected interval in r (rrange)
     # ;
-
     goodi = (rr  >= rrange[0]) & (rr  <= rrange[1])
-    f13 = f13[goodi]
-    f12 = f12[goodi]
-    f10 = rr[goodi]
-    f11 = numpy.sqrt( f12*f12 + f13*f13)
-
-    # ;
-    # ; define the result array
-    # ;
-    fourier = numpy.zeros((len(f10),4))
-    fourier[:,0] = f10
-    fourier[:,1] = f11
-    fourier[:,2] = f12
-    fourier[:,3] = f13
-    #print("OK = ", numpy.allclose(fourier, setFT))
+    f12 = coef * numpy.real(ff[:, goodi])           # real part of fft
+    f13 = coef * numpy.imag(ff[:, goodi]) * (-1.)   # imaginary part of fft
+    if not weights.flags.writeable:
+        # the cached grid is not given to the caller
+        weights = weights.copy()
+        interpolatedDataX = interpolatedDataX.copy()
     ddict = {}
-    ddict["Set"] = fourier
     ddict["InterpolatedK"] = interpolatedDataX
     ddict["InterpolatedSignal"] = interpolatedDataY
     ddict["KWeight"] = kweight
     ddict["K"] = k
-    ddict["WindowWeight"] = wweights
-    ddict["FTRadius"] = f10
-    ddict["FTIntensity"] = f11
+    ddict["WindowWeight"] = weights
+    ddict["FTRadius"] = rr[goodi]
+    ddict["FTIntensity"] = numpy.sqrt(f12 * f12 + f13 * f13)
     ddict["FTReal"] = f12
     ddict["FTImaginary"] = f13
     return ddict
@@ -771,48 +1002,82 @@ def getBackFT(fourier,npoint=4096,krange=[2.0,12.0],rstep=None,rmin=None,rmax=No
     	98-10-26 srio@esrf.fr uses Dialog_Message for error messages.
         20141204 srio@esrf.eu Translated to python
     """
+    ddict = getBackFTMultiple(fourier[:, 0], fourier[:, 2], fourier[:, 3],
+                              npoint=npoint, krange=krange, rstep=rstep,
+                              rmin=rmin)
+    #;
+    #; define the output set
+    #;
+    backftr = numpy.zeros((ddict["K"].size,4))
+    backftr[:,0] = ddict["K"]               # the conjugated variable (k [A^-1])
+    backftr[:,1] = ddict["Real"][0]         # the real part of backftr or atra
+    backftr[:,2] = ddict["Modulus"][0]      # the modulus of backftr
+    backftr[:,3] = ddict["Phase"][0]        # the phase
+
+    return backftr
 
+def getBackFTMultiple(r, real, imaginary, npoint=4096, krange=(2.0, 12.0),
+                      rstep=None, rmin=None):
+    """
+    Back Fourier transform of many Fourier transforms sharing the same
+    r values.
+
+    :param r: Array of shape (nPoints, )
+    :param real: Array of shape (nSpectra, nPoints) with the real parts
+    :param imaginary: Array of shape (nSpectra, nPoints) with the imaginary
+                      parts
+    :return: Dictionary with the k values and the real part, the modulus
+             and the phase of the back transforms as arrays of shape
+             (nSpectra, nK)
+
+    The rest of parameters are those of getBackFT.
+    """
+    r = numpy.asarray(r, dtype=numpy.float).reshape(-1)
+    npt = r.size
+    real = numpy.asarray(real, dtype=numpy.float).reshape(-1, npt)
+    imaginary = numpy.asarray(imaginary, dtype=numpy.float).reshape(-1, npt)
+    nSpectra = real.shape[0]
     kmin = krange[0]
     kmax = krange[1]
 
-    npt = len(fourier[:,0])
-    fou = numpy.zeros((npoint,4))
-
-    if rmin == None:
-        rmin = (fourier[:,0]).min()
-    if rmax == None:
-        rmax = (fourier[:,0]).max()
+    if rmin is None:
+        rmin = r.min()
 
     #;
-    #; fill "fou" set
+    #; fill the signal
     #;
-    if rstep == None: #;--- no interpolation
+    signal = numpy.zeros((nSpectra, npoint), dtype=numpy.complex128)
+    if rstep is None: #;--- no interpolation
         nn = int(npt/2)
-        rstep = fourier[nn+1,0] - fourier[nn,0]
-        rstep2 = fourier[nn+2,0] - fourier[nn+1,0]
+        rstep = r[nn+1] - r[nn]
+        rstep2 = r[nn+2] - r[nn+1]
         rdiff = numpy.abs (rstep - rstep2)
         if DEBUG:
             print(' back rstep = %f'%(rstep))
             print(' rdiff = %f'%rdiff)
         if (rdiff >= 1e-6):
             raise ValueError("r griding is not regular; Use rstep keyword -> Abort")
-            #return fou
         ptstart = int(rmin/rstep)
         if DEBUG:
             print(' ptstart = %d'%ptstart)
             print(' ptstart+npt = %d'%(ptstart+npt))
-        fou[ptstart:ptstart+npt,:]=fourier
+        signal[:, ptstart:ptstart+npt] = real - 1.0j * imaginary
     else: #;--- interpolation
-        fou[:,0] = numpy.linspace(0,0,npoint-1,npoint)*rstep
-        fou[:,1] = numpy.interp(fou[:,0],fourier[:,0],fourier[:,1],left=0.0,right=0.0)
-        fou[:,2] = numpy.interp(fou[:,0],fourier[:,0],fourier[:,2],left=0.0,right=0.0)
-        fou[:,3] = numpy.interp(fou[:,0],fourier[:,0],fourier[:,3],left=0.0,right=0.0)
+        grid = numpy.linspace(0.0, npoint-1, npoint) * rstep
+        j = numpy.clip(numpy.searchsorted(r, grid, side="right") - 1,
+                       0, npt - 2)
+        w1 = (grid - r[j]) / (r[j + 1] - r[j])
+        w0 = 1.0 - w1
+        outside = (grid < r[0]) | (grid > r[-1])
+        w0[outside] = 0.0
+        w1[outside] = 0.0
+        signal.real = real[:, j] * w0 + real[:, j + 1] * w1
+        signal.imag = -(imaginary[:, j] * w0 + imaginary[:, j + 1] * w1)
 
     #;
     #; call back fft
     #;
-    c = fou[:,2] - 1.0j * fou[:,3]
-    af = numpy.fft.fft(c)
+    af = numpy.fft.fft(signal, axis=-1)
 
     #;
     #; create the array of the conjugated variable
@@ -820,35 +1085,21 @@ def getBackFT(fourier,npoint=4096,krange=[2.0,12.0],rstep=None,rmin=None,rmax=No
     kstep = numpy.pi/npoint/rstep
     kk = numpy.linspace(0.0,npoint-1,npoint)*kstep
 
-
     #;
     #; prepare the output array
     #;
     coef = npoint*kstep/numpy.sqrt(numpy.pi)*numpy.sqrt(2.) # coefficienu used for direct fft
     coef1 = 2./coef                                         # 2 because we are only
-    afr = coef1 * af.real                                   # real part of back fft
-    afi = coef1 * af.imag                                   # imaginary part of back fft
-
-    #;
-    #; cut the results to the selected interval in k (krange)
-    #;
-
     goodi = (kk  >= kmin) & (kk  <= kmax)
-    afr = afr[goodi]
-    afi = afi[goodi]
-    afk = kk[goodi]
-    nptout = len(afr)
-
-    #;
-    #; define the output set
-    #;
-    backftr = numpy.zeros((nptout,4))
-    backftr[:,0] = afk                  # the conjugated variable (k [A^-1])
-    backftr[:,1] = afr                  # the real part of backftr or atra
-    backftr[:,2] = numpy.sqrt(afr*afr+afi*afi)    # the modulus of backftr
-    backftr[:,3] = numpy.arctan2(afi,afr)          # the phase
+    afr = coef1 * af.real[:, goodi]                         # real part of back fft
+    afi = coef1 * af.imag[:, goodi]                         # imaginary part of back fft
 
-    return backftr
+    ddict = {}
+    ddict["K"] = kk[goodi]
+    ddict["Real"] = afr
+    ddict["Modulus"] = numpy.sqrt(afr*afr+afi*afi)
+    ddict["Phase"] = numpy.arctan2(afi,afr)
+    return ddict
 
 
 class XASClass(object):
@@ -1035,19 +1286,18 @@ def getConfiguration(self, backend=None):
         else:
             return copy.deepcopy(self._configuration["DefaultBackend"])
 
-    def setSpectrum(self, energy, mu, units=None, sanitize=True):
-        self._lastE0CalculationDict = None
-        energy0 = numpy.array(energy, dtype=numpy.float64, copy=True)
-        mu0 = numpy.array(mu, dtype=numpy.float64, copy=True)
-        energy0.shape = -1
-        mu0.shape = -1
-        self._equidistant = False
+    def _sanitizeEnergy(self, energy, units=None):
+        """
+        Return the indices of the energy values to be used in order to
+        have a strictly increasing energy, those energies in eV, the
+        input units and a flag indicating if the energies are equidistant.
+        """
+        energy = numpy.array(energy, dtype=numpy.float64, copy=True)
+        energy.shape = -1
 
-        # TODO: This should become a function to be called on its own
         # make sure data are sorted
         idx = energy.argsort(kind='mergesort')
-        energy = numpy.take(energy0, idx)
-        mu = numpy.take(mu0, idx)
+        energy = numpy.take(energy, idx)
 
         # make sure data are strictly increasing
         delta = energy[1:] - energy[:-1]
@@ -1056,9 +1306,9 @@ def setSpectrum(self, energy, mu, units=None, sanitize=True):
         if delta.min() <= 1.0e-10:
             # force data to be strictly increasing
             # although we do not consider last point
-            idx = numpy.nonzero(delta>0)[0]
-            energy = numpy.take(energy, idx)
-            mu = numpy.take(mu, idx)
+            idx2 = numpy.nonzero(delta>0)[0]
+            energy = numpy.take(energy, idx2)
+            idx = numpy.take(idx, idx2)
             delta = None
 
         if dmin == dmax:
@@ -1075,6 +1325,19 @@ def setSpectrum(self, energy, mu, units=None, sanitize=True):
             raise ValueError("Unhandled units %s" % units)
         elif units.lower() == "kev":
             energy *= 1000.
+        return idx, energy, units, equidistant
+
+    def setSpectrum(self, energy, mu, units=None, sanitize=True):
+        self._lastE0CalculationDict = None
+        energy0 = numpy.array(energy, dtype=numpy.float64, copy=True)
+        mu0 = numpy.array(mu, dtype=numpy.float64, copy=True)
+        energy0.shape = -1
+        mu0.shape = -1
+        self._equidistant = False
+
+        idx, energy, units, equidistant = self._sanitizeEnergy(energy0, units)
+        mu = numpy.take(mu0, idx)
+        if units.lower() == "kev":
             energy0 *= 1000.
 
         # everything went well, update internal variables
@@ -1142,6 +1405,52 @@ def processSpectrum(self):
             ddict["BFT"] = setBFT
         return ddict
 
+    def processSpectra(self, energy, mu, units=None):
+        """
+        Process many spectra sharing the same energy axis at once.
+
+        :param energy: 1D array with the energies
+        :param mu: 2D array of shape (nSpectra, nEnergies)
+        :param units: "eV" or "keV". If None, it is guessed from the energies.
+        :return: Dictionary with the keys of processSpectrum. The values
+                 depending on the spectrum have the number of spectra as
+                 first dimension.
+
+        The results are those of calling setSpectrum and processSpectrum
+        for each spectrum but the edge search, the normalization, the
+        EXAFS extraction and the Fourier transform are performed on the
+        whole set of spectra as array operations. The energy is only
+        sorted and checked once. The analyzer current spectrum is not
+        modified.
+        """
+        nEnergies = numpy.size(energy)
+        idx, energy, units, equidistant = self._sanitizeEnergy(energy, units)
+        mu = numpy.asarray(mu, dtype=numpy.float64).reshape(-1, nEnergies)
+        mu = numpy.take(mu, idx, axis=1)
+        config = self._configuration["DefaultBackend"]["Normalization"]
+        e0 = self._calculateE0Multiple(energy, mu, config, equidistant)
+        ddict = self._normalizeMultiple(energy, mu, e0, config)
+        ddict["Energy"] = energy
+        ddict["Mu"] = mu
+        cleanMu = mu - ddict["NormalizedBackground"]
+        kValues = e2k(energy[None, :] - e0[:, None])
+        ddict.update(self.postEdge(kValues, cleanMu))
+
+        # normalization
+        exafs = (cleanMu - ddict["PostEdgeB"]) / ddict["PostEdgeB"]
+        ddict["EXAFSEnergy"] = k2e(kValues)
+        ddict["EXAFSKValues"] = kValues
+        ddict["EXAFSSignal"] = cleanMu
+        if ddict["KWeight"]:
+            exafs *= pow(kValues, ddict["KWeight"])
+        ddict["EXAFSNormalized"] = exafs
+
+        # FT
+        ddict["FT"] = self.fourierTransform(kValues, exafs,
+                                            kMin=ddict["KMin"],
+                                            kMax=ddict["KMax"])
+        return ddict
+
 
     def fourierTransform(self, k, mu, kMin=None, kMax=None, backend=None):
         if backend not in [None, "Default", "DefaultBackend"]:
@@ -1154,6 +1463,18 @@ def fourierTransform(self, k, mu, kMin=None, kMax=None, backend=None):
         if kMax is None:
             kMax = k.max()
         kRange = config["WindowRange"]
+        if len(k.shape) > 1:
+            # many spectra at once
+            if config["WindowRange"] in [None, "None"]:
+                kRange = [kMin, kMax]
+            else:
+                kRange = [numpy.maximum(kRange[0], kMin),
+                          numpy.minimum(kRange[1], kMax)]
+            return getFTMultiple(k, mu, kRange, npoints=config["Points"],
+                     window=config.get("Window", "Gaussian"),
+                     apodization=config.get("WindowApodization", 0.02),
+                     rrange=config["Range"],
+                     kstep=config["KStep"])
         if config["WindowRange"] in [None, "None"]:
             kRange = [kMin, kMax]
         else:
@@ -1178,7 +1499,13 @@ def postEdge(self, k, mu, backend=None):
         kWeight = config["KWeight"]
         if kMin is None:
             kMin = 2
-        if kMax is None:
+        if len(k.shape) > 1:
+            # many spectra at once, one kMax per spectrum
+            if kMax is None:
+                kMax = k.max(axis=-1)
+            else:
+                kMax = numpy.minimum(k.max(axis=-1), kMax)
+        elif kMax is None:
             kMax = k.max()
         else:
             kMax = min(k.max(), kMax)
@@ -1191,6 +1518,16 @@ def postEdge(self, k, mu, backend=None):
             knots = config["Knots"]["Values"]
             if not hasattr(knots, "__len__"):
                 knots = [knots]
+        if len(k.shape) > 1:
+            ddict = {}
+            ddict["PostEdgeK"] = k
+            ddict["PostEdgeB"] = postEdgeMultiple(k, mu, kMin, kMax,
+                                                  config["Knots"]["Orders"],
+                                                  knots=knots)
+            ddict["KMin"] = kMin
+            ddict["KMax"] = kMax
+            ddict["KWeight"] = kWeight
+            return ddict
         fit0, xNodes, yNodes = postEdge0(k, mu, kMin, kMax,
                          config["Knots"]["Orders"],
                          knots=knots, full=True)
@@ -1280,6 +1617,49 @@ def _calculateE0(self, energy, mu, config):
         self._lastE0CalculationDict = ddict
         return ddict
 
+    def _calculateE0Multiple(self, energy, mu, config, equidistant=False):
+        """
+        Equivalent to _calculateE0 for the 2D array mu. It returns the
+        array of edge energies.
+        """
+        method = config["E0Method"]
+        methodLower = method.lower()
+        e0 = config["E0Value"]
+        if methodLower.endswith("manual"):
+            if e0 is None:
+                raise ValueError("Edge energy not set")
+            return numpy.zeros((mu.shape[0],), dtype=numpy.float) + e0
+        if equidistant:
+            # data do not need to be interpolated
+            eWork = energy
+            muWork = mu
+        else:
+            # the interpolation is the same for all the spectra
+            nWorkingPoints = 10 * energy.size
+            eWork = numpy.linspace(energy[1], energy[-2], nWorkingPoints)
+            i = numpy.clip(numpy.searchsorted(energy, eWork, side="right") - 1,
+                           0, energy.size - 2)
+            slope = (eWork - energy[i]) / (energy[i + 1] - energy[i])
+            muWork = numpy.take(numpy.diff(mu, axis=1), i, axis=1)
+            muWork *= slope
+            muWork += numpy.take(mu, i, axis=1)
+
+        if methodLower.endswith("no smooth"):
+            idx = numpy.gradient(muWork, axis=1).argmax(axis=1)
+            return eWork[idx]
+        elif methodLower.endswith("3pt sg"):
+            npoints = 3
+        elif methodLower.endswith("5pt sg"):
+            npoints = 5
+        elif methodLower.endswith("7pt sg"):
+            npoints = 7
+        elif methodLower.endswith("9pt sg"):
+            npoints = 9
+        else:
+            raise ValueError("Method <%s> not implemented" % method)
+        return XASNormalization.getE0SavitzkyGolayMultiple(eWork, muWork,
+                                                           points=npoints)
+
     def _getRegionsData(self, x0, y0, regions):
         x = x0[:]
         y = y0[:]
@@ -1428,6 +1808,116 @@ def normalize(self, energy=None, mu=None, backend=None):
                 "NormalizedPlotMin": plotMin,
                 "NormalizedPlotMax":plotMax}
 
+    def _getNormalizationModelMatrix(self, method, x, eMin, eMax):
+        # The fitted functions are those of normalize, but the polynomials
+        # are expressed in terms of the energy scaled to [-1, 1] and the
+        # Victoreen terms are scaled in order to have a well conditioned
+        # system of normal equations.
+        methodLower = method.lower()
+        center = 0.5 * (eMax + eMin)
+        scale = 0.5 * (eMax - eMin)
+        if scale <= 0:
+            scale = 1.0
+        if methodLower in ["constant", "linear", "parabolic", "cubic"]:
+            t = (x - center) / scale
+            degree = ["constant", "linear",
+                      "parabolic", "cubic"].index(methodLower)
+            modelMatrix = numpy.empty((x.size, degree + 1), numpy.float)
+            modelMatrix[:, 0] = 1.0
+            for i in range(1, degree + 1):
+                modelMatrix[:, i] = pow(t, i)
+        elif methodLower == "victoreen":
+            modelMatrix = numpy.empty((x.size, 2), numpy.float)
+            modelMatrix[:, 0] = pow(x / center, -3)
+            modelMatrix[:, 1] = pow(x / center, -4)
+        elif methodLower == "modif. victoreen":
+            modelMatrix = numpy.empty((x.size, 2), numpy.float)
+            modelMatrix[:, 0] = pow(x / center, -3)
+            modelMatrix[:, 1] = 1.0
+        else:
+            raise ValueError("Unhandled polynomial <%s> " % method)
+        return modelMatrix
+
+    def _normalizeMultiple(self, energy, mu, e0, config):
+        """
+        Equivalent to normalize for the 2D array mu and the array of edges
+        e0. The least squares fits of all the spectra are solved at once
+        using their normal equations.
+        """
+        eMin = energy.min()
+        eMax = energy.max()
+        nSpectra = mu.shape[0]
+        data = {}
+        edgeValues = {}
+        plotMin = numpy.zeros((nSpectra,), dtype=numpy.float) + eMax
+        plotMax = numpy.zeros((nSpectra,), dtype=numpy.float) + eMin
+        for key in ["PreEdge", "PostEdge"]:
+            # Regions is a single list with 2 * n values delimiting n regions.
+            regions = config [key] ["Regions"]
+            edgeMethod = config[key]["Method"]
+            if edgeMethod.lower() != "polynomial":
+                raise ValueError("Only normalization with polynomials implemented")
+            method = config[key]["Polynomial"]
+            if regions is None:
+                if key == "PreEdge":
+                    regions = [-1000., -40.]
+                else:
+                    regions = [20., 1000.]
+            # number of times each point is used by the fit of each spectrum
+            weight = numpy.zeros(mu.shape, dtype=numpy.float)
+            for i in range(len(regions) // 2):
+                vMin = e0 + regions[2 * i]
+                vMax = e0 + regions[2 * i + 1]
+                if key == "PreEdge":
+                    vMin = numpy.where(vMin < eMin, eMin, vMin)
+                    vMax = numpy.where(vMax < eMin, 0.5 * (eMin + e0), vMax)
+                    plotMin = numpy.minimum(vMin, plotMin)
+                else:
+                    vMin = numpy.where(vMin > eMax, 0.5 * (e0 + eMax), vMin)
+                    vMax = numpy.where(vMax < eMin, eMax, vMax)
+                    plotMax = numpy.maximum(vMax, plotMax)
+                weight += (energy[None, :] >= vMin[:, None]) & \
+                          (energy[None, :] <= vMax[:, None])
+            modelMatrix = self._getNormalizationModelMatrix(method,
+                                                            energy,
+                                                            eMin, eMax)
+            nParameters = modelMatrix.shape[1]
+            products = modelMatrix[:, :, None] * modelMatrix[:, None, :]
+            products.shape = -1, nParameters * nParameters
+            alpha = numpy.dot(weight, products)
+            alpha.shape = nSpectra, nParameters, nParameters
+            beta = numpy.dot(weight * mu, modelMatrix)
+            parameters = solveMultiple(alpha, beta)
+            data[key] = numpy.dot(parameters, modelMatrix.T)
+            edgeValues[key] = (parameters * \
+                    self._getNormalizationModelMatrix(method, e0,
+                                                      eMin, eMax)).sum(axis=1)
+        jump = edgeValues["PostEdge"] - edgeValues["PreEdge"]
+        jumpMethod = config.get("JumpNormalizationMethod", "Flattened")
+        normalizedSpectrum = (mu - data["PreEdge"]) / jump[:, None]
+        if jumpMethod in [0, "Constant", "constant"]:
+            jumpMethod = "Constant"
+        else:
+            if jumpMethod not in [1, "Flattened", "flattened",
+                                  "Flatten", "flatten"]:
+                print("WARNING: Undefined jump normalization method. Assume Flattened")
+            jumpMethod = "Flattened"
+            i = numpy.argmin(energy[None, :] < e0[:, None], axis=1)
+            flattened = numpy.arange(energy.size)[None, :] >= i[:, None]
+            normalizedSpectrum = numpy.where(flattened,
+                        normalizedSpectrum * jump[:, None] / \
+                        (data["PostEdge"] - data["PreEdge"]),
+                        normalizedSpectrum)
+        return {"Jump": jump,
+                "JumpNormalizationMethod":jumpMethod,
+                "Edge":e0,
+                "NormalizedEnergy": energy,
+                "NormalizedMu":normalizedSpectrum,
+                "NormalizedBackground": data["PreEdge"],
+                "NormalizedSignal":data["PostEdge"],
+                "NormalizedPlotMin": plotMin,
+                "NormalizedPlotMax":plotMax}
+
 if __name__ == "__main__":
     import os
     import sys
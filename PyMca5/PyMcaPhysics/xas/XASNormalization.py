@@ -136,6 +136,43 @@ def getE0SavitzkyGolay(energy, mu, points=5, full=False):
         # return the corresponding x value
         return edge
 
+def getE0SavitzkyGolayMultiple(energy, mu, points=5):
+    """
+    Equivalent to getE0SavitzkyGolay applied to each row of the 2D array mu
+    sharing the 1D energy array. It returns an array with the edge of each
+    spectrum.
+    """
+    mu = numpy.asarray(mu, dtype=numpy.float)
+    nSpectra, nPoints = mu.shape
+    # the first derivative as in SGModule.getSavitzkyGolay
+    coeff = SGModule.calc_coeff(points, 2, 1)
+    nCoeff = numpy.size(coeff)
+    N = numpy.size(coeff - 1) // 2
+    yPrime = numpy.zeros(mu.shape, dtype=numpy.float)
+    nValid = nPoints - nCoeff + 1
+    valid = yPrime[:, N:N + nValid]
+    tmp = numpy.empty(valid.shape, dtype=numpy.float)
+    for i in range(nCoeff):
+        if coeff[i] == 0:
+            continue
+        start = nCoeff - 1 - i
+        numpy.multiply(mu[:, start:start + nValid], coeff[i], out=tmp)
+        valid += tmp
+
+    # get the index at maximum value
+    iMax = numpy.argmax(yPrime, axis=1)
+
+    # get the center of mass
+    w = points
+    idx = iMax[:, None] + numpy.arange(-w, w + 1)[None, :]
+    inside = (idx >= 0) & (idx < nPoints)
+    idx = numpy.clip(idx, 0, nPoints - 1)
+    selection = numpy.take(yPrime.ravel(),
+                           idx + (numpy.arange(nSpectra) * nPoints)[:, None])
+    selection = selection * inside
+    return (selection * numpy.take(energy, idx)).sum(axis=1) / \
+           selection.sum(axis=1)
+
 
 def estimateXANESEdge(spectrum, energy=None, npoints=5, full=False,
                       sanitize=True):
@@ -44,6 +44,9 @@
 
 DEBUG = 0
 
+# maximum number of spectra to be processed at once
+BLOCK_SIZE = 500
+
 class XASStackBatch(object):
     def __init__(self, analyzer=None):
         if analyzer is None:
@@ -258,7 +261,6 @@ def processMultipleSpectra(self, x, y,
 
         t0 = time.time()
         totalSpectra = data.shape[0] * data.shape[1]
-        jStep = min(100, data.shape[1])
         if weightPolicy == 2:
             SVD = False
             sigma_b = None
@@ -269,45 +271,45 @@ def processMultipleSpectra(self, x, y,
         else:
             SVD = True
             sigma_b = None
-        last_svd = None
-        #for i in range(10):
+        # the spectra of each block are processed at once
+        jStep = min(BLOCK_SIZE, data.shape[1])
         for i in range(0, data.shape[0]):
-            #print(i)
-            #chunks of nColumns spectra
-            if i == 0:
-                chunk = numpy.zeros((jStep,
-                                     iXMax-iXMin+1),
-                                     numpy.float)
             jStart = 0
-            j = 0
             while jStart < data.shape[1]:
                 jEnd = min(jStart + jStep, data.shape[1])
-                #chunk[:,:(jEnd - jStart)] = data[i, jStart:jEnd, iXMin:iXMax+1].T
                 spectra  = data[i, jStart:jEnd, iXMin:iXMax+1]
-                nSpectra = spectra.shape[0]
-                for spectrumNumber in range(nSpectra):
-                    if mask is not None:
-                        if mask[i, j] == 0:
-                            continue
-                    self._analyzer.setSpectrum(x, spectra[spectrumNumber])
-                    ddict = self._analyzer.processSpectrum()
-                    spectrumY[i, j] = ddict["Mu"]
-                    e0[i, j] = ddict["Edge"]
-                    jump[i, j] = ddict["Jump"]
-                    #normalizedX[i, j] = ddict["NormalizedEnergy"][normalizedIdx]
-                    normalizedY[i, j] = ddict["NormalizedMu"][normalizedIdx]
-                    #exafsX[i, j] = ddict["EXAFSKValues"][exafsIdx]
-                    exafsY[i, j] = ddict["EXAFSNormalized"][exafsIdx]
-                    #ftX[i, j] = ddict["FT"]["FTRadius"]
-                    ftY[i, j] = ddict["FT"]["FTIntensity"]
-                    ftImaginary[i, j] = ddict["FT"]["FTImaginary"]
-                    j +=1
+                # masked pixels and spectra without an edge (empty, flat or
+                # with non finite values) are not processed and their
+                # results are left to zero
+                valid = numpy.isfinite(spectra).all(axis=1)
+                valid[valid] = spectra[valid].max(axis=1) > \
+                               spectra[valid].min(axis=1)
+                if mask is not None:
+                    valid &= mask[i, jStart:jEnd] != 0
+                if not valid.any():
+                    jStart = jEnd
+                    continue
+                ddict = self._analyzer.processSpectra(x, spectra[valid])
+                results = [(spectrumY, ddict["Mu"]),
+                           (e0, ddict["Edge"]),
+                           (jump, ddict["Jump"]),
+                           (normalizedY, ddict["NormalizedMu"][:, normalizedIdx]),
+                           (exafsY, ddict["EXAFSNormalized"][:, exafsIdx]),
+                           (ftY, ddict["FT"]["FTIntensity"]),
+                           (ftImaginary, ddict["FT"]["FTImaginary"])]
+                for dataset, values in results:
+                    if not valid.all():
+                        block = numpy.zeros((valid.size,) + values.shape[1:],
+                                            dtype=values.dtype)
+                        block[valid] = values
+                        values = block
+                    dataset[i, jStart:jEnd] = values
                 jStart = jEnd
         outputDict = {}
         outputDict["names"] = ["Jump", "Edge"]
         output = numpy.zeros((2, e0.shape[0], e0.shape[1]), dtype = e0.dtype)
-        output[0, :] = jump.value
-        output[1, :] = e0.value
+        output[0, :] = jump[:]
+        output[1, :] = e0[:]
         outputDict["images"] = output
         out.flush()
         out.close()
@@ -32,6 +32,7 @@
 __copyright__ = "European Synchrotron Radiation Facility, Grenoble, France"
 import os
 import sys
+import hashlib
 import numpy
 import copy
 from .Strategies import STRATEGIES
@@ -44,11 +45,81 @@
 from PyMca5.PyMcaIO import ConfigDict
 from PyMca5.PyMcaMath.fitting import Gefit
 from PyMca5 import PyMcaDataDir
+from PyMca5.PyMcaCore import DiskCache
+import PyMca5
 DEBUG = 0
 #"python ClassMcaTheory.py -s1.1 --file=03novs060sum.mca --pkm=McaTheory.dat --continuum=0 --strip=1 --sumflag=1 --maxiter=4"
 CONTINUUM_LIST = [None,'Constant','Linear','Parabolic','Linear Polynomial','Exp. Polynomial']
 OLDESCAPE = 0
 MAX_ATTENUATION = 1.0E-300
+# keep the calculated peaks on disk to be reused by other instances and
+# processes in the PyMca cache directory. The default can be set with the
+# PYMCA_MCATHEORY_CACHE environment variable and the 'usecache' key of the
+# fit section of the configuration overrides it.
+USE_CACHE = os.getenv("PYMCA_MCATHEORY_CACHE", "0").lower() in \
+                                            ["1", "true", "yes", "on"]
+_CACHE = None
+
+# the constants of each element the peaks are calculated from
+_ELEMENT_KEYS = ['Z', 'mass', 'density', 'binding', 'omegak',
+                 'omegal1', 'omegal2', 'omegal3', 'omegam1', 'omegam2',
+                 'omegam3', 'omegam4', 'omegam5', 'CosterKronig']
+
+# element -> (XCOM table, digest) of the tables replaced at run time
+_XCOM_DIGESTS = {}
+
+def _getCache(useCache=None):
+    global _CACHE
+    if useCache is None:
+        useCache = USE_CACHE
+    if not useCache:
+        return None
+    if _CACHE is None:
+        _CACHE = DiskCache.DiskCache()
+    if not _CACHE.isEnabled():
+        return None
+    return _CACHE
+
+def _getXcomDigest(ele):
+    """
+    Return None if the element uses the attenuation data of the PyMca data
+    files (loaded or not) or the digest of the table replacing them.
+    """
+    xcom = Elements.Element[ele].get('xcom', None)
+    if (xcom is None) or Elements.isDefaultXcomData(ele):
+        return None
+    cached = _XCOM_DIGESTS.get(ele, None)
+    if (cached is not None) and (cached[0] is xcom):
+        return cached[1]
+    attenuation = hashlib.sha1()
+    for key in ['energy', 'coherent', 'compton', 'photo', 'pair']:
+        attenuation.update(numpy.ascontiguousarray(xcom[key],
+                                        dtype=numpy.float64).tobytes())
+    digest = attenuation.hexdigest()
+    _XCOM_DIGESTS[ele] = (xcom, digest)
+    return digest
+
+def _getElementsState():
+    """
+    Return the global data of the Elements module used to calculate the
+    peaks. They can be modified at run time (user defined materials, other
+    shell constants or attenuation coefficients) and they are part of the
+    cache key. Only called when the cache is used.
+    """
+    constants = []
+    attenuation = []
+    for ele in Elements.ElementList:
+        constants.append([Elements.Element[ele].get(key, None) \
+                          for key in _ELEMENT_KEYS])
+        attenuation.append(_getXcomDigest(ele))
+    return [Elements.Material,
+            constants,
+            repr(Elements.ElementShellRates),
+            repr(Elements.ElementShellTransitions),
+            Elements.LOGLOG,
+            Elements.VEIGELE,
+            attenuation]
+
 class McaTheory(object):
     def __init__(self, initdict=None, filelist=None, **kw):
         self.ydata0  = None
@@ -202,6 +273,9 @@ def __configure(self):
             self.config['fit']['energyscatter']   = [1]
         maxenergy = None
         energylist= None
+        energyweight = None
+        energyflag = None
+        energyscatter = None
         if self.config['fit']['energy'] is not None:
           if max(self.config['fit']['energyflag']) == 0:
               energylist = None
@@ -246,6 +320,137 @@ def __configure(self):
         self.config['detector']['ethreshold'] = ethreshold
         self.config['detector']['ithreshold'] = ithreshold
         self.config['detector']['nthreshold'] = nthreshold
+        peaks = None
+        cache = _getCache(self.config['fit'].get('usecache', None))
+        if cache is not None:
+            key = self.__getCacheKey()
+            peaks = cache.load(key)
+            if peaks is not None:
+                if DEBUG:
+                    print("Using cached peak configuration %s" % key)
+                self.__setElementsEnergy(maxenergy)
+                if peaks['fisx'] is not None:
+                    self.config['fisx'] = peaks['fisx']
+        if peaks is None:
+            peaks = self.__calculatePeaks(maxenergy, energylist, energyweight,
+                                          energyflag, energyscatter)
+            if cache is not None:
+                cache.save(key, peaks)
+        PEAKS0 = peaks['PEAKS0']
+        PEAKS0ESCAPE = peaks['PEAKS0ESCAPE']
+        PEAKS0NAMES = peaks['PEAKS0NAMES']
+        PEAKSW = peaks['PEAKSW']
+        HYPERMET = peaks['HYPERMET']
+        NGLOBAL = peaks['NGLOBAL']
+        PARAMETERS = peaks['PARAMETERS']
+        CONTINUUM = self.config['fit']['continuum']
+        self._fluoRates = peaks['fluorates']
+        self.PEAKS0     = PEAKS0
+        self.PEAKS0ESCAPE = PEAKS0ESCAPE
+        #for i in range(len(PEAKS0)):
+        #    print self.PEAKS0[i]
+        #    print self.PEAKS0ESCAPE[i]
+        self.PEAKS0NAMES= PEAKS0NAMES
+        self.PEAKSW     = PEAKSW
+        # concatenated peak table used by mcatheoryJacobian, built on demand
+        self._peakTable = None
+        self.FASTER     = 1
+        self.__HYPERMET   = HYPERMET
+        self.NGLOBAL    = NGLOBAL
+        self.PARAMETERS = PARAMETERS
+        self.ESCAPE     = self.config['fit']['escapeflag']
+        self.__SUM        = self.config['fit']['sumflag']
+        self.__CONTINUUM     = CONTINUUM
+        self.MAXITER    = self.config['fit']['maxiter']
+        self.STRIP      = self.config['fit']['stripflag']
+        #if self.laststrip is not None:
+        self.__mycounter = 0
+        calculateStrip = False
+        if (self.STRIP != self.laststrip) or \
+           (self.config['fit']['stripalgorithm'] != self.laststripalgorithm) or \
+           (self.config['fit']['stripfilterwidth'] != self.laststripfilterwidth) or \
+           (self.config['fit']['stripanchorsflag'] != self.laststripanchorsflag) or \
+           (self.config['fit']['stripanchorslist'] != self.laststripanchorslist):
+            calculateStrip = True
+        if not calculateStrip:
+            if self.config['fit']['stripalgorithm'] == 1:
+                #checking if needed to calculate SNIP
+                if (self.config['fit']['snipwidth'] != self.lastsnipwidth):
+                    calculateStrip = True
+            else:
+                #checking if needed to calculate strip
+                if (self.config['fit']['stripiterations'] != self.laststripiterations) or \
+                   (self.config['fit']['stripwidth'] != self.laststripwidth) or \
+                   (self.config['fit']['stripconstant'] != self.laststripconstant):
+                    calculateStrip = True
+        if (self.lastxmin != self.config['fit']['xmin']) or\
+           (self.lastxmax != self.config['fit']['xmax']):
+            if self.ydata0 is not None:
+                if DEBUG:
+                    print("Limits changed")
+                self.setData(x=self.xdata0,
+                             y=self.ydata0,
+                             sigmay=self.sigmay0,
+                             xmin = self.config['fit']['xmin'],
+                             xmax = self.config['fit']['xmax'],
+                             time = self.__lastTime)
+                return
+
+        if hasattr(self, "xdata"):
+            if self.STRIP:
+                if calculateStrip:
+                    if DEBUG:
+                        print("Calling to calculate non analytical background in config")
+                    self.__getselfzz()
+                else:
+                    if DEBUG:
+                        print("Using previous non analytical background in config")
+                self.datatofit = numpy.concatenate((self.xdata,
+                                self.ydata-self.zz, self.sigmay),1)
+                self.laststrip = 1
+            else:
+                if DEBUG:
+                    print("Using previous data")
+                self.datatofit = numpy.concatenate((self.xdata,
+                                self.ydata, self.sigmay),1)
+                self.laststrip = 0
+
+    def __getCacheKey(self):
+        # the configuration sections the peaks depend on
+        fitKeys = ['energy', 'energyweight', 'energyflag', 'energyscatter',
+                   'scatterflag', 'deltaonepeak', 'escapeflag', 'fitfunction',
+                   'hypermetflag', 'continuum', 'linpolorder', 'exppolorder']
+        fit = dict([(key, self.config['fit'].get(key, None)) \
+                    for key in fitKeys])
+        sections = {}
+        for key in ['detector', 'attenuators', 'multilayer', 'materials',
+                    'peaks', 'concentrations']:
+            sections[key] = self.config.get(key, {})
+        return DiskCache.getKey(PyMca5.version(), "McaTheory", fit, sections,
+                                self.attflag, OLDESCAPE, FISX,
+                                _getElementsState())
+
+    def __setElementsEnergy(self, maxenergy):
+        # same side effect on the Elements module as calculating the peaks
+        for element in self.config['peaks'].keys():
+            if len(element) > 1:
+                ele = element[0:1].upper()+element[1:2].lower()
+            else:
+                ele = element.upper()
+            if maxenergy != Elements.Element[ele]['buildparameters']['energy']:
+                Elements.updateDict (energy= maxenergy)
+
+    def __calculatePeaks(self, maxenergy, energylist, energyweight,
+                         energyflag, energyscatter):
+        """
+        Calculate the description of the fluorescence, escape and scatter
+        peaks to be fitted and the names of the fit parameters.
+        """
+        deltaonepeak = self.config['fit']['deltaonepeak']
+        detele       = self.config['detector']['detele']
+        ethreshold   = self.config['detector']['ethreshold']
+        nthreshold   = self.config['detector']['nthreshold']
+        ithreshold   = self.config['detector']['ithreshold']
         usematrix = 0
         attenuatorlist =[]
         filterlist = []
@@ -879,73 +1084,20 @@ def __configure(self):
                             #PARAMETERS.append("Scatter Peak")
                             #PARAMETERS.append("Scatter Compton")
 
-        self.PEAKS0     = PEAKS0
-        self.PEAKS0ESCAPE = PEAKS0ESCAPE
-        #for i in range(len(PEAKS0)):
-        #    print self.PEAKS0[i]
-        #    print self.PEAKS0ESCAPE[i]
-        self.PEAKS0NAMES= PEAKS0NAMES
-        self.PEAKSW     = PEAKSW
-        self.FASTER     = 1
-        self.__HYPERMET   = HYPERMET
-        self.NGLOBAL    = NGLOBAL
-        self.PARAMETERS = PARAMETERS
-        self.ESCAPE     = self.config['fit']['escapeflag']
-        self.__SUM        = self.config['fit']['sumflag']
-        self.__CONTINUUM     = CONTINUUM
-        self.MAXITER    = self.config['fit']['maxiter']
-        self.STRIP      = self.config['fit']['stripflag']
-        #if self.laststrip is not None:
-        self.__mycounter = 0
-        calculateStrip = False
-        if (self.STRIP != self.laststrip) or \
-           (self.config['fit']['stripalgorithm'] != self.laststripalgorithm) or \
-           (self.config['fit']['stripfilterwidth'] != self.laststripfilterwidth) or \
-           (self.config['fit']['stripanchorsflag'] != self.laststripanchorsflag) or \
-           (self.config['fit']['stripanchorslist'] != self.laststripanchorslist):
-            calculateStrip = True
-        if not calculateStrip:
-            if self.config['fit']['stripalgorithm'] == 1:
-                #checking if needed to calculate SNIP
-                if (self.config['fit']['snipwidth'] != self.lastsnipwidth):
-                    calculateStrip = True
-            else:
-                #checking if needed to calculate strip
-                if (self.config['fit']['stripiterations'] != self.laststripiterations) or \
-                   (self.config['fit']['stripwidth'] != self.laststripwidth) or \
-                   (self.config['fit']['stripconstant'] != self.laststripconstant):
-                    calculateStrip = True
-        if (self.lastxmin != self.config['fit']['xmin']) or\
-           (self.lastxmax != self.config['fit']['xmax']):
-            if self.ydata0 is not None:
-                if DEBUG:
-                    print("Limits changed")
-                self.setData(x=self.xdata0,
-                             y=self.ydata0,
-                             sigmay=self.sigmay0,
-                             xmin = self.config['fit']['xmin'],
-                             xmax = self.config['fit']['xmax'],
-                             time = self.__lastTime)
-                return
-
-        if hasattr(self, "xdata"):
-            if self.STRIP:
-                if calculateStrip:
-                    if DEBUG:
-                        print("Calling to calculate non analytical background in config")
-                    self.__getselfzz()
-                else:
-                    if DEBUG:
-                        print("Using previous non analytical background in config")
-                self.datatofit = numpy.concatenate((self.xdata,
-                                self.ydata-self.zz, self.sigmay),1)
-                self.laststrip = 1
-            else:
-                if DEBUG:
-                    print("Using previous data")
-                self.datatofit = numpy.concatenate((self.xdata,
-                                self.ydata, self.sigmay),1)
-                self.laststrip = 0
+        if usematrix:
+            # the fisx corrections are only calculated for a matrix
+            fisx = self.config['fisx']
+        else:
+            fisx = None
+        return {'PEAKS0': PEAKS0,
+                'PEAKS0ESCAPE': PEAKS0ESCAPE,
+                'PEAKS0NAMES': PEAKS0NAMES,
+                'PEAKSW': PEAKSW,
+                'HYPERMET': HYPERMET,
+                'NGLOBAL': NGLOBAL,
+                'PARAMETERS': PARAMETERS,
+                'fluorates': self._fluoRates,
+                'fisx': fisx}
 
     def setdata(self, *var, **kw):
         print("ClassMcaTheory.setdata deprecated, please use setData")
@@ -1212,124 +1364,19 @@ def __getselfzz(self):
     def getPeakMatrixContribution(self,param0,t0=None,hypermet=None,
                                   continuum=None,summing=None):
         """
-        For the time being a huge copy paste from mcatheory
+        Return the contribution of each group of peaks for unit area as the
+        columns of a matrix with as many rows as points.
         """
-        if continuum is None:
-            continuum = self.__CONTINUUM
         if hypermet is None:
             hypermet = self.__HYPERMET
-        if summing is None:
-            summing  = self.__SUM
         param= numpy.array(param0)
-        #param= numpy.ones(param.shape, numpy.float)
         if t0 is None:t0 = self.xdata
-        x    = numpy.array(t0)
-        matrix = numpy.zeros((len(x),len(param)-self.NGLOBAL)).astype(numpy.float)
-
-
+        x    = numpy.array(t0).ravel()
         zero = param[0]
         gain = param[1]
         energy=zero + gain * x
-        #print energy
-        noise= param[2] * param[2]
-        fano = param[3] * 2.3548*2.3548*0.00385
-        #t=time.time()
-        PEAKS0 = self.PEAKS0
-        PEAKS0ESCAPE = self.PEAKS0ESCAPE
-        PEAKSW = self.PEAKSW
-        PARAMETERS = self.PARAMETERS
-        FASTER = 0
-        for i in range(len(param[self.NGLOBAL:])):
-            result = 0 * energy
-            if self.ESCAPE:
-                #area = param[NGLOBAL+i]
-                (r,c) = (PEAKS0[i]).shape
-                PEAKSW[i][0:r,0] = PEAKS0[i][:,0] * 1 * gain
-                PEAKSW[i][0:r,1] = PEAKS0[i][:,1] * 1.0
-                PEAKSW[i][0:r,2] = numpy.sqrt(noise + PEAKS0[i][:,1] * fano)
-                #escape
-                if OLDESCAPE:
-                    PEAKSW[i][r:,0] = PEAKSW[i][0:r,0] * PEAKS0[i][:,3]
-                    PEAKSW[i][r:,1] = PEAKS0[i][:,1] - self.config['detector']['detene']
-                    PEAKSW[i][r:,2] = numpy.sqrt(noise + \
-                                        (PEAKSW[i][r:,1]>0) * PEAKSW[i][r:,1] * fano)
-                else:
-                    ii=0
-                    j=0
-                    for esc_group in PEAKS0ESCAPE[i]:
-                        for esc_line in esc_group:
-                            esc_ene  = esc_line[0] * 1.0
-                            esc_rate = esc_line[1]
-                            PEAKSW[i][j+r,0] =  PEAKSW[i][ii,0] * esc_rate
-                            PEAKSW[i][j+r,1] =  esc_ene
-                            j = j + 1
-                        ii = ii + 1
-                    PEAKSW[i][r:, 2] = numpy.sqrt(noise + \
-                                    (PEAKSW[i][r:,1]>0) * PEAKSW[i][r:,1] * fano)
-                (rw,cw) = (PEAKSW[i]).shape
-                if 0 and self.PARAMETERS[self.NGLOBAL+i] =='Fe K':
-                  for ii in range(rw):
-                    if ii < r:
-                        print(self.PARAMETERS[self.NGLOBAL+i],"PEAK ",ii,PEAKSW[i][ii])
-                    else:
-                        print(self.PARAMETERS[self.NGLOBAL+i],"PEAKesc ",ii,PEAKSW[i][ii])
-                #print PARAMETERS[self.NGLOBAL+i]
-                #print PEAKSW[i][:,1]
-                #print PEAKS0ESCAPE[i]
-                #for j in range(PEAKSW[i].shape[0]):
-                #    print "H = ", PEAKSW[i][j*r,0],"E = ",PEAKSW[i][j*r,1]
-
-                #if HYPERMET:
-                if hypermet:
-                    PEAKSW[i] [0:r,3] = param[PARAMETERS.index('ST AreaR')]
-                    PEAKSW[i] [:,4] = param[PARAMETERS.index('ST SlopeR')]
-                    PEAKSW[i] [0:r,5] = param[PARAMETERS.index('LT AreaR')]
-                    PEAKSW[i] [:,6] = param[PARAMETERS.index('LT SlopeR')]
-                    PEAKSW[i] [0:r,7] = param[PARAMETERS.index('STEP HeightR')]
-                    #neglect tails in escape peaks
-                    PEAKSW[i] [r:,3] = 0.0
-                    PEAKSW[i] [r:,5] = 0.0
-                    PEAKSW[i] [r:,7] = 0.0
-                if not FASTER:
-                    #if HYPERMET:
-                    if hypermet:
-                        if i == 0:
-                            result = SpecfitFuns.ahypermet(PEAKSW[i],energy,hypermet)
-                        else:
-                            result += SpecfitFuns.ahypermet(PEAKSW[i],energy,hypermet)
-                    else:
-                        if i == 0:
-                            result = SpecfitFuns.apvoigt(PEAKSW[i],energy)
-                        else:
-                            result += SpecfitFuns.apvoigt(PEAKSW[i],energy)
-            else:
-                PEAKSW[i][:,0] = PEAKS0[i][:,0] * param[self.NGLOBAL+i] * gain
-                PEAKSW[i][:,1] = PEAKS0[i][:,1] * 1.0
-                PEAKSW[i][:,2] = numpy.sqrt(noise + PEAKS0[i][:,1] * fano)
-                if hypermet:
-                    PEAKSW[i] [:,3] = param[PARAMETERS.index('ST AreaR')]
-                    PEAKSW[i] [:,4] = param[PARAMETERS.index('ST SlopeR')]
-                    PEAKSW[i] [:,5] = param[PARAMETERS.index('LT AreaR')]
-                    PEAKSW[i] [:,6] = param[PARAMETERS.index('LT SlopeR')]
-                    PEAKSW[i] [:,7] = param[PARAMETERS.index('STEP HeightR')]
-                else:
-                    #pseudo voigt
-                    PEAKSW[i] [:,3] = param[PARAMETERS.index('Eta Factor')]
-                if not FASTER:
-                    if hypermet:
-                        if i == 0:
-                            result = SpecfitFuns.ahypermet(PEAKSW[i],energy,hypermet)
-                        else:
-                            result += SpecfitFuns.ahypermet(PEAKSW[i],energy,hypermet)
-                    else:
-                        if i == 0:
-                            result = SpecfitFuns.apvoigt(PEAKSW[i],energy)
-                        else:
-                            result += SpecfitFuns.apvoigt(PEAKSW[i],energy)
-            #print "shape = ",result.shape
-            #print "matrix = ",matrix.shape
-            matrix[:,i] = result[:,0]
-        return matrix
+        a, offsets = self._getPeakParameters(param, hypermet)
+        return self._getGroupProfiles(a, offsets, energy, hypermet).T
 
     def linearMcaTheory(self, param0, t0, hypermet=None, continuum=None, summing=None):
         if continuum is None:
@@ -1367,125 +1414,20 @@ def mcatheory(self,param0,t0,hypermet=None,continuum=None,summing=None):
         zero = param[0]
         gain = param[1]
         energy=zero + gain * x
-        #print energy
-        noise= param[2] * param[2]
-        fano = param[3] * 2.3548*2.3548*0.00385
-        #t=time.time()
-        PEAKS0 = self.PEAKS0
-        PEAKS0ESCAPE = self.PEAKS0ESCAPE
-        PEAKSW = self.PEAKSW
-        PARAMETERS = self.PARAMETERS
-        FASTER = self.FASTER
-        for i in range(len(param[self.NGLOBAL:])):
-            if self.ESCAPE:
-                #area = param[NGLOBAL+i]
-                (r,c) = (PEAKS0[i]).shape
-                PEAKSW[i][0:r,0] = PEAKS0[i][:,0] * param[self.NGLOBAL+i] * gain
-                PEAKSW[i][0:r,1] = PEAKS0[i][:,1] * 1.0
-                PEAKSW[i][0:r,2] = numpy.sqrt(noise + PEAKS0[i][:,1] * fano)
-                #escape
-                if OLDESCAPE:
-                    PEAKSW[i][r:,0] = PEAKSW[i][0:r,0] * PEAKS0[i][:,3]
-                    PEAKSW[i][r:,1] = PEAKS0[i][:,1] - self.config['detector']['detene']
-                    PEAKSW[i][r:,2] = numpy.sqrt(noise + \
-                                        (PEAKSW[i][r:,1]>0) * PEAKSW[i][r:,1] * fano)
-                else:
-                    ii=0
-                    j=0
-                    for esc_group in PEAKS0ESCAPE[i]:
-                        for esc_line in esc_group:
-                            esc_ene  = esc_line[0] * 1.0
-                            esc_rate = esc_line[1]
-                            PEAKSW[i][j+r,0] =  PEAKSW[i][ii,0] * esc_rate
-                            PEAKSW[i][j+r,1] =  esc_ene
-                            j = j + 1
-                        ii = ii + 1
-                    PEAKSW[i][r:, 2] = numpy.sqrt(noise + \
-                                    (PEAKSW[i][r:,1]>0) * PEAKSW[i][r:,1] * fano)
-                (rw,cw) = (PEAKSW[i]).shape
-                if 0 and self.PARAMETERS[self.NGLOBAL+i] =='Fe K':
-                  for ii in range(rw):
-                    if ii < r:
-                        print(self.PARAMETERS[self.NGLOBAL+i],"PEAK ",ii,PEAKSW[i][ii])
-                    else:
-                        print(self.PARAMETERS[self.NGLOBAL+i],"PEAKesc ",ii,PEAKSW[i][ii])
-                #print PARAMETERS[self.NGLOBAL+i]
-                #print PEAKSW[i][:,1]
-                #print PEAKS0ESCAPE[i]
-                #for j in range(PEAKSW[i].shape[0]):
-                #    print "H = ", PEAKSW[i][j*r,0],"E = ",PEAKSW[i][j*r,1]
-
-                #if HYPERMET:
-                if hypermet:
-                    PEAKSW[i] [0:r,3] = param[PARAMETERS.index('ST AreaR')]
-                    PEAKSW[i] [:,4] = param[PARAMETERS.index('ST SlopeR')]
-                    PEAKSW[i] [0:r,5] = param[PARAMETERS.index('LT AreaR')]
-                    PEAKSW[i] [:,6] = param[PARAMETERS.index('LT SlopeR')]
-                    PEAKSW[i] [0:r,7] = param[PARAMETERS.index('STEP HeightR')]
-                    #neglect tails in escape peaks
-                    PEAKSW[i] [r:,3] = 0.0
-                    PEAKSW[i] [r:,5] = 0.0
-                    PEAKSW[i] [r:,7] = 0.0
-                else:
-                    PEAKSW[i] [:,3] = param[PARAMETERS.index('Eta Factor')]
-                if not FASTER:
-                    print("not FASTER")
-                    #if HYPERMET:
-                    if hypermet:
-                        if i == 0:
-                            result = SpecfitFuns.ahypermet(PEAKSW[i],energy,hypermet)
-                        else:
-                            result += SpecfitFuns.ahypermet(PEAKSW[i],energy,hypermet)
-                    else:
-                        if i == 0:
-                            result = SpecfitFuns.apvoigt(PEAKSW[i],energy)
-                        else:
-                            result += SpecfitFuns.apvoigt(PEAKSW[i],energy)
-            else:
-                PEAKSW[i][:,0] = PEAKS0[i][:,0] * param[self.NGLOBAL+i] * gain
-                PEAKSW[i][:,1] = PEAKS0[i][:,1] * 1.0
-                PEAKSW[i][:,2] = numpy.sqrt(noise + PEAKS0[i][:,1] * fano)
-                if hypermet:
-                    PEAKSW[i] [:,3] = param[PARAMETERS.index('ST AreaR')]
-                    PEAKSW[i] [:,4] = param[PARAMETERS.index('ST SlopeR')]
-                    PEAKSW[i] [:,5] = param[PARAMETERS.index('LT AreaR')]
-                    PEAKSW[i] [:,6] = param[PARAMETERS.index('LT SlopeR')]
-                    PEAKSW[i] [:,7] = param[PARAMETERS.index('STEP HeightR')]
-                else:
-                    PEAKSW[i] [:,3] = param[PARAMETERS.index('Eta Factor')]
-                if not FASTER:
-                    if hypermet:
-                        if i == 0:
-                            result = SpecfitFuns.ahypermet(PEAKSW[i],energy,hypermet)
-                        else:
-                            result += SpecfitFuns.ahypermet(PEAKSW[i],energy,hypermet)
-                    else:
-                        if i == 0:
-                            result = SpecfitFuns.apvoigt(PEAKSW[i],energy)
-                        else:
-                            result += SpecfitFuns.apvoigt(PEAKSW[i],energy)
-        #print PARAMETERS[self.NGLOBAL+4]
-        #print self.PEAKS0NAMES[4]
-        #print PEAKSW[4]
-        #print "loop takes ",time.time()-t
-        #loop takes 0.006 seconds
-        #t=time.time()
-        if FASTER:
-            if len(PEAKSW[:]):
-                a=numpy.concatenate(PEAKSW[:])
-                #t=time.time()
-                #result = SpecfitFuns.agauss(a,energy)
-                #if HYPERMET:
-                if hypermet:
+        a, offsets = self._getPeakParameters(param, hypermet)
+        if len(a):
+            # all the peaks of all the groups in a single call
+            a[:, 0] *= numpy.repeat(param[self.NGLOBAL:],
+                                    numpy.diff(offsets))
+            if hypermet:
+                if self.FASTER:
                     result = SpecfitFuns.fastahypermet(a,energy,hypermet)
                 else:
-                    result = SpecfitFuns.apvoigt(a,energy)
+                    result = SpecfitFuns.ahypermet(a,energy,hypermet)
             else:
-                result = 0.0 * x
-            #print "eval = ",time.time()-t
-        #evaluation takes 0.058 seconds
-        #with less peaks 0.036
-        #with tabulated function 0.018
+                result = SpecfitFuns.apvoigt(a,energy)
+        else:
+            result = 0.0 * x
         if continuum:
             result += self.continuum(param,x)
         if summing:
@@ -1504,6 +1446,146 @@ def mcatheory(self,param0,t0,hypermet=None,continuum=None,summing=None):
         else:
             return result
 
+    def _getPeakTable(self):
+        """
+        Return the fixed part of all the peaks of all the fitted groups
+        concatenated as a dictionary of arrays: heights (per unit area and
+        gain), energies, escape (1 for escape peaks) and offsets (the first
+        row of each group plus the total number of rows).
+        """
+        if self._peakTable is not None:
+            return self._peakTable
+        heights = []
+        energies = []
+        escape = []
+        offsets = [0]
+        for i in range(len(self.PEAKS0)):
+            peaks = self.PEAKS0[i]
+            r = peaks.shape[0]
+            heights.append(peaks[:, 0])
+            energies.append(peaks[:, 1])
+            escape.append(numpy.zeros(r))
+            if self.ESCAPE:
+                if OLDESCAPE:
+                    heights.append(peaks[:, 0] * peaks[:, 3])
+                    energies.append(peaks[:, 1] - \
+                                    self.config['detector']['detene'])
+                else:
+                    escHeights = []
+                    escEnergies = []
+                    ii = 0
+                    for esc_group in self.PEAKS0ESCAPE[i]:
+                        for esc_line in esc_group:
+                            escHeights.append(peaks[ii, 0] * esc_line[1])
+                            escEnergies.append(esc_line[0] * 1.0)
+                        ii = ii + 1
+                    heights.append(numpy.array(escHeights, numpy.float))
+                    energies.append(numpy.array(escEnergies, numpy.float))
+                escape.append(numpy.ones(len(heights[-1])))
+                r = r + len(heights[-1])
+            offsets.append(offsets[-1] + r)
+        if len(heights):
+            heights = numpy.concatenate(heights).astype(numpy.float)
+            energies = numpy.concatenate(energies).astype(numpy.float)
+            escape = numpy.concatenate(escape) > 0
+        else:
+            heights = numpy.zeros((0,), numpy.float)
+            energies = numpy.zeros((0,), numpy.float)
+            escape = numpy.zeros((0,), numpy.bool_)
+        self._peakTable = {'heights': heights,
+                           'energies': energies,
+                           'escape': escape,
+                           'offsets': offsets}
+        return self._peakTable
+
+    def _getPeakParameters(self, param, hypermet=None):
+        """
+        Return the table of all the peaks of all the groups for unit areas
+        in the format expected by SpecfitFuns and the offsets of the groups
+        in that table.
+        """
+        if hypermet is None:
+            hypermet = self.__HYPERMET
+        PARAMETERS = self.PARAMETERS
+        gain = param[1]
+        noise= param[2] * param[2]
+        fano = param[3] * 2.3548*2.3548*0.00385
+        table = self._getPeakTable()
+        escape = table['escape']
+        if self.__HYPERMET:
+            a = numpy.zeros((len(table['heights']), 3 + 5), numpy.float)
+        else:
+            a = numpy.zeros((len(table['heights']), 3 + 1), numpy.float)
+        a[:, 0] = table['heights'] * gain
+        a[:, 1] = table['energies']
+        a[:, 2] = numpy.sqrt(noise + (a[:, 1] > 0) * a[:, 1] * fano)
+        if hypermet:
+            #neglect tails in escape peaks
+            a[:, 3] = param[PARAMETERS.index('ST AreaR')] * (~escape)
+            a[:, 4] = param[PARAMETERS.index('ST SlopeR')]
+            a[:, 5] = param[PARAMETERS.index('LT AreaR')] * (~escape)
+            a[:, 6] = param[PARAMETERS.index('LT SlopeR')]
+            a[:, 7] = param[PARAMETERS.index('STEP HeightR')] * (~escape)
+        else:
+            a[:, 3] = param[PARAMETERS.index('Eta Factor')]
+        return a, table['offsets']
+
+    def _getGroupProfiles(self, a, offsets, energy, hypermet):
+        """
+        Return the sum of the peaks of each group given by the offsets in
+        the peak table a as the rows of a matrix.
+        """
+        ngroups = len(offsets) - 1
+        if hypermet:
+            return SpecfitFuns.fastahypermetgroups(a, energy,
+                            numpy.array(offsets, numpy.int32), hypermet)
+        profiles = numpy.zeros((ngroups, len(energy)), numpy.float)
+        for i in range(ngroups):
+            if offsets[i + 1] > offsets[i]:
+                profiles[i] = SpecfitFuns.apvoigt(a[offsets[i]:offsets[i + 1]],
+                                                  energy)
+        return profiles
+
+    def mcatheoryJacobian(self, param0, indices, t0):
+        """
+        mcatheoryJacobian(self, parameters, indices, x)
+        Return the fitting function and its derivatives respect to the
+        parameters given by the indices at the array of points x.
+
+        The peak profiles of all the groups are calculated only once and
+        used both for the function and for the derivatives respect to the
+        group areas. The same applies to the pile-up and the derivative
+        respect to the Sum parameter. The rest of derivatives are given by
+        analyticalDerivative.
+        """
+        hypermet = self.__HYPERMET
+        NGLOBAL = self.NGLOBAL
+        PARAMETERS = self.PARAMETERS
+        param = numpy.array(param0, numpy.float)
+        x = numpy.array(t0, numpy.float).ravel()
+        zero = param[0]
+        gain = param[1]
+        energy = zero + gain * x
+        a, offsets = self._getPeakParameters(param, hypermet)
+        profiles = self._getGroupProfiles(a, offsets, energy, hypermet)
+        result = numpy.dot(param[NGLOBAL:], profiles)
+        if self.__CONTINUUM:
+            result += self.continuum(param, x)
+        pileup = None
+        if self.__SUM:
+            pileup = SpecfitFuns.pileup(result, int(x[0]), zero, gain)
+            result += param[4] * pileup
+        deriv = numpy.zeros((len(indices), len(x)), numpy.float)
+        for j, index in enumerate(indices):
+            if index > NGLOBAL - 1:
+                deriv[j] = profiles[index - NGLOBAL]
+            elif (pileup is not None) and (index == 4):
+                deriv[j] = pileup
+            else:
+                deriv[j] = numpy.ravel(self.analyticalDerivative(param,
+                                                                 index, x))
+        return result, deriv
+
     def continuum(self,param,x):
         #CONTINUUM_LIST = [None,'Constant','Linear','Parabolic','Linear Polynomial','Exp. Polynomial']
         if self.__CONTINUUM == CONTINUUM_LIST.index('Constant'):
@@ -1590,75 +1672,15 @@ def analyticalDerivative(self, param0, index, t0):
         NGLOBAL = self.NGLOBAL
         HYPERMET = self.__HYPERMET
         PARAMETERS = self.PARAMETERS
-        ESCAPE = self.ESCAPE
-        PEAKS0 = self.PEAKS0
         if index > NGLOBAL-1:
          param=numpy.array(param0)
          x=numpy.array(t0)
          zero = param[0]
          gain = param[1] * 1.0
          energy=zero + gain * x
-         #print energy
-         noise= param[2]*param[2]
-         fano = param[3]*2.3548*2.3548*0.00385
          i=index-NGLOBAL
-         #for i in range(len(param[index-4]))):
-         if ESCAPE:
-            (r,c) = (PEAKS0[i]).shape
-            if OLDESCAPE:
-                if HYPERMET:
-                    dummy      = numpy.ones((2*r,3+5*(HYPERMET > 0)), numpy.float)
-                else:
-                    dummy      = numpy.ones((2*r,3+1), numpy.float)
-                dummy[0:r,0] = PEAKS0[i][:,0] * gain
-                dummy[0:r,1] = PEAKS0[i][:,1] * 1.0
-                dummy[0:r,2] = numpy.sqrt(noise+ PEAKS0[i][:,1] * fano)
-                dummy[r:,0] = PEAKS0[i][:,0] * gain * PEAKS0[i][:,3]
-                dummy[r:,1] = PEAKS0[i][:,1] - self.config['detector']['detene']
-                dummy[r:,2] = numpy.sqrt(noise + (dummy[r:,1]>0) * dummy[r:,1] * fano)
-            else:
-                n_escape_lines = self.PEAKSW[i].shape[0] - r
-                #if 1:print "nlines = ",r, "n escape lines =",n_escape_lines
-                if HYPERMET:
-                    dummy    = numpy.ones((r + n_escape_lines, 3+5*(HYPERMET > 0)), numpy.float)
-                else:
-                    dummy    = numpy.ones((r + n_escape_lines, 3+1), numpy.float)
-                dummy[0:r,0] = PEAKS0[i][:,0] * gain
-                dummy[0:r,1] = PEAKS0[i][:,1] * 1.0
-                dummy[0:r,2] = numpy.sqrt(noise+ PEAKS0[i][:,1] * fano)
-                ii=0
-                j=0
-                for esc_group in self.PEAKS0ESCAPE[i]:
-                    for esc_line in esc_group:
-                        esc_ene  = esc_line[0] * 1.0
-                        esc_rate = esc_line[1]
-                        dummy[j+r, 0] =  dummy[ii,0] * esc_rate
-                        dummy[j+r, 1] =  esc_ene
-                        j = j + 1
-                    ii = ii + 1
-                dummy[r:, 2] = numpy.sqrt(noise + (dummy[r:,1]>0) * dummy[r:,1] * fano)
-                #for jj in range(r+n_escape_lines):
-                #    print index, dummy[jj, 1], dummy[jj, 0], dummy[jj, 2]
-         else:
-            (r,c) = (PEAKS0[i]).shape
-            if HYPERMET:
-                dummy      = numpy.ones((r,3+5*(HYPERMET > 0)),numpy.float)
-            else:
-                dummy      = numpy.ones((r,3+1),numpy.float)
-            dummy[0:r,0] = PEAKS0[i][:,0] * gain
-            dummy[0:r,1] = PEAKS0[i][:,1] * 1.0
-            dummy[0:r,2] = numpy.sqrt(noise + PEAKS0[i][:,1] * fano)
-         if HYPERMET:
-                dummy[0:r,3] = param[PARAMETERS.index('ST AreaR')]
-                dummy[r:,3]  = 0.0
-                dummy[:,4] = param[PARAMETERS.index('ST SlopeR')]
-                dummy[0:r,5] = param[PARAMETERS.index('LT AreaR')]
-                dummy[r:,5]  = 0.0
-                dummy[:,6] = param[PARAMETERS.index('LT SlopeR')]
-                dummy[0:r,7] = param[PARAMETERS.index('STEP HeightR')]
-                dummy[r:,7]  = 0.0
-         else:
-                dummy[0:,3] = param[PARAMETERS.index('Eta Factor')]
+         a, offsets = self._getPeakParameters(param, HYPERMET)
+         dummy = a[offsets[i]:offsets[i+1]]
          if self.FASTER:
             if HYPERMET:
                 return SpecfitFuns.fastahypermet(dummy,energy,HYPERMET)
@@ -2102,6 +2124,7 @@ def startfit(self,digest=0, linear=None, currentIteration=None):
                                            weightflag=self.config['fit']['fitweight'],
                                            maxiter=self.MAXITER,
                                            model_deriv=self.analyticalDerivative,
+                                           model_jacobian=self.mcatheoryJacobian,
                                            deltachi=self.config['fit']['deltachi'],
                                            fulloutput=1, linear=linear)
             if self.__SUM and linear:
@@ -2121,6 +2144,7 @@ def startfit(self,digest=0, linear=None, currentIteration=None):
                                            weightflag=self.config['fit']['fitweight'],
                                            maxiter=self.MAXITER,
                                            model_deriv=self.analyticalDerivative,
+                                           model_jacobian=self.mcatheoryJacobian,
                                            deltachi=self.config['fit']['deltachi'],
                                            fulloutput=1, linear=linear)
         self.fittedpar=fitresult[0]
@@ -37,12 +37,35 @@
 import re
 import weakref
 import types
+import collections
+import importlib
 from PyMca5.PyMcaIO import ConfigDict
-from . import CoherentScattering
-from . import IncoherentScattering
-from . import PyMcaEPDL97
+from . import PhysicsDatabase
 from PyMca5 import PyMcaDataDir
 
+class _LazyModule(object):
+    """
+    Module of this package imported on first attribute access. The
+    scattering and EPDL97 modules read their data files when imported and
+    they are not needed by most of the users of this module.
+    """
+    def __init__(self, name):
+        self.__dict__['_name'] = name
+        self.__dict__['_module'] = None
+
+    def __getattr__(self, attr):
+        module = self.__dict__['_module']
+        if module is None:
+            # same package as this module as "from . import" would do
+            module = importlib.import_module("." + self._name,
+                                             __name__.rpartition(".")[0])
+            self.__dict__['_module'] = module
+        return getattr(module, attr)
+
+CoherentScattering = _LazyModule("CoherentScattering")
+IncoherentScattering = _LazyModule("IncoherentScattering")
+PyMcaEPDL97 = _LazyModule("PyMcaEPDL97")
+
 """
 Constant                     Symbol      2006 CODATA value          Relative uncertainty
 Electron relative atomic mass   Ar(e) 5.485 799 0943(23) x 10-4     4.2 x 10-10
@@ -55,6 +78,8 @@
 """
 MINENERGY = 0.175
 AVOGADRO_NUMBER = 6.02214179E23
+# number of (element, energies) mass attenuation coefficients kept in memory
+MASS_ATTENUATION_CACHE_SIZE = 512
 #
 #   Symbol  Atomic Number   x y ( positions on table )
 #       name,  mass, density
@@ -2208,14 +2233,6 @@ def getmassattcoef(compound, energy=None):
     div      = sum(fraction)
     fraction = [x/div for x in fraction]
     #print "fraction = ",fraction
-    ddict={}
-    ddict['energy']   = []
-    ddict['coherent'] = []
-    ddict['compton']  = []
-    ddict['photo']    = []
-    ddict['pair']     = []
-    ddict['total']    = []
-    eltindex = 0
     if energy is None:
         energy=[]
         for ele in elts:
@@ -2224,75 +2241,9 @@ def getmassattcoef(compound, energy=None):
                 if ene not in energy:
                     energy.append(ene)
         energy.sort()
-
-    for ele in elts:
-        xcom_data = getelementmassattcoef(ele,None)
-        #now I have to interpolate at the different energies
-        if not hasattr(energy, "__len__"):
-            energy =[energy]
-        eneindex = 0
-        for ene in energy:
-            if ene < 1.0:
-                if PyMcaEPDL97.EPDL97_DICT[ele]['original']:
-                    #make sure the binding energies are those used by this module and not EADL ones
-                    PyMcaEPDL97.setElementBindingEnergies(ele,
-                                                          Element[ele]['binding'])
-                tmpDict = PyMcaEPDL97.getElementCrossSections(ele, ene)
-                cohe  = tmpDict['coherent'][0]
-                comp  = tmpDict['compton'][0]
-                photo = tmpDict['photo'][0]
-                pair  = 0.0
-            else:
-                i0=max(numpy.nonzero(xcom_data['energy'] <= ene)[0])
-                i1=min(numpy.nonzero(xcom_data['energy'] >= ene)[0])
-                if (i1 == i0) or (i0>i1):
-                    cohe=xcom_data['coherent'][i1]
-                    comp=xcom_data['compton'][i1]
-                    photo=xcom_data['photo'][i1]
-                    pair=xcom_data['pair'][i1]
-                else:
-                    if LOGLOG:
-                        A=xcom_data['energylog10'][i0]
-                        B=xcom_data['energylog10'][i1]
-                        logene = numpy.log10(ene)
-                        c2=(logene-A)/(B-A)
-                        c1=(B-logene)/(B-A)
-                    else:
-                        A=xcom_data['energy'][i0]
-                        B=xcom_data['energy'][i1]
-                        c2=(ene-A)/(B-A)
-                        c1=(B-ene)/(B-A)
-                    cohe= pow(10.0,c2*xcom_data['coherentlog10'][i1]+\
-                                   c1*xcom_data['coherentlog10'][i0])
-                    comp= pow(10.0,c2*xcom_data['comptonlog10'][i1]+\
-                                   c1*xcom_data['comptonlog10'][i0])
-                    photo=pow(10.0,c2*xcom_data['photolog10'][i1]+\
-                                   c1*xcom_data['photolog10'][i0])
-                    if xcom_data['pair'][i1] > 0.0:
-                        c2 = c2*numpy.log10(xcom_data['pair'][i1])
-                        if xcom_data['pair'][i0] > 0.0:
-                            c1 = c1*numpy.log10(xcom_data['pair'][i0])
-                            pair = pow(10.0,c1+c2)
-                        else:
-                            pair =0.0
-                    else:
-                        pair =0.0
-            if eltindex == 0:
-                ddict['energy'].append(ene)
-                ddict['coherent'].append(cohe *fraction[eltindex])
-                ddict['compton'].append(comp *fraction[eltindex])
-                ddict['photo'].append(photo *fraction[eltindex])
-                ddict['pair'].append(pair*fraction[eltindex])
-                ddict['total'].append((cohe+comp+photo+pair)*fraction[eltindex])
-            else:
-                ddict['coherent'][eneindex] += cohe  *fraction[eltindex]
-                ddict['compton'] [eneindex] += comp  *fraction[eltindex]
-                ddict['photo']   [eneindex] += photo *fraction[eltindex]
-                ddict['pair']    [eneindex] += pair  *fraction[eltindex]
-                ddict['total']   [eneindex] += (cohe+comp+photo+pair) * fraction[eltindex]
-            eneindex += 1
-        eltindex += 1
-    return ddict
+    if not hasattr(energy, "__len__"):
+        energy =[energy]
+    return _getMixtureMassAttenuationCoefficients(elts, fraction, energy)
 
 def __materialInCompoundList(lst):
     for item in lst:
@@ -2452,85 +2403,11 @@ def getMaterialMassAttenuationCoefficients(compoundList0, fractionList0, energy0
         energy.sort()
 
     #I have the energy grid, the elements and their fractions
-    dict={}
-    dict['energy']   = []
-    dict['coherent'] = []
-    dict['compton']  = []
-    dict['photo']    = []
-    dict['pair']     = []
-    dict['total']    = []
-    eltindex = 0
-    for ele in materialElements.keys():
-        if 'xcom' in Element[ele]:
-            xcom_data = Element[ele]['xcom']
-        else:
-            xcom_data = getelementmassattcoef(ele,None)
-        #now I have to interpolate at the different energies
-        if (type(energy) != type([])):
-            energy =[energy]
-        eneindex = 0
-        for ene in energy:
-            if ene < 1.0:
-                if PyMcaEPDL97.EPDL97_DICT[ele]['original']:
-                    #make sure the binding energies are those used by this module and not EADL ones
-                    PyMcaEPDL97.setElementBindingEnergies(ele,
-                                                          Element[ele]['binding'])
-                tmpDict = PyMcaEPDL97.getElementCrossSections(ele, ene)
-                cohe  = tmpDict['coherent'][0]
-                comp  = tmpDict['compton'][0]
-                photo = tmpDict['photo'][0]
-                pair  = 0.0
-            else:
-                i0=max(numpy.nonzero(xcom_data['energy'] <= ene)[0])
-                i1=min(numpy.nonzero(xcom_data['energy'] >= ene)[0])
-                if (i1 == i0) or (i0>i1):
-                    cohe=xcom_data['coherent'][i1]
-                    comp=xcom_data['compton'][i1]
-                    photo=xcom_data['photo'][i1]
-                    pair=xcom_data['pair'][i1]
-                else:
-                    if LOGLOG:
-                        A=xcom_data['energylog10'][i0]
-                        B=xcom_data['energylog10'][i1]
-                        logene = numpy.log10(ene)
-                        c2=(logene-A)/(B-A)
-                        c1=(B-logene)/(B-A)
-                    else:
-                        A=xcom_data['energy'][i0]
-                        B=xcom_data['energy'][i1]
-                        c2=(ene-A)/(B-A)
-                        c1=(B-ene)/(B-A)
-                    cohe= pow(10.0,c2*xcom_data['coherentlog10'][i1]+\
-                                   c1*xcom_data['coherentlog10'][i0])
-                    comp= pow(10.0,c2*xcom_data['comptonlog10'][i1]+\
-                                   c1*xcom_data['comptonlog10'][i0])
-                    photo=pow(10.0,c2*xcom_data['photolog10'][i1]+\
-                                   c1*xcom_data['photolog10'][i0])
-                    if xcom_data['pair'][i1] > 0.0:
-                        c2 = c2*numpy.log10(xcom_data['pair'][i1])
-                        if xcom_data['pair'][i0] > 0.0:
-                            c1 = c1*numpy.log10(xcom_data['pair'][i0])
-                            pair = pow(10.0,c1+c2)
-                        else:
-                            pair =0.0
-                    else:
-                        pair =0.0
-            if eltindex == 0:
-                dict['energy'].append(ene)
-                dict['coherent'].append(cohe * materialElements[ele])
-                dict['compton'].append(comp * materialElements[ele])
-                dict['photo'].append(photo * materialElements[ele])
-                dict['pair'].append(pair* materialElements[ele])
-                dict['total'].append((cohe+comp+photo+pair)* materialElements[ele])
-            else:
-                dict['coherent'][eneindex] += cohe  * materialElements[ele]
-                dict['compton'] [eneindex] += comp  * materialElements[ele]
-                dict['photo']   [eneindex] += photo * materialElements[ele]
-                dict['pair']    [eneindex] += pair  * materialElements[ele]
-                dict['total']   [eneindex] += (cohe+comp+photo+pair) *  materialElements[ele]
-            eneindex += 1
-        eltindex += 1
-    return dict
+    if (type(energy) != type([])):
+        energy =[energy]
+    return _getMixtureMassAttenuationCoefficients(list(materialElements.keys()),
+                                     list(materialElements.values()),
+                                     energy)
 
 
 def getcandidates(energy,threshold=None,targetrays=None):
@@ -2634,172 +2511,195 @@ def getelementmassattcoef(ele,energy=None):
             dict['total']      = [total cross section]
     """
     if 'xcom' not in Element[ele].keys():
-        dirmod = PyMcaDataDir.PYMCA_DATA_DIR
-        #read xcom file
-        #print dirmod+"/"+ele+".mat"
-        xcomfile = os.path.join(dirmod, "attdata")
-        xcomfile = os.path.join(xcomfile, ele+".mat")
-        if not os.path.exists(xcomfile):
-            #freeze does bad things with the path ...
-            dirmod = os.path.dirname(dirmod)
+        #the compiled database if available
+        xcom = PhysicsDatabase.getXcomData(ele)
+        if xcom is None:
+            dirmod = PyMcaDataDir.PYMCA_DATA_DIR
+            #read xcom file
+            #print dirmod+"/"+ele+".mat"
             xcomfile = os.path.join(dirmod, "attdata")
             xcomfile = os.path.join(xcomfile, ele+".mat")
-            if dirmod.lower().endswith(".zip"):
+            if not os.path.exists(xcomfile):
+                #freeze does bad things with the path ...
                 dirmod = os.path.dirname(dirmod)
                 xcomfile = os.path.join(dirmod, "attdata")
                 xcomfile = os.path.join(xcomfile, ele+".mat")
-            if not os.path.exists(xcomfile):
-                print("Cannot find file ",xcomfile)
-                raise IOError("Cannot find %s" % xcomfile)
-        f = open(xcomfile, 'r')
-        line=f.readline()
-        while (line.split('ENERGY')[0] == line):
-            line = f.readline()
-        Element[ele]['xcom'] = {}
-        Element[ele]['xcom']['energy']   =[]
-        Element[ele]['xcom']['coherent'] =[]
-        Element[ele]['xcom']['compton']  =[]
-        Element[ele]['xcom']['photo']  =[]
-        Element[ele]['xcom']['pair']     =[]
-        Element[ele]['xcom']['total']    =[]
-        line = f.readline()
-        while (line.split('COHERENT')[0] == line):
-            line = line.split()
-            for value in line:
-                Element[ele]['xcom']['energy'].append(float(value)*1000.)
-            line = f.readline()
-        Element[ele]['xcom']['energy']=numpy.array(Element[ele]['xcom']['energy'])
-        line = f.readline()
-        while (line.split('INCOHERENT')[0] == line):
-            line = line.split()
-            for value in line:
-                Element[ele]['xcom']['coherent'].append(float(value))
-            line = f.readline()
-        Element[ele]['xcom']['coherent']=numpy.array(Element[ele]['xcom']['coherent'])
-        line = f.readline()
-        while (line.split('PHOTO')[0] == line):
-            line = line.split()
-            for value in line:
-                Element[ele]['xcom']['compton'].append(float(value))
-            line = f.readline()
-        Element[ele]['xcom']['compton']=numpy.array(Element[ele]['xcom']['compton'])
-        line = f.readline()
-        while (line.split('PAIR')[0] == line):
-            line = line.split()
-            for value in line:
-                Element[ele]['xcom']['photo'].append(float(value))
-            line = f.readline()
-        line = f.readline()
-        while (line.split('PAIR')[0] == line):
-            line = line.split()
-            for value in line:
-                Element[ele]['xcom']['pair'].append(float(value))
-            line = f.readline()
-        i = 0
-        line = f.readline()
-        while (len(line)):
-            line = line.split()
-            for value in line:
-                Element[ele]['xcom']['pair'][i] += float(value)
-                i += 1
-            line = f.readline()
-        if sys.version >= '3.0':
-            # next line gave problems under under windows
-            # just try numpy.argsort([1,1,1,1,1]) under linux and windows to see
-            # what I mean
-            # i1=numpy.argsort(Element[ele]['xcom']['energy']) did not work
-            # (uses quicksort and gives problems with Pb not passing tests)
-            i1=numpy.argsort(Element[ele]['xcom']['energy'], kind='mergesort')
-        else:
-            sset = map(None,Element[ele]['xcom']['energy'],range(len(Element[ele]['xcom']['energy'])))
-            sset.sort()
-            i1=numpy.array([x[1] for x in sset])
-        Element[ele]['xcom']['energy']=numpy.take(Element[ele]['xcom']['energy'],i1)
-        Element[ele]['xcom']['coherent']=numpy.take(Element[ele]['xcom']['coherent'],i1)
-        Element[ele]['xcom']['compton']=numpy.take(Element[ele]['xcom']['compton'],i1)
-        Element[ele]['xcom']['photo']=numpy.take(Element[ele]['xcom']['photo'],i1)
-        Element[ele]['xcom']['pair']=numpy.take(Element[ele]['xcom']['pair'],i1)
-        if Element[ele]['xcom']['coherent'][0] <= 0:
-           Element[ele]['xcom']['coherent'][0] = Element[ele]['xcom']['coherent'][1] * 1.0
+                if dirmod.lower().endswith(".zip"):
+                    dirmod = os.path.dirname(dirmod)
+                    xcomfile = os.path.join(dirmod, "attdata")
+                    xcomfile = os.path.join(xcomfile, ele+".mat")
+                if not os.path.exists(xcomfile):
+                    print("Cannot find file ",xcomfile)
+                    raise IOError("Cannot find %s" % xcomfile)
+            xcom = PhysicsDatabase.readXcomFile(xcomfile)
         try:
-            Element[ele]['xcom']['energylog10']=numpy.log10(Element[ele]['xcom']['energy'])
-            Element[ele]['xcom']['coherentlog10']=numpy.log10(Element[ele]['xcom']['coherent'])
-            Element[ele]['xcom']['comptonlog10']=numpy.log10(Element[ele]['xcom']['compton'])
-            Element[ele]['xcom']['photolog10']=numpy.log10(Element[ele]['xcom']['photo'])
+            xcom['energylog10']=numpy.log10(xcom['energy'])
+            xcom['coherentlog10']=numpy.log10(xcom['coherent'])
+            xcom['comptonlog10']=numpy.log10(xcom['compton'])
+            xcom['photolog10']=numpy.log10(xcom['photo'])
         except:
             raise ValueError("Problem calculating logaritm of %s.mat file data" % ele)
-        for i in range(0,len(Element[ele]['xcom']['energy'])):
-            Element[ele]['xcom']['total'].append(Element[ele]['xcom']['coherent'][i]+\
-                                                 Element[ele]['xcom']['compton'] [i]+\
-                                                 Element[ele]['xcom']['photo'] [i]+\
-                                                 Element[ele]['xcom']['pair'] [i])
+        xcom['total'] = (xcom['coherent'] + xcom['compton'] + \
+                         xcom['photo'] + xcom['pair']).tolist()
+        Element[ele]['xcom'] = xcom
+        _DEFAULT_XCOM[ele] = xcom
 
     if energy is None:
         return  Element[ele]['xcom']
-    ddict={}
-    ddict['energy']   = []
-    ddict['coherent'] = []
-    ddict['compton']  = []
-    ddict['photo']    = []
-    ddict['pair']     = []
-    ddict['total']    = []
     if not hasattr(energy, "__len__"):
         energy =[energy]
-    for ene in energy:
-        if ene < 1.0:
-            if PyMcaEPDL97.EPDL97_DICT[ele]['original']:
-                #make sure the binding energies are those used by this module and not EADL ones
-                PyMcaEPDL97.setElementBindingEnergies(ele,
-                                                      Element[ele]['binding'])
-            tmpDict = PyMcaEPDL97.getElementCrossSections(ele, ene)
-            cohe  = tmpDict['coherent'][0]
-            comp  = tmpDict['compton'][0]
-            photo = tmpDict['photo'][0]
-            pair  = 0.0
+    return _getMixtureMassAttenuationCoefficients([ele], [1.0], energy)
+
+class _LRUCache(object):
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._data = collections.OrderedDict()
+
+    def get(self, key):
+        try:
+            value = self._data.pop(key)
+        except KeyError:
+            return None
+        # move it to the end as most recently used
+        self._data[key] = value
+        return value
+
+    def put(self, key, value):
+        self._data.pop(key, None)
+        self._data[key] = value
+        while len(self._data) > self.maxsize:
+            try:
+                self._data.popitem(last=False)
+            except KeyError:
+                # emptied by another thread
+                break
+
+    def clear(self):
+        self._data.clear()
+
+_MASS_ATTENUATION_CACHE = _LRUCache(MASS_ATTENUATION_CACHE_SIZE)
+
+def _getEPDL97Version():
+    # no need to import the EPDL97 module just to know it was not modified
+    if PyMcaEPDL97.__dict__['_module'] is None:
+        return None
+    return PyMcaEPDL97.DATA_VERSION
+
+def _getElementMassAttenuationArrays(ele, energy):
+    """
+    Return the coherent, compton, photoelectric and pair production mass
+    attenuation coefficients of the element at all the given energies as
+    a tuple of read only arrays.
+
+    XCOM data are interpolated in a log-log scale above 1 keV and EPDL97
+    data are used below. The results are cached by element and energies.
+    The cached values are not used once the XCOM table of the element is
+    replaced or the EPDL97 data are reloaded or modified.
+    """
+    energy = numpy.array(energy, dtype=numpy.float64).reshape(-1)
+    energyKey = tuple(energy.tolist())
+    xcom_data = getelementmassattcoef(ele, None)
+    key = (ele, LOGLOG, _getEPDL97Version(), energyKey)
+    cached = _MASS_ATTENUATION_CACHE.get(key)
+    if (cached is not None) and (cached[0] is xcom_data):
+        return cached[1]
+    cohe = numpy.zeros(energy.shape, numpy.float64)
+    comp = numpy.zeros(energy.shape, numpy.float64)
+    photo = numpy.zeros(energy.shape, numpy.float64)
+    pair = numpy.zeros(energy.shape, numpy.float64)
+    low = energy < 1.0
+    if low.any():
+        if PyMcaEPDL97.EPDL97_DICT[ele]['original']:
+            #make sure the binding energies are those used by this module and not EADL ones
+            PyMcaEPDL97.setElementBindingEnergies(ele,
+                                                  Element[ele]['binding'])
+        tmpDict = PyMcaEPDL97.getElementCrossSections(ele, energy[low])
+        cohe[low] = tmpDict['coherent']
+        comp[low] = tmpDict['compton']
+        photo[low] = tmpDict['photo']
+    high = ~low
+    if high.any():
+        ene = energy[high]
+        xcomEnergy = xcom_data['energy']
+        # last tabulated energy <= ene and first tabulated energy >= ene
+        i0 = numpy.searchsorted(xcomEnergy, ene, side='right') - 1
+        i1 = numpy.searchsorted(xcomEnergy, ene, side='left')
+        if (i0.min() < 0) or (i1.max() >= len(xcomEnergy)):
+            raise ValueError("Energy outside tabulated range of element %s" % ele)
+        # tabulated energies (at the edges the value below the edge is used)
+        exact = i1 <= i0
+        if LOGLOG:
+            A = xcom_data['energylog10'][i0]
+            B = xcom_data['energylog10'][i1]
+            x = numpy.log10(ene)
         else:
-            i0=max(numpy.nonzero(Element[ele]['xcom']['energy'] <= ene)[0])
-            i1=min(numpy.nonzero(Element[ele]['xcom']['energy'] >= ene)[0])
-            if i1 <= i0:
-                cohe=Element[ele]['xcom']['coherent'][i1]
-                comp=Element[ele]['xcom']['compton'][i1]
-                photo=Element[ele]['xcom']['photo'][i1]
-                pair=Element[ele]['xcom']['pair'][i1]
-            else:
-                if LOGLOG:
-                    A=Element[ele]['xcom']['energylog10'][i0]
-                    B=Element[ele]['xcom']['energylog10'][i1]
-                    logene = numpy.log10(ene)
-                    c2=(logene-A)/(B-A)
-                    c1=(B-logene)/(B-A)
-                else:
-                    A=Element[ele]['xcom']['energy'][i0]
-                    B=Element[ele]['xcom']['energy'][i1]
-                    c2=(ene-A)/(B-A)
-                    c1=(B-ene)/(B-A)
-
-                cohe= pow(10.0,c2*Element[ele]['xcom']['coherentlog10'][i1]+\
-                               c1*Element[ele]['xcom']['coherentlog10'][i0])
-                comp= pow(10.0,c2*Element[ele]['xcom']['comptonlog10'][i1]+\
-                               c1*Element[ele]['xcom']['comptonlog10'][i0])
-                photo=pow(10.0,c2*Element[ele]['xcom']['photolog10'][i1]+\
-                               c1*Element[ele]['xcom']['photolog10'][i0])
-                if Element[ele]['xcom']['pair'][i1] > 0.0:
-                    c2 = c2*numpy.log10(Element[ele]['xcom']['pair'][i1])
-                    if Element[ele]['xcom']['pair'][i0] > 0.0:
-                        c1 = c1*numpy.log10(Element[ele]['xcom']['pair'][i0])
-                        pair = pow(10.0,c1+c2)
-                    else:
-                        pair =0.0
-                else:
-                    pair =0.0
-        ddict['energy'].append(ene)
-        ddict['coherent'].append(cohe)
-        ddict['compton'].append(comp)
-        ddict['photo'].append(photo)
-        ddict['pair'].append(pair)
-        ddict['total'].append(cohe+comp+photo+pair)
+            A = xcomEnergy[i0]
+            B = xcomEnergy[i1]
+            x = ene
+        delta = numpy.where(exact, 1.0, B - A)
+        c2 = (x - A) / delta
+        c1 = (B - x) / delta
+        for name, target in [('coherent', cohe),
+                             ('compton', comp),
+                             ('photo', photo)]:
+            logValues = xcom_data[name + 'log10']
+            values = numpy.power(10.0, c2 * logValues[i1] + c1 * logValues[i0])
+            target[high] = numpy.where(exact, xcom_data[name][i1], values)
+        pair0 = xcom_data['pair'][i0]
+        pair1 = xcom_data['pair'][i1]
+        positive = (pair0 > 0.0) & (pair1 > 0.0)
+        values = numpy.power(10.0,
+                    c2 * numpy.log10(numpy.where(positive, pair1, 1.0)) +\
+                    c1 * numpy.log10(numpy.where(positive, pair0, 1.0)))
+        values[~positive] = 0.0
+        pair[high] = numpy.where(exact, pair1, values)
+    output = (cohe, comp, photo, pair)
+    for array in output:
+        array.flags.writeable = False
+    # the EPDL97 data may have been loaded by this call
+    key = (ele, LOGLOG, _getEPDL97Version(), energyKey)
+    # keeping a reference to the XCOM table used avoids mistaking a new
+    # table for it
+    _MASS_ATTENUATION_CACHE.put(key, (xcom_data, output))
+    return output
+
+def _getMixtureMassAttenuationCoefficients(elementList, fractionList, energy):
+    """
+    Mass attenuation coefficients of a mixture of elements given their mass
+    fractions in the usual dictionnary of lists form.
+    """
+    ddict = {}
+    ddict['energy']   = list(energy)
+    coherent = numpy.zeros(len(energy), numpy.float64)
+    compton = numpy.zeros(len(energy), numpy.float64)
+    photo = numpy.zeros(len(energy), numpy.float64)
+    pair = numpy.zeros(len(energy), numpy.float64)
+    total = numpy.zeros(len(energy), numpy.float64)
+    for ele, fraction in zip(elementList, fractionList):
+        cohe, comp, phot, pai = _getElementMassAttenuationArrays(ele, energy)
+        coherent += cohe * fraction
+        compton += comp * fraction
+        photo += phot * fraction
+        pair += pai * fraction
+        total += (cohe + comp + phot + pai) * fraction
+    ddict['coherent'] = coherent.tolist()
+    ddict['compton']  = compton.tolist()
+    ddict['photo']    = photo.tolist()
+    ddict['pair']     = pair.tolist()
+    ddict['total']    = total.tolist()
     return ddict
 
+# element -> XCOM table read from the PyMca data
+_DEFAULT_XCOM = {}
+
+def isDefaultXcomData(ele):
+    """
+    Return True if the XCOM table of the element in use is the one read
+    from the PyMca data and False if it has been replaced or not yet read.
+    """
+    xcom = Element[ele].get('xcom', None)
+    return (xcom is not None) and (xcom is _DEFAULT_XCOM.get(ele, None))
+
 def getElementLShellRates(symbol,energy=None,photoweights = None):
     """
     getElementLShellRates(symbol,energy=None, photoweights = None)
@@ -34,13 +34,19 @@
 Module to perform a fast linear fit on a stack of fluorescence spectra.
 """
 import os
+import sys
+import ctypes
+import multiprocessing
 import numpy
 from PyMca5.PyMcaMath.linalg import lstsq
 from . import ClassMcaTheory
 from PyMca5.PyMcaMath.fitting import Gefit
 from . import ConcentrationsTool
-from PyMca5.PyMcaMath.fitting import SpecfitFuns
+from PyMca5.PyMcaMath import SNIPModule
 from PyMca5.PyMcaIO import ConfigDict
+from PyMca5.PyMcaIO import HDF5BlockReader
+from PyMca5.PyMcaIO import ImageStackOutput
+from PyMca5.PyMcaMisc import ProcessPool
 import time
 
 DEBUG = 0
@@ -65,7 +71,8 @@ def setFitConfigurationFile(self, ffile):
 
     def fitMultipleSpectra(self, x=None, y=None, xmin=None, xmax=None,
                            configuration=None, concentrations=False,
-                           ysum=None, weight=None, refit=True):
+                           ysum=None, weight=None, refit=True,
+                           processes=None, output=None):
         """
         This method performs the actual fit. The y keyword is the only mandatory input argument.
 
@@ -73,9 +80,15 @@ def fitMultipleSpectra(self, x=None, y=None, xmin=None, xmax=None,
         :param y: 3D array containing the spectra as [nrows, ncolumns, nchannels]
         :param xmin: lower limit of the fitting region
         :param xmax: upper limit of the fitting region
-        :param weight: 0 Means no weight, 1 Use an average weight, 2 Individual weights (slow)
+        :param weight: 0 Means no weight, 1 Use an average weight, 2 Individual weights
         :param concentrations: 0 Means no calculation, 1 Calculate them
         :param refit: if False, no check for negative results. Default is True.
+        :param processes: Number of worker processes used for the initial fit. None or 1
+                          means serial execution, 0 means as many processes as cores.
+        :param output: ImageStackOutput instance receiving the images. Default keeps them in
+                       memory. With an HDF5Output the rows are written to disk as they are
+                       fitted and the returned parameters, uncertainties and concentrations
+                       are the HDF5 datasets. Closing the output is left to the caller.
         :return: A dictionnary with the parameters, uncertainties, concentrations and names as keys.
         """
         if y is None:
@@ -106,7 +119,7 @@ def fitMultipleSpectra(self, x=None, y=None, xmin=None, xmax=None,
             # dictated by the file
             weight = config['fit']['fitweight']
             if weight:
-                # individual pixel weights (slow)
+                # individual pixel weights
                 weightPolicy = 2
             else:
                 # No weight
@@ -118,7 +131,7 @@ def fitMultipleSpectra(self, x=None, y=None, xmin=None, xmax=None,
                  config['fit']['fitweight'] = 1
                  toReconfigure = True
         elif weight == 2:
-           # individual pixel weights (slow)
+           # individual pixel weights
             weightPolicy = 2
             if not config['fit']['fitweight']:
                  config['fit']['fitweight'] = 1
@@ -266,10 +279,6 @@ def fitMultipleSpectra(self, x=None, y=None, xmin=None, xmax=None,
         dummySpectrum = firstSpectrum[iXMin:iXMax+1].reshape(-1, 1)
         # print("dummy = ", dummySpectrum.shape)
 
-        # allocate the output buffer
-        results = numpy.zeros((nFree, nRows, nColumns), numpy.float32)
-        uncertainties = numpy.zeros((nFree, nRows, nColumns), numpy.float32)
-
         #perform the initial fit
         if DEBUG:
             print("Configuration elapsed = %f"  % (time.time() - t0))
@@ -286,53 +295,50 @@ def fitMultipleSpectra(self, x=None, y=None, xmin=None, xmax=None,
         else:
             SVD = True
             sigma_b = None
-        last_svd = None
-        for i in range(0, data.shape[0]):
-            #print(i)
-            #chunks of nColumns spectra
-            if i == 0:
-                chunk = numpy.zeros((dummySpectrum.shape[0],
-                                     jStep),
-                                     numpy.float)
-            jStart = 0
-            while jStart < data.shape[1]:
-                jEnd = min(jStart + jStep, data.shape[1])
-                chunk[:,:(jEnd - jStart)] = data[i, jStart:jEnd, iXMin:iXMax+1].T
-                if config['fit']['stripflag']:
-                    for k in range(jStep):
-                        # obtain the smoothed spectrum
-                        background=SpecfitFuns.SavitskyGolay(chunk[:, k],
-                                                config['fit']['stripfilterwidth'])
-                        lastAnchor = 0
-                        for anchor in anchorslist:
-                            if (anchor > lastAnchor) and (anchor < background.size):
-                                background[lastAnchor:anchor] =\
-                                        SpecfitFuns.snip1d(background[lastAnchor:anchor],
-                                                           config['fit']['snipwidth'],
-                                                           0)
-                                lastAnchor = anchor
-                        if lastAnchor < background.size:
-                            background[lastAnchor:] =\
-                                    SpecfitFuns.snip1d(background[lastAnchor:],
-                                                       config['fit']['snipwidth'],
-                                                       0)
-                        chunk[:, k] -= background
-
-                # perform the multiple fit to all the spectra in the chunk
-                #print("SHAPES")
-                #print(derivatives.shape)
-                #print(chunk[:,:(jEnd - jStart)].shape)
-                ddict=lstsq(derivatives, chunk[:,:(jEnd - jStart)],
-                            sigma_b=sigma_b,
-                            weight=weight,
-                            digested_output=True,
-                            svd=SVD,
-                            last_svd=last_svd)
-                last_svd = ddict.get('svd', None)
-                parameters = ddict['parameters']
-                results[:, i, jStart:jEnd] = parameters
-                uncertainties[:, i, jStart:jEnd] = ddict['uncertainties']
-                jStart = jEnd
+        if config['fit']['stripflag']:
+            strip = (config['fit']['stripfilterwidth'],
+                     config['fit']['snipwidth'],
+                     anchorslist)
+        else:
+            strip = None
+        fitContext = {'derivatives': derivatives,
+                      'iXMin': iXMin,
+                      'iXMax': iXMax,
+                      'jStep': jStep,
+                      'strip': strip,
+                      'sigma_b': sigma_b,
+                      'weight': weight,
+                      'svd': SVD,
+                      'last_svd': None}
+        if output is None:
+            output = ImageStackOutput.ArrayOutput()
+        inMemory = isinstance(output, ImageStackOutput.ArrayOutput)
+        shape = (nFree, nRows, nColumns)
+        if processes == 0:
+            processes = multiprocessing.cpu_count()
+        if (processes is None) or (processes < 2) or (nRows < 2) or \
+           (ProcessPool.getMultiprocessingContext() is None):
+            # allocate the output buffer
+            results = output.createStack("parameters", shape,
+                                         labels=freeNames)
+            uncertainties = output.createStack("uncertainties", shape,
+                                               labels=freeNames)
+            _fitRowsIntoStacks(data, 0, nRows, results, uncertainties,
+                               fitContext, output.getBlockRows(results))
+        elif inMemory:
+            results, uncertainties = _fitRowsInParallel(data,
+                                                        shape,
+                                                        fitContext,
+                                                        processes)
+        else:
+            results = output.createStack("parameters", shape,
+                                         labels=freeNames)
+            uncertainties = output.createStack("uncertainties", shape,
+                                               labels=freeNames)
+            _fitRowsInParallel(data, shape, fitContext, processes,
+                               stacks=(results, uncertainties),
+                               blockRows=output.getBlockRows(results))
+        output.flush()
         if DEBUG:
             t = time.time() - t0
             print("First fit elapsed = %f" % t)
@@ -369,7 +375,7 @@ def fitMultipleSpectra(self, x=None, y=None, xmin=None, xmax=None,
                 for item in zeroList:
                     i = item[1]
                     badMask = item[2]
-                    results[i][badMask] = 0.0
+                    ImageStackOutput.setMaskedValues(results, i, badMask, 0.0)
                     print("WARNING: %d pixels of parameter %s forced to zero" % (item[0], freeNames[i]))
                 continue
             zeroList.sort()
@@ -392,8 +398,9 @@ def fitMultipleSpectra(self, x=None, y=None, xmin=None, xmax=None,
             if badMask.sum() < (0.0025 * nPixels):
                 # fit not worth
                 for i in badParameters:
-                    results[i][badMask] = 0.0
-                    uncertainties[i][badMask] = 0.0
+                    ImageStackOutput.setMaskedValues(results, i, badMask, 0.0)
+                    ImageStackOutput.setMaskedValues(uncertainties, i,
+                                                     badMask, 0.0)
                     if DEBUG:
                         print("WARNING: %d pixels of parameter %s set to zero" % (badMask.sum(),
                                                                                   freeNames[i]))
@@ -404,58 +411,20 @@ def fitMultipleSpectra(self, x=None, y=None, xmin=None, xmax=None,
                 A = derivatives[:, [i for i in range(nFree) if i not in badParameters]]
                 #assume we'll not have too many spectra
                 if data.dtype not in [numpy.float32, numpy.float64]:
-                    data
-                if data.dtype not in [numpy.float32, numpy.float64]:
-                    if data.itemsize < 5:
+                    if data.dtype.itemsize < 5:
                         data_dtype = numpy.float32
                     else:
-                        data_dtype = numpy.floa64
+                        data_dtype = numpy.float64
                 else:
                     data_dtype = data.dtype
-                try:
-                    if data.dtype != data_dtype:
-                        spectra = numpy.zeros((int(badMask.sum()), 1 + iXMax - iXMin),
-                                          data_dtype)
-                        spectra[:] = data[badMask, iXMin:iXMax+1]
-                    else:
-                        spectra = data[badMask, iXMin:iXMax+1]
-                    spectra.shape = badMask.sum(), -1
-                except TypeError:
-                    # in case of dynamic arrays, two dimensional indices are not
-                    # supported by h5py
-                    spectra = numpy.zeros((int(badMask.sum()), 1 + iXMax - iXMin),
-                                          data_dtype)
-                    selectedIndices = numpy.nonzero(badMask > 0)
-                    tmpData = numpy.zeros((1, 1 + iXMax - iXMin), data_dtype)
-                    oldDataRow = -1
-                    j = 0
-                    for i in range(len(selectedIndices[0])):
-                        j = selectedIndices[0][i]
-                        if j != oldDataRow:
-                            tmpData = data[j]
-                            olddataRow = j
-                        spectra[i] = tmpData[selectedIndices[1][i], iXMin:iXMax+1]
+                # HDF5 datasets are read by chunks containing bad pixels
+                spectra = HDF5BlockReader.getMaskedSpectra(data, badMask,
+                                                channels=(iXMin, iXMax + 1),
+                                                dtype=data_dtype)
                 spectra = spectra.T
                 #
-                if config['fit']['stripflag']:
-                    for k in range(spectra.shape[1]):
-                        # obtain the smoothed spectrum
-                        background=SpecfitFuns.SavitskyGolay(spectra[:, k],
-                                                config['fit']['stripfilterwidth'])
-                        lastAnchor = 0
-                        for anchor in anchorslist:
-                            if (anchor > lastAnchor) and (anchor < background.size):
-                                background[lastAnchor:anchor] =\
-                                        SpecfitFuns.snip1d(background[lastAnchor:anchor],
-                                                           config['fit']['snipwidth'],
-                                                           0)
-                                lastAnchor = anchor
-                        if lastAnchor < background.size:
-                            background[lastAnchor:] =\
-                                    SpecfitFuns.snip1d(background[lastAnchor:],
-                                                       config['fit']['snipwidth'],
-                                                       0)
-                    spectra[:, k] -= background
+                if strip is not None:
+                    _subtractStripBackground(spectra, strip)
                 ddict = lstsq(A, spectra,
                               sigma_b=sigma_b,
                               weight=weight,
@@ -464,11 +433,15 @@ def fitMultipleSpectra(self, x=None, y=None, xmin=None, xmax=None,
                 idx = 0
                 for i in range(nFree):
                     if i in badParameters:
-                        results[i][badMask] = 0.0
-                        uncertainties[i][badMask] = 0.0
+                        ImageStackOutput.setMaskedValues(results, i,
+                                                         badMask, 0.0)
+                        ImageStackOutput.setMaskedValues(uncertainties, i,
+                                                         badMask, 0.0)
                     else:
-                        results[i][badMask] = ddict['parameters'][idx]
-                        uncertainties[i][badMask] = ddict['uncertainties'][idx]
+                        ImageStackOutput.setMaskedValues(results, i,
+                                        badMask, ddict['parameters'][idx])
+                        ImageStackOutput.setMaskedValues(uncertainties, i,
+                                        badMask, ddict['uncertainties'][idx])
                         idx += 1
 
         if DEBUG and refit:
@@ -539,8 +512,8 @@ def fitMultipleSpectra(self, x=None, y=None, xmin=None, xmax=None,
             if len(concentrationsResult['layerlist']) > 1:
                 nValues += len(concentrationsResult['layerlist'])
             nElements = len(list(concentrationsResult['mass fraction'].keys()))
-            massFractions = numpy.zeros((nValues * nElements, nRows, nColumns),
-                                        numpy.float32)
+            massFractions = output.createStack("concentrations",
+                                        (nValues * nElements, nRows, nColumns))
 
 
             referenceElement = addInfo['ReferenceElement']
@@ -581,7 +554,7 @@ def fitMultipleSpectra(self, x=None, y=None, xmin=None, xmax=None,
                 group = fitresult['result']['groups'][idx]
                 referenceArea = fitresult['result'][group]['fitarea']
                 referenceConcentrations = concentrationsResult['mass fraction'][group]
-                goodIdx = results[nFreeBackgroundParameters+idx] > 0
+                referenceImage = results[nFreeBackgroundParameters+idx]
                 massFractions[idx] = referenceConcentrations
                 counter = 0
                 for i, group in enumerate(fitresult['result']['groups']):
@@ -590,19 +563,24 @@ def fitMultipleSpectra(self, x=None, y=None, xmin=None, xmax=None,
                             print("skept %s" % group)
                         continue
                     outputDict['names'].append("C(%s)" % group)
-                    goodI = results[nFreeBackgroundParameters+i] > 0
-                    tmp = results[nFreeBackgroundParameters+idx][goodI]
-                    massFractions[counter][goodI] = (results[nFreeBackgroundParameters+i][goodI]/(tmp + (tmp == 0))) *\
+                    image = results[nFreeBackgroundParameters+i]
+                    goodI = image > 0
+                    tmp = referenceImage[goodI]
+                    ImageStackOutput.setMaskedValues(massFractions, counter, goodI,
+                                (image[goodI]/(tmp + (tmp == 0))) *\
                                 ((referenceArea/fitresult['result'][group]['fitarea']) *\
-                                (concentrationsResult['mass fraction'][group]))
+                                (concentrationsResult['mass fraction'][group])))
                     counter += 1
                     if len(concentrationsResult['layerlist']) > 1:
                         for layer in concentrationsResult['layerlist']:
                             outputDict['names'].append("C(%s)-%s" % (group, layer))
-                            massFractions[counter][goodI] = (results[nFreeBackgroundParameters+i][goodI]/(tmp + (tmp == 0))) *\
+                            ImageStackOutput.setMaskedValues(massFractions, counter, goodI,
+                                (image[goodI]/(tmp + (tmp == 0))) *\
                                 ((referenceArea/fitresult['result'][group]['fitarea']) *\
-                                (concentrationsResult[layer]['mass fraction'][group]))
+                                (concentrationsResult[layer]['mass fraction'][group])))
                             counter += 1
+            output.setLabels(massFractions, outputDict['names'][nFree:])
+            output.flush()
             outputDict['concentrations'] = massFractions
             if DEBUG:
                 t = time.time() - t0
@@ -611,6 +589,193 @@ def fitMultipleSpectra(self, x=None, y=None, xmin=None, xmax=None,
             ####################################################
         return outputDict
 
+def _subtractStripBackground(chunk, strip):
+    """
+    Subtract in place the SNIP background of each column of chunk.
+
+    :param chunk: 2D array of shape (nChannels, nSpectra)
+    :param strip: tuple (stripfilterwidth, snipwidth, anchorslist)
+    """
+    filterWidth, snipWidth, anchorslist = strip
+    background = SNIPModule.getMultipleSpectraBackground(chunk.T,
+                                                         snipWidth,
+                                                         anchors=anchorslist,
+                                                         smoothing=0,
+                                                         sg_width=filterWidth)
+    chunk -= background.T
+
+def _fitRows(data, rowStart, rowEnd, results, uncertainties, context,
+             rowOffset=0):
+    """
+    Fit the rows rowStart to rowEnd - 1 of the stack in chunks of
+    context['jStep'] spectra, storing the output in results and uncertainties.
+    The row i of the stack is stored into the row i - rowOffset of the output.
+
+    The SVD of the model matrix is taken from and stored into
+    context['last_svd'] in order to be reused by subsequent calls.
+    """
+    derivatives = context['derivatives']
+    iXMin = context['iXMin']
+    iXMax = context['iXMax']
+    jStep = context['jStep']
+    strip = context['strip']
+    last_svd = context['last_svd']
+    chunk = numpy.zeros((1 + iXMax - iXMin, jStep), numpy.float64)
+    # HDF5 datasets are read in blocks aligned to their chunks
+    blocks = HDF5BlockReader.iterateBlocks(data, rowStart, rowEnd,
+                                           columns=jStep,
+                                           channels=(iXMin, iXMax + 1))
+    for (r0, r1, c0, c1), block in blocks:
+        for i in range(r0, r1):
+            #chunks of nColumns spectra
+            jStart = c0
+            while jStart < c1:
+                jEnd = min(jStart + jStep, c1)
+                chunk[:,:(jEnd - jStart)] = \
+                                block[i - r0, jStart - c0:jEnd - c0].T
+                if strip is not None:
+                    _subtractStripBackground(chunk, strip)
+
+                # perform the multiple fit to all the spectra in the chunk
+                ddict=lstsq(derivatives, chunk[:,:(jEnd - jStart)],
+                            sigma_b=context['sigma_b'],
+                            weight=context['weight'],
+                            digested_output=True,
+                            svd=context['svd'],
+                            last_svd=last_svd)
+                last_svd = ddict.get('svd', None)
+                results[:, i - rowOffset, jStart:jEnd] = ddict['parameters']
+                uncertainties[:, i - rowOffset, jStart:jEnd] = \
+                                                ddict['uncertainties']
+                jStart = jEnd
+    context['last_svd'] = last_svd
+
+def _fitRowBlock(data, rowStart, rowEnd, nFree, context):
+    """
+    Fit the rows rowStart to rowEnd - 1 into new arrays of shape
+    (nFree, rowEnd - rowStart, nColumns).
+    """
+    shape = (nFree, rowEnd - rowStart, data.shape[1])
+    results = numpy.zeros(shape, numpy.float32)
+    uncertainties = numpy.zeros(shape, numpy.float32)
+    _fitRows(data, rowStart, rowEnd, results, uncertainties, context,
+             rowOffset=rowStart)
+    return results, uncertainties
+
+def _fitRowsIntoStacks(data, rowStart, rowEnd, results, uncertainties,
+                       context, blockRows):
+    """
+    Fit the rows rowStart to rowEnd - 1 of the stack into the output stacks.
+
+    Stacks other than numpy arrays are written blockRows rows at a time in
+    order to keep in memory only the results of a block.
+    """
+    if isinstance(results, numpy.ndarray):
+        _fitRows(data, rowStart, rowEnd, results, uncertainties, context)
+        return
+    nFree = results.shape[0]
+    for r0 in range(rowStart, rowEnd, blockRows):
+        r1 = min(r0 + blockRows, rowEnd)
+        blockResults, blockUncertainties = _fitRowBlock(data, r0, r1,
+                                                        nFree, context)
+        results[:, r0:r1] = blockResults
+        uncertainties[:, r0:r1] = blockUncertainties
+        if DEBUG:
+            print("Written rows %d to %d" % (r0, r1 - 1))
+
+def _fitTile(rows):
+    # the forked workers share the data, the derivatives and the SVD
+    # without pickling them
+    rowStart, rowEnd = rows
+    ctx = ProcessPool.WORKER_CONTEXT
+    data = ctx['data']
+    if ctx['h5']:
+        # h5py handles cannot be shared among processes
+        if ctx.get('h5file') is None:
+            import h5py
+            ctx['h5file'] = h5py.File(ctx['h5'][0], "r")
+        data = ctx['h5file'][ctx['h5'][1]]
+    shape = ctx['shape']
+    if ctx['results'] is None:
+        # the results are sent back to be written by the calling process
+        results, uncertainties = _fitRowBlock(data, rowStart, rowEnd,
+                                              shape[0], ctx['fit'])
+        return rowStart, rowEnd, results, uncertainties
+    results = numpy.frombuffer(ctx['results'], dtype=numpy.float32)
+    results.shape = shape
+    uncertainties = numpy.frombuffer(ctx['uncertainties'], dtype=numpy.float32)
+    uncertainties.shape = shape
+    _fitRows(data, rowStart, rowEnd, results, uncertainties, ctx['fit'])
+    return rowStart, rowEnd
+
+def _fitRowsInParallel(data, shape, context, processes, stacks=None,
+                       blockRows=1):
+    """
+    Fit the stack splitting it in tiles of complete rows distributed among
+    a pool of worker processes writing into shared output buffers.
+
+    The first row is fitted by the calling process in order to obtain the
+    SVD to be shared by all the workers. The same chunking as in the serial
+    fit is used, therefore the results are identical.
+
+    If the output stacks are given, the workers send back the results of
+    their tiles, made of multiples of blockRows rows, and the calling
+    process writes them as they arrive.
+    """
+    mpContext = ProcessPool.getMultiprocessingContext()
+    nFree, nRows, nColumns = shape
+    if stacks is None:
+        size = nFree * nRows * nColumns
+        sharedResults = mpContext.RawArray(ctypes.c_float, size)
+        sharedUncertainties = mpContext.RawArray(ctypes.c_float, size)
+        results = numpy.frombuffer(sharedResults, dtype=numpy.float32)
+        results.shape = shape
+        uncertainties = numpy.frombuffer(sharedUncertainties,
+                                         dtype=numpy.float32)
+        uncertainties.shape = shape
+        _fitRows(data, 0, 1, results, uncertainties, context)
+        firstRow = 1
+    else:
+        sharedResults = None
+        sharedUncertainties = None
+        results, uncertainties = stacks
+        firstRow = min(blockRows, nRows)
+        _fitRowsIntoStacks(data, 0, firstRow, results, uncertainties,
+                           context, blockRows)
+    if firstRow >= nRows:
+        return results, uncertainties
+
+    h5 = None
+    if HDF5BlockReader.isHDF5Dataset(data):
+        # h5py dataset to be reopened by the workers
+        h5 = (data.file.filename, data.name)
+    tileRows = max(1, (nRows - firstRow) // (4 * processes))
+    if stacks is not None:
+        tileRows = blockRows * max(1, tileRows // blockRows)
+    tiles = [(i, min(i + tileRows, nRows)) \
+             for i in range(firstRow, nRows, tileRows)]
+    pool = ProcessPool.getPool(min(processes, len(tiles)),
+                               {'data': data,
+                                'h5': h5,
+                                'shape': shape,
+                                'results': sharedResults,
+                                'uncertainties': sharedUncertainties,
+                                'fit': context})
+    try:
+        for rows in pool.imap_unordered(_fitTile, tiles):
+            if stacks is not None:
+                results[:, rows[0]:rows[1]] = rows[2]
+                uncertainties[:, rows[0]:rows[1]] = rows[3]
+            if DEBUG:
+                print("Fitted rows %d to %d" % (rows[0], rows[1] - 1))
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+    return results, uncertainties
+
 def getFileListFromPattern(pattern, begin, end, increment=None):
     if type(begin) == type(1):
         begin = [begin]
@@ -655,7 +820,7 @@ def getFileListFromPattern(pattern, begin, end, increment=None):
     longoptions = ['cfg=', 'outdir=', 'concentrations=', 'weight=', 'refit=',
                    'tif=', #'listfile=',
                    'filepattern=', 'begin=', 'end=', 'increment=',
-                   "outfileroot="]
+                   "outfileroot=", "processes=", "h5="]
     try:
         opts, args = getopt.getopt(
                      sys.argv[1:],
@@ -676,6 +841,8 @@ def getFileListFromPattern(pattern, begin, end, increment=None):
     weight=0
     tif=0
     concentrations=0
+    processes=None
+    h5=0
     for opt, arg in opts:
         if opt in ('--cfg'):
             configurationFile = arg
@@ -709,6 +876,10 @@ def getFileListFromPattern(pattern, begin, end, increment=None):
             fileRoot = arg
         elif opt in ['--tif', '--tiff']:
             tif = int(arg)
+        elif opt in '--processes':
+            processes = int(arg)
+        elif opt in '--h5':
+            h5 = int(arg)
     if filepattern is not None:
         if (begin is None) or (end is None):
             raise ValueError(\
@@ -753,6 +924,17 @@ def getFileListFromPattern(pattern, begin, end, increment=None):
         sys.exit(0)
     if outputDir is None:
         print("RESULTS WILL NOT BE SAVED: No output directory specified")
+    if fileRoot in [None, ""]:
+        fileRoot = "images"
+    output = None
+    if h5 and (outputDir is not None):
+        # the images are written to disk while fitting
+        imagesDir = os.path.join(outputDir, "IMAGES")
+        if not os.path.exists(imagesDir):
+            os.makedirs(imagesDir)
+        output = ImageStackOutput.HDF5Output(os.path.join(imagesDir,
+                                                          fileRoot + ".h5"),
+                                             compression="gzip")
     t0 = time.time()
     fastFit = FastXRFLinearFit()
     fastFit.setFitConfigurationFile(configurationFile)
@@ -760,9 +942,14 @@ def getFileListFromPattern(pattern, begin, end, increment=None):
     result = fastFit.fitMultipleSpectra(y=dataStack,
                                          weight=weight,
                                          refit=refit,
-                                         concentrations=concentrations)
+                                         concentrations=concentrations,
+                                         processes=processes,
+                                         output=output)
     print("Total Elapsed = % s " % (time.time() - t0))
-    if outputDir is not None:
+    if output is not None:
+        output.close()
+        print("Images written to %s" % output.fileName)
+    elif outputDir is not None:
         if 'concentrations' in result:
             imageNames = result['names']
             images = numpy.concatenate((result['parameters'],
@@ -772,8 +959,6 @@ def getFileListFromPattern(pattern, begin, end, increment=None):
             imageNames = result['names']
         nImages = images.shape[0]
 
-        if fileRoot in [None, ""]:
-            fileRoot = "images"
         if not os.path.exists(outputDir):
             os.mkdir(outputDir)
         imagesDir = os.path.join(outputDir, "IMAGES")
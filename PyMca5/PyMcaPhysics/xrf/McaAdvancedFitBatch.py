@@ -32,6 +32,7 @@
 __copyright__ = "European Synchrotron Radiation Facility, Grenoble, France"
 import sys
 import os
+import multiprocessing
 import numpy
 from . import ClassMcaTheory
 from PyMca5.PyMcaCore import SpecFileLayer
@@ -49,9 +50,85 @@
 except ImportError:
     HDF5SUPPORT = False
 from PyMca5.PyMcaIO import ConfigDict
+from PyMca5.PyMcaMisc import ProcessPool
 from . import ConcentrationsTool
 
 
+def _getWorkerMcaTheory(configIndex):
+    # one McaTheory instance per used configuration, configured only once
+    mcafitDict = ProcessPool.WORKER_CONTEXT['mcafit']
+    if configIndex not in mcafitDict:
+        config = ProcessPool.WORKER_CONTEXT['configList'][configIndex]
+        mcafitDict[configIndex] = ClassMcaTheory.McaTheory(config)
+        mcafitDict[configIndex].enableOptimizedLinearFit()
+    return mcafitDict[configIndex]
+
+
+def _fitMca(task):
+    """
+    Fit one spectrum in a worker process writing the .fit file if requested.
+
+    Return a tuple (result, concentrations, list of error messages). The
+    result is None if the spectrum could not be fitted.
+    """
+    configIndex, x, y, filename, info, outfile, fitFiles = task
+    mcafit = _getWorkerMcaTheory(configIndex)
+    tool = ProcessPool.WORKER_CONTEXT['tool']
+    errors = []
+    try:
+        #I make sure I take the fit limits configuration
+        mcafit.config['fit']['use_limit'] = 1
+        mcafit.setData(x, y, time=info.get("McaLiveTime", None))
+        mcafit.estimate()
+        if fitFiles or ((tool is not None) and (mcafit._fluoRates is None)):
+            fitresult, result = mcafit.startfit(digest=1)
+        else:
+            fitresult = mcafit.startfit(digest=0)
+            result = mcafit.imagingDigestResult()
+    except Exception:
+        if mcafit.config['fit'].get("strategyflag", False):
+            # the configuration is restored at next call
+            del ProcessPool.WORKER_CONTEXT['mcafit'][configIndex]
+        return None, None, ["Error fitting file with output = %s: %s" % \
+                                              (filename, sys.exc_info()[1])]
+    concentrations = None
+    if tool is not None:
+        try:
+            fitresult0 = {}
+            fitresult0['fitresult'] = fitresult
+            fitresult0['result'] = result
+            conf = mcafit.configure()
+            tconf = tool.configure()
+            if 'concentrations' in conf:
+                tconf.update(conf['concentrations'])
+            if fitFiles or (mcafit._fluoRates is None):
+                concentrations = tool.processFitResult(config=tconf,
+                                            fitresult=fitresult0,
+                                            elementsfrommatrix=False)
+            else:
+                result['config'] = mcafit.config
+                concentrations = tool.processFitResult(config=tconf,
+                                            fitresult=fitresult0,
+                                            elementsfrommatrix=False,
+                                            fluorates=mcafit._fluoRates)
+        except Exception:
+            errors.append("Error in concentrations of file with output = "\
+                          "%s: %s" % (filename, sys.exc_info()[1]))
+    if fitFiles:
+        result = mcafit.digestresult(outfile=outfile, info=info)
+        if concentrations is not None:
+            try:
+                f = ConfigDict.ConfigDict()
+                f.read(outfile)
+                f['concentrations'] = concentrations
+                os.remove(outfile)
+                f.write(outfile)
+            except Exception:
+                errors.append("Error writing concentrations to fit file "\
+                              "%s: %s" % (outfile, sys.exc_info()[1]))
+    return result, concentrations, errors
+
+
 class McaAdvancedFitBatch(object):
     def __init__(self,initdict,filelist=None,outputdir=None,
                     roifit=None,roiwidth=None,
@@ -59,7 +136,16 @@ def __init__(self,initdict,filelist=None,outputdir=None,
                     concentrations=0, fitfiles=1, fitimages=1,
                     filebeginoffset = 0, fileendoffset=0,
                     mcaoffset=0, chunk = None,
-                    selection=None, lock=None):
+                    selection=None, lock=None, processes=None):
+        """
+        If processes is greater than one, the spectra are fitted by a pool of
+        processes, each one keeping its configured fit instance. The value 0
+        means the number of CPUs. Without fork support they are fitted by
+        the calling process.
+
+        The errors fitting the spectra are written to the <rootname>_errors.txt
+        file of the output directory.
+        """
         #for the time being the concentrations are bound to the .fit files
         #that is not necessary, but it will be correctly implemented in
         #future releases
@@ -100,6 +186,10 @@ def __init__(self,initdict,filelist=None,outputdir=None,
         self.mcaOffset = mcaoffset
         self.chunk     = chunk
         self.selection = selection
+        if processes == 0:
+            processes = multiprocessing.cpu_count()
+        self.processes = processes
+        self.__tasks = None
 
 
     def setFileList(self,filelist=None):
@@ -161,6 +251,38 @@ def processList(self):
         self.counter =  0
         self.__row   = self.fileBeginOffset - 1
         self.__stack = None
+        if self.chunk is not None:
+            err_extension = "_%06d_partial_errors.txt" % self.chunk
+        else:
+            err_extension = "_errors.txt"
+        self._errorsFile = self.os_path_join(self._outputdir,
+                                             self._rootname + err_extension)
+        if os.path.exists(self._errorsFile):
+            try:
+                os.remove(self._errorsFile)
+            except:
+                print("I could not delete existing errors file %s" %\
+                      self._errorsFile)
+        if (not self.roiFit) and (self.processes is not None) and \
+           (self.processes > 1):
+            if self._concentrations:
+                tool = ConcentrationsTool.ConcentrationsTool()
+            else:
+                tool = None
+            pool = ProcessPool.getPool(self.processes,
+                                       {'configList': self.__configList,
+                                        'mcafit': {},
+                                        'tool': tool})
+            if pool is not None:
+                self.__tasks = ProcessPool.OrderedTasks(pool, self.__mergeMca)
+        try:
+            self.__processList()
+        finally:
+            if self.__tasks is not None:
+                self.__tasks.terminate()
+                self.__tasks = None
+
+    def __processList(self):
         for i in range(0+self.fileBeginOffset,
                        len(self._filelist)-self.fileEndOffset,
                        self.fileStep):
@@ -190,6 +312,9 @@ def processList(self):
                     break
             else:
                 self.__processOneFile()
+        # merge the fits still in progress
+        if self.__tasks is not None:
+            self.__tasks.handle(0)
         if self.counter:
             if not self.roiFit:
                 if self.fitFiles:
@@ -254,6 +379,15 @@ def onEnd(self):
     def __log(self,text):
         print(text)
 
+    def __logError(self, text):
+        print(text)
+        try:
+            f = open(self._errorsFile, "a")
+            f.write(text + "\n")
+            f.close()
+        except:
+            print("I could not write to errors file %s" % self._errorsFile)
+
     def __tryEdf(self,inputfile):
         try:
             ffile   = EdfFileLayer.EdfFileLayer(fastedf=0)
@@ -355,10 +489,8 @@ def __processStack(self):
                 infoDict = {}
                 infoDict['SourceName'] = info['SourceName']
                 infoDict['Key']        = key
-                self.__processOneMca(x,y0,filename,key,info=infoDict)
-                self.onMca(mca, numberofmca, filename=filename,
-                                            key=key,
-                                            info=infoDict)
+                self.__scheduleMca(x, y0, filename, key, infoDict,
+                                   mca, numberofmca)
 
     def __processOneFile(self):
         ffile=self.file
@@ -393,10 +525,8 @@ def __processOneFile(self):
                         infoDict['SourceName'] = info['SourceName']
                         infoDict['Key']        = key
                         infoDict['McaLiveTime'] = info.get('McaLiveTime', None)
-                        self.__processOneMca(x,y0,filename,key,info=infoDict)
-                        self.onMca(mca, numberofmca, filename=filename,
-                                                    key=key,
-                                                    info=infoDict)
+                        self.__scheduleMca(x, y0, filename, key, infoDict,
+                                           mca, numberofmca)
                 else:
                     if info['NbMca'] > 0:
                         self.fitImages = True
@@ -432,6 +562,16 @@ def __processOneFile(self):
                                 self.__ncols *= len(fileinfo['KeyList'])
                                 self.__ncolsModified = True
 
+                        autotime = self.mcafit.config["concentrations"].get(\
+                                        "useautotime", False)
+                        allMcaData = None
+                        if (not autotime) and hasattr(scan_obj, "allmca"):
+                            # all the mca of the scan parsed in one pass
+                            try:
+                                allMcaData = scan_obj.allmca()
+                            except:
+                                # spectra of different lengths
+                                allMcaData = None
                         #import time
                         for mca_index in range(numberOfMcaToTakeFromScan):
                             i = 0 + self.mcaOffset + mca_index * self.mcaStep
@@ -446,13 +586,13 @@ def __processOneFile(self):
                             point = int(i/info['NbMcaDet']) + 1
                             mca   = (i % info['NbMcaDet'])  + 1
                             key = "%s.%s.%05d.%d" % (scan,order,point,mca)
-                            autotime = self.mcafit.config["concentrations"].get(\
-                                        "useautotime", False)
                             if autotime:
                                 #slow info reading methods needed to access time
                                 mcainfo,mcadata = ffile.LoadSource(key)
                                 info['McaLiveTime'] = mcainfo.get('McaLiveTime',
                                                               None)
+                            elif allMcaData is not None:
+                                mcadata = allMcaData[i]
                             else:
                                 mcadata = scan_obj.mca(i+1)
                             y0  = numpy.array(mcadata)
@@ -465,12 +605,57 @@ def __processOneFile(self):
                             infoDict['Key']        = key
                             infoDict['McaLiveTime'] = info.get('McaLiveTime',
                                                                None)
-                            self.__processOneMca(x,y0,filename,key,info=infoDict)
-                            self.onMca(i, info['NbMca'],filename=filename,
-                                                    key=key,
-                                                    info=infoDict)
+                            self.__scheduleMca(x, y0, filename, key,
+                                               infoDict, i, info['NbMca'])
                             #print "remaining = ",(time.time()-e0) * (info['NbMca'] - i)
 
+    def __scheduleMca(self, x, y, filename, key, info, mca, nmca):
+        if self.__tasks is None:
+            self.__processOneMca(x, y, filename, key, info=info)
+            self.onMca(mca, nmca, filename=filename, key=key, info=info)
+            return
+        fitfile = self.__getFitFile(filename, key)
+        if self.useExistingFiles and os.path.exists(fitfile):
+            # nothing to fit, the existing result is read when merging
+            function = None
+            task = None
+        else:
+            if self.fitFiles:
+                fitdir = os.path.dirname(fitfile)
+                if not os.path.isdir(fitdir):
+                    try:
+                        os.makedirs(fitdir)
+                    except:
+                        print("I could not create directory %s" % fitdir)
+            function = _fitMca
+            task = (self.__currentConfig, x, y, filename, info, fitfile,
+                    self.fitFiles)
+        # results are merged in order, limiting the number of pending fits
+        self.__tasks.submit(function, task,
+                            info=(self.__row, self.__col, x, y, filename,
+                                  key, info, mca, nmca),
+                            maxPending=4 * self.processes)
+
+    def __mergeMca(self, taskInfo, output):
+        # merge a fit at the position it had when scheduled
+        row, col, x, y, filename, key, info, mca, nmca = taskInfo
+        currentRow = self.__row
+        currentCol = self.__col
+        self.__row = row
+        self.__col = col
+        if output is None:
+            self.__processOneMca(x, y, filename, key, info=info)
+        else:
+            result, concentrations, errors = output
+            for error in errors:
+                self.__logError(error)
+            if result is not None:
+                self.__processOneMca(x, y, filename, key, info=info,
+                                     output=(result, concentrations))
+        self.onMca(mca, nmca, filename=filename, key=key, info=info)
+        self.__row = currentRow
+        self.__col = currentCol
+
     def __getFitFile(self, filename, key):
         fitdir = self.os_path_join(self._outputdir,"FIT")
         fitdir = self.os_path_join(fitdir,filename+"_FITDIR")
@@ -499,7 +684,7 @@ def os_path_join(self, a, b):
                                            a.decode('latin-1'))
         return outfile
 
-    def __processOneMca(self,x,y,filename,key,info=None):
+    def __processOneMca(self,x,y,filename,key,info=None,output=None):
         self._concentrationsAsAscii = ""
         if not self.roiFit:
             result = None
@@ -522,13 +707,19 @@ def __processOneMca(self,x,y,filename,key,info=None):
                         print("I could not delete existing concentrations file %s" %\
                               self._concentrationsFile)
             #print "self._concentrationsFile", self._concentrationsFile
-            if self.useExistingFiles and os.path.exists(fitfile):
+            if output is not None:
+                # fitted by a worker process, .fit file already written
+                useExistingResult = 1
+                result, concentrations = output
+                concentrationsdone = 1
+            elif self.useExistingFiles and os.path.exists(fitfile):
                 useExistingResult = 1
                 try:
                     dict = ConfigDict.ConfigDict()
                     dict.read(fitfile)
                     result = dict['result']
                     if 'concentrations' in dict:
+                        concentrations = dict['concentrations']
                         concentrationsdone = 1
                 except:
                     print("Error trying to use result file %s" % fitfile)
@@ -542,8 +733,8 @@ def __processOneMca(self,x,y,filename,key,info=None):
                     self.mcafit.config['fit']['use_limit'] = 1
                     self.mcafit.setData(x,y, time=info.get("McaLiveTime", None))
                 except:
-                    print("Error entering data of file with output = %s\n%s" %\
-                          (filename, sys.exc_info()[1]))
+                    self.__logError("Error entering data of file with output = %s\n%s" %\
+                                    (filename, sys.exc_info()[1]))
                     # make sure the configuration is restored
                     if self.mcafit.config['fit'].get("strategyflag", False):
                         config = self.__configList[self.__currentConfig]
@@ -576,15 +767,15 @@ def __processOneMca(self,x,y,filename,key,info=None):
                                             elementsfrommatrix=False,
                                             fluorates = self.mcafit._fluoRates)
                         except:
-                            print("error in concentrations")
-                            print(sys.exc_info()[0:-1])
+                            self.__logError("Error in concentrations of file with output = %s: %s" %\
+                                            (filename, sys.exc_info()[1]))
                         concentrationsdone = True
                     else:
                         #just images
                         fitresult = self.mcafit.startfit(digest=0)
                 except:
-                    print("Error fitting file with output = %s: %s)" %\
-                          (filename, sys.exc_info()[1]))
+                    self.__logError("Error fitting file with output = %s: %s" %\
+                                    (filename, sys.exc_info()[1]))
                     if self.mcafit.config['fit'].get("strategyflag", False):
                         config = self.__configList[self.__currentConfig]
                         print("Restoring fitconfiguration")
@@ -618,8 +809,8 @@ def __processOneMca(self,x,y,filename,key,info=None):
                                             fitresult=fitresult0,
                                             elementsfrommatrix=False)
                         except:
-                            print("error in concentrations")
-                            print(sys.exc_info()[0:-1])
+                            self.__logError("Error in concentrations of file with output = %s: %s" %\
+                                            (filename, sys.exc_info()[1]))
                             #return
                 self._concentrationsAsAscii=self._toolConversion.getConcentrationsAsAscii(concentrations)
                 if len(self._concentrationsAsAscii) > 1:
@@ -656,7 +847,7 @@ def __processOneMca(self,x,y,filename,key,info=None):
                 if not useExistingResult:
                     result = self.mcafit.digestresult(outfile=outfile,
                                                       info=info)
-                if concentrations is not None:
+                if (concentrations is not None) and (output is None):
                     try:
                         f=ConfigDict.ConfigDict()
                         f.read(outfile)
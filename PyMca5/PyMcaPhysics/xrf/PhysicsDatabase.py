@@ -0,0 +1,247 @@
+#/*##########################################################################
+#
+# The PyMca X-Ray Fluorescence Toolkit
+#
+# Copyright (c) 2004-2016 European Synchrotron Radiation Facility
+#
+# This file is part of the PyMca X-ray Fluorescence Toolkit developed at
+# the ESRF by the Software group.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+#############################################################################*/
+__author__ = "V.A. Sole - ESRF Data Analysis"
+__contact__ = "sole@esrf.fr"
+__license__ = "MIT"
+__copyright__ = "European Synchrotron Radiation Facility, Grenoble, France"
+__doc__ = """
+Binary version of the XCOM mass attenuation tables.
+
+The attdata/<element>.mat text files are compiled into a single
+uncompressed numpy .npz file with one [energy, coherent, compton, photo,
+pair] array per element. The array of an element is only read, and
+copied into memory, on first use.
+
+The database is compiled at build time and installed into the attdata
+directory. If not found there or not up to date, it is compiled once into
+the PyMca cache directory. A database is up to date if it has the current
+DATABASE_VERSION, it was compiled from .mat files with the same names and
+sizes, and none of them is newer than the database file.
+
+This module only depends on numpy in order to be usable from setup.py:
+
+    python PhysicsDatabase.py attdata_directory [output_file]
+"""
+import os
+import sys
+import glob
+import tempfile
+import threading
+import numpy
+
+DEBUG = 0
+
+DATABASE_NAME = "xcom.npz"
+# to be increased when the content of the database changes
+DATABASE_VERSION = 1
+XCOM_KEYS = ['energy', 'coherent', 'compton', 'photo', 'pair']
+
+_DATABASE = None
+_DATABASE_LOCK = threading.Lock()
+
+
+def readXcomFile(fileName):
+    """
+    Read an XCOM output file returning a dictionnary of arrays with the keys
+    energy (in keV), coherent, compton, photo and pair (nuclear plus
+    electron field) sorted by increasing energy.
+    """
+    f = open(fileName, 'r')
+    try:
+        lines = f.readlines()
+    finally:
+        f.close()
+    ddict = {}
+    for key in XCOM_KEYS:
+        ddict[key] = []
+    # each block of values is preceded by its label
+    labels = ['ENERGY', 'COHERENT', 'INCOHERENT', 'PHOTO', 'PAIR', 'PAIR']
+    blocks = [[]]
+    i = 0
+    for line in lines:
+        if (i < len(labels)) and (labels[i] in line):
+            i += 1
+            blocks.append([])
+            continue
+        if i:
+            blocks[-1].extend([float(value) for value in line.split()])
+    if i < len(labels):
+        raise IOError("Invalid XCOM file %s" % fileName)
+    energy = numpy.array(blocks[1]) * 1000.
+    nuclear = numpy.array(blocks[5])
+    electron = numpy.array(blocks[6])
+    # stable sort to keep the order of the values at the absorption edges
+    i1 = numpy.argsort(energy, kind='mergesort')
+    ddict['energy'] = numpy.take(energy, i1)
+    ddict['coherent'] = numpy.take(numpy.array(blocks[2]), i1)
+    ddict['compton'] = numpy.take(numpy.array(blocks[3]), i1)
+    ddict['photo'] = numpy.take(numpy.array(blocks[4]), i1)
+    ddict['pair'] = numpy.take(nuclear + electron, i1)
+    if ddict['coherent'][0] <= 0:
+        ddict['coherent'][0] = ddict['coherent'][1] * 1.0
+    return ddict
+
+
+def _getSourceFiles(attdataDirectory):
+    return sorted(glob.glob(os.path.join(attdataDirectory, "*.mat")))
+
+
+def compileDatabase(attdataDirectory, outputFile=None):
+    """
+    Compile all the .mat files found in attdataDirectory into outputFile.
+    By default the output is written into attdataDirectory.
+    """
+    if outputFile is None:
+        outputFile = os.path.join(attdataDirectory, DATABASE_NAME)
+    data = {}
+    sourceNames = []
+    sourceSizes = []
+    for fileName in _getSourceFiles(attdataDirectory):
+        element = os.path.splitext(os.path.basename(fileName))[0]
+        ddict = readXcomFile(fileName)
+        data["xcom_" + element] = numpy.array([ddict[key] \
+                                                for key in XCOM_KEYS])
+        sourceNames.append(os.path.basename(fileName))
+        sourceSizes.append(os.path.getsize(fileName))
+    if not len(data):
+        raise IOError("No XCOM file found in %s" % attdataDirectory)
+    data["version"] = numpy.array(DATABASE_VERSION)
+    data["source_names"] = numpy.array(sourceNames)
+    data["source_sizes"] = numpy.array(sourceSizes, dtype=numpy.int64)
+    # write to a temporary file in the same directory and rename it in
+    # order not to expose incomplete files to other processes
+    fd, tmpName = tempfile.mkstemp(suffix=".tmp",
+                                   dir=os.path.dirname(os.path.abspath(outputFile)))
+    try:
+        with os.fdopen(fd, "wb") as f:
+            numpy.savez(f, **data)
+        if hasattr(os, "replace"):
+            os.replace(tmpName, outputFile)
+        else:
+            if os.path.exists(outputFile):
+                os.remove(outputFile)
+            os.rename(tmpName, outputFile)
+    except:
+        if os.path.exists(tmpName):
+            os.remove(tmpName)
+        raise
+    return outputFile
+
+
+def isDatabaseValid(fileName, attdataDirectory):
+    """
+    Return True if the database fileName exists and is up to date with
+    the .mat files of attdataDirectory.
+    """
+    if not os.path.exists(fileName):
+        return False
+    try:
+        database = numpy.load(fileName)
+        try:
+            if int(database["version"]) != DATABASE_VERSION:
+                return False
+            names = [str(name) for name in database["source_names"]]
+            sizes = database["source_sizes"].tolist()
+        finally:
+            database.close()
+    except:
+        # not a database or from a previous version
+        if DEBUG:
+            print("Invalid XCOM database %s: %s" % (fileName,
+                                                   sys.exc_info()[1]))
+        return False
+    sourceFiles = _getSourceFiles(attdataDirectory)
+    if names != [os.path.basename(name) for name in sourceFiles]:
+        return False
+    if sizes != [os.path.getsize(name) for name in sourceFiles]:
+        return False
+    # a tolerance for file systems with coarse time stamps
+    mtime = os.path.getmtime(fileName) + 2.0
+    for name in sourceFiles:
+        if os.path.getmtime(name) > mtime:
+            return False
+    return True
+
+
+def _getAttDataDirectory():
+    from PyMca5 import PyMcaDataDir
+    return os.path.join(PyMcaDataDir.PYMCA_DATA_DIR, "attdata")
+
+
+def _openDatabase():
+    attdataDirectory = _getAttDataDirectory()
+    fileName = os.path.join(attdataDirectory, DATABASE_NAME)
+    if not isDatabaseValid(fileName, attdataDirectory):
+        import PyMca5
+        cacheDirectory = PyMca5.getDefaultCacheDirectory()
+        if cacheDirectory is None:
+            return None
+        fileName = os.path.join(cacheDirectory, DATABASE_NAME)
+        if not isDatabaseValid(fileName, attdataDirectory):
+            if DEBUG:
+                print("Compiling XCOM database into %s" % fileName)
+            compileDatabase(attdataDirectory, fileName)
+    return numpy.load(fileName)
+
+
+def getXcomData(element):
+    """
+    Return the XCOM data of the element as a dictionnary of arrays or None
+    if not available in the database.
+    """
+    global _DATABASE
+    with _DATABASE_LOCK:
+        if _DATABASE is None:
+            try:
+                _DATABASE = _openDatabase()
+            except:
+                if DEBUG:
+                    print("Cannot open XCOM database: %s" % sys.exc_info()[1])
+                _DATABASE = False
+        if not _DATABASE:
+            return None
+        key = "xcom_" + element
+        if key not in _DATABASE.files:
+            return None
+        data = _DATABASE[key]
+    ddict = {}
+    for i, key in enumerate(XCOM_KEYS):
+        ddict[key] = data[i] * 1
+    return ddict
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python PhysicsDatabase.py attdata_directory [output_file]")
+        sys.exit(1)
+    if len(sys.argv) > 2:
+        outputFile = sys.argv[2]
+    else:
+        outputFile = None
+    print("Written %s" % compileDatabase(sys.argv[1], outputFile))
@@ -61,6 +61,9 @@
 for element in ElementList:
     EPDL97_DICT[element] = {}
 
+#incremented each time the data of an element are loaded or replaced
+DATA_VERSION = 0
+
 #initialize the dictionnary, for the time being compatible with PyMca 4.3.0
 EPDL97_DICT = {}
 for element in ElementList:
@@ -100,6 +103,7 @@ def setElementBindingEnergies(element, ddict):
     respect other programs absorption edges. Data will be extrapolated when
     needed. WARNING: Coherent resonances are not replaced.
     """
+    global DATA_VERSION
     if len(EPDL97_DICT[element]['EPDL97'].keys()) < 2:
         _initializeElement(element)
     EPDL97_DICT[element]['original'] = False
@@ -108,6 +112,7 @@ def setElementBindingEnergies(element, ddict):
         EPDL97_DICT[element]['binding'].update(ddict['binding'])
     else:
         EPDL97_DICT[element]['binding'].update(ddict)
+    DATA_VERSION += 1
 
 def _initializeElement(element):
     """
@@ -116,6 +121,7 @@ def _initializeElement(element):
     Reads the file and loads all the relevant element information contained
     int the EPDL97 file into the internal dictionnary.
     """
+    global DATA_VERSION
     #read the specfile data
     sf = specfile.Specfile(EPDL97_FILE)
     scan_index = ElementList.index(element)
@@ -193,6 +199,7 @@ def _initializeElement(element):
     #take care of rounding problems
     idx = EPDL97_DICT[element]['EPDL97']['all other'] < 0.0
     EPDL97_DICT[element]['EPDL97']['all other'][idx] = 0.0
+    DATA_VERSION += 1
 
 
 def getElementCrossSections(element, energy=None, forced_shells=None):
@@ -120,6 +120,28 @@ def getDefaultUserPluginsDirectory():
         print("WARNING: Cannot initialize plugis directory")
         return None
 
+def getDefaultCacheDirectory():
+    """
+    Return the default directory where to store cached calculations.
+
+    The PYMCA_CACHE_DIR environment variable takes precedence over the
+    cache subdirectory of the settings directory.
+    The directory will be created if not existing. In case of error it returns None.
+    """
+    try:
+        cacheDir = os.getenv("PYMCA_CACHE_DIR")
+        if not cacheDir:
+            settingsDir = os.path.dirname(getDefaultSettingsFile())
+            if not os.path.exists(settingsDir):
+                return None
+            cacheDir = os.path.join(settingsDir, "cache")
+        if not os.path.exists(cacheDir):
+            os.makedirs(cacheDir)
+        return cacheDir
+    except:
+        print("WARNING: Cannot initialize cache directory")
+        return None
+
 def getUserDataFile(fileName, directory=""):
     """
     Look for an alternative to the given filename in the default user data directory
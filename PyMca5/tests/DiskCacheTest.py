@@ -0,0 +1,229 @@
+#/*##########################################################################
+#
+# The PyMca X-Ray Fluorescence Toolkit
+#
+# Copyright (c) 2004-2014 European Synchrotron Radiation Facility
+#
+# This file is part of the PyMca X-ray Fluorescence Toolkit developed at
+# the ESRF by the Software group.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+#############################################################################*/
+__author__ = "V. Armando Sole - ESRF Data Analysis"
+__contact__ = "sole@esrf.fr"
+__license__ = "MIT"
+__copyright__ = "European Synchrotron Radiation Facility, Grenoble, France"
+import unittest
+import os
+import shutil
+import tempfile
+import numpy
+
+class testDiskCache(unittest.TestCase):
+    def setUp(self):
+        """
+        import the module
+        """
+        try:
+            from PyMca5.PyMcaCore import DiskCache
+            self._module = DiskCache
+        except:
+            self._module = None
+        self._tmpDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """clean up any possible files"""
+        shutil.rmtree(self._tmpDir, ignore_errors=True)
+
+    def testDiskCacheImport(self):
+        #"""Test successful import"""
+        self.assertTrue(self._module is not None,\
+                        "Unsuccessful PyMca5.PyMcaCore.DiskCache import")
+
+    def testDiskCacheKey(self):
+        getKey = self._module.getKey
+        a = {'peaks': {'Fe': ['K'], 'Cu': 'K'},
+             'fit': {'energy': [10.0, None], 'escapeflag': 1}}
+        b = {'fit': {'escapeflag': 1, 'energy': [10.0, None]},
+             'peaks': {'Cu': 'K', 'Fe': ['K']}}
+        self.assertEqual(getKey(a), getKey(b),
+                         "Key depends on dictionary ordering")
+        b['fit']['energy'] = (10.0, None)
+        self.assertEqual(getKey(a), getKey(b),
+                         "Key depends on the container type")
+        b['fit']['energy'] = [10.000001, None]
+        self.assertNotEqual(getKey(a), getKey(b),
+                            "Different inputs give the same key")
+        self.assertEqual(getKey(numpy.arange(3.)),
+                         getKey(numpy.arange(3.)))
+        self.assertNotEqual(getKey(numpy.arange(3.)),
+                            getKey(numpy.arange(3)))
+
+    def testDiskCacheStorage(self):
+        cache = self._module.DiskCache(self._tmpDir)
+        key = self._module.getKey("test", 1)
+        self.assertTrue(cache.load(key) is None)
+        obj = {'PEAKS0': [numpy.arange(8.).reshape(2, 4)],
+               'PARAMETERS': ['Zero', 'Gain']}
+        self.assertTrue(cache.save(key, obj))
+        read = cache.load(key)
+        self.assertEqual(read['PARAMETERS'], obj['PARAMETERS'])
+        self.assertTrue(numpy.allclose(read['PEAKS0'][0], obj['PEAKS0'][0]))
+
+        # a corrupted file is a miss and it is removed
+        fileName = os.path.join(self._tmpDir, key + self._module.EXTENSION)
+        with open(fileName, "wb") as f:
+            f.write(b"not a cache file")
+        self.assertTrue(cache.load(key) is None)
+        self.assertFalse(os.path.exists(fileName))
+
+    def testDiskCacheTypes(self):
+        cache = self._module.DiskCache(self._tmpDir)
+        key = self._module.getKey("types")
+        obj = {'rates': {1: (0.5, numpy.float64(0.25)), 'K': [None, True]},
+               'counts': numpy.arange(6, dtype=numpy.int32).reshape(3, 2),
+               'name': 'Fe K'}
+        self.assertTrue(cache.save(key, obj))
+        read = cache.load(key)
+        self.assertEqual(sorted(read.keys()), sorted(obj.keys()))
+        self.assertEqual(read['rates'][1], (0.5, 0.25))
+        self.assertTrue(isinstance(read['rates'][1], tuple))
+        self.assertTrue(isinstance(read['rates'][1][1], numpy.float64))
+        self.assertEqual(read['rates']['K'], [None, True])
+        self.assertEqual(read['counts'].dtype, numpy.int32)
+        self.assertTrue(numpy.all(read['counts'] == obj['counts']))
+        self.assertEqual(read['name'], 'Fe K')
+
+        # only plain data are stored
+        self.assertFalse(cache.save(key + "0", {'object': object()}))
+        self.assertFalse(cache.save(key + "1", numpy.array([object()])))
+
+    @unittest.skipIf(not hasattr(os, "getuid") or os.getuid() != 0,
+                     "needs to change the directory owner")
+    def testDiskCacheOwner(self):
+        cache = self._module.DiskCache(self._tmpDir)
+        self.assertTrue(cache.isEnabled())
+        key = self._module.getKey("owner")
+        cache.save(key, [1.0])
+        # a directory of another user is not used
+        os.chown(self._tmpDir, os.getuid() + 1, -1)
+        self.assertFalse(cache.isEnabled())
+        self.assertTrue(cache.load(key) is None)
+        self.assertFalse(cache.save(key, [2.0]))
+
+    def testDiskCacheEviction(self):
+        cache = self._module.DiskCache(self._tmpDir)
+        keys = []
+        for i in range(5):
+            key = self._module.getKey(i)
+            cache.save(key, numpy.zeros(1024, numpy.float64) + i)
+            fileName = os.path.join(self._tmpDir,
+                                    key + self._module.EXTENSION)
+            # explicit usage times for the test not to depend on the
+            # file system time resolution
+            os.utime(fileName, (1000. + i, 1000. + i))
+            keys.append(key)
+        # room for three files
+        cache.evict(maxsize=3 * os.path.getsize(fileName))
+        present = [cache.load(key) is not None for key in keys]
+        self.assertEqual(present, [False, False, True, True, True])
+        cache.clear()
+        self.assertEqual(os.listdir(self._tmpDir), [])
+
+    def testDiskCacheMcaTheory(self):
+        from PyMca5 import PyMcaDataDir
+        from PyMca5.PyMcaIO import ConfigDict
+        from PyMca5.PyMcaPhysics.xrf import ClassMcaTheory
+        from PyMca5.PyMcaPhysics.xrf import Elements
+        configuration = ConfigDict.ConfigDict()
+        configuration.read(os.path.join(PyMcaDataDir.PYMCA_DATA_DIR,
+                                        "McaTheory.cfg"))
+        configuration["fit"]["energy"] = [12.0]
+        configuration["fit"]["energyweight"] = [1.0]
+        configuration["fit"]["energyflag"] = [1]
+        configuration["fit"]["energyscatter"] = [1]
+        configuration["peaks"] = {"Fe": "K", "Cu": "K"}
+
+        def cachedFiles():
+            return [x for x in os.listdir(self._tmpDir) \
+                    if x.endswith(self._module.EXTENSION)]
+
+        def configure(useCache):
+            configuration["fit"]["usecache"] = useCache
+            mcaTheory = ClassMcaTheory.McaTheory()
+            mcaTheory.setConfiguration(configuration)
+            return mcaTheory
+
+        oldCache = ClassMcaTheory._CACHE
+        xcom = Elements.getelementmassattcoef("Fe")
+        try:
+            ClassMcaTheory._CACHE = self._module.DiskCache(self._tmpDir)
+            # not used unless requested
+            configure(0)
+            self.assertEqual(cachedFiles(), [])
+
+            # the second instance reads the peaks of the first one
+            reference = configure(1)
+            self.assertEqual(len(cachedFiles()), 1)
+            mcaTheory = configure(1)
+            self.assertEqual(len(cachedFiles()), 1)
+            self.assertEqual(mcaTheory.PARAMETERS, reference.PARAMETERS)
+            for i in range(len(reference.PEAKS0)):
+                self.assertTrue(numpy.allclose(mcaTheory.PEAKS0[i],
+                                               reference.PEAKS0[i]))
+
+            # other attenuation coefficients give other peaks
+            self.assertTrue(Elements.isDefaultXcomData("Fe"))
+            newXcom = dict(xcom)
+            newXcom["photo"] = 2 * numpy.array(xcom["photo"])
+            newXcom["photolog10"] = numpy.log10(newXcom["photo"])
+            Elements.Element["Fe"]["xcom"] = newXcom
+            self.assertFalse(Elements.isDefaultXcomData("Fe"))
+            configure(1)
+            self.assertEqual(len(cachedFiles()), 2)
+            configure(1)
+            self.assertEqual(len(cachedFiles()), 2)
+        finally:
+            ClassMcaTheory._CACHE = oldCache
+            Elements.Element["Fe"]["xcom"] = xcom
+        configure(1)
+        self.assertEqual(len(cachedFiles()), 2)
+
+def getSuite(auto=True):
+    testSuite = unittest.TestSuite()
+    if auto:
+        testSuite.addTest(\
+            unittest.TestLoader().loadTestsFromTestCase(testDiskCache))
+    else:
+        # use a predefined order
+        testSuite.addTest(testDiskCache("testDiskCacheImport"))
+        testSuite.addTest(testDiskCache("testDiskCacheKey"))
+        testSuite.addTest(testDiskCache("testDiskCacheStorage"))
+        testSuite.addTest(testDiskCache("testDiskCacheTypes"))
+        testSuite.addTest(testDiskCache("testDiskCacheOwner"))
+        testSuite.addTest(testDiskCache("testDiskCacheEviction"))
+        testSuite.addTest(testDiskCache("testDiskCacheMcaTheory"))
+    return testSuite
+
+def test(auto=False):
+    unittest.TextTestRunner(verbosity=2).run(getSuite(auto=auto))
+
+if __name__ == '__main__':
+    test()
@@ -0,0 +1,188 @@
+#/*##########################################################################
+#
+# The PyMca X-Ray Fluorescence Toolkit
+#
+# Copyright (c) 2004-2016 European Synchrotron Radiation Facility
+#
+# This file is part of the PyMca X-ray Fluorescence Toolkit developed at
+# the ESRF by the Software group.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+#############################################################################*/
+__author__ = "V. Armando Sole - ESRF Data Analysis"
+__contact__ = "sole@esrf.fr"
+__license__ = "MIT"
+__copyright__ = "European Synchrotron Radiation Facility, Grenoble, France"
+import unittest
+import os
+import shutil
+import tempfile
+import threading
+import time
+import numpy
+
+class testEDFStack(unittest.TestCase):
+    def setUp(self):
+        """
+        import the module
+        """
+        try:
+            from PyMca5.PyMcaIO import EDFStack
+            self._module = EDFStack
+        except:
+            self._module = None
+        self._tmpDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """clean up any possible files"""
+        shutil.rmtree(self._tmpDir, ignore_errors=True)
+
+    def _waitForThreads(self, nThreads, timeout=10.0):
+        # the threads of a terminated pool take some time to exit
+        t0 = time.time()
+        while (threading.active_count() > nThreads) and \
+              (time.time() - t0 < timeout):
+            time.sleep(0.01)
+        return threading.active_count()
+
+    def testEDFStackImport(self):
+        #"""Test successful import"""
+        self.assertTrue(self._module is not None,
+                        "Unsuccessful PyMca5.PyMcaIO.EDFStack import")
+
+    def testEDFStackIterateFileList(self):
+        self.testEDFStackImport()
+        fileList = ["file_%02d.edf" % i for i in range(20)]
+        random = numpy.random.RandomState(1)
+        delays = random.uniform(0.0, 0.005, len(fileList))
+        lock = threading.Lock()
+        state = {"running": 0, "maximum": 0}
+
+        def function(index, filename):
+            with lock:
+                state["running"] += 1
+                state["maximum"] = max(state["maximum"], state["running"])
+            # later files may finish first
+            time.sleep(delays[index])
+            with lock:
+                state["running"] -= 1
+            return (index, filename)
+
+        nThreads = threading.active_count()
+        expected = [(i, name) for i, name in enumerate(fileList)]
+        for workers, readahead in [(1, 8), (2, 2), (4, 4), (4, 8), (3, 1)]:
+            state["maximum"] = 0
+            output = list(self._module.iterateFileList(fileList, function,
+                                                       workers=workers,
+                                                       readahead=readahead))
+            # the order of the list whatever the completion order
+            self.assertEqual(output, expected)
+            # never more files read at once than threads
+            self.assertTrue(state["maximum"] <= workers)
+            self.assertEqual(self._waitForThreads(nThreads), nThreads,
+                             "Threads left running")
+
+    def testEDFStackIterateFileListErrors(self):
+        self.testEDFStackImport()
+        fileList = ["file_%02d.edf" % i for i in range(20)]
+        calls = []
+
+        def function(index, filename):
+            calls.append(index)
+            if index == 5:
+                raise IOError("Cannot read %s" % filename)
+            time.sleep(0.001)
+            return index
+
+        nThreads = threading.active_count()
+        for workers in [1, 4]:
+            # the error of a file is raised when reaching that file
+            del calls[:]
+            output = []
+            try:
+                for index in self._module.iterateFileList(fileList, function,
+                                                          workers=workers,
+                                                          readahead=8):
+                    output.append(index)
+            except IOError:
+                pass
+            else:
+                self.fail("IOError not propagated with %d workers" % workers)
+            self.assertEqual(output, [0, 1, 2, 3, 4])
+            # at most readahead files were scheduled
+            self.assertTrue(max(calls) < 5 + 8)
+            self.assertEqual(self._waitForThreads(nThreads), nThreads,
+                             "Threads left running after an error")
+
+            # stopping the iteration stops the threads
+            del calls[:]
+            iterator = self._module.iterateFileList(fileList, function,
+                                                    workers=workers,
+                                                    readahead=4)
+            self.assertEqual(next(iterator), 0)
+            self.assertEqual(next(iterator), 1)
+            iterator.close()
+            self.assertEqual(self._waitForThreads(nThreads), nThreads,
+                             "Threads left running after closing")
+            nCalls = len(calls)
+            time.sleep(0.05)
+            self.assertEqual(len(calls), nCalls)
+            self.assertTrue(nCalls <= 2 + 4)
+
+    def testEDFStackLoadFileList(self):
+        self.testEDFStackImport()
+        from PyMca5.PyMcaIO import EdfFile
+        data = numpy.arange(12 * 5 * 7, dtype=numpy.float32)
+        data.shape = 12, 5, 7
+        fileList = []
+        for i in range(data.shape[0]):
+            fileName = os.path.join(self._tmpDir, "image_%04d.edf" % i)
+            edf = EdfFile.EdfFile(fileName, "wb")
+            edf.WriteImage({}, data[i])
+            edf = None
+            fileList.append(fileName)
+        serial = self._module.EDFStack(fileList, workers=1)
+        self.assertTrue(numpy.allclose(serial.data, data))
+        for workers, readahead in [(2, 2), (4, 32)]:
+            stack = self._module.EDFStack(fileList, workers=workers,
+                                          readahead=readahead)
+            self.assertEqual(stack.data.shape, serial.data.shape)
+            self.assertTrue(numpy.array_equal(stack.data, serial.data))
+            self.assertEqual(stack.info["NumberOfFiles"],
+                             serial.info["NumberOfFiles"])
+
+def getSuite(auto=True):
+    testSuite = unittest.TestSuite()
+    if auto:
+        testSuite.addTest(\
+            unittest.TestLoader().loadTestsFromTestCase(testEDFStack))
+    else:
+        # use a predefined order
+        testSuite.addTest(testEDFStack("testEDFStackImport"))
+        testSuite.addTest(testEDFStack("testEDFStackIterateFileList"))
+        testSuite.addTest(testEDFStack("testEDFStackIterateFileListErrors"))
+        testSuite.addTest(testEDFStack("testEDFStackLoadFileList"))
+    return testSuite
+
+def test(auto=False):
+    unittest.TextTestRunner(verbosity=2).run(getSuite(auto=auto))
+
+if __name__ == '__main__':
+    test()
@@ -116,6 +116,33 @@ def testEdfFileReadWrite(self):
         edf =None
         gc.collect()
 
+    def testEdfFileMemoryMap(self):
+        self.assertTrue(self.fileClass is not None)
+        data = numpy.arange(6000).astype(numpy.float32)
+        data.shape = 60, 100
+        edf = self.fileClass(self.fname, 'wb+')
+        edf.WriteImage({'Title': "title"}, data)
+        edf.WriteImage({'Title': "title2"}, data.astype(numpy.int16) + 1,
+                       Append=1)
+        edf = None
+
+        edf = self.fileClass(self.fname, 'rb')
+        for index, reference in [(0, data), (1, data.astype(numpy.int16) + 1)]:
+            readData = edf.GetData(index, memmap=True)
+            self.assertTrue(isinstance(readData, numpy.memmap))
+            self.assertEqual(readData.dtype, reference.dtype)
+            self.assertTrue((readData == reference).all())
+            # sub-regions given as (x, y) position and size
+            readData = edf.GetData(index, Pos=(10, 5), Size=(20, 0),
+                                   memmap=True)
+            self.assertTrue(isinstance(readData, numpy.memmap))
+            self.assertTrue((readData == reference[5:, 10:30]).all())
+            self.assertTrue((readData == \
+                    edf.GetData(index, Pos=(10, 5), Size=(20, 0))).all())
+        readData = None
+        edf = None
+        gc.collect()
+
 def getSuite(auto=True):
     testSuite = unittest.TestSuite()
     if auto:
@@ -125,6 +152,7 @@ def getSuite(auto=True):
         # use a predefined order
         testSuite.addTest(testEdfFile("testEdfFileImport"))
         testSuite.addTest(testEdfFile("testEdfFileReadWrite"))
+        testSuite.addTest(testEdfFile("testEdfFileMemoryMap"))
     return testSuite
 
 def test(auto=False):
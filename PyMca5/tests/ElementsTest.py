@@ -295,6 +295,168 @@ def testMaterialCrossSectionsCalculation(self):
                     self.assertTrue((100.0 * abs(yTest-yRef)/yRef) < 0.01)
                 energyIndex += 1
 
+    def testMaterialCrossSectionsEnergyList(self):
+        if DEBUG:
+            print()
+            print("Testing Mass Attenuation of energy lists")
+
+        # energies below 1 keV, at the Hg L3 edge and in between
+        xcom = self._elements.getelementmassattcoef('Hg', None)
+        edge = float(xcom['energy'][numpy.argmax(numpy.diff(xcom['photo']))])
+        energyList = [0.8, 1.5, edge, 12.2, 20.4, 90.33]
+        for formula in ['H2O1', 'Hg1S1']:
+            data = self._elements.getMaterialMassAttenuationCoefficients(
+                                                formula, 1.0, energyList)
+            formulaData = self._elements.getmassattcoef(formula, energyList)
+            for energyIndex, energy in enumerate(energyList):
+                # one energy at a time gives the same values
+                refData = self._elements.getmassattcoef(formula, energy)
+                for key in ['coherent', 'compton', 'photo', 'total']:
+                    yRef = refData[key][0]
+                    for yTest in [data[key][energyIndex],
+                                  formulaData[key][energyIndex]]:
+                        self.assertTrue(abs(yTest - yRef) <= 1.0e-10 * yRef)
+
+    def testMassAttenuationCacheInvalidation(self):
+        if DEBUG:
+            print()
+            print("Testing Mass Attenuation cache invalidation")
+        # the EPDL97 module used by the Elements module
+        PyMcaEPDL97 = self._elements.PyMcaEPDL97
+        ele = 'Cu'
+        energyList = [0.5, 8.0, 20.0]
+        reference = self._elements.getmassattcoef(ele, energyList)
+        xcom = self._elements.getelementmassattcoef(ele, None)
+        epdl97 = PyMcaEPDL97.EPDL97_DICT[ele]['EPDL97']
+        try:
+            # a replaced XCOM table is used
+            newXcom = dict(xcom)
+            for key in ['coherent', 'compton', 'photo', 'pair']:
+                newXcom[key] = 2 * xcom[key]
+                if key + 'log10' in xcom:
+                    newXcom[key + 'log10'] = numpy.log10(newXcom[key])
+            self._elements.Element[ele]['xcom'] = newXcom
+            data = self._elements.getmassattcoef(ele, energyList)
+            for key in ['coherent', 'compton', 'photo', 'total']:
+                self.assertAlmostEqual(data[key][0], reference[key][0])
+                for i in [1, 2]:
+                    self.assertTrue(abs(data[key][i] - 2 * reference[key][i])
+                                    <= 1.0e-10 * reference[key][i])
+
+            # modified EPDL97 data are used
+            self._elements.Element[ele]['xcom'] = xcom
+            binding = PyMcaEPDL97.EPDL97_DICT[ele]['binding']
+            PyMcaEPDL97.EPDL97_DICT[ele]['EPDL97'] = dict(epdl97)
+            PyMcaEPDL97.EPDL97_DICT[ele]['EPDL97']['coherent'] = \
+                                                    3 * epdl97['coherent']
+            PyMcaEPDL97.setElementBindingEnergies(ele, binding)
+            data = self._elements.getmassattcoef(ele, energyList)
+            self.assertTrue(abs(data['coherent'][0] - \
+                                3 * reference['coherent'][0]) <= \
+                            1.0e-10 * reference['coherent'][0])
+            for key in ['coherent', 'compton', 'photo', 'total']:
+                for i in [1, 2]:
+                    self.assertAlmostEqual(data[key][i], reference[key][i])
+        finally:
+            self._elements.Element[ele]['xcom'] = xcom
+            PyMcaEPDL97.EPDL97_DICT[ele]['EPDL97'] = epdl97
+            PyMcaEPDL97.setElementBindingEnergies(ele,
+                                    PyMcaEPDL97.EPDL97_DICT[ele]['binding'])
+        data = self._elements.getmassattcoef(ele, energyList)
+        for key in ['coherent', 'compton', 'photo', 'total']:
+            for i in range(len(energyList)):
+                self.assertAlmostEqual(data[key][i], reference[key][i])
+
+    def testXcomDatabase(self):
+        if DEBUG:
+            print()
+            print("Testing XCOM binary database")
+        import tempfile
+        from PyMca5.PyMcaPhysics import PhysicsDatabase
+        attdata = os.path.join(self.dataDir, "attdata")
+        fd, fileName = tempfile.mkstemp(suffix=".npz")
+        os.close(fd)
+        try:
+            PhysicsDatabase.compileDatabase(attdata, fileName)
+            database = numpy.load(fileName)
+            for ele in ['H', 'Fe', 'Pb', 'U']:
+                textData = PhysicsDatabase.readXcomFile(\
+                                os.path.join(attdata, ele + ".mat"))
+                binaryData = database["xcom_" + ele]
+                for i, key in enumerate(PhysicsDatabase.XCOM_KEYS):
+                    self.assertTrue(numpy.array_equal(textData[key],
+                                                      binaryData[i]))
+                # and what the module uses
+                xcom = self._elements.getelementmassattcoef(ele)
+                for key in PhysicsDatabase.XCOM_KEYS:
+                    self.assertTrue(numpy.array_equal(textData[key],
+                                                      xcom[key]))
+            database.close()
+            self.assertTrue(PhysicsDatabase.isDatabaseValid(fileName,
+                                                            attdata))
+        finally:
+            os.remove(fileName)
+
+    def testXcomDatabaseValidity(self):
+        if DEBUG:
+            print()
+            print("Testing XCOM binary database invalidation")
+        import tempfile
+        import shutil
+        import time
+        from PyMca5.PyMcaPhysics import PhysicsDatabase
+        attdata = os.path.join(self.dataDir, "attdata")
+        tmpDir = tempfile.mkdtemp()
+        try:
+            for ele in ['H', 'Fe']:
+                shutil.copy(os.path.join(attdata, ele + ".mat"), tmpDir)
+            fileName = os.path.join(tmpDir, "xcom.npz")
+            self.assertFalse(PhysicsDatabase.isDatabaseValid(fileName,
+                                                             tmpDir))
+            PhysicsDatabase.compileDatabase(tmpDir, fileName)
+            self.assertTrue(PhysicsDatabase.isDatabaseValid(fileName,
+                                                            tmpDir))
+
+            # a source file modified after the compilation
+            sourceFile = os.path.join(tmpDir, "Fe.mat")
+            mtime = time.time() + 10.
+            os.utime(sourceFile, (mtime, mtime))
+            self.assertFalse(PhysicsDatabase.isDatabaseValid(fileName,
+                                                             tmpDir))
+            os.utime(fileName, (mtime, mtime))
+            self.assertTrue(PhysicsDatabase.isDatabaseValid(fileName,
+                                                            tmpDir))
+
+            os.utime(sourceFile, None)
+
+            # a source file added or with a different size
+            shutil.copy(os.path.join(attdata, "Pb.mat"), tmpDir)
+            self.assertFalse(PhysicsDatabase.isDatabaseValid(fileName,
+                                                             tmpDir))
+            PhysicsDatabase.compileDatabase(tmpDir, fileName)
+            self.assertTrue(PhysicsDatabase.isDatabaseValid(fileName,
+                                                            tmpDir))
+            fid = open(sourceFile, "a")
+            fid.write("\n")
+            fid.close()
+            mtime = os.path.getmtime(fileName) - 10.
+            os.utime(sourceFile, (mtime, mtime))
+            self.assertFalse(PhysicsDatabase.isDatabaseValid(fileName,
+                                                             tmpDir))
+
+            # a database of another version
+            PhysicsDatabase.compileDatabase(tmpDir, fileName)
+            self.assertTrue(PhysicsDatabase.isDatabaseValid(fileName,
+                                                            tmpDir))
+            version = PhysicsDatabase.DATABASE_VERSION
+            try:
+                PhysicsDatabase.DATABASE_VERSION = version + 1
+                self.assertFalse(PhysicsDatabase.isDatabaseValid(fileName,
+                                                                 tmpDir))
+            finally:
+                PhysicsDatabase.DATABASE_VERSION = version
+        finally:
+            shutil.rmtree(tmpDir)
 
 def getSuite(auto=True):
     testSuite = unittest.TestSuite()
@@ -307,6 +469,10 @@ def getSuite(auto=True):
         testSuite.addTest(testElements("testElementCrossSectionsReadout"))
         testSuite.addTest(testElements("testElementCrossSectionsCalculation"))
         testSuite.addTest(testElements("testMaterialCrossSectionsCalculation"))
+        testSuite.addTest(testElements("testMaterialCrossSectionsEnergyList"))
+        testSuite.addTest(testElements("testMassAttenuationCacheInvalidation"))
+        testSuite.addTest(testElements("testXcomDatabase"))
+        testSuite.addTest(testElements("testXcomDatabaseValidity"))
     return testSuite
 
 def test(auto=False):
@@ -70,6 +70,39 @@ def testGefitLeastSquares(self):
         for i in range(len(originalParameters)):
             self.assertTrue(abs(fittedpar[i] - originalParameters[i]) < 0.01)
 
+    def gaussianPlusLinearBackgroundJacobian(self, param, indices, t):
+        dummy = 2.3548200450309493 * (t - param[3])/ param[4]
+        gaussian = numpy.exp(-0.5 * dummy * dummy)
+        derivatives = [numpy.ones(t.shape),
+                       t,
+                       gaussian,
+                       param[2] * gaussian * dummy * 2.3548200450309493 / param[4],
+                       param[2] * gaussian * dummy * dummy / param[4]]
+        return param[0] + param[1] * t + param[2] * gaussian,\
+               numpy.array([derivatives[i] for i in indices])
+
+    def testGefitJacobian(self):
+        self.testGefitImport()
+        x = numpy.arange(500.)
+        originalParameters = numpy.array([10.5, 2, 1000.0, 200., 100],
+                                         numpy.float)
+        fitFunction = self.gaussianPlusLinearBackground
+        y = fitFunction(originalParameters, x)
+
+        startingParameters = [0.0 ,1.0,900.0, 150., 90]
+        # the slope is kept fixed
+        constraints = [[0, 3, 0, 0, 0], [0] * 5, [0] * 5]
+        startingParameters[1] = originalParameters[1]
+        fittedpar, chisq, sigmapar =self.gefit.LeastSquaresFit(fitFunction,
+                                                     startingParameters,
+                                                     xdata=x,
+                                                     ydata=y,
+                                                     sigmadata=None,
+                                                     constrains=constraints,
+                    model_jacobian=self.gaussianPlusLinearBackgroundJacobian)
+        for i in range(len(originalParameters)):
+            self.assertTrue(abs(fittedpar[i] - originalParameters[i]) < 0.01)
+
 def getSuite(auto=True):
     testSuite = unittest.TestSuite()
     if auto:
@@ -79,6 +112,7 @@ def getSuite(auto=True):
         # use a predefined order
         testSuite.addTest(testGefit("testGefitImport"))
         testSuite.addTest(testGefit("testGefitLeastSquares"))
+        testSuite.addTest(testGefit("testGefitJacobian"))
     return testSuite
 
 def test(auto=False):
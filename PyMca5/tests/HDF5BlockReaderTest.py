@@ -0,0 +1,277 @@
+#/*##########################################################################
+#
+# The PyMca X-Ray Fluorescence Toolkit
+#
+# Copyright (c) 2004-2016 European Synchrotron Radiation Facility
+#
+# This file is part of the PyMca X-ray Fluorescence Toolkit developed at
+# the ESRF by the Software group.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+#############################################################################*/
+__author__ = "V. Armando Sole - ESRF Data Analysis"
+__contact__ = "sole@esrf.fr"
+__license__ = "MIT"
+__copyright__ = "European Synchrotron Radiation Facility, Grenoble, France"
+import unittest
+import os
+import shutil
+import tempfile
+import threading
+import numpy
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+
+class _FailingDataset(object):
+    """
+    Array looking like an HDF5 dataset whose reading fails at a given row.
+    """
+    def __init__(self, data, chunks, failingRow, error=IOError):
+        self._data = data
+        self.shape = data.shape
+        self.dtype = data.dtype
+        self.chunks = chunks
+        self.id = None
+        self.file = None
+        self._failingRow = failingRow
+        self._error = error
+
+    def __getitem__(self, key):
+        if key[0].start <= self._failingRow < key[0].stop:
+            raise self._error("Cannot read row %d" % self._failingRow)
+        return self._data[key]
+
+
+@unittest.skipIf(h5py is None, "h5py not available")
+class testHDF5BlockReader(unittest.TestCase):
+    def setUp(self):
+        """
+        import the module
+        """
+        try:
+            from PyMca5.PyMcaIO import HDF5BlockReader
+            self._module = HDF5BlockReader
+        except:
+            self._module = None
+        self._tmpDir = tempfile.mkdtemp()
+        random = numpy.random.RandomState(13)
+        self.data = random.randint(0, 1000, (11, 13, 20)).astype(numpy.int32)
+        # some pixels selected in a few blocks
+        self.mask = numpy.zeros(self.data.shape[:2], numpy.bool_)
+        self.mask[1, 2] = True
+        self.mask[4:6, 7:12] = True
+        self.mask[10, 12] = True
+        self.mask[7, 0] = True
+        self._fileName = os.path.join(self._tmpDir, "data.h5")
+        h5 = h5py.File(self._fileName, "w")
+        try:
+            h5.create_dataset("chunked", data=self.data, chunks=(3, 4, 20))
+            h5.create_dataset("chunked_channels", data=self.data,
+                              chunks=(2, 5, 7))
+            h5["contiguous"] = self.data
+        finally:
+            h5.close()
+
+    def tearDown(self):
+        """clean up any possible files"""
+        shutil.rmtree(self._tmpDir, ignore_errors=True)
+
+    def _checkBlocks(self, data, rowStart=0, rowEnd=None, columns=None,
+                     channels=None, mask=None, prefetch=1):
+        """
+        Read the blocks and compare them to the slices of the numpy data.
+        Return the list of (r0, r1, c0, c1) tuples.
+        """
+        if rowEnd is None:
+            rowEnd = self.data.shape[0]
+        if channels is None:
+            channels = (0, self.data.shape[2])
+        covered = numpy.zeros(self.data.shape[:2], numpy.int32)
+        blockList = []
+        for (r0, r1, c0, c1), block in self._module.iterateBlocks(data,
+                                            rowStart=rowStart, rowEnd=rowEnd,
+                                            columns=columns,
+                                            channels=channels, mask=mask,
+                                            prefetch=prefetch):
+            self.assertTrue(numpy.array_equal(block,
+                    self.data[r0:r1, c0:c1, channels[0]:channels[1]]),
+                    "Different block %s" % ((r0, r1, c0, c1),))
+            covered[r0:r1, c0:c1] += 1
+            blockList.append((r0, r1, c0, c1))
+        # no pixel is read twice nor out of the requested rows
+        self.assertTrue(covered.max() <= 1)
+        self.assertFalse(covered[:rowStart].any())
+        self.assertFalse(covered[rowEnd:].any())
+        if mask is None:
+            self.assertTrue(covered[rowStart:rowEnd].all())
+        else:
+            self.assertTrue(covered[rowStart:rowEnd][\
+                                    mask[rowStart:rowEnd]].all())
+            for r0, r1, c0, c1 in blockList:
+                self.assertTrue(mask[r0:r1, c0:c1].any())
+        return blockList
+
+    def testHDF5BlockReaderImport(self):
+        #"""Test successful import"""
+        self.assertTrue(self._module is not None,
+                        "Unsuccessful PyMca5.PyMcaIO.HDF5BlockReader import")
+
+    def testHDF5BlockReaderBlockShape(self):
+        h5 = h5py.File(self._fileName, "r")
+        try:
+            self.assertTrue(self._module.isHDF5Dataset(h5["chunked"]))
+            self.assertFalse(self._module.isHDF5Dataset(self.data))
+            # multiples of the chunk shape
+            self.assertEqual(self._module.getBlockShape(h5["chunked"]),
+                             (3, 13))
+            self.assertEqual(self._module.getBlockShape(h5["chunked"],
+                                                        rows=4, columns=5),
+                             (6, 8))
+            self.assertEqual(self._module.getBlockShape(h5["chunked"],
+                                                        rows=20, columns=1),
+                             (11, 4))
+            # complete rows otherwise
+            self.assertEqual(self._module.getBlockShape(h5["contiguous"]),
+                             (1, 13))
+            self.assertEqual(self._module.getBlockShape(self.data, rows=4),
+                             (4, 13))
+        finally:
+            h5.close()
+
+    def testHDF5BlockReaderIterateBlocks(self):
+        h5 = h5py.File(self._fileName, "r")
+        try:
+            for name in ["chunked", "chunked_channels", "contiguous"]:
+                dataset = h5[name]
+                chunks = dataset.chunks
+                for rowStart, rowEnd in [(0, None), (4, 10), (2, 3)]:
+                    for columns in [None, 6]:
+                        for channels in [None, (3, 17)]:
+                            for prefetch in [0, 1, 3]:
+                                blockList = self._checkBlocks(dataset,
+                                                rowStart=rowStart,
+                                                rowEnd=rowEnd,
+                                                columns=columns,
+                                                channels=channels,
+                                                prefetch=prefetch)
+                                if chunks is None:
+                                    continue
+                                # blocks aligned to the chunks
+                                for r0, r1, c0, c1 in blockList:
+                                    self.assertTrue((r0 == rowStart) or \
+                                                    (r0 % chunks[0] == 0))
+                                    self.assertTrue((r1 == rowEnd) or \
+                                                    (r1 % chunks[0] == 0) or \
+                                                    (r1 == dataset.shape[0]))
+                                    self.assertEqual(c0 % chunks[1], 0)
+                # masked blocks
+                blockList = self._checkBlocks(dataset, mask=self.mask)
+                if chunks == (3, 4, 20):
+                    self.assertEqual(blockList, [(0, 3, 0, 13), (3, 6, 0, 13),
+                                                 (6, 9, 0, 13),
+                                                 (9, 11, 0, 13)])
+                    blockList = self._checkBlocks(dataset, columns=4,
+                                                  mask=self.mask)
+                    self.assertEqual(blockList, [(0, 3, 0, 4), (3, 6, 4, 8),
+                                                 (3, 6, 8, 12), (6, 9, 0, 4),
+                                                 (9, 11, 12, 13)])
+            # in memory data
+            self._checkBlocks(self.data)
+            self._checkBlocks(self.data, rowStart=4, rowEnd=10,
+                              channels=(3, 17), mask=self.mask)
+        finally:
+            h5.close()
+
+    def testHDF5BlockReaderStop(self):
+        h5 = h5py.File(self._fileName, "r")
+        try:
+            nThreads = threading.active_count()
+            # the reading thread finishes when the caller stops iterating
+            blocks = self._module.iterateBlocks(h5["chunked"], columns=4)
+            for item in blocks:
+                break
+            blocks.close()
+            self.assertEqual(threading.active_count(), nThreads)
+            # reading errors reach the caller, interruptions too
+            for error in [IOError, KeyboardInterrupt, SystemExit]:
+                dataset = _FailingDataset(self.data, (3, 4, 20), 7,
+                                          error=error)
+                blocks = self._module.iterateBlocks(dataset, columns=4)
+                blockList = []
+                try:
+                    for item in blocks:
+                        blockList.append(item[0])
+                except error:
+                    pass
+                else:
+                    self.fail("Reading error %s not raised" % error)
+                self.assertEqual(blockList[-1], (3, 6, 12, 13))
+                self.assertEqual(threading.active_count(), nThreads)
+        finally:
+            h5.close()
+
+    def testHDF5BlockReaderMaskedSpectra(self):
+        h5 = h5py.File(self._fileName, "r")
+        try:
+            for data in [h5["chunked"], h5["chunked_channels"],
+                         h5["contiguous"], self.data]:
+                for channels in [None, (3, 17)]:
+                    for dtype in [None, numpy.float64]:
+                        spectra = self._module.getMaskedSpectra(data,
+                                                    self.mask,
+                                                    channels=channels,
+                                                    dtype=dtype)
+                        first, last = channels or (0, self.data.shape[2])
+                        reference = self.data[self.mask, first:last]
+                        self.assertEqual(spectra.dtype,
+                                         dtype or self.data.dtype)
+                        self.assertTrue(numpy.array_equal(spectra, reference),
+                                        "Different spectra")
+                # nothing selected
+                spectra = self._module.getMaskedSpectra(data,
+                                    numpy.zeros(self.mask.shape, numpy.bool_))
+                self.assertEqual(spectra.shape, (0, self.data.shape[2]))
+        finally:
+            h5.close()
+
+def getSuite(auto=True):
+    testSuite = unittest.TestSuite()
+    if auto:
+        testSuite.addTest(\
+            unittest.TestLoader().loadTestsFromTestCase(testHDF5BlockReader))
+    else:
+        # use a predefined order
+        testSuite.addTest(testHDF5BlockReader("testHDF5BlockReaderImport"))
+        testSuite.addTest(testHDF5BlockReader("testHDF5BlockReaderBlockShape"))
+        testSuite.addTest(\
+            testHDF5BlockReader("testHDF5BlockReaderIterateBlocks"))
+        testSuite.addTest(testHDF5BlockReader("testHDF5BlockReaderStop"))
+        testSuite.addTest(\
+            testHDF5BlockReader("testHDF5BlockReaderMaskedSpectra"))
+    return testSuite
+
+def test(auto=False):
+    unittest.TextTestRunner(verbosity=2).run(getSuite(auto=auto))
+
+if __name__ == '__main__':
+    test()
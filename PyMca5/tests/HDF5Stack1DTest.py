@@ -0,0 +1,274 @@
+#/*##########################################################################
+#
+# The PyMca X-Ray Fluorescence Toolkit
+#
+# Copyright (c) 2004-2016 European Synchrotron Radiation Facility
+#
+# This file is part of the PyMca X-ray Fluorescence Toolkit developed at
+# the ESRF by the Software group.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+#############################################################################*/
+__author__ = "V. Armando Sole - ESRF Data Analysis"
+__contact__ = "sole@esrf.fr"
+__license__ = "MIT"
+__copyright__ = "European Synchrotron Radiation Facility, Grenoble, France"
+import unittest
+import os
+import shutil
+import tempfile
+import numpy
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+
+def _getSpectra(data, monitor=None, mcaIndex=-1):
+    """
+    Return the spectra of data as a 2D array [nSpectra, nChannels] divided
+    by the monitor, reading them one at a time as HDF5Stack1D used to do.
+    The monitor has one value per spectrum, one value per channel of each
+    spectrum or, if mcaIndex is 0, one value per image.
+    """
+    data = numpy.asarray(data, numpy.float64)
+    if mcaIndex == 0:
+        nChannels = data.shape[0]
+        pixels = data.reshape(nChannels, -1)
+        spectra = [pixels[:, i] for i in range(pixels.shape[1])]
+    else:
+        nChannels = data.shape[-1]
+        spectra = list(data.reshape(-1, nChannels))
+    result = numpy.zeros((len(spectra), nChannels))
+    for i, spectrum in enumerate(spectra):
+        if monitor is None:
+            result[i] = spectrum
+        elif monitor.size == len(spectra):
+            result[i] = spectrum / monitor.reshape(-1)[i]
+        elif (mcaIndex == 0) and (monitor.size == nChannels):
+            result[i] = spectrum / monitor.reshape(-1)
+        else:
+            result[i] = spectrum / monitor.reshape(-1, nChannels)[i]
+    return result
+
+
+@unittest.skipIf(h5py is None, "h5py not available")
+class testHDF5Stack1D(unittest.TestCase):
+    def setUp(self):
+        """
+        import the module
+        """
+        try:
+            from PyMca5.PyMcaIO import HDF5Stack1D
+            self._module = HDF5Stack1D
+        except:
+            self._module = None
+        self._tmpDir = tempfile.mkdtemp()
+        if self._module is not None:
+            self._blockSize = self._module.BLOCK_SIZE
+        random = numpy.random.RandomState(3)
+        # two entries of 5 rows of 4 spectra of 30 channels
+        self.spectra = [random.randint(0, 1000, (5, 4, 30)).astype(\
+                                        numpy.uint32) for i in range(2)]
+        self.monitor = [random.uniform(1.0, 2.0, (5, 4)) \
+                        for i in range(2)]
+        self.fullMonitor = [random.uniform(1.0, 2.0, (5, 4, 30)) \
+                            for i in range(2)]
+
+    def tearDown(self):
+        """clean up any possible files"""
+        if self._module is not None:
+            self._module.BLOCK_SIZE = self._blockSize
+        shutil.rmtree(self._tmpDir, ignore_errors=True)
+
+    def _createFile(self, images=False, nEntries=2):
+        fileName = os.path.join(self._tmpDir, "stack.h5")
+        h5 = h5py.File(fileName, "w")
+        try:
+            for i in range(nEntries):
+                group = h5.create_group("entry%d/data" % i)
+                counts = self.spectra[i]
+                fullMonitor = self.fullMonitor[i]
+                if images:
+                    counts = numpy.transpose(counts, (2, 0, 1))
+                    fullMonitor = numpy.transpose(fullMonitor, (2, 0, 1))
+                    chunks = (7, 5, 4)
+                else:
+                    chunks = (2, 4, 30)
+                group.create_dataset("counts", data=counts, chunks=chunks)
+                group["monitor"] = self.monitor[i]
+                group["full_monitor"] = fullMonitor
+                group["channel_monitor"] = fullMonitor[:, 0, 0] \
+                                           if images else fullMonitor[0, 0]
+        finally:
+            h5.close()
+        return fileName
+
+    def _getStack(self, fileName, monitor=None, index=None):
+        selection = {'x': None, 'y': '/data/counts', 'm': monitor}
+        if index is not None:
+            selection['index'] = index
+        stack = self._module.HDF5Stack1D([fileName], selection)
+        self.assertTrue(isinstance(stack.data, numpy.ndarray))
+        return stack, stack.data
+
+    def testHDF5Stack1DImport(self):
+        #"""Test successful import"""
+        self.assertTrue(self._module is not None,
+                        "Unsuccessful PyMca5.PyMcaIO.HDF5Stack1D import")
+
+    def testHDF5Stack1DReadArray(self):
+        fileName = self._createFile()
+        # several hyperslabs of two chunks
+        self._module.BLOCK_SIZE = 2 * 2 * 4 * 30 * 8
+        h5 = h5py.File(fileName, "r")
+        try:
+            dataset = h5["entry0/data/counts"]
+            self.assertEqual(self._module._getBlockLength(dataset, 8), 4)
+            for monitor in [None,
+                            self.monitor[0].reshape(5, 4, 1),
+                            self.fullMonitor[0],
+                            self.fullMonitor[0][:1]]:
+                if (monitor is not None) and (monitor.shape[0] == 1):
+                    # the same monitor for all the rows
+                    reference = _getSpectra(self.spectra[0],
+                                    numpy.repeat(monitor, 5, axis=0))
+                else:
+                    reference = _getSpectra(self.spectra[0], monitor)
+                for dtype in [numpy.float64, numpy.float32, numpy.int32]:
+                    destination = numpy.zeros(dataset.shape, dtype)
+                    self._module._readArray(dataset, destination, monitor)
+                    expected = reference.reshape(dataset.shape)
+                    if dtype == numpy.int32:
+                        expected = expected.astype(dtype)
+                    self.assertTrue(numpy.allclose(destination, expected,
+                                                   rtol=1.0e-6),
+                                    "Different data %s" % dtype)
+                # not contiguous destination
+                destination = numpy.zeros((5, 4, 60))[:, :, ::2]
+                self._module._readArray(dataset, destination, monitor)
+                self.assertTrue(numpy.allclose(destination,
+                                    reference.reshape(dataset.shape)))
+                # numpy arrays are handled too
+                destination = numpy.zeros(dataset.shape)
+                self._module._readArray(dataset[()], destination, monitor)
+                self.assertTrue(numpy.allclose(destination,
+                                    reference.reshape(dataset.shape)))
+        finally:
+            h5.close()
+
+    def testHDF5Stack1DReadImagesAsSpectra(self):
+        fileName = self._createFile(images=True)
+        # several hyperslabs of one chunk
+        self._module.BLOCK_SIZE = 10 * 5 * 4 * 8
+        h5 = h5py.File(fileName, "r")
+        try:
+            dataset = h5["entry0/data/counts"]
+            self.assertEqual(self._module._getBlockLength(dataset, 8), 7)
+            channelMonitor = self.fullMonitor[0][0, 0]
+            for monitor, reference in [\
+                    (None, _getSpectra(dataset[()], mcaIndex=0)),
+                    (self.monitor[0].reshape(-1, 1),
+                     _getSpectra(dataset[()], self.monitor[0], mcaIndex=0)),
+                    (channelMonitor.reshape(1, -1),
+                     _getSpectra(dataset[()], channelMonitor, mcaIndex=0))]:
+                for dtype in [numpy.float64, numpy.float32]:
+                    destination = numpy.zeros((20, 30), dtype)
+                    self._module._readImagesAsSpectra(dataset, destination,
+                                                      monitor)
+                    self.assertTrue(numpy.allclose(destination, reference,
+                                                   rtol=1.0e-6),
+                                    "Different data %s" % dtype)
+            # the spectra are the ones of the original layout
+            self.assertTrue(numpy.allclose(destination.reshape(5, 4, 30),
+                                           self.spectra[0] / channelMonitor,
+                                           rtol=1.0e-6))
+        finally:
+            h5.close()
+
+    def testHDF5Stack1DSpectra(self):
+        fileName = self._createFile()
+        self._module.BLOCK_SIZE = 2 * 4 * 30 * 8
+        for monitor, monitorData in [(None, [None, None]),
+                                     ("/data/monitor", self.monitor),
+                                     ("/data/full_monitor", self.fullMonitor)]:
+            stack, data = self._getStack(fileName, monitor=monitor)
+            self.assertEqual(stack.info["McaIndex"], 2)
+            reference = numpy.concatenate(\
+                            [_getSpectra(self.spectra[i], monitorData[i]) \
+                             for i in range(2)])
+            self.assertEqual(data.shape[-1], 30)
+            self.assertTrue(numpy.allclose(data.reshape(-1, 30), reference),
+                            "Different data with monitor %s" % monitor)
+        self.assertRaises(ValueError, self._getStack, fileName,
+                          monitor="/data/channel_monitor")
+
+    def testHDF5Stack1DImages(self):
+        self._module.BLOCK_SIZE = 7 * 5 * 4 * 8
+        # two entries read as spectra
+        fileName = self._createFile(images=True)
+        for monitor, monitorData in [(None, [None, None]),
+                                     ("/data/monitor", self.monitor),
+                                     ("/data/channel_monitor",
+                                      [m[0, 0] for m in self.fullMonitor])]:
+            stack, data = self._getStack(fileName, monitor=monitor, index=0)
+            self.assertEqual(stack.info["McaIndex"], 2)
+            reference = numpy.concatenate([_getSpectra(\
+                            numpy.transpose(self.spectra[i], (2, 0, 1)),
+                            monitorData[i], mcaIndex=0) for i in range(2)])
+            self.assertTrue(numpy.allclose(data.reshape(-1, 30), reference),
+                            "Different data with monitor %s" % monitor)
+
+        # a single entry kept as images
+        fileName = self._createFile(images=True, nEntries=1)
+        for monitor, monitorData in [(None, None),
+                                     ("/data/monitor", self.monitor[0]),
+                                     ("/data/channel_monitor",
+                                      self.fullMonitor[0][0, 0])]:
+            stack, data = self._getStack(fileName, monitor=monitor, index=0)
+            self.assertEqual(stack.info["McaIndex"], 0)
+            self.assertEqual(data.shape, (30, 5, 4))
+            reference = _getSpectra(numpy.transpose(self.spectra[0],
+                                                    (2, 0, 1)),
+                                    monitorData, mcaIndex=0)
+            self.assertTrue(numpy.allclose(data.reshape(30, -1).T,
+                                           reference),
+                            "Different images with monitor %s" % monitor)
+
+def getSuite(auto=True):
+    testSuite = unittest.TestSuite()
+    if auto:
+        testSuite.addTest(\
+            unittest.TestLoader().loadTestsFromTestCase(testHDF5Stack1D))
+    else:
+        # use a predefined order
+        testSuite.addTest(testHDF5Stack1D("testHDF5Stack1DImport"))
+        testSuite.addTest(testHDF5Stack1D("testHDF5Stack1DReadArray"))
+        testSuite.addTest(\
+            testHDF5Stack1D("testHDF5Stack1DReadImagesAsSpectra"))
+        testSuite.addTest(testHDF5Stack1D("testHDF5Stack1DSpectra"))
+        testSuite.addTest(testHDF5Stack1D("testHDF5Stack1DImages"))
+    return testSuite
+
+def test(auto=False):
+    unittest.TextTestRunner(verbosity=2).run(getSuite(auto=auto))
+
+if __name__ == '__main__':
+    test()
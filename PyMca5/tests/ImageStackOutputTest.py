@@ -0,0 +1,328 @@
+#/*##########################################################################
+#
+# The PyMca X-Ray Fluorescence Toolkit
+#
+# Copyright (c) 2004-2016 European Synchrotron Radiation Facility
+#
+# This file is part of the PyMca X-ray Fluorescence Toolkit developed at
+# the ESRF by the Software group.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+#############################################################################*/
+__author__ = "V. Armando Sole - ESRF Data Analysis"
+__contact__ = "sole@esrf.fr"
+__license__ = "MIT"
+__copyright__ = "European Synchrotron Radiation Facility, Grenoble, France"
+import unittest
+import os
+import sys
+import shutil
+import subprocess
+import tempfile
+import numpy
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+DEBUG = 0
+
+class testImageStackOutput(unittest.TestCase):
+    def setUp(self):
+        """
+        import the module
+        """
+        try:
+            from PyMca5.PyMcaIO import ImageStackOutput
+            self._module = ImageStackOutput
+        except:
+            self._module = None
+        self._tmpDir = tempfile.mkdtemp()
+        if self._module is not None:
+            self._chunkSize = self._module.CHUNK_SIZE
+
+    def tearDown(self):
+        """clean up any possible files"""
+        if self._module is not None:
+            self._module.CHUNK_SIZE = self._chunkSize
+        shutil.rmtree(self._tmpDir, ignore_errors=True)
+
+    def _getConfiguration(self):
+        from PyMca5 import PyMcaDataDir
+        from PyMca5.PyMcaIO import ConfigDict
+        configuration = ConfigDict.ConfigDict()
+        configuration.read(os.path.join(PyMcaDataDir.PYMCA_DATA_DIR,
+                                        "McaTheory.cfg"))
+        configuration["fit"]["energy"] = [12.0]
+        configuration["fit"]["energyweight"] = [1.0]
+        configuration["fit"]["energyflag"] = [1]
+        configuration["fit"]["energyscatter"] = [1]
+        configuration["fit"]["linearfitflag"] = 1
+        # a constant background
+        configuration["fit"]["continuum"] = 1
+        configuration["peaks"] = {"Fe": "K", "Cu": "K", "Zn": "K"}
+        configuration["attenuators"]["Matrix"] = [1, "Water", 1.0, 0.01,
+                                                  45.0, 45.0]
+        configuration["concentrations"]["usematrix"] = 0
+        configuration["concentrations"]["reference"] = "Fe"
+        return configuration
+
+    def _getMap(self, configuration, nRows=9, nColumns=11, nChannels=800):
+        """
+        Return a map of spectra calculated with the fit model itself. The
+        Cu peaks are missing in the first rows, hence the fit gives
+        negative Cu areas at some of those pixels.
+        """
+        from PyMca5.PyMcaPhysics.xrf import ClassMcaTheory
+        x = numpy.arange(float(nChannels))
+        mcaTheory = ClassMcaTheory.McaTheory()
+        mcaTheory.setConfiguration(configuration)
+        mcaTheory.enableOptimizedLinearFit()
+        mcaTheory.setData(x=x, y=numpy.ones(x.shape))
+        mcaTheory.estimate()
+        iXMin = int(mcaTheory.xdata[0])
+        iXMax = int(mcaTheory.xdata[-1]) + 1
+        random = numpy.random.RandomState(7)
+        spectra = numpy.zeros((nRows, nColumns, x.size))
+        spectra[:, :, iXMin:iXMax] = 20.0
+        for group in ["Fe K", "Cu K", "Zn K"]:
+            i = mcaTheory.PARAMETERS.index(group)
+            peaks = numpy.ravel(mcaTheory.linearMcaTheoryDerivative(\
+                                mcaTheory.parameters, i, mcaTheory.xdata))
+            areas = random.uniform(2000., 8000., (nRows, nColumns))
+            if group == "Cu K":
+                areas[:3] = 0.0
+            spectra[:, :, iXMin:iXMax] += areas[:, :, None] * peaks
+        spectra = random.poisson(spectra).astype(numpy.float32)
+        return x, spectra
+
+    def _fit(self, x, y, configuration, output=None, refit=True,
+             processes=None):
+        from PyMca5.PyMcaPhysics.xrf import FastXRFLinearFit
+        fastFit = FastXRFLinearFit.FastXRFLinearFit()
+        return fastFit.fitMultipleSpectra(x=x, y=y,
+                                          configuration=configuration,
+                                          concentrations=True,
+                                          weight=0,
+                                          refit=refit,
+                                          processes=processes,
+                                          output=output)
+
+    def _assertSameResults(self, result, reference):
+        for key in ['parameters', 'uncertainties', 'concentrations']:
+            self.assertEqual(result[key].shape, reference[key].shape)
+            self.assertTrue(numpy.allclose(result[key][()], reference[key],
+                                           rtol=1.0e-5, atol=1.0e-12),
+                            "Different %s" % key)
+
+    def testImageStackOutputImport(self):
+        #"""Test successful import"""
+        self.assertTrue(self._module is not None,
+                        "Unsuccessful PyMca5.PyMcaIO.ImageStackOutput import")
+
+    def testImageStackOutputArray(self):
+        output = self._module.ArrayOutput()
+        stack = output.createStack("parameters", (3, 5, 4), labels=["a"])
+        self.assertTrue(isinstance(stack, numpy.ndarray))
+        self.assertEqual(stack.shape, (3, 5, 4))
+        self.assertEqual(stack.dtype, numpy.float32)
+        self.assertFalse(stack.any())
+        self.assertEqual(output.getBlockRows(stack), 5)
+        mask = numpy.zeros((5, 4), dtype=numpy.bool_)
+        mask[1, 2] = True
+        mask[3] = True
+        self._module.setMaskedValues(stack, 1, mask, -1.0)
+        self._module.setMaskedValues(stack, 2, mask,
+                                     numpy.arange(mask.sum()))
+        self.assertTrue(numpy.array_equal(stack[1], -1.0 * mask))
+        self.assertTrue(numpy.array_equal(stack[2][mask],
+                                          numpy.arange(mask.sum())))
+        self.assertFalse(stack[0].any())
+        self.assertFalse(stack[2][~mask].any())
+        output.setLabels(stack, ["a", "b", "c"])
+        output.flush()
+        output.close()
+
+    @unittest.skipIf(h5py is None, "h5py not available")
+    def testImageStackOutputHDF5(self):
+        fileName = os.path.join(self._tmpDir, "output.h5")
+        # two rows of float32 per chunk
+        self._module.CHUNK_SIZE = 2 * 4 * 4
+        output = self._module.HDF5Output(fileName, entry="entry/images",
+                                         compression="gzip")
+        try:
+            labels = ["Fe K", "Cu K", "Zn K"]
+            stack = output.createStack("parameters", (3, 5, 4),
+                                       labels=labels)
+            self.assertEqual(stack.name, "/entry/images/parameters")
+            self.assertEqual(stack.chunks, (1, 2, 4))
+            self.assertEqual(stack.compression, "gzip")
+            self.assertEqual(output.getBlockRows(stack), 2)
+            self.assertEqual([label.decode("utf-8") \
+                              for label in stack.attrs["labels"]], labels)
+
+            # same behavior as the numpy arrays
+            reference = numpy.zeros(stack.shape, numpy.float32)
+            values = numpy.arange(20.).reshape(5, 4)
+            stack[:, 1:3] = values[1:3]
+            reference[:, 1:3] = values[1:3]
+            mask = values > 12
+            self._module.setMaskedValues(stack, 0, mask, -1.0)
+            self._module.setMaskedValues(reference, 0, mask, -1.0)
+            self._module.setMaskedValues(stack, 2, mask, values[mask])
+            self._module.setMaskedValues(reference, 2, mask, values[mask])
+            self.assertTrue(numpy.array_equal(stack[()], reference))
+
+            # an existing stack is replaced
+            stack = output.createStack("parameters", (2, 3, 4))
+            self.assertEqual(stack.shape, (2, 3, 4))
+            self.assertFalse(stack[()].any())
+            self.assertFalse("labels" in stack.attrs)
+
+            # empty stacks
+            stack = output.createStack("concentrations", (0, 5, 4))
+            self.assertEqual(stack.shape, (0, 5, 4))
+            self.assertTrue(output.getBlockRows(stack) > 0)
+            output.flush()
+        finally:
+            output.close()
+        # closing twice is harmless
+        output.close()
+        h5 = h5py.File(fileName, "r")
+        try:
+            self.assertEqual(h5["entry/images/parameters"].shape, (2, 3, 4))
+            self.assertEqual(h5["entry/images/concentrations"].shape,
+                             (0, 5, 4))
+        finally:
+            h5.close()
+
+    @unittest.skipIf(h5py is None, "h5py not available")
+    def testImageStackOutputFastXRFLinearFit(self):
+        configuration = self._getConfiguration()
+        x, y = self._getMap(configuration)
+        reference = self._fit(x, y, configuration)
+        names = reference['names']
+        iCu = names.index("Cu K")
+        iConcentration = names.index("C(Cu K)") - len(reference['parameters'])
+
+        # the refit of the negative pixels is tested
+        unconstrained = self._fit(x, y, configuration, refit=False)
+        negative = unconstrained['parameters'][iCu] < 0
+        self.assertTrue(negative.any())
+        self.assertTrue(negative[3:].sum() < negative[:3].sum())
+        self.assertFalse((reference['parameters'][iCu] < 0).any())
+        self.assertFalse((reference['concentrations'][iConcentration] \
+                          < 0).any())
+        self.assertFalse(numpy.allclose(reference['parameters'][iCu],
+                                        unconstrained['parameters'][iCu]))
+        # only the negative pixels of the first fit are modified
+        for i in range(len(reference['parameters'])):
+            self.assertTrue(numpy.allclose(\
+                                reference['parameters'][i][~negative],
+                                unconstrained['parameters'][i][~negative]))
+        self.assertFalse(reference['parameters'][iCu][negative].any())
+
+        # several blocks of rows in the HDF5 file
+        self._module.CHUNK_SIZE = 2 * y.shape[1] * 4
+        for processes in [None, 2]:
+            fileName = os.path.join(self._tmpDir, "fit%s.h5" % processes)
+            output = self._module.HDF5Output(fileName)
+            try:
+                result = self._fit(x, y, configuration, output=output,
+                                   processes=processes)
+                self.assertEqual(result['parameters'].chunks[1], 2)
+                self.assertEqual(result['names'], names)
+                self._assertSameResults(result, reference)
+            finally:
+                output.close()
+            h5 = h5py.File(fileName, "r")
+            try:
+                self._assertSameResults(h5["images"], reference)
+                labels = [label.decode("utf-8") for label in \
+                          h5["images/concentrations"].attrs["labels"]]
+                self.assertEqual(labels,
+                                 names[len(reference['parameters']):])
+            finally:
+                h5.close()
+
+    @unittest.skipIf(h5py is None, "h5py not available")
+    def testImageStackOutputFastXRFLinearFitScript(self):
+        from PyMca5.PyMcaIO import EdfFile
+        configuration = self._getConfiguration()
+        x, y = self._getMap(configuration)
+        reference = self._fit(x, y, configuration)
+        configurationFile = os.path.join(self._tmpDir, "fit.cfg")
+        configuration.write(configurationFile)
+        # one EDF file per row of the map
+        fileList = []
+        for i in range(y.shape[0]):
+            fileName = os.path.join(self._tmpDir, "row_%04d.edf" % i)
+            edf = EdfFile.EdfFile(fileName, "wb")
+            edf.WriteImage({}, y[i])
+            edf = None
+            fileList.append(fileName)
+        outputDir = os.path.join(self._tmpDir, "output")
+        env = os.environ.copy()
+        env["PYTHONPATH"] = os.pathsep.join(sys.path)
+        process = subprocess.Popen([sys.executable, "-m",
+                                    "PyMca5.PyMcaPhysics.xrf.FastXRFLinearFit",
+                                    "--cfg=%s" % configurationFile,
+                                    "--outdir=%s" % outputDir,
+                                    "--concentrations=1",
+                                    "--refit=1",
+                                    "--h5=1"] + fileList,
+                                   stdout=subprocess.PIPE,
+                                   stderr=subprocess.STDOUT,
+                                   env=env)
+        out = process.communicate()[0]
+        if DEBUG:
+            print(out)
+        self.assertEqual(process.returncode, 0, out)
+        # only the HDF5 file is written
+        imagesDir = os.path.join(outputDir, "IMAGES")
+        self.assertEqual(os.listdir(imagesDir), ["images.h5"])
+        h5 = h5py.File(os.path.join(imagesDir, "images.h5"), "r")
+        try:
+            self.assertEqual(h5["images/parameters"].compression, "gzip")
+            self._assertSameResults(h5["images"], reference)
+        finally:
+            h5.close()
+
+def getSuite(auto=True):
+    testSuite = unittest.TestSuite()
+    if auto:
+        testSuite.addTest(\
+            unittest.TestLoader().loadTestsFromTestCase(testImageStackOutput))
+    else:
+        # use a predefined order
+        testSuite.addTest(testImageStackOutput("testImageStackOutputImport"))
+        testSuite.addTest(testImageStackOutput("testImageStackOutputArray"))
+        testSuite.addTest(testImageStackOutput("testImageStackOutputHDF5"))
+        testSuite.addTest(\
+            testImageStackOutput("testImageStackOutputFastXRFLinearFit"))
+        testSuite.addTest(\
+            testImageStackOutput("testImageStackOutputFastXRFLinearFitScript"))
+    return testSuite
+
+def test(auto=False):
+    unittest.TextTestRunner(verbosity=2).run(getSuite(auto=auto))
+
+if __name__ == '__main__':
+    test()
@@ -0,0 +1,361 @@
+#/*##########################################################################
+#
+# The PyMca X-Ray Fluorescence Toolkit
+#
+# Copyright (c) 2004-2016 European Synchrotron Radiation Facility
+#
+# This file is part of the PyMca X-ray Fluorescence Toolkit developed at
+# the ESRF by the Software group.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+#############################################################################*/
+__author__ = "V. Armando Sole - ESRF Data Analysis"
+__contact__ = "sole@esrf.fr"
+__license__ = "MIT"
+__copyright__ = "European Synchrotron Radiation Facility, Grenoble, France"
+import unittest
+import os
+import shutil
+import tempfile
+import numpy
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+# indices covering the access made to the stacks
+KEYS = [0, -1, numpy.int64(2), (1, 2), (-1, -1, -1), (slice(None), 1),
+        (Ellipsis, 5), (0, Ellipsis), (Ellipsis,), slice(None),
+        slice(None, None, -1), (slice(None), slice(None, None, -2)),
+        (slice(1, 3), slice(1, None), slice(5, 20, 3)),
+        (Ellipsis, slice(None, None, -1)), (slice(None), 3, slice(2, 9)),
+        (slice(3, 0, -2), Ellipsis, slice(25, 4, -7)), slice(2, 2),
+        (slice(None), slice(None), 7), (slice(0, 1), [0, 2], slice(None)),
+        [4, 0, 2], (1, [3, -1, 0]), (slice(None), [1, 1, 2], 4),
+        (2, slice(None), numpy.array([5, 3])), (slice(1, 4), []),
+        (Ellipsis, [29, 0])]
+
+
+@unittest.skipIf(h5py is None, "h5py not available")
+class testLazyHDF5Stack(unittest.TestCase):
+    def setUp(self):
+        """
+        import the module
+        """
+        try:
+            from PyMca5.PyMcaIO import LazyHDF5Stack
+            self._module = LazyHDF5Stack
+        except:
+            self._module = None
+        self._tmpDir = tempfile.mkdtemp()
+        self._random = numpy.random.RandomState(5)
+
+    def tearDown(self):
+        """clean up any possible files"""
+        shutil.rmtree(self._tmpDir, ignore_errors=True)
+
+    def _getSpectra(self, shape):
+        return self._random.randint(0, 1000, shape).astype(numpy.uint32)
+
+    def _createSources(self):
+        """
+        Write datasets of one, two and three dimensions filling a stack of
+        five rows of four spectra. Return the sources and the stack.
+        """
+        fileNames = [os.path.join(self._tmpDir, "first.h5"),
+                     os.path.join(self._tmpDir, "second.h5")]
+        shapes = [(2, 4, 30), (4, 30), (1, 2, 30), (1, 2, 30), (3, 30),
+                  (30,)]
+        sources = []
+        spectra = []
+        for i, shape in enumerate(shapes):
+            fileName = fileNames[i % 2]
+            h5 = h5py.File(fileName, "a")
+            try:
+                data = self._getSpectra(shape)
+                path = "/entry%d/data" % i
+                if len(shape) == 3:
+                    h5.create_dataset(path, data=data, chunks=(1, 1, 30))
+                else:
+                    h5[path] = data
+                sources.append((fileName, path, None))
+                spectra.append(data.reshape(-1, 30))
+            finally:
+                h5.close()
+        return sources, numpy.concatenate(spectra).reshape(5, 4, 30)
+
+    def _checkStack(self, stack, reference):
+        self.assertEqual(stack.shape, reference.shape)
+        self.assertEqual(len(stack), reference.shape[0])
+        for key in KEYS:
+            try:
+                expected = reference[key]
+            except IndexError:
+                # the stack is too small for the key
+                self.assertRaises(IndexError, stack.__getitem__, key)
+                continue
+            data = stack[key]
+            self.assertEqual(data.shape, expected.shape,
+                             "Different shape with key %s" % (key,))
+            self.assertTrue(numpy.allclose(data, expected),
+                            "Different data with key %s" % (key,))
+        self.assertTrue(numpy.allclose(numpy.asarray(stack), reference))
+
+    def testLazyHDF5StackImport(self):
+        #"""Test successful import"""
+        self.assertTrue(self._module is not None,
+                        "Unsuccessful PyMca5.PyMcaIO.LazyHDF5Stack import")
+
+    def testLazyHDF5StackReadPieces(self):
+        fileName = os.path.join(self._tmpDir, "pieces.h5")
+        data = self._getSpectra((3, 4, 30))
+        h5 = h5py.File(fileName, "w")
+        try:
+            dataset = h5.create_dataset("data", data=data, chunks=(1, 2, 30))
+            spectra = data.reshape(-1, 30)
+            for s0, s1 in [(0, 12), (1, 3), (2, 11), (4, 8), (5, 6),
+                           (3, 12), (0, 7)]:
+                for h0, h1 in [(0, 30), (3, 17)]:
+                    target = numpy.zeros((s1 - s0, h1 - h0))
+                    self._module._readPieces(dataset, s0, s1, h0, h1, target)
+                    self.assertTrue(numpy.array_equal(target,
+                                                spectra[s0:s1, h0:h1]),
+                                    "Different spectra %d to %d" % (s0, s1))
+                    # not contiguous target
+                    target = numpy.zeros((s1 - s0, 2 * (h1 - h0)))[:, ::2]
+                    self._module._readPieces(dataset, s0, s1, h0, h1, target)
+                    self.assertTrue(numpy.array_equal(target,
+                                                spectra[s0:s1, h0:h1]))
+            # datasets of one and two dimensions
+            dataset = h5.create_dataset("spectra", data=spectra)
+            target = numpy.zeros((3, 10))
+            self._module._readPieces(dataset, 4, 7, 10, 20, target)
+            self.assertTrue(numpy.array_equal(target, spectra[4:7, 10:20]))
+            dataset = h5.create_dataset("spectrum", data=spectra[0])
+            target = numpy.zeros((1, 10))
+            self._module._readPieces(dataset, 0, 1, 10, 20, target)
+            self.assertTrue(numpy.array_equal(target[0], spectra[0, 10:20]))
+        finally:
+            h5.close()
+
+    def testLazyHDF5StackGetItem(self):
+        sources, reference = self._createSources()
+        stack = self._module.LazyHDF5Stack(sources, shape=(5, 4))
+        try:
+            self.assertEqual(stack.dtype, numpy.uint32)
+            self._checkStack(stack, reference)
+            self.assertRaises(IndexError, stack.__getitem__, 5)
+            self.assertRaises(IndexError, stack.__getitem__, (0, -5))
+            self.assertRaises(IndexError, stack.__getitem__, (0, 0, 0, 0))
+            self.assertRaises(IndexError, stack.__getitem__, [0, 5])
+            self.assertRaises(TypeError, stack.__getitem__, [0.5, 1])
+            self.assertRaises(TypeError, stack.__getitem__, ([0], [1]))
+        finally:
+            stack.close()
+        # all the spectra in a single row by default
+        stack = self._module.LazyHDF5Stack(sources, dtype=numpy.float32)
+        try:
+            self.assertEqual(stack.dtype, numpy.float32)
+            self._checkStack(stack, reference.reshape(1, 20, 30))
+        finally:
+            stack.close()
+
+    def testLazyHDF5StackMonitor(self):
+        fileName = os.path.join(self._tmpDir, "monitor.h5")
+        data = [self._getSpectra((2, 3, 30)) for i in range(3)]
+        monitor = [self._random.uniform(1.0, 2.0, (2, 3)) for i in range(3)]
+        fullMonitor = self._random.uniform(1.0, 2.0, (2, 3, 30))
+        h5 = h5py.File(fileName, "w")
+        try:
+            for i in range(3):
+                h5.create_dataset("entry%d/data" % i, data=data[i],
+                                  chunks=(1, 3, 30))
+                h5["entry%d/monitor" % i] = monitor[i]
+            h5["entry1/full_monitor"] = fullMonitor
+            h5["entry1/channel_monitor"] = fullMonitor[0, 0]
+            h5["entry1/wrong_monitor"] = fullMonitor[0]
+        finally:
+            h5.close()
+        # one value per spectrum, one value per channel of each spectrum
+        # and a monitor given as an array
+        sources = [(fileName, "entry0/data", "entry0/monitor"),
+                   (fileName, "entry1/data", "entry1/full_monitor"),
+                   (fileName, "entry2/data", monitor[2])]
+        reference = numpy.concatenate([data[0] / monitor[0][:, :, None],
+                                       data[1] / fullMonitor,
+                                       data[2] / monitor[2][:, :, None]])
+        stack = self._module.LazyHDF5Stack(sources, shape=(6, 3))
+        try:
+            self.assertEqual(stack.dtype, numpy.float64)
+            self._checkStack(stack, reference)
+        finally:
+            stack.close()
+        # monitors that cannot be used
+        for monitorPath in ["entry1/channel_monitor", "entry1/wrong_monitor",
+                            monitor[0][0]]:
+            self.assertRaises(ValueError, self._module.LazyHDF5Stack,
+                              [(fileName, "entry1/data", monitorPath)])
+
+    def testLazyHDF5StackErrors(self):
+        sources, reference = self._createSources()
+        # wrong number of spectra
+        self.assertRaises(ValueError, self._module.LazyHDF5Stack, sources,
+                          shape=(4, 4))
+        self.assertRaises(ValueError, self._module.LazyHDF5Stack, [])
+        fileName = os.path.join(self._tmpDir, "errors.h5")
+        h5 = h5py.File(fileName, "w")
+        try:
+            h5["channels"] = self._getSpectra((4, 20))
+            h5["dimensions"] = self._getSpectra((1, 2, 2, 30))
+        finally:
+            h5.close()
+        # different number of channels
+        self.assertRaises(ValueError, self._module.LazyHDF5Stack,
+                          sources + [(fileName, "channels", None)])
+        # more than three dimensions
+        self.assertRaises(ValueError, self._module.LazyHDF5Stack,
+                          [(fileName, "dimensions", None)])
+
+    @unittest.skipIf((h5py is None) or (not hasattr(h5py, "VirtualLayout")),
+                     "h5py virtual datasets not available")
+    def testLazyHDF5StackVirtualDataset(self):
+        sources, reference = self._createSources()
+        stack = self._module.LazyHDF5Stack(sources, shape=(5, 4))
+        fileName = os.path.join(self._tmpDir, "virtual.h5")
+        h5 = h5py.File(fileName, "w")
+        try:
+            dataset = stack.createVirtualDataset(h5, "stack")
+            self.assertEqual(dataset.shape, reference.shape)
+            self.assertEqual(dataset.dtype, reference.dtype)
+            self.assertTrue(numpy.array_equal(dataset[()], reference))
+            self.assertTrue(numpy.array_equal(dataset[()], stack[:]))
+        finally:
+            h5.close()
+            stack.close()
+
+        # datasets that cannot be mapped into the stack rows
+        fileName = os.path.join(self._tmpDir, "layouts.h5")
+        h5 = h5py.File(fileName, "w")
+        try:
+            h5["images"] = self._getSpectra((2, 3, 30))
+            h5["spectra"] = self._getSpectra((4, 30))
+            h5["two"] = self._getSpectra((2, 30))
+        finally:
+            h5.close()
+        # three dimensions with rows not dividing the stack rows
+        stack = self._module.LazyHDF5Stack([(fileName, "images", None)],
+                                           shape=(3, 2))
+        # two dimensions across stack rows
+        stack2 = self._module.LazyHDF5Stack([(fileName, "two", None),
+                                             (fileName, "spectra", None)],
+                                            shape=(2, 3))
+        h5 = h5py.File(os.path.join(self._tmpDir, "virtual2.h5"), "w")
+        try:
+            self.assertRaises(ValueError, stack.createVirtualDataset,
+                              h5, "images")
+            self.assertRaises(ValueError, stack2.createVirtualDataset,
+                              h5, "spectra")
+        finally:
+            h5.close()
+            stack.close()
+            stack2.close()
+
+    def testLazyHDF5StackHDF5Stack1D(self):
+        from PyMca5.PyMcaIO import HDF5Stack1D
+        # two files of one entry of 5 x 4 spectra
+        fileList = []
+        for i in range(2):
+            fileName = os.path.join(self._tmpDir, "file%d.h5" % i)
+            h5 = h5py.File(fileName, "w")
+            try:
+                h5.create_dataset("entry/data/counts",
+                                  data=self._getSpectra((5, 4, 30)),
+                                  chunks=(1, 4, 30))
+                h5["entry/data/monitor"] = self._random.uniform(1.0, 2.0,
+                                                                (5, 4))
+                h5["entry/data/full_monitor"] = self._random.uniform(1.0,
+                                                    2.0, (5, 4, 30))
+            finally:
+                h5.close()
+            fileList.append(fileName)
+        for monitor in [None, "/data/monitor", "/data/full_monitor"]:
+            selection = {'x': None, 'y': '/data/counts', 'm': monitor}
+            eager = HDF5Stack1D.HDF5Stack1D(fileList, selection)
+            lazy = HDF5Stack1D.HDF5Stack1D(fileList, selection, lazy=True)
+            try:
+                self.assertTrue(isinstance(eager.data, numpy.ndarray))
+                self.assertTrue(isinstance(lazy.data,
+                                           self._module.LazyHDF5Stack))
+                self.assertEqual(lazy.info["McaIndex"], 2)
+                self.assertEqual(lazy.data.dtype, eager.data.dtype)
+                self._checkStack(lazy.data, eager.data)
+            finally:
+                lazy.data.close()
+
+    def testLazyHDF5StackStackBase(self):
+        from PyMca5.PyMcaCore import StackBase
+        sources, reference = self._createSources()
+        mask = numpy.zeros((5, 4), numpy.uint8)
+        mask[1, 1:3] = 1
+        mask[2, 0] = 1
+        mask[2, 3] = 1
+        mask[4, [0, 2]] = 1
+        for fileIndex in [0, 1]:
+            stack = self._module.LazyHDF5Stack(sources, shape=(5, 4))
+            try:
+                stackBase = StackBase.StackBase()
+                stackBase.setStack(stack, mcaindex=2, fileindex=fileIndex)
+                counts = stackBase.getActiveCurve()[1]
+                self.assertTrue(numpy.allclose(counts,
+                                               reference.sum(axis=(0, 1))))
+                stackBase.setSelectionMask(mask)
+                mcaDataObject = stackBase.calculateMcaDataObject()
+                self.assertTrue(numpy.allclose(mcaDataObject.y[0],
+                                        reference[mask > 0].sum(axis=0)),
+                                "Incorrect mca from mask calculation")
+                imageDict = stackBase.calculateROIImages(5, 20, imiddle=10)
+                self.assertTrue(numpy.allclose(imageDict['ROI'],
+                                        reference[:, :, 5:20].sum(axis=-1)))
+            finally:
+                stack.close()
+
+def getSuite(auto=True):
+    testSuite = unittest.TestSuite()
+    if auto:
+        testSuite.addTest(\
+            unittest.TestLoader().loadTestsFromTestCase(testLazyHDF5Stack))
+    else:
+        # use a predefined order
+        testSuite.addTest(testLazyHDF5Stack("testLazyHDF5StackImport"))
+        testSuite.addTest(testLazyHDF5Stack("testLazyHDF5StackReadPieces"))
+        testSuite.addTest(testLazyHDF5Stack("testLazyHDF5StackGetItem"))
+        testSuite.addTest(testLazyHDF5Stack("testLazyHDF5StackMonitor"))
+        testSuite.addTest(testLazyHDF5Stack("testLazyHDF5StackErrors"))
+        testSuite.addTest(\
+            testLazyHDF5Stack("testLazyHDF5StackVirtualDataset"))
+        testSuite.addTest(testLazyHDF5Stack("testLazyHDF5StackHDF5Stack1D"))
+        testSuite.addTest(testLazyHDF5Stack("testLazyHDF5StackStackBase"))
+    return testSuite
+
+def test(auto=False):
+    unittest.TextTestRunner(verbosity=2).run(getSuite(auto=auto))
+
+if __name__ == '__main__':
+    test()
@@ -0,0 +1,170 @@
+#/*##########################################################################
+#
+# The PyMca X-Ray Fluorescence Toolkit
+#
+# Copyright (c) 2004-2016 European Synchrotron Radiation Facility
+#
+# This file is part of the PyMca X-ray Fluorescence Toolkit developed at
+# the ESRF by the Software group.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+#############################################################################*/
+__author__ = "V. Armando Sole - ESRF Data Analysis"
+__contact__ = "sole@esrf.fr"
+__license__ = "MIT"
+__copyright__ = "European Synchrotron Radiation Facility, Grenoble, France"
+import unittest
+import numpy
+
+class testLinalg(unittest.TestCase):
+    def setUp(self):
+        """
+        import the module
+        """
+        try:
+            from PyMca5.PyMcaMath import linalg
+            self._module = linalg
+        except:
+            self._module = None
+        random = numpy.random.RandomState(11)
+        # a model of gaussians and a constant
+        x = numpy.arange(100.)
+        a = numpy.ones((x.size, 4))
+        for i, position in enumerate([20., 45., 70.]):
+            a[:, i + 1] = numpy.exp(-0.5 * ((x - position) / 6.) ** 2)
+        self.a = a
+        parameters = random.uniform(10., 1000., (4, 30))
+        self.b = random.poisson(numpy.dot(a, parameters)).astype(numpy.float64)
+        self.sigma_b = random.uniform(0.5, 5.0, self.b.shape)
+
+    def _solveSpectra(self, a, b, sigma_b):
+        """
+        Return the parameters, uncertainties and covariance matrices of the
+        weighted fit of each column of b solved one by one.
+        """
+        n = a.shape[1]
+        parameters = numpy.zeros((n, b.shape[1]))
+        sigmapar = numpy.zeros((n, b.shape[1]))
+        covariances = numpy.zeros((b.shape[1], n, n))
+        for i in range(b.shape[1]):
+            weight = sigma_b[:, i:i + 1]
+            A = a / weight
+            parameters[:, i] = numpy.linalg.lstsq(A, b[:, i] / weight[:, 0],
+                                                  rcond=-1)[0]
+            covariances[i] = numpy.linalg.inv(numpy.dot(A.T, A))
+            sigmapar[:, i] = numpy.sqrt(numpy.diag(covariances[i]))
+        return parameters, sigmapar, covariances
+
+    def _solve(self, a, b, sigma_b):
+        n = a.shape[1]
+        parameters = numpy.zeros((n, b.shape[1]))
+        sigmapar = numpy.zeros((n, b.shape[1]))
+        covariances = numpy.zeros((b.shape[1], n, n))
+        self._module._solveWeightedNormalEquations(a, b, sigma_b, parameters,
+                                                   sigmapar, covariances)
+        return parameters, sigmapar, covariances
+
+    def _assertSame(self, result, reference, rtol=1.0e-7):
+        for name, value, expected in zip(\
+                ["parameters", "uncertainties", "covariances"],
+                result, reference):
+            self.assertTrue(numpy.allclose(value, expected, rtol=rtol,
+                                           atol=rtol * abs(expected).max()),
+                            "Different %s" % name)
+
+    def testLinalgImport(self):
+        #"""Test successful import"""
+        self.assertTrue(self._module is not None,
+                        "Unsuccessful PyMca5.PyMcaMath.linalg import")
+
+    def testLinalgWeightedNormalEquations(self):
+        reference = self._solveSpectra(self.a, self.b, self.sigma_b)
+        self._assertSame(self._solve(self.a, self.b, self.sigma_b),
+                         reference)
+        # the same uncertainties for all the spectra
+        sigma_b = self.sigma_b[:, :1]
+        self._assertSame(self._solve(self.a, self.b, sigma_b),
+                         self._solveSpectra(self.a, self.b,
+                                numpy.repeat(sigma_b, self.b.shape[1], 1)))
+        # without covariance matrix
+        n = self.a.shape[1]
+        parameters = numpy.zeros((n, self.b.shape[1]))
+        sigmapar = numpy.zeros((n, self.b.shape[1]))
+        self._module._solveWeightedNormalEquations(self.a, self.b,
+                                                   self.sigma_b,
+                                                   parameters, sigmapar)
+        self._assertSame((parameters, sigmapar), reference[:2])
+
+    def testLinalgIllConditioned(self):
+        # columns of very different scales and two almost identical peaks
+        a = self.a * numpy.array([1.0e-4, 1.0, 1.0e5, 1.0])
+        a[:, 3] = numpy.exp(-0.5 * ((numpy.arange(100.) - 45.5) / 6.) ** 2)
+        self.assertTrue(numpy.linalg.cond(a) > 1.0e6)
+        self._assertSame(self._solve(a, self.b, self.sigma_b),
+                         self._solveSpectra(a, self.b, self.sigma_b),
+                         rtol=1.0e-5)
+
+    def testLinalgSingular(self):
+        # the last peak has no weight in the spectrum 4 and that system
+        # is singular. The other spectra are still solved.
+        a = self.a.copy()
+        a[:, 3] = 0.0
+        a[60:80, 3] = 1.0
+        sigma_b = self.sigma_b.copy()
+        sigma_b[50:, 4] = numpy.inf
+        parameters, sigmapar, covariances = self._solve(a, self.b, sigma_b)
+        good = numpy.arange(self.b.shape[1]) != 4
+        self._assertSame((parameters[:, good], sigmapar[:, good],
+                          covariances[good]),
+                         self._solveSpectra(a, self.b[:, good],
+                                            sigma_b[:, good]))
+        self.assertFalse(parameters[:, 4].any())
+        self.assertFalse(sigmapar[:, 4].any())
+        self.assertTrue(numpy.isfinite(parameters).all())
+
+    def testLinalgLstsq(self):
+        # the solution of the normal equations versus the SVD
+        for sigma_b in [self.sigma_b, None]:
+            svd = self._module.lstsq(self.a, self.b, sigma_b=sigma_b,
+                                     weight=1, covariances=True, svd=True)
+            normal = self._module.lstsq(self.a, self.b, sigma_b=sigma_b,
+                                        weight=1, covariances=True,
+                                        svd=False)
+            self._assertSame(normal, svd)
+
+def getSuite(auto=True):
+    testSuite = unittest.TestSuite()
+    if auto:
+        testSuite.addTest(\
+            unittest.TestLoader().loadTestsFromTestCase(testLinalg))
+    else:
+        # use a predefined order
+        testSuite.addTest(testLinalg("testLinalgImport"))
+        testSuite.addTest(testLinalg("testLinalgWeightedNormalEquations"))
+        testSuite.addTest(testLinalg("testLinalgIllConditioned"))
+        testSuite.addTest(testLinalg("testLinalgSingular"))
+        testSuite.addTest(testLinalg("testLinalgLstsq"))
+    return testSuite
+
+def test(auto=False):
+    unittest.TextTestRunner(verbosity=2).run(getSuite(auto=auto))
+
+if __name__ == '__main__':
+    test()
@@ -0,0 +1,297 @@
+#/*##########################################################################
+#
+# The PyMca X-Ray Fluorescence Toolkit
+#
+# Copyright (c) 2004-2016 European Synchrotron Radiation Facility
+#
+# This file is part of the PyMca X-ray Fluorescence Toolkit developed at
+# the ESRF by the Software group.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+#############################################################################*/
+__author__ = "V. Armando Sole - ESRF Data Analysis"
+__contact__ = "sole@esrf.fr"
+__license__ = "MIT"
+__copyright__ = "European Synchrotron Radiation Facility, Grenoble, France"
+import unittest
+import os
+import shutil
+import tempfile
+import numpy
+
+class testMcaAdvancedFitBatch(unittest.TestCase):
+    def setUp(self):
+        """
+        import the module
+        """
+        try:
+            from PyMca5.PyMcaPhysics.xrf import McaAdvancedFitBatch
+            self._module = McaAdvancedFitBatch
+        except:
+            self._module = None
+        self._tmpDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """clean up any possible files"""
+        shutil.rmtree(self._tmpDir, ignore_errors=True)
+
+    def _getConfiguration(self):
+        from PyMca5 import PyMcaDataDir
+        from PyMca5.PyMcaIO import ConfigDict
+        configuration = ConfigDict.ConfigDict()
+        configuration.read(os.path.join(PyMcaDataDir.PYMCA_DATA_DIR,
+                                        "McaTheory.cfg"))
+        configuration["fit"]["energy"] = [12.0]
+        configuration["fit"]["energyweight"] = [1.0]
+        configuration["fit"]["energyflag"] = [1]
+        configuration["fit"]["energyscatter"] = [1]
+        configuration["fit"]["linearfitflag"] = 1
+        configuration["fit"]["continuum"] = 1
+        configuration["peaks"] = {"Fe": "K", "Cu": "K", "Zn": "K"}
+        configuration["attenuators"]["Matrix"] = [1, "Water", 1.0, 0.01,
+                                                  45.0, 45.0]
+        configuration["concentrations"]["usematrix"] = 0
+        configuration["concentrations"]["reference"] = "Fe"
+        return configuration
+
+    def _getConfigurationFile(self, configuration):
+        configurationFile = os.path.join(self._tmpDir, "fit.cfg")
+        if not os.path.exists(configurationFile):
+            configuration.write(configurationFile)
+        return configurationFile
+
+    def _createFiles(self, configuration, nRows=3, nColumns=4,
+                     nChannels=800):
+        """
+        Write one EDF file per row of a map of spectra calculated with the
+        fit model itself and return the list of file names.
+        """
+        from PyMca5.PyMcaIO import EdfFile
+        from PyMca5.PyMcaPhysics.xrf import ClassMcaTheory
+        x = numpy.arange(float(nChannels))
+        mcaTheory = ClassMcaTheory.McaTheory()
+        mcaTheory.setConfiguration(configuration)
+        mcaTheory.enableOptimizedLinearFit()
+        mcaTheory.setData(x=x, y=numpy.ones(x.shape))
+        mcaTheory.estimate()
+        iXMin = int(mcaTheory.xdata[0])
+        iXMax = int(mcaTheory.xdata[-1]) + 1
+        random = numpy.random.RandomState(5)
+        spectra = numpy.zeros((nRows, nColumns, x.size))
+        spectra[:, :, iXMin:iXMax] = 20.0
+        for group in ["Fe K", "Cu K", "Zn K"]:
+            i = mcaTheory.PARAMETERS.index(group)
+            peaks = numpy.ravel(mcaTheory.linearMcaTheoryDerivative(\
+                                mcaTheory.parameters, i, mcaTheory.xdata))
+            areas = random.uniform(2000., 8000., (nRows, nColumns))
+            spectra[:, :, iXMin:iXMax] += areas[:, :, None] * peaks
+        spectra = random.poisson(spectra).astype(numpy.float32)
+        fileList = []
+        for i in range(nRows):
+            fileName = os.path.join(self._tmpDir, "row_%04d.edf" % i)
+            edf = EdfFile.EdfFile(fileName, "wb")
+            edf.WriteImage({}, spectra[i])
+            edf = None
+            fileList.append(fileName)
+        return fileList
+
+    def _process(self, configuration, fileList, outputDir, processes=None,
+                 overwrite=1):
+        """
+        Run the batch and return the keys of the spectra in the order
+        they were reported.
+        """
+        if not os.path.exists(outputDir):
+            os.mkdir(outputDir)
+        keys = []
+        class Batch(self._module.McaAdvancedFitBatch):
+            def onNewFile(self, ffile, filelist):
+                pass
+
+            def onMca(self, mca, nmca, filename=None, key=None, info=None):
+                keys.append(key)
+        batch = Batch(self._getConfigurationFile(configuration),
+                      fileList, outputDir,
+                      concentrations=1, fitfiles=1, fitimages=1,
+                      overwrite=overwrite, processes=processes)
+        batch.processList()
+        return keys
+
+    def _getFitFiles(self, outputDir):
+        fitFiles = []
+        for dirpath, dirnames, filenames in os.walk(os.path.join(outputDir,
+                                                                 "FIT")):
+            for fileName in filenames:
+                fitFiles.append(os.path.relpath(os.path.join(dirpath,
+                                                             fileName),
+                                                outputDir))
+        fitFiles.sort()
+        return fitFiles
+
+    def _readFitFile(self, fileName):
+        from PyMca5.PyMcaIO import ConfigDict
+        fitFile = ConfigDict.ConfigDict()
+        fitFile.read(fileName)
+        return fitFile
+
+    def _assertSameOutput(self, outputDir, referenceDir):
+        from PyMca5.PyMcaIO import EdfFile
+        # the images
+        imagesDir = os.path.join(outputDir, "IMAGES")
+        referenceImagesDir = os.path.join(referenceDir, "IMAGES")
+        names = sorted(os.listdir(imagesDir))
+        self.assertEqual(names, sorted(os.listdir(referenceImagesDir)))
+        self.assertTrue(len(names) > 0)
+        for name in names:
+            if not name.endswith(".edf"):
+                continue
+            image = EdfFile.EdfFile(os.path.join(imagesDir, name),
+                                    "rb").GetData(0)
+            reference = EdfFile.EdfFile(os.path.join(referenceImagesDir, name),
+                                        "rb").GetData(0)
+            self.assertEqual(image.shape, reference.shape)
+            self.assertTrue(numpy.allclose(image, reference, rtol=1.0e-5),
+                            "Different image %s" % name)
+        # the .fit files
+        fitFiles = self._getFitFiles(outputDir)
+        self.assertEqual(fitFiles, self._getFitFiles(referenceDir))
+        for name in fitFiles:
+            result = self._readFitFile(os.path.join(outputDir, name))
+            reference = self._readFitFile(os.path.join(referenceDir, name))
+            for group in reference['result']['groups']:
+                self.assertTrue(numpy.allclose(\
+                                    result['result'][group]['fitarea'],
+                                    reference['result'][group]['fitarea'],
+                                    rtol=1.0e-5),
+                                "Different %s area in %s" % (group, name))
+            for group in reference['concentrations']['groups']:
+                self.assertTrue(numpy.allclose(\
+                    result['concentrations']['mass fraction'][group],
+                    reference['concentrations']['mass fraction'][group],
+                    rtol=1.0e-5),
+                    "Different %s concentration in %s" % (group, name))
+
+    def testMcaAdvancedFitBatchImport(self):
+        #"""Test successful import"""
+        self.assertTrue(self._module is not None,
+                "Unsuccessful PyMca5.PyMcaPhysics.xrf.McaAdvancedFitBatch import")
+
+    def testMcaAdvancedFitBatchPool(self):
+        configuration = self._getConfiguration()
+        fileList = self._createFiles(configuration)
+        referenceDir = os.path.join(self._tmpDir, "serial")
+        referenceKeys = self._process(configuration, fileList, referenceDir)
+        self.assertEqual(len(referenceKeys), 12)
+        outputDir = os.path.join(self._tmpDir, "pool")
+        keys = self._process(configuration, fileList, outputDir, processes=2)
+        # the results are merged in the order the spectra were read
+        self.assertEqual(keys, referenceKeys)
+        self._assertSameOutput(outputDir, referenceDir)
+
+    def testMcaAdvancedFitBatchRestart(self):
+        configuration = self._getConfiguration()
+        fileList = self._createFiles(configuration)
+        referenceDir = os.path.join(self._tmpDir, "serial")
+        referenceKeys = self._process(configuration, fileList, referenceDir)
+        outputDir = os.path.join(self._tmpDir, "pool")
+        self._process(configuration, fileList, outputDir, processes=2)
+        # an interrupted batch: some spectra still to be fitted and one
+        # stored result modified to see it is used instead of fitting
+        fitFiles = self._getFitFiles(outputDir)
+        removed = fitFiles[1::3]
+        for name in removed:
+            os.remove(os.path.join(outputDir, name))
+        modified = os.path.join(outputDir, fitFiles[0])
+        fitFile = self._readFitFile(modified)
+        fitFile['result']['chisq'] = 1234.5
+        os.remove(modified)
+        fitFile.write(modified)
+
+        keys = self._process(configuration, fileList, outputDir, processes=2,
+                             overwrite=0)
+        self.assertEqual(keys, referenceKeys)
+        for name in removed:
+            self.assertTrue(os.path.exists(os.path.join(outputDir, name)),
+                            "Spectrum %s not fitted" % name)
+        from PyMca5.PyMcaIO import EdfFile
+        imagesDir = os.path.join(outputDir, "IMAGES")
+        chisqName = [name for name in os.listdir(imagesDir) \
+                     if name.endswith("_chisq.edf")][0]
+        chisq = EdfFile.EdfFile(os.path.join(imagesDir, chisqName),
+                                "rb").GetData(0)
+        self.assertAlmostEqual(chisq[0, 0], 1234.5, places=3)
+        # everything else is the result of the serial fit
+        fitFile['result']['chisq'] = self._readFitFile(\
+            os.path.join(referenceDir, fitFiles[0]))['result']['chisq']
+        os.remove(modified)
+        fitFile.write(modified)
+        self._process(configuration, fileList, outputDir, processes=2,
+                      overwrite=0)
+        self._assertSameOutput(outputDir, referenceDir)
+
+    def testMcaAdvancedFitBatchErrors(self):
+        configuration = self._getConfiguration()
+        fileList = self._createFiles(configuration)
+        # no channel within the fit limits
+        configuration["fit"]["xmin"] = 5000
+        configuration["fit"]["xmax"] = 6000
+        reports = []
+        for processes in [None, 2]:
+            outputDir = os.path.join(self._tmpDir, "output%s" % processes)
+            keys = self._process(configuration, fileList, outputDir,
+                                 processes=processes)
+            self.assertEqual(len(keys), 12)
+            fileName = os.path.join(outputDir,
+                                    "row_0000_to_0002.edf_errors.txt")
+            self.assertTrue(os.path.exists(fileName),
+                            "Errors not reported with processes = %s" % \
+                            processes)
+            f = open(fileName, "r")
+            reports.append(f.readlines())
+            f.close()
+            self.assertEqual(self._getFitFiles(outputDir), [])
+        self.assertEqual(len(reports[0]), 12)
+        self.assertTrue(reports[0][0].startswith("Error fitting file"))
+        # the errors of the workers are sent back to the report
+        self.assertEqual(reports[1], reports[0])
+
+def getSuite(auto=True):
+    testSuite = unittest.TestSuite()
+    if auto:
+        testSuite.addTest(\
+            unittest.TestLoader().loadTestsFromTestCase(\
+                                            testMcaAdvancedFitBatch))
+    else:
+        # use a predefined order
+        testSuite.addTest(testMcaAdvancedFitBatch(\
+                                    "testMcaAdvancedFitBatchImport"))
+        testSuite.addTest(testMcaAdvancedFitBatch(\
+                                    "testMcaAdvancedFitBatchPool"))
+        testSuite.addTest(testMcaAdvancedFitBatch(\
+                                    "testMcaAdvancedFitBatchRestart"))
+        testSuite.addTest(testMcaAdvancedFitBatch(\
+                                    "testMcaAdvancedFitBatchErrors"))
+    return testSuite
+
+def test(auto=False):
+    unittest.TextTestRunner(verbosity=2).run(getSuite(auto=auto))
+
+if __name__ == '__main__':
+    test()
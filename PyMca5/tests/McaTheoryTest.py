@@ -0,0 +1,130 @@
+#/*##########################################################################
+#
+# The PyMca X-Ray Fluorescence Toolkit
+#
+# Copyright (c) 2004-2016 European Synchrotron Radiation Facility
+#
+# This file is part of the PyMca X-ray Fluorescence Toolkit developed at
+# the ESRF by the Software group.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+#############################################################################*/
+__author__ = "V. Armando Sole - ESRF Data Analysis"
+__contact__ = "sole@esrf.fr"
+__license__ = "MIT"
+__copyright__ = "European Synchrotron Radiation Facility, Grenoble, France"
+import unittest
+import os
+import numpy
+
+class testMcaTheory(unittest.TestCase):
+    def setUp(self):
+        """
+        import the module
+        """
+        try:
+            from PyMca5.PyMcaPhysics.xrf import ClassMcaTheory
+            self._module = ClassMcaTheory
+        except:
+            self._module = None
+
+    def testMcaTheoryImport(self):
+        #"""Test successful import"""
+        self.assertTrue(self._module is not None,\
+                "Unsuccessful PyMca5.PyMcaPhysics.xrf.ClassMcaTheory import")
+
+    def _getConfiguration(self):
+        from PyMca5 import PyMcaDataDir
+        from PyMca5.PyMcaIO import ConfigDict
+        configuration = ConfigDict.ConfigDict()
+        configuration.read(os.path.join(PyMcaDataDir.PYMCA_DATA_DIR,
+                                        "McaTheory.cfg"))
+        configuration["fit"]["energy"] = [12.0]
+        configuration["fit"]["energyweight"] = [1.0]
+        configuration["fit"]["energyflag"] = [1]
+        configuration["fit"]["energyscatter"] = [1]
+        configuration["fit"]["continuum"] = 0
+        configuration["fit"]["sumflag"] = 0
+        configuration["peaks"] = {"Fe": "K", "Cu": "K", "Zn": "K"}
+        return configuration
+
+    def testMcaTheoryPeakMatrixContribution(self):
+        self.testMcaTheoryImport()
+        x = numpy.arange(800.)
+        for escape in [0, 1]:
+            for hypermet in [1, 15]:
+                configuration = self._getConfiguration()
+                configuration["fit"]["escapeflag"] = escape
+                configuration["fit"]["hypermetflag"] = hypermet
+                mcaTheory = self._module.McaTheory()
+                mcaTheory.setConfiguration(configuration)
+                mcaTheory.setData(x=x, y=numpy.ones(x.shape))
+                mcaTheory.estimate()
+                nGlobal = mcaTheory.NGLOBAL
+                parameters = numpy.array(mcaTheory.parameters, copy=True)
+                nGroups = len(parameters) - nGlobal
+                self.assertTrue(nGroups > 0)
+
+                # the contributions do not depend on the current areas
+                parameters[nGlobal:] = 1.0
+                reference = mcaTheory.getPeakMatrixContribution(parameters,
+                                                                x)
+                self.assertEqual(reference.shape, (x.size, nGroups))
+                areas = numpy.linspace(10., 1000., nGroups)
+                parameters[nGlobal:] = areas
+                matrix = mcaTheory.getPeakMatrixContribution(parameters, x)
+                self.assertTrue(numpy.allclose(matrix, reference),
+                        "Contributions depend on the areas with escape %d" % \
+                        escape)
+
+                # and the model is their sum weighted by the areas
+                model = mcaTheory.mcatheory(parameters, x)
+                self.assertTrue(numpy.allclose(numpy.dot(matrix, areas),
+                                               model))
+
+                # each group has unit area (in counts) within the spectrum
+                # when its peaks are far from the limits
+                for group in ["Fe K", "Cu K"]:
+                    i = mcaTheory.PARAMETERS.index(group) - nGlobal
+                    area = matrix[:, i].sum()
+                    if escape or (hypermet != 1):
+                        # the escape peaks and the step increase it
+                        self.assertTrue(area > 0.99)
+                        self.assertTrue(area < 1.2)
+                    else:
+                        self.assertTrue(abs(area - 1.0) < 1.0e-3,
+                                        "Area of %s is %f" % (group, area))
+
+def getSuite(auto=True):
+    testSuite = unittest.TestSuite()
+    if auto:
+        testSuite.addTest(\
+            unittest.TestLoader().loadTestsFromTestCase(testMcaTheory))
+    else:
+        # use a predefined order
+        testSuite.addTest(testMcaTheory("testMcaTheoryImport"))
+        testSuite.addTest(testMcaTheory("testMcaTheoryPeakMatrixContribution"))
+    return testSuite
+
+def test(auto=False):
+    unittest.TextTestRunner(verbosity=2).run(getSuite(auto=auto))
+
+if __name__ == '__main__':
+    test()
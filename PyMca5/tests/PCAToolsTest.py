@@ -90,6 +90,44 @@ def testPCAToolsCovariance(self):
             self.assertTrue(numpy.allclose(numpyAvg, pymcaAvg))
             self.assertTrue(nData == nSpectra)
 
+    def testPCAToolsCovarianceBlocks(self):
+        from PyMca5.PyMcaMath.mva import PCATools
+        x = numpy.random.random((20, 30, 9))
+        mask = numpy.ones((20, 30), numpy.uint8)
+        mask[3:7, 10:20] = 0
+        weights = numpy.random.random(9)
+
+        # expected values using the selected spectra only
+        selection = x[mask > 0] * weights
+        numpyCov = numpy.cov(selection.T)
+        numpyAvg = selection.sum(axis=0) / selection.shape[0]
+
+        # use blocks smaller than a row and bigger than a row
+        oldBlockSize = PCATools.BLOCK_SIZE
+        try:
+            for blockSize in [100, 1000]:
+                PCATools.BLOCK_SIZE = blockSize
+                for workers in [1, 3]:
+                    pymcaCov, pymcaAvg, nData = \
+                            PCATools.getCovarianceMatrix(x,
+                                                         force=True,
+                                                         center=True,
+                                                         weights=weights,
+                                                         spatial_mask=mask,
+                                                         workers=workers)
+                    self.assertTrue(nData == selection.shape[0])
+                    self.assertTrue(numpy.allclose(numpyCov, pymcaCov))
+                    self.assertTrue(numpy.allclose(numpyAvg, pymcaAvg))
+        finally:
+            PCATools.BLOCK_SIZE = oldBlockSize
+
+        # binning is a sampling of the channels
+        pymcaCov, pymcaAvg, nData = PCATools.getCovarianceMatrix(x,
+                                                                 binning=2,
+                                                                 workers=2)
+        numpyCov = numpy.cov(x.reshape(-1, 9)[:, 0:8:2].T)
+        self.assertTrue(numpy.allclose(numpyCov, pymcaCov))
+
     def testPCAToolsPCA(self):
         from PyMca5.PyMcaMath.mva.PCATools import numpyPCA
         x = numpy.array([[0.0,  2.0,  3.0],
@@ -131,6 +169,34 @@ def testPCAToolsPCA(self):
             self.assertTrue(numpy.allclose(eigenvalues, numpyEigenvalues))
             self.assertTrue(numpy.allclose(eigenvectors, numpyEigenvectors))
 
+    def testPCAToolsRandomizedPCA(self):
+        from PyMca5.PyMcaMath.mva.PCATools import getCovarianceMatrix
+        from PyMca5.PyMcaMath.mva.PCATools import randomizedPCA
+        # stack of rank 3
+        spectra = numpy.random.random((3, 50))
+        maps = numpy.random.random((20, 10, 3)) * numpy.array([10., 5., 1.])
+        x = numpy.dot(maps, spectra)
+
+        # reference using the full covariance matrix
+        cov, avg, nData = getCovarianceMatrix(x, force=True, center=True)
+        evalues, evectors = numpy.linalg.eigh(cov)
+        idx = numpy.argsort(evalues)[::-1][:3]
+        evalues = evalues[idx]
+        evectors = evectors[:, idx].T
+
+        result = randomizedPCA(x, ncomponents=3, legacy=False)
+        self.assertTrue(numpy.allclose(result["eigenvalues"], evalues,
+                                       rtol=1.0e-4))
+        self.assertTrue(numpy.allclose(result["average"], avg))
+        self.assertTrue(result["pixels"] == nData)
+        self.assertTrue(result["scores"].shape == (3, 20, 10))
+        for i in range(3):
+            # the eigenvectors can be multiplied by -1
+            vector = result["eigenvectors"][i]
+            if numpy.dot(vector, evectors[i]) < 0:
+                vector = -vector
+            self.assertTrue(numpy.allclose(vector, evectors[i], atol=1.0e-4))
+
     if MDP:
         def testPCAToolsMDP(self):
             from PyMca5.PyMcaMath.mva.PCATools import getCovarianceMatrix, numpyPCA
@@ -175,7 +241,9 @@ def getSuite(auto=True):
         # use a predefined order
         testSuite.addTest(testPCATools("testPCAToolsImport"))
         testSuite.addTest(testPCATools("testPCAToolsCovariance"))
+        testSuite.addTest(testPCATools("testPCAToolsCovarianceBlocks"))
         testSuite.addTest(testPCATools("testPCAToolsPCA"))
+        testSuite.addTest(testPCATools("testPCAToolsRandomizedPCA"))
         if MDP:
             testSuite.addTest(testPCATools("testPCAToolsMDP"))
     return testSuite
@@ -0,0 +1,103 @@
+#/*##########################################################################
+#
+# The PyMca X-Ray Fluorescence Toolkit
+#
+# Copyright (c) 2004-2016 European Synchrotron Radiation Facility
+#
+# This file is part of the PyMca X-ray Fluorescence Toolkit developed at
+# the ESRF by the Software group.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+#############################################################################*/
+__author__ = "V. Armando Sole - ESRF Data Analysis"
+__contact__ = "sole@esrf.fr"
+__license__ = "MIT"
+__copyright__ = "European Synchrotron Radiation Facility, Grenoble, France"
+import unittest
+import os
+
+def _square(task):
+    from PyMca5.PyMcaMisc import ProcessPool
+    return task * task + ProcessPool.WORKER_CONTEXT['offset'], os.getpid()
+
+class testProcessPool(unittest.TestCase):
+    def setUp(self):
+        """
+        import the module
+        """
+        try:
+            from PyMca5.PyMcaMisc import ProcessPool
+            self._module = ProcessPool
+        except:
+            self._module = None
+
+    def testProcessPoolImport(self):
+        #"""Test successful import"""
+        self.assertTrue(self._module is not None,
+                        "Unsuccessful PyMca5.PyMcaMisc.ProcessPool import")
+
+    def testProcessPoolOrderedTasks(self):
+        pool = self._module.getPool(3, {'offset': 1})
+        if pool is None:
+            self.skipTest("Worker processes cannot be forked")
+        handled = []
+        def callback(info, result):
+            handled.append((info, result))
+        tasks = self._module.OrderedTasks(pool, callback)
+        try:
+            for i in range(20):
+                if i % 5:
+                    tasks.submit(_square, i, info=i, maxPending=4)
+                else:
+                    # nothing to be calculated
+                    tasks.submit(None, None, info=i, maxPending=4)
+                self.assertTrue(len(tasks) <= 4)
+            self.assertEqual(len(handled) + len(tasks), 20)
+            tasks.handle(0)
+            self.assertEqual(len(tasks), 0)
+        finally:
+            tasks.terminate()
+        # handled in the submission order
+        self.assertEqual([info for info, result in handled], list(range(20)))
+        for info, result in handled:
+            if info % 5:
+                self.assertEqual(result[0], info * info + 1)
+                self.assertNotEqual(result[1], os.getpid())
+            else:
+                self.assertTrue(result is None)
+        # the context of the calling process is not modified
+        self.assertEqual(self._module.WORKER_CONTEXT, {})
+
+def getSuite(auto=True):
+    testSuite = unittest.TestSuite()
+    if auto:
+        testSuite.addTest(\
+            unittest.TestLoader().loadTestsFromTestCase(testProcessPool))
+    else:
+        # use a predefined order
+        testSuite.addTest(testProcessPool("testProcessPoolImport"))
+        testSuite.addTest(testProcessPool("testProcessPoolOrderedTasks"))
+    return testSuite
+
+def test(auto=False):
+    unittest.TextTestRunner(verbosity=2).run(getSuite(auto=auto))
+
+if __name__ == '__main__':
+    test()
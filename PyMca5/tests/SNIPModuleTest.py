@@ -0,0 +1,196 @@
+#/*##########################################################################
+#
+# The PyMca X-Ray Fluorescence Toolkit
+#
+# Copyright (c) 2004-2016 European Synchrotron Radiation Facility
+#
+# This file is part of the PyMca X-ray Fluorescence Toolkit developed at
+# the ESRF by the Software group.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+#############################################################################*/
+__author__ = "V. Armando Sole - ESRF Data Analysis"
+__contact__ = "sole@esrf.fr"
+__license__ = "MIT"
+__copyright__ = "European Synchrotron Radiation Facility, Grenoble, France"
+import unittest
+import numpy
+
+class testSNIPModule(unittest.TestCase):
+    def setUp(self):
+        """
+        import the module
+        """
+        try:
+            from PyMca5.PyMcaMath import SNIPModule
+            self._module = SNIPModule
+        except:
+            self._module = None
+        if self._module is not None:
+            self._blockSize = self._module.SPECTRA_BLOCK_SIZE
+        random = numpy.random.RandomState(17)
+        # a sloped background with some peaks
+        x = numpy.arange(500.)
+        self.spectra = numpy.zeros((25, x.size))
+        for i in range(self.spectra.shape[0]):
+            spectrum = random.uniform(50., 100.) * numpy.exp(-x / 300.)
+            for position in [80., 210., 330., 420.]:
+                spectrum += random.uniform(100., 2000.) * \
+                            numpy.exp(-0.5 * ((x - position) / 4.) ** 2)
+            self.spectra[i] = random.poisson(spectrum)
+
+    def tearDown(self):
+        if self._module is not None:
+            self._module.SPECTRA_BLOCK_SIZE = self._blockSize
+
+    def _getBackground(self, spectrum, width, anchors=None, smoothing=0,
+                       sg_width=None):
+        """
+        Return the background of a single spectrum calculated as
+        FastXRFLinearFit used to do it.
+        """
+        from PyMca5.PyMcaMath.fitting import SpecfitFuns
+        if sg_width is not None:
+            background = SpecfitFuns.SavitskyGolay(spectrum, sg_width)
+        else:
+            background = numpy.array(spectrum, dtype=numpy.float64)
+        lastAnchor = 0
+        if anchors is not None:
+            for anchor in anchors:
+                if (anchor > lastAnchor) and (anchor < background.size):
+                    background[lastAnchor:anchor] = \
+                            SpecfitFuns.snip1d(background[lastAnchor:anchor],
+                                               width, smoothing)
+                    lastAnchor = anchor
+        if lastAnchor < background.size:
+            background[lastAnchor:] = \
+                            SpecfitFuns.snip1d(background[lastAnchor:],
+                                               width, smoothing)
+        return background
+
+    def testSNIPModuleImport(self):
+        #"""Test successful import"""
+        self.assertTrue(self._module is not None,
+                        "Unsuccessful PyMca5.PyMcaMath.SNIPModule import")
+
+    def testSNIPModuleSavitskyGolay(self):
+        from PyMca5.PyMcaMath.fitting import SpecfitFuns
+        for width in [3, 5, 10, 21]:
+            for spectra in [self.spectra,
+                            self.spectra.astype(numpy.float32),
+                            self.spectra.T.copy().T,
+                            self.spectra[:, ::2]]:
+                original = spectra.copy()
+                smoothed = SpecfitFuns.SavitskyGolay(spectra, width)
+                # the input is not modified
+                self.assertTrue((spectra == original).all())
+                self.assertEqual(smoothed.shape, spectra.shape)
+                for i in range(spectra.shape[0]):
+                    reference = SpecfitFuns.SavitskyGolay(spectra[i], width)
+                    self.assertTrue(numpy.allclose(smoothed[i], reference),
+                                    "Different spectrum %d width %d" % \
+                                    (i, width))
+        # too short spectra are not smoothed
+        spectra = self.spectra[:, :7]
+        self.assertTrue((SpecfitFuns.SavitskyGolay(spectra, 11) == \
+                         spectra).all())
+
+    def testSNIPModuleMultipleSpectraBackground(self):
+        for anchors in [None, [], [150, 300], [0, 300, 150, 499, 1000]]:
+            for smoothing in [0, 2]:
+                for sgWidth in [None, 5]:
+                    background = self._module.getMultipleSpectraBackground(\
+                                        self.spectra, 30, anchors=anchors,
+                                        smoothing=smoothing, sg_width=sgWidth)
+                    self.assertEqual(background.shape, self.spectra.shape)
+                    for i in range(self.spectra.shape[0]):
+                        reference = self._getBackground(self.spectra[i], 30,
+                                                        anchors=anchors,
+                                                        smoothing=smoothing,
+                                                        sg_width=sgWidth)
+                        self.assertTrue(numpy.allclose(background[i],
+                                                       reference),
+                                "Different background of spectrum %d with "\
+                                "anchors %s, smoothing %d and SG width %s" % \
+                                (i, anchors, smoothing, sgWidth))
+        # a single spectrum keeps its shape
+        background = self._module.getMultipleSpectraBackground(\
+                            self.spectra[3], 30, anchors=[150], sg_width=5)
+        self.assertEqual(background.shape, self.spectra[3].shape)
+        self.assertTrue(numpy.allclose(background,
+                            self._getBackground(self.spectra[3], 30,
+                                                anchors=[150], sg_width=5)))
+
+    def testSNIPModuleStack(self):
+        # several blocks of spectra
+        self._module.SPECTRA_BLOCK_SIZE = 7
+        for roi_min, roi_max in [(None, None), (40, 450)]:
+            first = 0 if roi_min is None else roi_min
+            last = self.spectra.shape[1] if roi_max is None else roi_max
+            reference = numpy.zeros(self.spectra.shape)
+            for i in range(self.spectra.shape[0]):
+                reference[i, first:last] = self.spectra[i, first:last] - \
+                    self._module.getSpectrumBackground(\
+                                    self.spectra[i, first:last], 30,
+                                    smoothing=1)
+            # spectra as last index
+            stack = self.spectra.reshape(5, 5, -1).copy()
+            self._module.subtractSnip1DBackgroundFromStack(stack, 30,
+                                                           roi_min=roi_min,
+                                                           roi_max=roi_max,
+                                                           smoothing=1)
+            self.assertEqual(stack.shape, (5, 5, self.spectra.shape[1]))
+            self.assertTrue(numpy.allclose(stack.reshape(reference.shape),
+                                           reference))
+            # spectra as first index
+            class Stack(object):
+                pass
+            stack = Stack()
+            stack.data = self.spectra.T.reshape(-1, 5, 5).copy()
+            stack.info = {"McaIndex": 0}
+            self._module.subtractSnip1DBackgroundFromStack(stack, 30,
+                                                           roi_min=roi_min,
+                                                           roi_max=roi_max,
+                                                           smoothing=1)
+            # the channels out of the region of interest are kept
+            reference[:, :first] = self.spectra[:, :first]
+            reference[:, last:] = self.spectra[:, last:]
+            self.assertTrue(numpy.allclose(stack.data.reshape(-1, 25).T,
+                                           reference))
+
+def getSuite(auto=True):
+    testSuite = unittest.TestSuite()
+    if auto:
+        testSuite.addTest(\
+            unittest.TestLoader().loadTestsFromTestCase(testSNIPModule))
+    else:
+        # use a predefined order
+        testSuite.addTest(testSNIPModule("testSNIPModuleImport"))
+        testSuite.addTest(testSNIPModule("testSNIPModuleSavitskyGolay"))
+        testSuite.addTest(\
+            testSNIPModule("testSNIPModuleMultipleSpectraBackground"))
+        testSuite.addTest(testSNIPModule("testSNIPModuleStack"))
+    return testSuite
+
+def test(auto=False):
+    unittest.TextTestRunner(verbosity=2).run(getSuite(auto=auto))
+
+if __name__ == '__main__':
+    test()
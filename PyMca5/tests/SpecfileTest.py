@@ -35,6 +35,7 @@
 import os
 import gc
 import tempfile
+import numpy
 
 class testSpecfile(unittest.TestCase):
     def setUp(self):
@@ -143,6 +144,216 @@ def testSpecfileReadingCompatibleWithUserLocale(self):
                     (datacol[1], data[0][1]))
         gc.collect()
 
+    def testSpecfileAllMca(self):
+        #"""Test reading all the mca of a scan at once"""
+        self.testSpecfileImport()
+        text  = "#F \n"
+        text += "\n"
+        text += "#S 1  Undefined command 0\n"
+        text += "#N 2\n"
+        text += "#@MCA 16C\n"
+        text += "#L First  Second\n"
+        text += "1  10\n"
+        text += "@A 1 2 3 4\\\n 5 6\n"
+        text += "2  20\n"
+        text += "@A 7 8.5 -9 1.0e2\\\n 11 12\n"
+        text += "3  30\n"
+        text += "@A 0 0 0 0\\\n 0 2.5E-1\n"
+        text += "\n"
+        tmpFile = tempfile.mkstemp(text=False)
+        if sys.version < '3.0':
+            os.write(tmpFile[0], text)
+        else:
+            os.write(tmpFile[0], bytes(text, 'utf-8'))
+        os.close(tmpFile[0])
+        try:
+            self._sf = self.specfileClass.Specfile(tmpFile[1])
+            self._scan = self._sf[0]
+            nMca = self._scan.nbmca()
+            self.assertEqual(nMca, 3,
+                             'Expected to read 3 mca, got %d' % nMca)
+            data = self._scan.allmca()
+            self.assertEqual(data.shape, (3, 6),
+                             'Expected shape (3, 6), got %s' % (data.shape,))
+            for i in range(nMca):
+                mca = self._scan.mca(i + 1)
+                for j in range(6):
+                    self.assertEqual(data[i, j], mca[j],
+                                     'Read %f instead of %f' %\
+                                     (data[i, j], mca[j]))
+            self.assertEqual(data[2, 5], 0.25,
+                             'Read %f instead of %f' % (data[2, 5], 0.25))
+            # preallocated output
+            out = numpy.zeros((2, 6), numpy.float64)
+            self._scan.allmca(out)
+            self.assertTrue((out == data[:2]).all(),
+                            'Incorrect data read into output array')
+        finally:
+            self._sf = None
+            self._scan = None
+            gc.collect()
+            if os.path.exists(tmpFile[1]):
+                os.remove(tmpFile[1])
+
+    def testSpecfileAllMcaThreads(self):
+        #"""Test reading all the mca while other threads use the file"""
+        self.testSpecfileImport()
+        import threading
+        random = numpy.random.RandomState(1)
+        nMca, nChannels = 400, 256
+        expected = [random.randint(0, 10000, (nMca, nChannels)) \
+                    for i in range(2)]
+        text  = "#F \n"
+        text += "\n"
+        for i in range(2):
+            text += "#S %d  Undefined command %d\n" % (i + 1, i)
+            text += "#N 1\n"
+            text += "#@MCA %dC\n" % nChannels
+            text += "#L First\n"
+            for j in range(nMca):
+                text += "%d\n" % j
+                text += "@A " + " ".join(["%d" % v for v in expected[i][j]])
+                text += "\n"
+            text += "\n"
+        fileNames = []
+        for i in range(2):
+            tmpFile = tempfile.mkstemp(text=False)
+            if sys.version < '3.0':
+                os.write(tmpFile[0], text)
+            else:
+                os.write(tmpFile[0], bytes(text, 'utf-8'))
+            os.close(tmpFile[0])
+            fileNames.append(tmpFile[1])
+        errors = []
+
+        def readAllMca(sf):
+            try:
+                scan = sf[0]
+                for i in range(10):
+                    if not (scan.allmca() == expected[0]).all():
+                        errors.append("Incorrect data read by allmca")
+            except:
+                errors.append("Error reading all the mca: %s" % \
+                              (sys.exc_info()[1],))
+
+        try:
+            files = [self.specfileClass.Specfile(name) for name in fileNames]
+            # different files read at once
+            threads = [threading.Thread(target=readAllMca, args=(sf,)) \
+                       for sf in files]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEqual(errors, [])
+            # the same file used meanwhile by another thread is either
+            # read correctly or reported as busy
+            thread = threading.Thread(target=readAllMca, args=(files[0],))
+            thread.start()
+            while thread.is_alive():
+                try:
+                    scan = files[0].select("2.1")
+                    mca = scan.mca(nMca)
+                    self.assertTrue((mca == expected[1][-1]).all(),
+                                    'Incorrect mca read')
+                except self.specfileClass.error:
+                    pass
+            thread.join()
+            self.assertEqual(errors, [])
+            self.assertTrue((files[0][1].allmca() == expected[1]).all(),
+                            'Incorrect data read after the threads')
+        finally:
+            files = None
+            scan = None
+            gc.collect()
+            for name in fileNames:
+                if os.path.exists(name):
+                    os.remove(name)
+
+    def testSpecfileIndex(self):
+        #"""Test the index file of growing files"""
+        self.testSpecfileImport()
+        indexName = self.fname + ".sfI"
+        oldValue = os.environ.get("SPECFILE_INDEX_MIN_SIZE", None)
+
+        def append(text):
+            f = open(self.fname, "ab")
+            if sys.version < '3.0':
+                f.write(text)
+            else:
+                f.write(bytes(text, 'utf-8'))
+            f.close()
+
+        def read(useIndex):
+            if useIndex:
+                os.environ["SPECFILE_INDEX_MIN_SIZE"] = "0"
+            else:
+                os.environ["SPECFILE_INDEX_MIN_SIZE"] = "-1"
+            sf = self.specfileClass.Specfile(self.fname)
+            result = []
+            for i in range(len(sf)):
+                scan = sf[i]
+                result.append((scan.number(), scan.order(),
+                               scan.header(""), scan.data().tolist()))
+            sf = None
+            gc.collect()
+            return result
+
+        try:
+            expected = read(False)
+            self.assertFalse(os.path.exists(indexName),
+                             'Index file written for a small file')
+            self.assertEqual(read(True), expected,
+                             'Scans differ reading the index file')
+            self.assertTrue(os.path.exists(indexName),
+                            'Index file not written')
+            self.assertEqual(read(True), expected,
+                             'Scans differ reading the index file')
+            # append a scan with an incomplete line
+            append("#S 30  Undefined command 2\n#N 2\n#L A  B\n1  2\n3")
+            self.assertEqual(len(read(True)), 3,
+                             'Expected to read 3 scans')
+            append("  4\n\n#S 10  Undefined command 3\n#N 2\n#L A  B\n5  6\n")
+            expected = read(False)
+            self.assertEqual(len(expected), 4,
+                             'Expected to read 4 scans, read %d' %\
+                             len(expected))
+            self.assertEqual(expected[2][3], [[1, 3], [2, 4]],
+                             'Incorrect data read %s' % expected[2][3])
+            self.assertEqual(expected[3][:2], (10, 2),
+                             'Expected scan 10.2, got %s' % (expected[3][:2],))
+            self.assertEqual(read(True), expected,
+                             'Scans differ reading the grown file')
+            # update an opened file
+            os.environ["SPECFILE_INDEX_MIN_SIZE"] = "0"
+            self._sf = self.specfileClass.Specfile(self.fname)
+            self.assertEqual(self._sf.update(), 0,
+                             'Unexpected update of an unchanged file')
+            append("7  8\n\n#S 40  Undefined command 4\n#N 2\n#L A  B\n9  10\n")
+            self.assertEqual(self._sf.update(), 1,
+                             'Modified file not updated')
+            self.assertEqual(len(self._sf), 5,
+                             'Expected to read 5 scans, read %d' %\
+                             len(self._sf))
+            self.assertEqual(self._sf[3].data().tolist(), [[5, 7], [6, 8]],
+                             'Incorrect data read after update')
+            self.assertEqual(self._sf[4].number(), 40,
+                             'Expected scan 40, got %d' %\
+                             self._sf[4].number())
+            self._sf = None
+            gc.collect()
+            self.assertEqual(read(True), read(False),
+                             'Scans differ reading the updated index file')
+        finally:
+            if oldValue is None:
+                del os.environ["SPECFILE_INDEX_MIN_SIZE"]
+            else:
+                os.environ["SPECFILE_INDEX_MIN_SIZE"] = oldValue
+            self._sf = None
+            gc.collect()
+            if os.path.exists(indexName):
+                os.remove(indexName)
+
 def getSuite(auto=True):
     testSuite = unittest.TestSuite()
     if auto:
@@ -154,6 +365,9 @@ def getSuite(auto=True):
         testSuite.addTest(testSpecfile("testSpecfileReading"))
         testSuite.addTest(\
             testSpecfile("testSpecfileReadingCompatibleWithUserLocale"))
+        testSuite.addTest(testSpecfile("testSpecfileAllMca"))
+        testSuite.addTest(testSpecfile("testSpecfileAllMcaThreads"))
+        testSuite.addTest(testSpecfile("testSpecfileIndex"))
     return testSuite
 
 def test(auto=False):
@@ -0,0 +1,149 @@
+#/*##########################################################################
+#
+# The PyMca X-Ray Fluorescence Toolkit
+#
+# Copyright (c) 2004-2016 European Synchrotron Radiation Facility
+#
+# This file is part of the PyMca X-ray Fluorescence Toolkit developed at
+# the ESRF by the Software group.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+#############################################################################*/
+__author__ = "V. Armando Sole - ESRF Data Analysis"
+__contact__ = "sole@esrf.fr"
+__license__ = "MIT"
+__copyright__ = "European Synchrotron Radiation Facility, Grenoble, France"
+import unittest
+import numpy
+
+class testSpecfitFuns(unittest.TestCase):
+    def setUp(self):
+        """
+        import the module
+        """
+        try:
+            from PyMca5.PyMcaMath.fitting import SpecfitFuns
+            self._module = SpecfitFuns
+        except:
+            self._module = None
+
+    def testSpecfitFunsImport(self):
+        #"""Test successful import"""
+        self.assertTrue(self._module is not None,\
+                        "Unsuccessful PyMca5.PyMcaMath.fitting.SpecfitFuns import")
+
+    def _getPeakTable(self, npeaks, escape=False):
+        # area, position, fwhm and the tail parameters of each peak
+        random = numpy.random.RandomState(3)
+        a = numpy.zeros((npeaks, 8), numpy.float64)
+        a[:, 0] = random.uniform(0.1, 1.0, npeaks)
+        a[:, 1] = random.uniform(2.0, 18.0, npeaks)
+        a[:, 2] = random.uniform(0.12, 0.25, npeaks)
+        a[:, 3] = 0.05
+        a[:, 4] = 0.8
+        a[:, 5] = 0.02
+        a[:, 6] = 10.0
+        a[:, 7] = 0.001
+        if escape:
+            # every other peak is the escape peak of the previous one as
+            # McaTheory sets them: shifted, smaller and without the long
+            # tail nor the step
+            a[1::2, 0] = 0.01 * a[0::2, 0][:a[1::2].shape[0]]
+            a[1::2, 1] = a[0::2, 1][:a[1::2].shape[0]] - 1.74
+            a[1::2, 5] = 0.0
+            a[1::2, 7] = 0.0
+        return a
+
+    def testSpecfitFunsHypermetGroups(self):
+        self.testSpecfitFunsImport()
+        x = numpy.linspace(0.5, 20.0, 1000)
+        for escape in [False, True]:
+            a = self._getPeakTable(12, escape=escape)
+            if escape:
+                # each group has its peaks followed by their escape peaks
+                offsets = [0, 4, 6, 6, 12]
+            else:
+                offsets = [0, 1, 5, 5, 9, 12]
+            ngroups = len(offsets) - 1
+            for tails in [15, 1, 3, 5, 9, 7]:
+                profiles = self._module.fastahypermetgroups(a, x,
+                                    numpy.array(offsets, numpy.int32), tails)
+                self.assertEqual(profiles.shape, (ngroups, x.size))
+                for i in range(ngroups):
+                    if offsets[i] == offsets[i + 1]:
+                        expected = numpy.zeros(x.shape)
+                    else:
+                        # the sum of the individual peaks of the group
+                        expected = numpy.zeros(x.shape)
+                        for j in range(offsets[i], offsets[i + 1]):
+                            expected += self._module.fastahypermet(a[j],
+                                                                   x, tails)
+                    self.assertTrue(numpy.allclose(profiles[i], expected,
+                                                   rtol=1.0e-10, atol=1.0e-14),
+                        "Group %d differs with escape %s and tails %d" % \
+                        (i, escape, tails))
+                # all the groups together give the sum of all the peaks
+                self.assertTrue(numpy.allclose(profiles.sum(axis=0),
+                                    self._module.fastahypermet(a, x, tails)))
+        # no tails at all
+        profiles = self._module.fastahypermetgroups(a, x,
+                                    numpy.array(offsets, numpy.int32), 0)
+        self.assertEqual(profiles.shape, (len(offsets) - 1, x.size))
+        self.assertFalse(profiles.any())
+
+    def testSpecfitFunsHypermetGroupsErrors(self):
+        self.testSpecfitFunsImport()
+        x = numpy.linspace(0.5, 20.0, 100)
+        a = self._getPeakTable(4)
+        offsets = numpy.array([0, 2, 4], numpy.int32)
+        # zero sigma even for a peak of zero area
+        for area in [1.0, 0.0]:
+            b = a.copy()
+            b[3, 0] = area
+            b[3, 2] = 0.0
+            self.assertRaises(ValueError,
+                              self._module.fastahypermetgroups,
+                              b, x, offsets, 15)
+        # invalid offsets and table
+        for wrongOffsets in [[0, 3, 2], [0, 2, 5], [-1, 2, 4]]:
+            self.assertRaises(ValueError,
+                              self._module.fastahypermetgroups,
+                              a, x, numpy.array(wrongOffsets, numpy.int32), 15)
+        self.assertRaises(ValueError,
+                          self._module.fastahypermetgroups,
+                          a.ravel()[:-1], x, offsets, 15)
+
+def getSuite(auto=True):
+    testSuite = unittest.TestSuite()
+    if auto:
+        testSuite.addTest(\
+            unittest.TestLoader().loadTestsFromTestCase(testSpecfitFuns))
+    else:
+        # use a predefined order
+        testSuite.addTest(testSpecfitFuns("testSpecfitFunsImport"))
+        testSuite.addTest(testSpecfitFuns("testSpecfitFunsHypermetGroups"))
+        testSuite.addTest(testSpecfitFuns("testSpecfitFunsHypermetGroupsErrors"))
+    return testSuite
+
+def test(auto=False):
+    unittest.TextTestRunner(verbosity=2).run(getSuite(auto=auto))
+
+if __name__ == '__main__':
+    test()
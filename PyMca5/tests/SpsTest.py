@@ -0,0 +1,190 @@
+#/*##########################################################################
+#
+# The PyMca X-Ray Fluorescence Toolkit
+#
+# Copyright (c) 2004-2016 European Synchrotron Radiation Facility
+#
+# This file is part of the PyMca X-ray Fluorescence Toolkit developed at
+# the ESRF by the Software group.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+#############################################################################*/
+__author__ = "V. Armando Sole - ESRF Data Analysis"
+__contact__ = "sole@esrf.fr"
+__license__ = "MIT"
+__copyright__ = "European Synchrotron Radiation Facility, Grenoble, France"
+import unittest
+import os
+import gc
+import numpy
+try:
+    from PyMca5.PyMcaIO import sps
+except ImportError:
+    sps = None
+
+
+@unittest.skipIf(sps is None, "sps not available")
+class testSps(unittest.TestCase):
+    # the arrays created by a process exist until it ends
+    _counter = 0
+
+    def setUp(self):
+        """
+        import the module
+        """
+        try:
+            from PyMca5.PyMcaCore import SpsDataSource
+            self._module = SpsDataSource
+        except:
+            self._module = None
+        testSps._counter += 1
+        self.spec = "pymcatest%d_%d" % (os.getpid(), testSps._counter)
+        self.flag = sps.TAG_ARRAY | sps.TAG_IMAGE
+        try:
+            self.array = sps.create(self.spec, "image", 4, 5, sps.DOUBLE,
+                                    self.flag)
+        except sps.error:
+            self.skipTest("Shared memory arrays cannot be created")
+        self.array[:] = numpy.arange(20.).reshape(4, 5)
+        sps.updatedone(self.spec, "image")
+
+    def tearDown(self):
+        self.array = None
+        gc.collect()
+
+    def testSpsDataSourceImport(self):
+        #"""Test successful import"""
+        self.assertTrue(self._module is not None,
+                        "Unsuccessful PyMca5.PyMcaCore.SpsDataSource import")
+
+    def testSpsDataView(self):
+        view = sps.getdataview(self.spec, "image")
+        self.assertEqual(view.shape, (4, 5))
+        self.assertEqual(view.dtype, numpy.float64)
+        # read-only
+        self.assertFalse(view.flags.writeable)
+        self.assertRaises(ValueError, view.__setitem__, 0, 1.0)
+        self.assertTrue((view == self.array).all())
+        # live
+        self.array[1] = -1.0
+        self.assertTrue((view[1] == -1.0).all())
+        # the counter follows the updates
+        counter = sps.viewcounter(view)
+        self.assertEqual(counter, sps.updatecounter(self.spec, "image"))
+        sps.updatedone(self.spec, "image")
+        self.assertEqual(sps.viewcounter(view), counter + 1)
+        self.assertEqual(sps.viewcounter(view),
+                         sps.updatecounter(self.spec, "image"))
+        self.assertEqual(sps.viewshmid(view),
+                         sps.getshmid(self.spec, "image"))
+        # only views can be used
+        self.assertRaises(sps.error, sps.viewcounter, self.array)
+        self.assertRaises(sps.error, sps.viewshmid, numpy.zeros((4, 5)))
+        self.assertRaises(sps.error, sps.getdataview, self.spec, "other")
+
+        # slices keep the memory attached
+        rows = view[1:3]
+        column = view[:, 2]
+        view = None
+        gc.collect()
+        self.array[2] = 7.0
+        self.assertTrue((rows[0] == -1.0).all())
+        self.assertTrue((rows[1] == 7.0).all())
+        self.assertEqual(column.tolist(), [2.0, -1.0, 7.0, 17.0])
+
+        # a recreated array is a different memory, the old view keeps
+        # the old data
+        view = sps.getdataview(self.spec, "image")
+        shmid = sps.viewshmid(view)
+        array = sps.create(self.spec, "image", 6, 5, sps.DOUBLE, self.flag)
+        array[:] = 3.0
+        self.assertNotEqual(sps.getshmid(self.spec, "image"), shmid)
+        self.assertEqual(sps.viewshmid(view), shmid)
+        self.assertEqual(view.shape, (4, 5))
+        self.assertTrue((view[2] == 7.0).all())
+        self.assertTrue((rows[1] == 7.0).all())
+        newView = sps.getdataview(self.spec, "image")
+        self.assertEqual(newView.shape, (6, 5))
+        self.assertTrue((newView == 3.0).all())
+
+    def testSpsDataSourceData(self):
+        dataSource = self._module.SpsDataSource(self.spec)
+        self.assertEqual(dataSource.getSourceInfo()["KeyList"], ["image"])
+        view = sps.getdataview(self.spec, "image")
+
+        # copies by default
+        dataObject = dataSource.getDataObject("image")
+        self.assertTrue(dataObject.data.flags.writeable)
+        self.assertFalse(numpy.may_share_memory(dataObject.data, view))
+        self.assertTrue((dataObject.data == self.array).all())
+        self.array[0] = -5.0
+        self.assertEqual(dataObject.data[0, 0], 0.0)
+
+        # views of the shared memory on request
+        liveObject = dataSource.getDataObject("image", copyData=False)
+        self.assertFalse(liveObject.data.flags.writeable)
+        self.assertTrue((liveObject.data == self.array).all())
+        self.array[0] = -6.0
+        self.assertTrue((liveObject.data[0] == -6.0).all())
+
+        # the selected curves are always copies
+        selection = {'rows': {'x': [], 'y': [1, 3], 'm': []}}
+        for copyData in [True, False]:
+            curveObject = dataSource.getDataObject("image",
+                                                   selection=selection,
+                                                   copyData=copyData)
+            self.assertEqual(len(curveObject.y), 2)
+            for curve, row in zip(curveObject.y, [1, 3]):
+                self.assertTrue(curve.flags.writeable)
+                self.assertFalse(numpy.may_share_memory(curve, view))
+                self.assertTrue((curve == self.array[row]).all())
+
+        # the same data without the views
+        dataSource.zeroCopy = False
+        reference = dataSource.getDataObject("image")
+        self.assertTrue((reference.data == liveObject.data).all())
+        dataSource.zeroCopy = True
+
+        # a recreated array is followed
+        array = sps.create(self.spec, "image", 6, 5, sps.DOUBLE, self.flag)
+        array[:] = 2.0
+        sps.updatedone(self.spec, "image")
+        dataObject = dataSource.getDataObject("image", copyData=False)
+        self.assertEqual(dataObject.data.shape, (6, 5))
+        self.assertTrue((dataObject.data == 2.0).all())
+        self.assertTrue((liveObject.data[0] == -6.0).all())
+
+def getSuite(auto=True):
+    testSuite = unittest.TestSuite()
+    if auto:
+        testSuite.addTest(\
+            unittest.TestLoader().loadTestsFromTestCase(testSps))
+    else:
+        # use a predefined order
+        testSuite.addTest(testSps("testSpsDataSourceImport"))
+        testSuite.addTest(testSps("testSpsDataView"))
+        testSuite.addTest(testSps("testSpsDataSourceData"))
+    return testSuite
+
+def test(auto=False):
+    unittest.TextTestRunner(verbosity=2).run(getSuite(auto=auto))
+
+if __name__ == '__main__':
+    test()
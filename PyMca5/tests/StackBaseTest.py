@@ -200,6 +200,53 @@ def testStackBaseStack2DDataHandling(self):
         dummyArray = None
         referenceData = None
 
+    def testStackBaseROIIndex(self):
+        from PyMca5.PyMcaCore import StackBase
+        nrows = 20
+        ncolumns = 30
+        nchannels = 300
+        numpy.random.seed(1)
+        referenceData = numpy.random.poisson(10.,
+                            (nrows, ncolumns, nchannels)).astype(numpy.float)
+        for mcaindex in [2, 0]:
+            if mcaindex == 0:
+                referenceData = numpy.ascontiguousarray(\
+                                        referenceData.transpose(2, 0, 1))
+            for data in [referenceData, DummyArray(referenceData)]:
+                stackBase = StackBase.StackBase()
+                stackBase.setStack(data, mcaindex=mcaindex)
+                # ROIs within one block, across blocks and the whole range
+                for i0, imiddle, i1 in [(3, 5, 9), (10, 100, 271),
+                                        (17, 34, 51), (0, 150, nchannels)]:
+                    stackBase.setROIIndexEnabled(False)
+                    expected = stackBase.calculateROIImages(i0, i1,
+                                                            imiddle=imiddle)
+                    stackBase.setROIIndexEnabled(True)
+                    imageDict = stackBase.calculateROIImages(i0, i1,
+                                                            imiddle=imiddle)
+                    for key in ["ROI", "Maximum", "Minimum", "Left",
+                                "Middle", "Right", "Background"]:
+                        self.assertTrue(numpy.allclose(imageDict[key],
+                                                       expected[key]),
+                                "Incorrect %s image using ROI index" % key)
+                # by default only used beyond the size limit
+                stackBase.setROIIndexEnabled(None)
+                self.assertFalse(stackBase.isROIIndexEnabled())
+                self.assertTrue(stackBase._ROIIndex is None)
+                stackBase.setROIIndexLimit(referenceData.size - 1)
+                self.assertTrue(stackBase.isROIIndexEnabled())
+                imageDict = stackBase.calculateROIImages(10, 271,
+                                                         imiddle=100)
+                self.assertTrue(stackBase._ROIIndex is not None)
+                self.assertTrue(numpy.allclose(imageDict["ROI"],
+                                    numpy.take(referenceData,
+                                               range(10, 271),
+                                               axis=mcaindex).sum(axis=mcaindex)))
+                stackBase.setROIIndexLimit(referenceData.size)
+                self.assertFalse(stackBase.isROIIndexEnabled())
+                self.assertTrue(stackBase._ROIIndex is None)
+        stackBase = None
+
 def getSuite(auto=True):
     testSuite = unittest.TestSuite()
     if auto:
@@ -210,6 +257,7 @@ def getSuite(auto=True):
         testSuite.addTest(testStackBase("testStackBaseImport"))
         testSuite.addTest(testStackBase("testStackBaseStack1DDataHandling"))
         testSuite.addTest(testStackBase("testStackBaseStack2DDataHandling"))
+        testSuite.addTest(testStackBase("testStackBaseROIIndex"))
     return testSuite
 
 def test(auto=False):
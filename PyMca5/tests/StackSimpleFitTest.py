@@ -0,0 +1,234 @@
+#/*##########################################################################
+#
+# The PyMca X-Ray Fluorescence Toolkit
+#
+# Copyright (c) 2004-2014 European Synchrotron Radiation Facility
+#
+# This file is part of the PyMca X-ray Fluorescence Toolkit developed at
+# the ESRF by the Software group.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+#############################################################################*/
+__author__ = "V. Armando Sole - ESRF Data Analysis"
+__contact__ = "sole@esrf.fr"
+__license__ = "MIT"
+__copyright__ = "European Synchrotron Radiation Facility, Grenoble, France"
+import unittest
+import os
+import sys
+import shutil
+import tempfile
+import types
+import numpy
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+# fit functions to be imported by the worker processes
+FUNCTIONS = """
+import numpy
+
+def gaussian(parameters, x):
+    height, position, fwhm = parameters
+    sigma = fwhm / 2.3548200450309493
+    return height * numpy.exp(-0.5 * ((x - position) / sigma) ** 2)
+
+def estimateGaussian(x, y, z):
+    i = numpy.argmax(y)
+    return [y[i], x[i], 30.0], [[0, 0, 0], [0, 0, 0], [0, 0, 0]]
+
+THEORY = ["StackTestGaussian"]
+PARAMETERS = [["Height", "Position", "FWHM"]]
+FUNCTION = [gaussian]
+ESTIMATE = [estimateGaussian]
+"""
+
+class testStackSimpleFit(unittest.TestCase):
+    def setUp(self):
+        """
+        import the module
+        """
+        try:
+            from PyMca5.PyMcaMath.fitting import StackSimpleFit
+            self._module = StackSimpleFit
+        except:
+            self._module = None
+        self._tmpDir = tempfile.mkdtemp()
+        self._functionsFile = os.path.join(self._tmpDir,
+                                           "StackTestFunctions.py")
+        with open(self._functionsFile, "w") as f:
+            f.write(FUNCTIONS)
+        # a stack of gaussians with slowly changing parameters
+        self.x = numpy.arange(200.)
+        nRows = 4
+        nColumns = 7
+        self.stack = numpy.zeros((nRows, nColumns, self.x.size),
+                                 numpy.float64)
+        self.expected = {}
+        for key in ["Height", "Position", "FWHM"]:
+            self.expected[key] = numpy.zeros((nRows, nColumns))
+        for i in range(nRows):
+            for j in range(nColumns):
+                height = 100. + 10. * i + j
+                position = 80. + 2. * i + 1.5 * j
+                fwhm = 25. + 0.5 * j
+                self.expected["Height"][i, j] = height
+                self.expected["Position"][i, j] = position
+                self.expected["FWHM"][i, j] = fwhm
+                sigma = fwhm / 2.3548200450309493
+                self.stack[i, j] = height * \
+                    numpy.exp(-0.5 * ((self.x - position) / sigma) ** 2)
+
+    def tearDown(self):
+        """clean up any possible files"""
+        if self._tmpDir in sys.path:
+            sys.path.remove(self._tmpDir)
+        # the next test imports the functions from another directory
+        sys.modules.pop("StackTestFunctions", None)
+        shutil.rmtree(self._tmpDir, ignore_errors=True)
+
+    def _getFit(self, functions):
+        from PyMca5.PyMcaMath.fitting import SimpleFitModule
+        fit = SimpleFitModule.SimpleFit()
+        fit.importFunctions(functions)
+        fit.setFitFunction("StackTestGaussian")
+        fit.setConfiguration({'fit': {'strip_flag': 0}})
+        return fit
+
+    def _fitStack(self, fit, name, processes=None, warmStart=False,
+                  hdf5=False, mask=None):
+        instance = self._module.StackSimpleFit(fit=fit)
+        instance.setData(self.x, self.stack)
+        instance.setOutputDirectory(self._tmpDir)
+        instance.setOutputFileBaseName(name)
+        instance.setProcesses(processes)
+        instance.setWarmStart(warmStart)
+        instance.setHDF5Output(hdf5)
+        instance.processStack(mask=mask)
+        return instance.getOutputFileNames()
+
+    def _readEdf(self, fileName):
+        from PyMca5.PyMcaIO import EdfFile
+        edf = EdfFile.EdfFile(fileName, 'rb')
+        images = {}
+        for i in range(edf.GetNumImages()):
+            images[edf.GetHeader(i)['Title']] = edf.GetData(i)
+        return images
+
+    def testStackSimpleFitImport(self):
+        #"""Test successful import"""
+        self.assertTrue(self._module is not None,\
+                        "Unsuccessful PyMca5.PyMcaMath.fitting.StackSimpleFit import")
+
+    def testStackSimpleFitPool(self):
+        serial = self._readEdf(self._fitStack(\
+                                self._getFit(self._functionsFile),
+                                "serial")['edf'])
+        pool = self._readEdf(self._fitStack(\
+                                self._getFit(self._functionsFile),
+                                "pool", processes=2, warmStart=True)['edf'])
+        self.assertEqual(sorted(serial.keys()), sorted(pool.keys()))
+        for key in ["Height", "Position", "FWHM"]:
+            self.assertTrue(numpy.allclose(serial[key], self.expected[key],
+                                           rtol=1.0e-4),
+                            "Wrong %s" % key)
+            self.assertTrue(numpy.allclose(pool[key], serial[key],
+                                           rtol=1.0e-4),
+                            "Different %s with and without pool" % key)
+
+    def testStackSimpleFitFunctionsWithoutFile(self):
+        # functions not defined in a file cannot be imported by the worker
+        # processes and the stack is fitted in a single process
+        module = types.ModuleType("StackTestFunctionsWithoutFile")
+        exec(FUNCTIONS, module.__dict__)
+        self.assertFalse(hasattr(module, "__file__"))
+        fit = self._getFit(module)
+        self.assertTrue(self._module._getWorkerConfiguration(\
+                                        fit.getConfiguration()) is None)
+        serial = self._readEdf(self._fitStack(\
+                                self._getFit(self._functionsFile),
+                                "serial")['edf'])
+        pool = self._readEdf(self._fitStack(fit, "pool",
+                                            processes=2)['edf'])
+        for key in serial:
+            self.assertTrue(numpy.allclose(pool[key], serial[key]),
+                            "Different %s" % key)
+
+    @unittest.skipIf(h5py is None, "h5py not available")
+    def testStackSimpleFitHDF5Output(self):
+        mask = numpy.ones(self.stack.shape[:2], numpy.uint8)
+        mask[1, :] = 0
+        mask[2, 3] = 0
+        serial = self._readEdf(self._fitStack(\
+                                self._getFit(self._functionsFile),
+                                "serial", mask=mask)['edf'])
+        # write the rows to the file in several blocks
+        flushSize = self._module.HDF5_FLUSH_SIZE
+        self._module.HDF5_FLUSH_SIZE = self.stack.shape[1]
+        try:
+            fileNames = self._fitStack(self._getFit(self._functionsFile),
+                                       "output", processes=2, hdf5=True,
+                                       mask=mask)
+            self.assertFalse(os.path.exists(fileNames['edf']))
+            h5 = h5py.File(fileNames['h5'], "r")
+            try:
+                for key in serial:
+                    if key == "chisq":
+                        path = "stack_fit/chisq"
+                    elif key.startswith("s("):
+                        path = "stack_fit/uncertainties/" + key[2:-1]
+                    else:
+                        path = "stack_fit/parameters/" + key
+                    self.assertTrue(numpy.allclose(h5[path][()],
+                                                   serial[key],
+                                                   rtol=1.0e-4),
+                                    "Different %s" % key)
+                self.assertFalse(h5["stack_fit/parameters/Height"][1].any())
+            finally:
+                h5.close()
+            # the previous results are not overwritten
+            mtime = os.path.getmtime(fileNames['h5'])
+            self.assertRaises(IOError, self._fitStack,
+                              self._getFit(self._functionsFile),
+                              "output", hdf5=True)
+            self.assertEqual(mtime, os.path.getmtime(fileNames['h5']))
+        finally:
+            self._module.HDF5_FLUSH_SIZE = flushSize
+
+def getSuite(auto=True):
+    testSuite = unittest.TestSuite()
+    if auto:
+        testSuite.addTest(\
+            unittest.TestLoader().loadTestsFromTestCase(testStackSimpleFit))
+    else:
+        # use a predefined order
+        testSuite.addTest(testStackSimpleFit("testStackSimpleFitImport"))
+        testSuite.addTest(testStackSimpleFit("testStackSimpleFitPool"))
+        testSuite.addTest(\
+            testStackSimpleFit("testStackSimpleFitFunctionsWithoutFile"))
+        testSuite.addTest(testStackSimpleFit("testStackSimpleFitHDF5Output"))
+    return testSuite
+
+def test(auto=False):
+    unittest.TextTestRunner(verbosity=2).run(getSuite(auto=auto))
+
+if __name__ == '__main__':
+    test()
@@ -0,0 +1,237 @@
+#/*##########################################################################
+#
+# The PyMca X-Ray Fluorescence Toolkit
+#
+# Copyright (c) 2004-2016 European Synchrotron Radiation Facility
+#
+# This file is part of the PyMca X-ray Fluorescence Toolkit developed at
+# the ESRF by the Software group.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+#############################################################################*/
+__author__ = "V.A. Sole - ESRF Data Analysis"
+__contact__ = "sole@esrf.fr"
+__license__ = "MIT"
+__copyright__ = "European Synchrotron Radiation Facility, Grenoble, France"
+import unittest
+import os
+import shutil
+import tempfile
+import numpy
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+class testXAS(unittest.TestCase):
+    def setUp(self):
+        """
+        import the module
+        """
+        try:
+            from PyMca5.PyMcaPhysics.xas import XASClass
+            self.xasClass = XASClass
+        except:
+            self.xasClass = None
+
+    def testXASImport(self):
+        self.assertTrue(self.xasClass is not None)
+
+    def _getShiftedSpectra(self, nSpectra):
+        from PyMca5.PyMcaDataDir import PYMCA_DATA_DIR
+        data = numpy.loadtxt(os.path.join(PYMCA_DATA_DIR, "EXAFS_Ge.dat"))
+        energy = data[:, 0]
+        mu = data[:, 1]
+        # spectra with different edges, jumps and backgrounds
+        spectra = []
+        for i in range(nSpectra):
+            shift = 3.0 * (i - 3)
+            spectrum = numpy.interp(energy - shift, energy, mu)
+            spectra.append((1.0 + 0.2 * i) * spectrum + 0.01 * i)
+        return energy, numpy.array(spectra)
+
+    def testXASMultipleSpectra(self):
+        self.testXASImport()
+        energy, spectra = self._getShiftedSpectra(6)
+        analyzer = self.xasClass.XASClass()
+        result = analyzer.processSpectra(energy, spectra)
+        # processing the spectra at once or one by one gives the same
+        # results within RTOL of the maximum of each signal
+        RTOL = 1.0e-7
+        for i in range(spectra.shape[0]):
+            analyzer.setSpectrum(energy, spectra[i])
+            ddict = analyzer.processSpectrum()
+            self.assertTrue(abs(result["Edge"][i] - ddict["Edge"]) < \
+                            RTOL * ddict["Edge"], "Different Edge")
+            self.assertTrue(abs(result["Jump"][i] - ddict["Jump"]) < \
+                            RTOL * ddict["Jump"], "Different Jump")
+            idx = (ddict["EXAFSKValues"] >= ddict["KMin"]) & \
+                  (ddict["EXAFSKValues"] <= ddict["KMax"])
+            for key, values, reference in [
+                    ("NormalizedMu", result["NormalizedMu"][i],
+                     ddict["NormalizedMu"]),
+                    ("EXAFSKValues", result["EXAFSKValues"][i],
+                     ddict["EXAFSKValues"]),
+                    ("EXAFSNormalized", result["EXAFSNormalized"][i][idx],
+                     ddict["EXAFSNormalized"][idx]),
+                    ("FTIntensity", result["FT"]["FTIntensity"][i],
+                     ddict["FT"]["FTIntensity"]),
+                    ("FTImaginary", result["FT"]["FTImaginary"][i],
+                     ddict["FT"]["FTImaginary"])]:
+                delta = abs(values - reference).max()
+                self.assertTrue(delta <= RTOL * abs(reference).max(),
+                                "Different %s, delta = %g" % (key, delta))
+
+    def testXASMultipleSpectraNotFinite(self):
+        self.testXASImport()
+        energy, spectra = self._getShiftedSpectra(4)
+        spectra[1] = 0.0
+        spectra[2, 100:] = numpy.nan
+        analyzer = self.xasClass.XASClass()
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            result = analyzer.processSpectra(energy, spectra)
+        # the spectra without an edge do not prevent the processing of
+        # the others
+        for i in [0, 3]:
+            analyzer.setSpectrum(energy, spectra[i])
+            ddict = analyzer.processSpectrum()
+            self.assertTrue(numpy.allclose(result["FT"]["FTIntensity"][i],
+                                           ddict["FT"]["FTIntensity"]))
+
+    @unittest.skipIf(h5py is None, "h5py not available")
+    def testXASStackBatchMaskedPixels(self):
+        self.testXASImport()
+        from PyMca5.PyMcaPhysics.xas import XASStackBatch
+        energy, spectra = self._getShiftedSpectra(6)
+        stack = numpy.zeros((2, 4, energy.size), dtype=numpy.float32)
+        stack[0, :] = spectra[:4]
+        stack[1, :2] = spectra[4:]
+        stack[1, 2:] = spectra[:2]
+        # a masked pixel, an empty one and one with non finite values
+        mask = numpy.ones((2, 4), dtype=numpy.uint8)
+        mask[1, 0] = 0
+        stack[0, 1] = 0.0
+        stack[1, 3, 10] = numpy.nan
+        invalid = [(1, 0), (0, 1), (1, 3)]
+        tmpDir = tempfile.mkdtemp()
+        try:
+            instance = XASStackBatch.XASStackBatch()
+            instance.processMultipleSpectra(energy, stack, mask=mask,
+                                            directory=tmpDir, name="stack")
+            h5 = h5py.File(os.path.join(tmpDir, "stack.h5"), "r")
+            try:
+                edge = h5["xas_analysis/edge"][()]
+                jump = h5["xas_analysis/jump"][()]
+                ft = h5["xas_analysis/FT/Intensity"][()]
+            finally:
+                h5.close()
+        finally:
+            shutil.rmtree(tmpDir, ignore_errors=True)
+        analyzer = self.xasClass.XASClass()
+        for i in range(stack.shape[0]):
+            for j in range(stack.shape[1]):
+                if (i, j) in invalid:
+                    self.assertEqual(edge[i, j], 0)
+                    self.assertEqual(jump[i, j], 0)
+                    self.assertFalse(ft[i, j].any())
+                    continue
+                # the output is stored in single precision
+                analyzer.setSpectrum(energy, stack[i, j])
+                ddict = analyzer.processSpectrum()
+                self.assertTrue(abs(edge[i, j] - ddict["Edge"]) < 0.01)
+                self.assertTrue(abs(jump[i, j] - ddict["Jump"]) < \
+                                1.0e-5 * ddict["Jump"])
+                reference = ddict["FT"]["FTIntensity"]
+                self.assertTrue(abs(ft[i, j] - reference).max() < \
+                                1.0e-5 * reference.max())
+
+    def testXASMultipleFourierTransforms(self):
+        self.testXASImport()
+        k = numpy.linspace(0.05, 15.0, 700)
+        exafs = numpy.sin(4.6 * k) * numpy.exp(-0.02 * k * k)
+        spectra = numpy.array([exafs, 2.0 * exafs, exafs * exafs])
+        kmin = numpy.array([2.0, 2.0, 3.0])
+        result = self.xasClass.getFTMultiple(k, spectra,
+                                             krange=(kmin, 12.0),
+                                             kweight=2,
+                                             window="Hanning")
+        for i in range(spectra.shape[0]):
+            ddict = self.xasClass.getFT(k, spectra[i],
+                                        krange=(kmin[i], 12.0),
+                                        kweight=2,
+                                        window="Hanning")
+            for key in ["FTReal", "FTImaginary", "FTIntensity"]:
+                self.assertTrue(numpy.allclose(result[key][i], ddict[key]),
+                                "Different %s" % key)
+            # the same back transform with and without interpolation
+            backFT = self.xasClass.getBackFT(ddict["Set"])
+            rstep = ddict["Set"][1, 0] - ddict["Set"][0, 0]
+            interpolated = self.xasClass.getBackFT(ddict["Set"], rstep=rstep)
+            # the k values can differ by rounding at the limits
+            self.assertTrue(abs(backFT.shape[0] - interpolated.shape[0]) < 3)
+            for column in [1, 2]:
+                self.assertTrue(numpy.allclose(backFT[:, column],
+                                    numpy.interp(backFT[:, 0],
+                                                 interpolated[:, 0],
+                                                 interpolated[:, column]),
+                                    atol=1.0e-6))
+        backFT = self.xasClass.getBackFTMultiple(result["FTRadius"],
+                                                 result["FTReal"],
+                                                 result["FTImaginary"])
+        self.assertTrue(numpy.allclose(backFT["Real"][1],
+                                       2.0 * backFT["Real"][0]))
+
+    def testXASFourierTransformCachedGrid(self):
+        self.testXASImport()
+        k = numpy.linspace(0.05, 15.0, 700)
+        exafs = numpy.sin(4.6 * k) * numpy.exp(-0.02 * k * k)
+        reference = self.xasClass.getFT(k, exafs)
+        for key in ["InterpolatedK", "WindowWeight"]:
+            reference[key] = reference[key].copy()
+        for i in range(2):
+            # the second call uses the cached grid
+            ddict = self.xasClass.getFT(k, exafs)
+            for key in ["InterpolatedK", "WindowWeight"]:
+                self.assertTrue(ddict[key].flags.writeable,
+                                "Read only %s" % key)
+                self.assertTrue(numpy.allclose(ddict[key], reference[key]))
+                # modifying the output does not modify the cache
+                ddict[key][:] = 0.0
+
+def getSuite(auto=True):
+    testSuite = unittest.TestSuite()
+    if auto:
+        testSuite.addTest(\
+            unittest.TestLoader().loadTestsFromTestCase(testXAS))
+    else:
+        # use a predefined order
+        testSuite.addTest(testXAS("testXASImport"))
+        testSuite.addTest(testXAS("testXASMultipleSpectra"))
+        testSuite.addTest(testXAS("testXASMultipleSpectraNotFinite"))
+        testSuite.addTest(testXAS("testXASStackBatchMaskedPixels"))
+        testSuite.addTest(testXAS("testXASMultipleFourierTransforms"))
+        testSuite.addTest(testXAS("testXASFourierTransformCachedGrid"))
+    return testSuite
+
+def test(auto=False):
+    unittest.TextTestRunner(verbosity=2).run(getSuite(auto=auto))
+
+if __name__ == '__main__':
+    test()
@@ -190,6 +190,27 @@ def use_fisx():
             'PyMca5.PyMcaGui.math.fitting',]
 py_modules = []
 
+def build_physics_database(outputFile):
+    # binary version of the XCOM tables to be installed with them
+    attdata = os.path.join('PyMca5', 'PyMcaData', 'attdata')
+    try:
+        import runpy
+        module = runpy.run_path(os.path.join('PyMca5', 'PyMcaPhysics', 'xrf',
+                                             'PhysicsDatabase.py'))
+        if not module['isDatabaseValid'](outputFile, attdata):
+            print("Compiled %s" % module['compileDatabase'](attdata,
+                                                          outputFile))
+        return outputFile
+    except:
+        print("XCOM database could not be compiled")
+        print(sys.exc_info())
+        return None
+
+def get_physics_database_name(command):
+    # the database is written into the temporary build directory
+    build_cmd = command.get_finalized_command('build')
+    return os.path.join(build_cmd.build_temp, 'xcom.npz')
+
 # Specify all the required PyMca data
 data_files = [(PYMCA_DATA_DIR, ['LICENSE',
                          'LICENSE.GPL',
@@ -205,7 +226,9 @@ def use_fisx():
                          'PyMca5/PyMcaData/EXAFS_Cu.dat',
                          'PyMca5/PyMcaData/EXAFS_Ge.dat',
                          'PyMca5/PyMcaData/XRFSpectrum.mca']),
-              (PYMCA_DATA_DIR+'/attdata', glob.glob('PyMca5/PyMcaData/attdata/*')),
+              (PYMCA_DATA_DIR+'/attdata', [x for x in \
+                                glob.glob('PyMca5/PyMcaData/attdata/*') \
+                                if not x.endswith('.npz')]),
               (PYMCA_DOC_DIR+'/HTML', glob.glob('PyMca5/PyMcaData/HTML/*.*')),
               (PYMCA_DOC_DIR+'/HTML/IMAGES', glob.glob('PyMca5/PyMcaData/HTML/IMAGES/*')),
               (PYMCA_DOC_DIR+'/HTML/PyMCA_files', glob.glob('PyMca5/HTML/PyMCA_files/*'))]
@@ -521,6 +544,10 @@ def run (self):
                 lineToBeWritten = line.replace(txt, PYMCA_DOC_DIR)
             fid.write(lineToBeWritten)
         fid.close()
+        database = get_physics_database_name(self)
+        if not os.path.exists(os.path.dirname(database)):
+            os.makedirs(os.path.dirname(database))
+        build_physics_database(database)
         return toReturn
 
 # data_files fix from http://wiki.python.org/moin/DistutilsInstallDataScattered
@@ -555,6 +582,14 @@ def run(self):
         if os.path.exists(pymcaOld):
             print("Removing previously installed file %s" % pymcaOld)
             os.remove(pymcaOld)
+
+        # the XCOM database compiled by build_py
+        database = get_physics_database_name(self)
+        if os.path.exists(database):
+            for directory, files in self.data_files:
+                if directory.endswith('attdata'):
+                    files.append(database)
+                    break
         return install_data.run(self)
 
 